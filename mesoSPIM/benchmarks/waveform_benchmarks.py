@@ -0,0 +1,87 @@
+'''
+Micro-benchmarks of the waveform primitives in utils/waveforms.py
+
+Compares allocating calls with calls writing into preallocated buffers (out=),
+and the bundling of all analog output channels into (channels x samples) buffers.
+
+Usage (from the repository root):
+
+    python -m mesoSPIM.benchmarks.waveform_benchmarks [--samplerate 100000] [--sweeptime 0.2] [--repeat 200]
+'''
+
+import argparse
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+from ..src.utils import waveforms
+
+N_LASERS = 8
+
+def benchmark(function, repeat):
+    ''' Returns the best time per call in microseconds out of 5 runs of repeat calls '''
+    return min(timeit.repeat(function, number=repeat, repeat=5)) / repeat * 1e6
+
+def get_primitive_benchmarks(samplerate, sweeptime):
+    ''' Returns {name : (allocating call, call with out=)} for all primitives '''
+    samples = waveforms.get_sample_count(samplerate, sweeptime)
+    out = np.empty(samples)
+    calls = {'single_pulse' : (waveforms.single_pulse, dict(delay=10, pulsewidth=80, amplitude=5, offset=0)),
+             'tunable_lens_ramp' : (waveforms.tunable_lens_ramp, dict(delay=7.5, rise=85, fall=2.5, amplitude=0.7, offset=2.3)),
+             'sawtooth' : (waveforms.sawtooth, dict(frequency=99.9, amplitude=2.5, offset=0, dutycycle=50, phase=np.pi/2)),
+             'square' : (waveforms.square, dict(frequency=99.9, amplitude=2.5, offset=0, dutycycle=50, phase=np.pi))}
+    benchmarks = {}
+    for name, (function, kwargs) in calls.items():
+        benchmarks[name] = (lambda function=function, kwargs=kwargs: function(samplerate, sweeptime, **kwargs),
+                            lambda function=function, kwargs=kwargs: function(samplerate, sweeptime, out=out, **kwargs))
+    return benchmarks
+
+def get_bundle_benchmarks(samplerate, sweeptime):
+    ''' Bundling of the laser channels: stacking new arrays vs. filling a preallocated buffer '''
+    samples = waveforms.get_sample_count(samplerate, sweeptime)
+    pulse = waveforms.single_pulse(samplerate, sweeptime, 10, 80, 5, 0)
+    buffer = np.zeros((N_LASERS, samples))
+
+    def stack():
+        zero_waveform = np.zeros(samples)
+        waveform_list = [zero_waveform for i in range(N_LASERS)]
+        waveform_list[2] = pulse
+        return np.stack(waveform_list)
+
+    def fill():
+        buffer.fill(0)
+        buffer[2] = pulse
+        return buffer
+
+    return {f'laser bundle ({N_LASERS} channels)' : (stack, fill)}
+
+def get_import_time():
+    ''' Time to import the waveform module in a fresh interpreter in ms '''
+    code = 'import time; t = time.perf_counter(); import mesoSPIM.src.utils.waveforms; print(time.perf_counter() - t)'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return float(output) * 1e3
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--samplerate', type=int, default=100000)
+    parser.add_argument('--sweeptime', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    samples = waveforms.get_sample_count(args.samplerate, args.sweeptime)
+    print(f'{samples} samples per sweep ({args.samplerate} samples/s, {args.sweeptime} s)')
+    print(f'{"":<28}{"allocating (us)":>18}{"preallocated (us)":>20}{"speedup":>10}')
+
+    benchmarks = get_primitive_benchmarks(args.samplerate, args.sweeptime)
+    benchmarks.update(get_bundle_benchmarks(args.samplerate, args.sweeptime))
+    for name, (allocating, preallocated) in benchmarks.items():
+        allocating_time = benchmark(allocating, args.repeat)
+        preallocated_time = benchmark(preallocated, args.repeat)
+        print(f'{name:<28}{allocating_time:>18.1f}{preallocated_time:>20.1f}{allocating_time/preallocated_time:>9.1f}x')
+
+    print(f'Import of utils.waveforms: {get_import_time():.1f} ms')
+
+if __name__ == '__main__':
+    main()
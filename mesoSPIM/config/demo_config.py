@@ -17,7 +17,7 @@ dark_mode = False
 Waveform output for Galvos, ETLs etc.
 '''
 
-waveformgeneration = 'DemoWaveFormGeneration' # 'DemoWaveFormGeneration' or 'NI'
+waveformgeneration = 'DemoWaveFormGeneration' # 'DemoWaveFormGeneration', 'NI' or 'SimulatedNI'
 
 '''
 Card designations need to be the same as in NI MAX, if necessary, use NI MAX
@@ -39,6 +39,21 @@ acquisition_hardware = {'master_trigger_out_line' : 'PXI6259/port0/line1',
                         'laser_task_line' :  'PXI6733/ao0:7',
                         'laser_task_trigger_source' : '/PXI6259/PFI0'}
 
+'''
+Simulated NI-DAQmx: With 'SimulatedNI' as waveformgeneration, laser or shutter, the NI code
+runs against a simulation of the DAQ cards instead of the NI-DAQmx driver. Tasks, triggers and
+finite outputs take as long as on the hardware, plus the overheads below (in s). Everything
+written to the tasks is recorded (at most 'max_records' writes and task events).
+'''
+daq_simulation = {'task_create_time': 0.002,
+                  'task_start_time': 0.003,
+                  'task_stop_time': 0.0005,
+                  'task_close_time': 0.002,
+                  'write_time_per_sample': 2e-8,
+                  'record_writes': True,
+                  'max_records': 10000,
+                  }
+
 '''
 Human interface device (Joystick)
 '''
@@ -48,7 +63,7 @@ sidepanel = 'Demo' #'Demo' or 'FarmSimulator'
 Digital laser enable lines
 '''
 
-laser = 'Demo' # 'Demo' or 'NI'
+laser = 'Demo' # 'Demo', 'NI' or 'SimulatedNI'
 
 ''' The laserdict keys are the laser designation that will be shown
 in the user interface '''
@@ -89,7 +104,7 @@ galvo_etl_designation = {'Galvo-L' : 0,
 Shutter configuration
 '''
 
-shutter = 'Demo' # 'Demo' or 'NI'
+shutter = 'Demo' # 'Demo', 'NI' or 'SimulatedNI'
 shutterdict = {'shutter_left' : 'PXI6259/port0/line0',
               'shutter_right' : 'PXI6259/port2/line0'}
 
@@ -335,11 +350,133 @@ pixelsize = {'0.63x' : 10.52,
 '''
 HDF5 parameters, when this format is used for data saving (optional).
 '''
-hdf5 = {'subsamp': ((1, 1, 1),), #((1, 1, 1),) no subsamp, ((1, 1, 1), (1, 4, 4)) for 2-level (z,y,x) subsamp.
+hdf5 = {'subsamp': ((1, 1, 1),), #((1, 1, 1),) no subsamp, ((1, 1, 1), (2, 2, 2), (4, 4, 4)) for a 3-level (z,y,x) pyramid, computed during acquisition.
         'compression': None, # None, 'gzip', 'lzf'
+        'blockdim': ((16, 256, 256),), # HDF5 chunk shape in (z,y,x). Planes are buffered and written in blocks of this z depth (2 blocks in memory)
         'flip_xyz': (True, True, False) # match BigDataViewer axes to mesoSPIM 
         }
 
+'''
+OME-Zarr options: If the filename ends with .zarr, all rows of an acquisition list are saved as 
+chunked and compressed OME-NGFF arrays in a single zarr directory. Requires zarr v2: python -m pip install "zarr<3"
+'chunks' are in (z,y,x) order, 'compression' is a Blosc compressor ('zstd', 'lz4', 'blosclz', 'zlib') or None.
+Chunks are compressed in parallel by 'n_threads' threads.
+'subsamp' defines the resolution levels in (z,y,x) order like for HDF5, e.g. ((1, 1, 1), (2, 2, 2), (4, 4, 4)).
+'''
+zarr = {'chunks': (32, 256, 256),
+        'compression': 'zstd',
+        'compression_level': 3,
+        'n_threads': 8,
+        'subsamp': ((1, 1, 1),),
+        }
+
+'''
+Raw file options: Additional resolution levels in (z,y,x) order are written as sidecar files
+<filename>_level<n>_<z>x<y>x<x>.raw next to each raw file, e.g. ((1, 1, 1), (2, 2, 2), (4, 4, 4)).
+((1, 1, 1),) writes no sidecar files.
+'''
+raw = {'subsamp': ((1, 1, 1),),
+       }
+
+'''
+Z-scan mode: In 'step' mode, the stage moves to every plane (step-and-shoot). In 'continuous' mode,
+the z stage moves at constant velocity (z_step / sweeptime) through the stack while the NI cards
+output one sweep per plane. This requires a stage with z-scan support (DemoStage, PI) and is not
+used for rows with focus interpolation. Before the first plane, the stage accelerates with
+'acceleration' (um/s^2, should match the stage controller) and moves for 'settle_time' (s)
+at constant velocity. Scans faster than 'max_velocity' (um/s) fall back to step mode.
+'''
+z_scan = {'mode': 'step', # 'step' or 'continuous'
+          'acceleration': 10000,
+          'settle_time': 0.1,
+          'max_velocity': 2000,
+          }
+
+'''
+Preflight check before an acquisition list is started
+
+The data volume of the list (uncompressed, including resolution levels and projections) is
+compared against the free space of each target volume, plus a 'free_space_margin' (fraction).
+If 'bandwidth_probe' is True, 'probe_size_mb' are written to each volume to measure its
+write bandwidth, which is cached for 'probe_max_age_s'. If the disk is slower than the data
+rate at 'average_frame_rate', a warning is shown, or the list is not started at all if
+'refuse_if_too_slow' is True. Missing disk space always stops the acquisition list.
+'''
+preflight = {'enabled': True,
+             'free_space_margin': 0.05,
+             'bandwidth_probe': True,
+             'probe_size_mb': 256,
+             'probe_max_age_s': 3600,
+             'refuse_if_too_slow': False,
+             }
+
+'''
+Pipelined acquisition lists
+
+If 'enabled' is True, the next stack of an acquisition list is prepared (stage movement,
+filter, zoom, laser, ETL settings and waveforms) while the camera thread is still writing the
+end of the previous stack and closing its files. The dead time between stacks is logged.
+'''
+stack_pipeline = {'enabled': True,
+                  }
+
+'''
+Acquisition list optimizer
+
+If 'enabled' is True, the rows of an acquisition list are reordered before it is run to
+minimize the predicted time between stacks. The first row stays first, the table itself and
+the filenames are not changed. Filter, zoom and laser changes take 'filter_change_time',
+'zoom_change_time' and 'laser_change_time' (s), stage moves are predicted with 'stage_velocity'
+(um/s) and rotations (via the rotation position in stage_parameters) with 'rotation_velocity'
+(degrees/s). 'max_2opt_passes' limits the search for a better order.
+'''
+acquisition_optimizer = {'enabled': False,
+                         'filter_change_time': 0.5,
+                         'zoom_change_time': 1.0,
+                         'laser_change_time': 0.0,
+                         'stage_velocity': 1000,
+                         'rotation_velocity': 10,
+                         'max_2opt_passes': 20,
+                         }
+
+'''
+Learned acquisition time model
+
+If 'enabled' is True, stack and acquisition list times are predicted from measured stacks
+instead of 'average_frame_rate' alone. The model fits the time per frame, a fixed overhead per
+stack, filter, zoom and laser changes, rotations and stage travel to the stacks in the json file
+'history_file' (at most 'max_records' stacks). The Core adds every completed stack and updates the
+prediction during a run, stacks of existing data can be imported from the TIMING INFORMATION of the
+metadata files in 'metadata_folders'. Until enough stacks are measured, the prediction follows
+'average_frame_rate', 'stack_overhead' (s) and the times in acquisition_optimizer, which count as
+'prior_weight' stacks. Costs which the history cannot tell apart (e.g. overhead and frames if
+all stacks have the same number of planes) are fitted together in the ratio of these values.
+'''
+timing_model = {'enabled': True,
+                'history_file': 'log/timing_history.json',
+                'metadata_folders': [],
+                'max_records': 2000,
+                'stack_overhead': 2.0,
+                'prior_weight': 5,
+                }
+
+'''
+Frame buffer between camera and image writer
+
+Frames are copied into a preallocated ring buffer and written to disk by a separate thread.
+'n_slots' sets the buffer size in frames (memory: n_slots * x_pixels * y_pixels * 2 bytes).
+If the buffer is full, the camera thread waits up to 'put_timeout_ms' for a free slot before
+the frame is dropped. High-water mark and dropped frames are logged after each stack.
+If 'zero_copy' is True, frames are not copied by the camera thread if the camera memory they live in
+is not reused before they are written (e.g. Hamamatsu cameras with more than 2 * n_slots DCAM
+buffers). The writer thread copies them out of camera memory instead. Once the writer falls behind,
+the camera thread copies frames again for the rest of the stack.
+'''
+frame_buffer = {'n_slots': 64,
+                'put_timeout_ms': 1000,
+                'zero_copy': False,
+                }
+
 '''
 Initial acquisition parameters
 
@@ -370,7 +507,7 @@ startup = {
 'intensity' : 10,
 'shutterstate':False, # Is the shutter open or not?
 'shutterconfig':'Right', # Can be "Left", "Right","Both","Interleaved"
-'laser_interleaving':False,
+'laser_interleaving':False, # Acquire consecutive rows which only differ in laser, intensity & ETL settings in a single stack, alternating lasers plane by plane
 'filter' : '405-488-561-640-Quadrupleblock',
 'etl_l_delay_%' : 7.5,
 'etl_l_ramp_rising_%' : 85,
@@ -405,6 +542,7 @@ startup = {
 'camera_display_live_subsampling': 1,
 'camera_display_snap_subsampling': 1,
 'camera_display_acquisition_subsampling': 2,
+'camera_display_max_framerate': 15, # Upper limit for the display rate in the camera window in frames/s
 'camera_binning':'1x1',
 'camera_sensor_mode':'ASLM',
 'average_frame_rate': 4.969,
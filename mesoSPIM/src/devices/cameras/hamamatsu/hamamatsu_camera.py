@@ -277,6 +277,7 @@ class HamamatsuCamera(object):
         self.frame_y = 0
         self.last_frame_number = 0
         self.properties = None
+        self.backlog = 0
         self.max_backlog = 0
         self.number_image_buffers = 0
 
@@ -319,6 +320,7 @@ class HamamatsuCamera(object):
         """
         self.buffer_index = -1
         self.last_frame_number = 0
+        self.backlog = 0
 
         # Set sub array mode.
         self.setSubArrayMode()
@@ -641,6 +643,7 @@ class HamamatsuCamera(object):
             print(">> Warning! hamamatsu camera frame buffer overrun detected!")
         if (backlog > self.max_backlog):
             self.max_backlog = backlog
+        self.backlog = backlog
         self.last_frame_number = cur_frame_number
 
 
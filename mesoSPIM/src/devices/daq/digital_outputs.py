@@ -0,0 +1,137 @@
+'''
+Persistent digital output tasks for static lines such as shutters and laser enables
+
+Creating an NI task takes several milliseconds, writing to a running static digital
+output task only takes microseconds. Instead of a task per switching operation, the
+DigitalOutputManager keeps one task per port with all lines registered on that port
+and updates them with a single write per port.
+'''
+
+import atexit
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+''' Shared managers, one per nidaqmx module: {module name : DigitalOutputManager} '''
+_managers = {}
+
+def get_digital_output_manager(nidaqmx):
+    '''
+    Returns the digital output manager shared by all devices using the nidaqmx module
+
+    Its tasks are closed when the program exits, the lines keep their last state.
+    '''
+    if nidaqmx.__name__ not in _managers:
+        manager = DigitalOutputManager(nidaqmx)
+        atexit.register(manager.close)
+        _managers[nidaqmx.__name__] = manager
+    return _managers[nidaqmx.__name__]
+
+class DigitalOutputPort(object):
+    '''
+    Running static digital output task for the registered lines of a port
+
+    Every line is a channel of its own, so other lines of the port (e.g. the master
+    trigger) can still be used by other tasks.
+
+    Args:
+        nidaqmx (module): nidaqmx or the simulated nidaqmx module
+        port (str): Port, e.g. 'PXI6259/port0'
+        line_states (dict): {line : bool} initial states, e.g. {'PXI6259/port0/line0' : False}
+    '''
+    def __init__(self, nidaqmx, port, line_states):
+        self.port = port
+        self.lines = list(line_states.keys())
+        self.states = [bool(state) for state in line_states.values()]
+
+        self.task = nidaqmx.Task()
+        for line in self.lines:
+            self.task.do_channels.add_do_chan(line, line_grouping=nidaqmx.constants.LineGrouping.CHAN_PER_LINE)
+        self.task.start()
+        self.write()
+
+    def write(self):
+        ''' Outputs the states of all lines with a single write '''
+        self.task.write(self.states)
+
+    def close(self):
+        self.task.close()
+
+class DigitalOutputManager(object):
+    '''
+    Keeps one long-lived digital output task per port
+
+    Lines are registered once (which creates or extends the task of their port),
+    afterwards they are switched by write_lines() without any task setup. Changes
+    of several lines on the same port are output together.
+
+    Args:
+        nidaqmx (module): nidaqmx or the simulated nidaqmx module
+    '''
+    def __init__(self, nidaqmx):
+        self.nidaqmx = nidaqmx
+        self.ports = {}
+        self.write_count = 0
+        self.last_write_duration = 0.0
+
+    @staticmethod
+    def get_port_name(line):
+        ''' 'PXI6259/port0/line1' -> 'PXI6259/port0' '''
+        return line.strip().rsplit('/', 1)[0]
+
+    def register_lines(self, lines, state=False):
+        '''
+        Adds lines to the tasks of their ports, new lines are set to state
+
+        Adding lines to a port recreates its task once, already registered lines keep their state.
+        '''
+        new_lines = {}
+        for line in lines:
+            port = self.get_port_name(line)
+            if port not in self.ports or line not in self.ports[port].lines:
+                new_lines.setdefault(port, {})[line] = state
+
+        for port, line_states in new_lines.items():
+            if port in self.ports:
+                existing_port = self.ports[port]
+                existing_port.close()
+                line_states = dict(zip(existing_port.lines, existing_port.states), **line_states)
+            self.ports[port] = DigitalOutputPort(self.nidaqmx, port, line_states)
+            logger.info(f'Digital outputs: Task for {port} with lines {", ".join(self.ports[port].lines)}')
+
+    def write_lines(self, line_states):
+        '''
+        Sets several lines at once with a single write per affected port
+
+        Args:
+            line_states (dict): {line : bool}, lines have to be registered
+        '''
+        start_time = time.perf_counter()
+        changed_ports = []
+        for line, state in line_states.items():
+            port = self.ports[self.get_port_name(line)]
+            port.states[port.lines.index(line)] = bool(state)
+            if port not in changed_ports:
+                changed_ports.append(port)
+
+        for port in changed_ports:
+            port.write()
+        self.write_count += 1
+        self.last_write_duration = time.perf_counter() - start_time
+
+    def set_line(self, line, state):
+        self.write_lines({line : state})
+
+    def get_line(self, line):
+        port = self.ports[self.get_port_name(line)]
+        return port.states[port.lines.index(line)]
+
+    def close(self):
+        ''' Closes all tasks, the lines keep their last state '''
+        for port in self.ports.values():
+            try:
+                port.close()
+            except Exception as error:
+                logger.warning(f'Digital outputs: Task for {port.port} could not be closed: {error}')
+        self.ports = {}
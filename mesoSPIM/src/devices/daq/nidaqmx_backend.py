@@ -0,0 +1,31 @@
+'''
+Selection of the nidaqmx implementation: The NI-DAQmx driver or its simulation
+'''
+
+import logging
+logger = logging.getLogger(__name__)
+
+def get_nidaqmx(device_type, cfg=None):
+    '''
+    Returns the nidaqmx module to use for a device
+
+    Args:
+        device_type (str): Setting of the device in the config file, 'NI' or 'SimulatedNI'
+        cfg: Configuration module, the daq_simulation section configures the simulation.
+             The master trigger line of acquisition_hardware triggers the simulated tasks.
+
+    Returns:
+        module: nidaqmx or the simulated nidaqmx module, both with constants and types submodules
+    '''
+    if device_type == 'SimulatedNI':
+        from . import simulated_nidaqmx
+        if cfg is not None and not simulated_nidaqmx.configured:
+            simulated_nidaqmx.configure(trigger_lines=(cfg.acquisition_hardware['master_trigger_out_line'],),
+                                        **cfg.daq_simulation)
+            logger.info('Using simulated NI-DAQmx')
+        return simulated_nidaqmx
+    else:
+        import nidaqmx
+        import nidaqmx.constants
+        import nidaqmx.types
+        return nidaqmx
@@ -0,0 +1,402 @@
+'''
+Simulated nidaqmx module
+
+A drop-in replacement for the parts of the nidaqmx API used by the mesoSPIM, so that
+the NI code paths (waveform generation, shutters, laser enable lines) run without DAQ cards.
+
+The simulation models:
+- tasks with analog output, digital output and counter pulse channels
+- finite sample clock and implicit (counter) timing
+- digital edge start triggers: Tasks waiting for a trigger are armed by start() and
+  start their output when one of the trigger_lines has a rising edge. This corresponds
+  to the mesoSPIM wiring, where the master trigger line is connected to the PFI input
+  used as start trigger by all other tasks. If trigger_lines is None, any digital
+  output line triggers.
+- wait_until_done() blocking for the duration of the output and raising a DaqError on timeouts
+- overheads of creating, starting, stopping and closing tasks and of writing samples
+- reservation of analog output and counter resources by running tasks
+
+Everything written to a task is recorded in simulated_nidaqmx.recorder.
+
+Select it with 'SimulatedNI' as waveformgeneration, shutter or laser in the config file.
+'''
+
+import re
+import time
+import itertools
+from collections import deque, Counter
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+from . import constants
+from . import types
+from . import errors
+from .constants import AcquisitionType, LineGrouping, Edge
+from .errors import DaqError
+
+''' Overheads in s, roughly those of a PXI system '''
+default_parameters = {'task_create_time' : 0.002,
+                      'task_start_time' : 0.003,
+                      'task_stop_time' : 0.0005,
+                      'task_close_time' : 0.002,
+                      'write_time_per_sample' : 2e-8,
+                      'record_writes' : True,
+                      'max_records' : 10000,
+                      'trigger_lines' : None,
+                      }
+
+parameters = dict(default_parameters)
+configured = False
+
+def configure(**kwargs):
+    '''
+    Sets simulation parameters (see default_parameters) and clears the recorder
+    '''
+    global configured
+    for key in kwargs:
+        if key not in default_parameters:
+            raise KeyError(f'Unknown simulation parameter: {key}')
+    parameters.update(kwargs)
+    recorder.clear()
+    configured = True
+
+class Recorder(object):
+    '''
+    Records the activity of all simulated tasks
+
+    Attributes:
+        events (deque): (timestamp, task name, event, detail) tuples
+        writes (deque): (timestamp, task name, channel, data) tuples, data is a copy
+        line_states (dict): Last value written to each digital output channel
+        counts (Counter): Number of events by type, e.g. counts['create']
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.events = deque(maxlen=parameters['max_records'])
+        self.writes = deque(maxlen=parameters['max_records'])
+        self.line_states = {}
+        self.counts = Counter()
+
+    def add_event(self, task_name, event, detail=None):
+        self.counts[event] += 1
+        self.events.append((time.perf_counter(), task_name, event, detail))
+
+    def add_write(self, task_name, channel, data):
+        self.counts['write'] += 1
+        if parameters['record_writes']:
+            self.writes.append((time.perf_counter(), task_name, channel, np.array(data, copy=True)))
+
+    def get_writes(self, task_name=None, channel=None):
+        ''' Returns the recorded data written to a task and/or channel '''
+        return [data for timestamp, name, chan, data in self.writes
+                if (task_name is None or name == task_name) and (channel is None or chan == channel)]
+
+recorder = Recorder()
+
+''' Tasks waiting for their start trigger '''
+_armed_tasks = []
+''' Resources (AO timing engines, counters) in use: {resource : task name} '''
+_reserved_resources = {}
+_task_counter = itertools.count()
+
+def _sleep(duration):
+    if duration > 0:
+        time.sleep(duration)
+
+def _count_lines(physical_channel):
+    ''' 'Dev1/ao0:3' -> 4, 'Dev1/port0/line1' -> 1 '''
+    count = 0
+    for channel in physical_channel.split(','):
+        match = re.search(r'(\d+):(\d+)$', channel.strip())
+        count += abs(int(match.group(2)) - int(match.group(1))) + 1 if match else 1
+    return count
+
+def _get_device(physical_channel):
+    return physical_channel.strip().strip('/').split('/')[0]
+
+def _send_trigger():
+    ''' A rising edge on a digital line starts all armed tasks '''
+    now = time.perf_counter()
+    for task in list(_armed_tasks):
+        task._begin_output(now)
+    del _armed_tasks[:]
+
+class _Channel(object):
+    def __init__(self, kind, physical_channel, **kwargs):
+        self.kind = kind
+        self.physical_channel = physical_channel
+        self.n_lines = _count_lines(physical_channel)
+        self.options = kwargs
+
+class _ChannelCollection(object):
+    def __init__(self, task, kind):
+        self.task = task
+        self.kind = kind
+
+    def _add(self, physical_channel, **kwargs):
+        self.task._check_open()
+        channel = _Channel(self.kind, physical_channel, **kwargs)
+        self.task.channels.append(channel)
+        recorder.add_event(self.task.name, 'add_channel', physical_channel)
+        return channel
+
+class _AOChannelCollection(_ChannelCollection):
+    def add_ao_voltage_chan(self, physical_channel, name_to_assign_to_channel='', **kwargs):
+        return self._add(physical_channel, **kwargs)
+
+class _DOChannelCollection(_ChannelCollection):
+    def add_do_chan(self, lines, name_to_assign_to_lines='', line_grouping=LineGrouping.CHAN_FOR_ALL_LINES):
+        return self._add(lines, line_grouping=line_grouping)
+
+class _COChannelCollection(_ChannelCollection):
+    def add_co_pulse_chan_time(self, counter, name_to_assign_to_channel='', units=None, idle_state=None,
+                               initial_delay=0.0, low_time=0.01, high_time=0.01):
+        return self._add(counter, initial_delay=initial_delay, low_time=low_time, high_time=high_time)
+
+class _Timing(object):
+    def __init__(self, task):
+        self.task = task
+        self.samp_clk_rate = None
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = None
+        self.implicit = False
+
+    def cfg_samp_clk_timing(self, rate, source='', active_edge=Edge.RISING,
+                            sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        self.samp_clk_rate = rate
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = samps_per_chan
+
+    def cfg_implicit_timing(self, sample_mode=AcquisitionType.FINITE, samps_per_chan=1000):
+        self.implicit = True
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = samps_per_chan
+
+class _StartTrigger(object):
+    def __init__(self):
+        self.trigger_source = None
+
+    def cfg_dig_edge_start_trig(self, trigger_source, trigger_edge=Edge.RISING):
+        self.trigger_source = trigger_source
+
+    def disable_start_trig(self):
+        self.trigger_source = None
+
+class _Triggers(object):
+    def __init__(self):
+        self.start_trigger = _StartTrigger()
+
+class Task(object):
+    '''
+    Simulated nidaqmx.Task
+
+    States: 'idle' (created or stopped), 'armed' (started, waiting for the start
+    trigger), 'running' (generating output) and 'closed'.
+    '''
+    def __init__(self, new_task_name=''):
+        self.name = new_task_name if new_task_name else f'SimulatedTask{next(_task_counter)}'
+        self.channels = []
+        self.ao_channels = _AOChannelCollection(self, 'ao')
+        self.do_channels = _DOChannelCollection(self, 'do')
+        self.co_channels = _COChannelCollection(self, 'co')
+        self.timing = _Timing(self)
+        self.triggers = _Triggers()
+
+        self.state = 'idle'
+        self.output_start_time = None
+        self.samples_written = 0
+
+        _sleep(parameters['task_create_time'])
+        recorder.add_event(self.name, 'create')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def channel_names(self):
+        return [channel.physical_channel for channel in self.channels]
+
+    def _check_open(self):
+        if self.state == 'closed':
+            raise DaqError(f'Task {self.name} has been closed', error_code=-200088)
+
+    def _get_kind(self):
+        kinds = set(channel.kind for channel in self.channels)
+        if len(kinds) != 1:
+            raise DaqError(f'Task {self.name} needs channels of exactly one type, has {kinds}', error_code=-200478)
+        return kinds.pop()
+
+    def _get_resources(self):
+        kind = self._get_kind()
+        if kind == 'ao':
+            ''' All analog outputs of a device share its timing engine '''
+            return set(_get_device(channel.physical_channel) + '/ao' for channel in self.channels)
+        elif kind == 'co':
+            return set(channel.physical_channel.strip('/') for channel in self.channels)
+        elif self.timing.samp_clk_rate is not None:
+            return set(_get_device(channel.physical_channel) + '/do' for channel in self.channels)
+        else:
+            return set()
+
+    def get_duration(self):
+        ''' Output duration in s after the start (trigger) '''
+        kind = self._get_kind()
+        if kind == 'co':
+            n_pulses = self.timing.samp_quant_samp_per_chan if self.timing.implicit else 1
+            return max(channel.options['initial_delay'] + n_pulses * channel.options['high_time'] +
+                       (n_pulses - 1) * channel.options['low_time'] for channel in self.channels)
+        elif self.timing.samp_clk_rate is not None:
+            if self.timing.samp_quant_samp_mode != AcquisitionType.FINITE:
+                return float('inf')
+            return self.timing.samp_quant_samp_per_chan / self.timing.samp_clk_rate
+        else:
+            return 0.0
+
+    def _begin_output(self, timestamp):
+        self.state = 'running'
+        self.output_start_time = timestamp
+        recorder.add_event(self.name, 'output')
+
+    def start(self):
+        self._check_open()
+        kind = self._get_kind()
+        if self.state != 'idle':
+            raise DaqError(f'Task {self.name} is already running', error_code=-200479)
+        if kind == 'ao' and self.samples_written == 0:
+            raise DaqError(f'Task {self.name}: No data has been written to the buffer', error_code=-200462)
+
+        for resource in self._get_resources():
+            if resource in _reserved_resources:
+                raise DaqError(f'Task {self.name}: Resource {resource} is reserved by task {_reserved_resources[resource]}',
+                               error_code=-50103)
+        for resource in self._get_resources():
+            _reserved_resources[resource] = self.name
+
+        _sleep(parameters['task_start_time'])
+        recorder.add_event(self.name, 'start')
+        if self.triggers.start_trigger.trigger_source is not None:
+            self.state = 'armed'
+            _armed_tasks.append(self)
+        else:
+            self._begin_output(time.perf_counter())
+
+    def write(self, data, auto_start=None, timeout=10.0):
+        '''
+        Writes data to the task, returns the number of samples per channel
+
+        Digital output tasks without sample clock are on-demand: The data is
+        applied immediately and rising edges trigger armed tasks.
+        '''
+        self._check_open()
+        kind = self._get_kind()
+        if kind == 'co':
+            raise DaqError(f'Task {self.name}: Counter output tasks can not be written to', error_code=-200463)
+
+        array = np.asarray(data)
+        n_lines = sum(channel.n_lines for channel in self.channels)
+        if kind == 'ao' and n_lines > 1:
+            if array.ndim != 2 or array.shape[0] != n_lines:
+                raise DaqError(f'Task {self.name}: Data of shape {array.shape} does not match {n_lines} channels',
+                               error_code=-200524)
+            n_samples = array.shape[1]
+        else:
+            n_samples = array.size
+
+        if self.timing.samp_clk_rate is not None:
+            samps_per_chan = self.timing.samp_quant_samp_per_chan
+            if n_samples > samps_per_chan:
+                raise DaqError(f'Task {self.name}: {n_samples} samples exceed the buffer of {samps_per_chan} samples',
+                               error_code=-200547)
+            if samps_per_chan % n_samples != 0:
+                logger.warning(f'Simulated DAQ: Task {self.name}: {n_samples} samples are regenerated, '
+                               f'but do not evenly divide {samps_per_chan} samples')
+
+        _sleep(n_samples * n_lines * parameters['write_time_per_sample'])
+        self.samples_written = n_samples
+        recorder.add_write(self.name, ','.join(self.channel_names), array)
+
+        if kind == 'do' and self.timing.samp_clk_rate is None:
+            self._write_on_demand(array)
+        elif auto_start and self.state == 'idle':
+            self.start()
+        return n_samples
+
+    def _write_on_demand(self, array):
+        values = np.ravel(array).tolist()
+        if len(self.channels) > 1:
+            ''' Several channels (e.g. one per line): One value per channel '''
+            channel_values = [(channel, [value]) for channel, value in zip(self.channel_names, values)]
+        else:
+            channel_values = [(self.channel_names[0], values)]
+
+        trigger_lines = parameters['trigger_lines']
+        for channel, values in channel_values:
+            is_trigger_line = trigger_lines is None or channel in trigger_lines
+            previous = recorder.line_states.get(channel, 0)
+            for value in values:
+                if is_trigger_line and int(value) & ~int(previous):
+                    _send_trigger()
+                previous = value
+            recorder.line_states[channel] = previous
+
+    def is_task_done(self):
+        self._check_open()
+        if self.state == 'armed':
+            return False
+        if self.state == 'running':
+            return time.perf_counter() >= self.output_start_time + self.get_duration()
+        return True
+
+    def wait_until_done(self, timeout=10.0):
+        '''
+        Waits until the output is complete
+
+        Raises:
+            DaqError: If the task is not done within timeout seconds, e.g. because
+                      it never received its start trigger. -1 waits infinitely.
+        '''
+        self._check_open()
+        if timeout == -1:
+            timeout = float('inf')
+        if self.state == 'armed':
+            if timeout == float('inf'):
+                raise DaqError(f'Task {self.name} waits infinitely for a start trigger which never arrives')
+            _sleep(timeout)
+            raise DaqError(f'Task {self.name}: Wait Until Done did not indicate all samples were generated '
+                           f'(no start trigger within {timeout} s)')
+        if self.state == 'running':
+            remaining = self.output_start_time + self.get_duration() - time.perf_counter()
+            if remaining > timeout:
+                _sleep(timeout)
+                raise DaqError(f'Task {self.name}: Wait Until Done did not indicate all samples were generated '
+                               f'within {timeout} s')
+            _sleep(remaining)
+
+    def stop(self):
+        self._check_open()
+        if self in _armed_tasks:
+            _armed_tasks.remove(self)
+        for resource, name in list(_reserved_resources.items()):
+            if name == self.name:
+                del _reserved_resources[resource]
+        if self.state != 'idle':
+            _sleep(parameters['task_stop_time'])
+            recorder.add_event(self.name, 'stop')
+        self.state = 'idle'
+        self.output_start_time = None
+
+    def close(self):
+        if self.state == 'closed':
+            return
+        self.stop()
+        _sleep(parameters['task_close_time'])
+        self.state = 'closed'
+        recorder.add_event(self.name, 'close')
@@ -0,0 +1,9 @@
+'''
+Errors of the simulated nidaqmx module
+'''
+
+class DaqError(Exception):
+    ''' Raised like nidaqmx.errors.DaqError, e.g. if a task does not finish within the timeout '''
+    def __init__(self, message, error_code=-200560):
+        super().__init__(message)
+        self.error_code = error_code
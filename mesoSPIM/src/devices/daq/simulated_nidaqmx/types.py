@@ -0,0 +1,7 @@
+'''
+Types of the simulated nidaqmx module
+'''
+
+from collections import namedtuple
+
+CtrTime = namedtuple('CtrTime', ['high_time', 'low_time'])
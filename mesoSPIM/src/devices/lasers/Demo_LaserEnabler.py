@@ -15,6 +15,11 @@ class Demo_LaserEnabler:
         else:
             pass
 
+    def enable_multiple(self, lasers):
+        for laser in lasers:
+            self._check_if_laser_in_laserdict(laser)
+        self.laserenablestate = ', '.join(lasers)
+
     def enable_all(self):
         self.laserenablestate = 'all on'
 
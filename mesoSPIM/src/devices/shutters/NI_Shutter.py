@@ -4,42 +4,58 @@ Author: Fabian Voigt
 #TODO
 """
 
-import nidaqmx
-from nidaqmx.constants import LineGrouping
+from ..daq.nidaqmx_backend import get_nidaqmx
+from ..daq.digital_outputs import get_digital_output_manager
 
 class NI_Shutter:
     """
-    Slow shutter, intended more as a gating device than a fast open/close because the
-    NI task is recreated and deleted every time a shutter is actuated.
+    Shutter on a digital output line
 
-    Thus, the shutter has more a "gating" function to protect the sample than
-    fast control of the laser, this is done via the laser intensity anyway.
+    The line is part of a persistent digital output task (see DigitalOutputManager),
+    so opening and closing only takes a single write to the running task. This is
+    fast enough for switching between left and right shutters frame by frame.
 
     This uses the property of NI-DAQmx-outputs to keep their last digital state or
     analog voltage for as long the device is not powered down.
+
+    Args:
+        shutterline (str): Digital output line, e.g. 'PXI6259/port0/line0'
+        nidaqmx (module): nidaqmx or the simulated nidaqmx module, default: nidaqmx
     """
-    def __init__(self, shutterline):
+    def __init__(self, shutterline, nidaqmx=None):
         self.shutterline =  shutterline
+        self.nidaqmx = nidaqmx if nidaqmx is not None else get_nidaqmx('NI')
+        self.digital_outputs = get_digital_output_manager(self.nidaqmx)
 
         # Make sure that the Shutter is closed upon initialization
-        with nidaqmx.Task() as task:
-            task.do_channels.add_do_chan(self.shutterline,line_grouping=LineGrouping.CHAN_FOR_ALL_LINES)
-            task.write([False], auto_start=True)
-            self.shutterstate = False
+        self.digital_outputs.register_lines([self.shutterline])
+        self.digital_outputs.set_line(self.shutterline, False)
+        self.shutterstate = False
 
     # Open and close shutter take an optional argument to deal with the on_click method of Jupyter Widgets
     def open(self, *args):
-        with nidaqmx.Task() as task:
-            task.do_channels.add_do_chan(self.shutterline,line_grouping=LineGrouping.CHAN_FOR_ALL_LINES)
-            task.write([True], auto_start=True)
-            self.shutterstate = True
+        self.digital_outputs.set_line(self.shutterline, True)
+        self.shutterstate = True
 
     def close(self, *args):
-        with nidaqmx.Task() as task:
-            task.do_channels.add_do_chan(self.shutterline,line_grouping=LineGrouping.CHAN_FOR_ALL_LINES)
-            task.write([False], auto_start=True)
-            self.shutterstate = False
+        self.digital_outputs.set_line(self.shutterline, False)
+        self.shutterstate = False
 
     def state(self, *args):
         """ Returns "True" if the shutter is open, otherwise "False" """
         return self.shutterstate
+
+def set_shutters(shutter_states):
+    """
+    Opens (True) or closes (False) several NI shutters with a single update of their digital outputs
+
+    Args:
+        shutter_states (dict): {NI_Shutter : bool}
+    """
+    managers = {}
+    for shutter, state in shutter_states.items():
+        managers.setdefault(id(shutter.digital_outputs), (shutter.digital_outputs, {}))[1][shutter.shutterline] = state
+    for manager, line_states in managers.values():
+        manager.write_lines(line_states)
+    for shutter, state in shutter_states.items():
+        shutter.shutterstate = bool(state)
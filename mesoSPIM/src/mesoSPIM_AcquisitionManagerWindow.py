@@ -38,6 +38,7 @@ from .utils.focus_tracking_wizard import FocusTrackingWizard
 from .utils.image_processing_wizard import ImageProcessingWizard
 
 from .utils.utility_functions import convert_seconds_to_string
+from .utils.timing_model import AcquisitionTimingModel, get_timing_config
 
 class MyStyle(QtWidgets.QProxyStyle):
     def drawPrimitive(self, element, option, painter, widget=None):
@@ -67,6 +68,12 @@ class mesoSPIM_AcquisitionManagerWindow(QtWidgets.QWidget):
 
         self.state = mesoSPIM_StateSingleton()
 
+        ''' The Core adds measured stacks to the history, this instance reloads it when it changed '''
+        if get_timing_config(self.cfg)['enabled']:
+            self.timing_model = AcquisitionTimingModel.from_config(self.cfg)
+        else:
+            self.timing_model = None
+
         loadUi('gui/mesoSPIM_AcquisitionManagerWindow.ui', self)
         self.setWindowTitle('mesoSPIM Acquisition Manager')
 
@@ -299,8 +306,16 @@ class mesoSPIM_AcquisitionManagerWindow(QtWidgets.QWidget):
             exec(string_to_execute)
 
     def update_acquisition_time_prediction(self):
-        framerate = self.state['current_framerate']
-        total_time = self.state['acq_list'].get_acquisition_time(framerate)
+        ''' Predicts the time of every row (shown as row header tooltip) and of the whole list '''
+        acq_list = self.state['acq_list']
+        if self.timing_model is not None:
+            self.timing_model.reload_if_changed()
+            row_times = self.timing_model.predict_rows(acq_list, interleaved=self.state['laser_interleaving'])
+        else:
+            framerate = self.state['current_framerate']
+            row_times = [acq.get_acquisition_time(framerate) for acq in acq_list]
+        self.model.setPredictedTimes(row_times)
+        total_time = sum(row_times)
         self.state['predicted_acq_list_time'] = total_time
         self.state['remaining_acq_list_time'] = total_time
         time_string = convert_seconds_to_string(total_time)
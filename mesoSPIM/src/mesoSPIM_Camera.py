@@ -20,11 +20,13 @@ except:
 '''
 from .mesoSPIM_State import mesoSPIM_StateSingleton
 from .mesoSPIM_ImageWriter import mesoSPIM_ImageWriter
+from .mesoSPIM_ImageDisplay import mesoSPIM_ImageDisplay
 from .utils.acquisitions import AcquisitionList, Acquisition
+from .utils.telemetry import FrameTelemetry, TelemetryAggregator
+from .utils.command_registry import CommandRegistry
 
 class mesoSPIM_Camera(QtCore.QObject):
     '''Top-level class for all cameras'''
-    sig_camera_frame = QtCore.pyqtSignal(np.ndarray)
     sig_finished = QtCore.pyqtSignal()
     sig_update_gui_from_state = QtCore.pyqtSignal(bool)
     sig_status_message = QtCore.pyqtSignal(str)
@@ -38,6 +40,18 @@ class mesoSPIM_Camera(QtCore.QObject):
         self.state = mesoSPIM_StateSingleton()
         self.image_writer = mesoSPIM_ImageWriter(self)
 
+        ''' Frames for display are handed to a display worker in its own thread '''
+        self.image_display = mesoSPIM_ImageDisplay(self)
+        self.display_thread = QtCore.QThread()
+        self.image_display.moveToThread(self.display_thread)
+        self.display_thread.started.connect(self.image_display.start)
+        self.display_thread.start()
+
+        ''' Per-stack camera telemetry, read by the Core for progress & metadata '''
+        self.telemetry = TelemetryAggregator()
+        ''' Telemetry of the last finished image series, kept when the next series starts '''
+        self.series_telemetry = self.telemetry.get_summary()
+
         self.stopflag = False
 
         self.x_pixels = self.cfg.camera_parameters['x_pixels']
@@ -59,6 +73,16 @@ class mesoSPIM_Camera(QtCore.QObject):
         self.camera_display_snap_subsampling = self.cfg.startup['camera_display_snap_subsampling']
         self.camera_display_acquisition_subsampling = self.cfg.startup['camera_display_acquisition_subsampling']
 
+        ''' State requests handled by the camera '''
+        self.command_registry = CommandRegistry('Camera')
+        self.command_registry.register('camera_exposure_time', self.set_camera_exposure_time, float)
+        self.command_registry.register('camera_line_interval', self.set_camera_line_interval, float)
+        self.command_registry.register('state', self.set_state, str)
+        self.command_registry.register('camera_display_live_subsampling', self.set_camera_display_live_subsampling, int)
+        self.command_registry.register('camera_display_snap_subsampling', self.set_camera_display_snap_subsampling, int)
+        self.command_registry.register('camera_display_acquisition_subsampling', self.set_camera_display_acquisition_subsampling, int)
+        self.command_registry.register('camera_binning', self.set_camera_binning, str)
+
         ''' Wiring signals '''
         self.parent.sig_state_request.connect(self.state_request_handler)
 
@@ -66,6 +90,9 @@ class mesoSPIM_Camera(QtCore.QObject):
         self.parent.sig_add_images_to_image_series.connect(self.add_images_to_series)
         self.parent.sig_add_images_to_image_series_and_wait_until_done.connect(self.add_images_to_series, type=3)
         self.parent.sig_end_image_series.connect(self.end_image_series, type=3)
+        ''' Pipelined acquisition lists: The Core prepares the next stack while the series ends '''
+        self.parent.sig_end_image_series_in_background.connect(self.end_image_series)
+        self.parent.sig_wait_for_image_series.connect(self.wait_for_image_series, type=3)
 
         self.parent.sig_prepare_live.connect(self.prepare_live, type = 3)
         self.parent.sig_get_live_image.connect(self.get_live_image)
@@ -89,27 +116,18 @@ class mesoSPIM_Camera(QtCore.QObject):
             self.camera.close_camera()
         except Exception as error:
             logger.info('Error while closing the camera:', str(error))
+        try:
+            self.display_thread.quit()
+            self.display_thread.wait()
+        except:
+            pass
 
     @QtCore.pyqtSlot(dict)
     def state_request_handler(self, dict):
-        for key, value in zip(dict.keys(),dict.values()):
-            # print('Camera Thread: State request: Key: ', key, ' Value: ', value)
-            '''
-            The request handling is done with exec() to write fewer lines of
-            code.
-            '''
-            if key in ('camera_exposure_time',
-                        'camera_line_interval',
-                        'state',
-                        'camera_display_live_subsampling',
-                        'camera_display_snap_subsampling',
-                        'camera_display_acquisition_subsampling',
-                        'camera_binning'):
-                exec('self.set_'+key+'(value)')
-            # Log Thread ID during Live: just debugging code
-            elif key == 'state':
-                if value == 'live':
-                    logger.info('Thread ID during live: '+str(int(QtCore.QThread.currentThreadId())))
+        '''
+        The request handling is done with a lookup in the command registry
+        '''
+        self.command_registry.dispatch(dict)
 
     def set_state(self, value):
         pass
@@ -168,9 +186,12 @@ class mesoSPIM_Camera(QtCore.QObject):
 
         self.image_writer.prepare_acquisition(acq, acq_list)
 
-        self.max_frame = acq.get_image_count()
+        ''' With laser interleaving, every plane has one frame per interleaved row '''
+        self.max_frame = acq.get_image_count() * max(1, len(self.image_writer.channels))
         self.processing_options_string = acq['processing']
 
+        self.telemetry.reset()
+        self.camera.reset_telemetry()
         self.camera.initialize_image_series()
         self.cur_image = 0
         logger.info(f'Camera: Finished Preparing Image Series')
@@ -183,34 +204,45 @@ class mesoSPIM_Camera(QtCore.QObject):
 
         if self.stopflag is False:
             if self.cur_image < self.max_frame:
+                retrieval_start = time.perf_counter()
                 images = self.camera.get_images_in_series()
+                for record in self.camera.get_frame_telemetry(len(images), time.perf_counter() - retrieval_start):
+                    self.telemetry.add(record)
+
+                copy = self.frames_need_copy(len(images))
+                display_copy = self.camera.get_frame_reuse_distance() is not None
                 for image in images:
-                    image = np.rot90(image)
-                    self.sig_camera_frame.emit(image[0:self.x_pixels:self.camera_display_acquisition_subsampling,0:self.y_pixels:self.camera_display_acquisition_subsampling])
-                    self.image_writer.write_image(image, acq, acq_list)
+                    ''' Images are written in camera layout, rotation is only applied to views '''
+                    self.image_display.post_image(image, self.camera_display_acquisition_subsampling, copy=display_copy)
+                    self.image_writer.write_image(image, acq, acq_list, copy=copy)
                     self.cur_image += 1
 
+    def frames_need_copy(self, n_new_frames):
+        '''
+        Checks if the frames returned by the camera have to be copied before they are queued for writing
+
+        Camera-owned frame memory can be handed to the writer directly if the camera
+        does not overwrite it while the frame is still waiting in the ring buffer. This
+        requires room for a full ring buffer, the frames retrieved at once (the driver
+        backlog) and the same number of frames again as a margin while the writer
+        copies the oldest frame out of camera memory. Once the writer fell behind (a put had to wait, which copies the
+        queued frames), frames are copied for the rest of the image series. The writer
+        copies the frame it reads out of camera memory first, the display copies frames
+        at the display framerate.
+        '''
+        if not self.cfg.frame_buffer['zero_copy']:
+            return True
+        reuse_distance = self.camera.get_frame_reuse_distance()
+        if reuse_distance is None:
+            return False
+        frame_buffer = self.image_writer.frame_buffer
+        if frame_buffer.frames_waited > 0:
+            return True
+        return 2 * (frame_buffer.n_slots + n_new_frames) > reuse_distance
+
     @QtCore.pyqtSlot(Acquisition, AcquisitionList)
     def end_image_series(self, acq, acq_list):
-        if self.stopflag is False:
-            if self.processing_options_string != '':
-                if self.processing_options_string == 'MAX':
-                    ''' Image processing needs to be reimplemented in an incremental fashion '''
-                    pass 
-
-                    '''
-                    self.sig_status_message.emit('Doing Max Projection')
-                    logger.info('Camera: Started Max Projection of '+str(self.max_frame)+' Images')
-                    stackview = self.xy_stack.view()
-                    stackview.shape = (self.max_frame, self.x_pixels, self.y_pixels)
-                    max_proj = np.max(stackview, axis=0)
-                    filename = 'MAX_' +self.filename + '.tif'
-                    path = self.folder+'/'+filename
-                    tifffile.imsave(path, max_proj, photometric='minisblack')
-                    logger.info('Camera: Saved Max Projection')
-                    self.sig_status_message.emit('Done with image processing')
-                    '''
-
+        ''' Projections (processing options) are computed incrementally by the image writer '''
         try:
             self.camera.close_image_series()
         except:
@@ -221,14 +253,27 @@ class mesoSPIM_Camera(QtCore.QObject):
         self.end_time =  time.time()
         framerate = (self.cur_image + 1)/(self.end_time - self.start_time)
         logger.info(f'Camera: Framerate: {framerate}')
+
+        telemetry = self.telemetry.get_summary()
+        self.series_telemetry = telemetry
+        logger.info(f'Camera: Telemetry: {telemetry}')
+        if telemetry['dropped_frames'] > 0:
+            logger.warning(f'Camera: {telemetry["dropped_frames"]} frames were lost in the camera driver (max. backlog: {telemetry["max_backlog"]} frames)')
         self.sig_finished.emit()
 
+    @QtCore.pyqtSlot()
+    def wait_for_image_series(self):
+        '''
+        Called with a blocking connection: Returns once all previously queued
+        calls, e.g. an image series ending in the background, are done.
+        '''
+        pass
+
     @QtCore.pyqtSlot()
     def snap_image(self):
         image = self.camera.get_image()
-        image = np.rot90(image)
-        self.sig_camera_frame.emit(image[0:self.x_pixels:self.camera_display_snap_subsampling,0:self.y_pixels:self.camera_display_snap_subsampling])
-        self.image_writer.write_snap_image(image)
+        self.image_display.post_image(image, self.camera_display_snap_subsampling)
+        self.image_writer.write_snap_image(np.rot90(image))
 
     @QtCore.pyqtSlot()
     def prepare_live(self):
@@ -243,11 +288,10 @@ class mesoSPIM_Camera(QtCore.QObject):
     @QtCore.pyqtSlot()
     def get_live_image(self):
         images = self.camera.get_live_image()
+        display_copy = self.camera.get_frame_reuse_distance() is not None
 
         for image in images:
-            image = np.rot90(image)
-
-            self.sig_camera_frame.emit(image[0:self.x_pixels:self.camera_display_live_subsampling,0:self.y_pixels:self.camera_display_live_subsampling])
+            self.image_display.post_image(image, self.camera_display_live_subsampling, copy=display_copy)
             self.live_image_count += 1
             #self.sig_camera_status.emit(str(self.live_image_count))
 
@@ -311,6 +355,57 @@ class mesoSPIM_GenericCamera(QtCore.QObject):
         '''Should return a single numpy array'''
         pass
 
+    def get_frame_reuse_distance(self):
+        '''
+        Number of frames after which the camera overwrites the memory of a frame
+        returned by get_images_in_series(). Should return None if every frame is a
+        newly allocated array and 0 if this is unknown (frames are always copied).
+        '''
+        return 0
+
+    def reset_telemetry(self):
+        ''' Called before every image series '''
+        self.telemetry_frame_count = 0
+        self.telemetry_last_timestamp = None
+
+    def get_driver_status(self):
+        '''
+        Returns the status of the camera driver after the last get_images_in_series() call
+
+        Returns:
+            tuple: (frame_number, buffer_fill): Number of the newest frame as counted by the driver
+                   and fill level (0..1) of the driver buffer. None for values the camera does not provide.
+        '''
+        return None, None
+
+    def get_frame_telemetry(self, n_frames, latency):
+        '''
+        Returns a FrameTelemetry record for each of the n_frames frames returned by the
+        last get_images_in_series() call, which took latency seconds.
+
+        Frames are numbered by the driver if it provides frame numbers, otherwise they
+        are counted here (and dropped frames can not be detected).
+        '''
+        timestamp = time.perf_counter()
+        newest_frame_number, buffer_fill = self.get_driver_status()
+        if newest_frame_number is None:
+            newest_frame_number = self.telemetry_frame_count + n_frames
+
+        if self.telemetry_last_timestamp is None or n_frames == 0:
+            interval = None
+        else:
+            interval = (timestamp - self.telemetry_last_timestamp) / n_frames
+        if n_frames > 0:
+            self.telemetry_last_timestamp = timestamp
+        self.telemetry_frame_count += n_frames
+
+        return [FrameTelemetry(frame_number=newest_frame_number - n_frames + 1 + i,
+                               backlog=n_frames,
+                               buffer_fill=buffer_fill,
+                               interval=interval,
+                               latency=latency,
+                               timestamp=timestamp) for i in range(n_frames)]
+
     def close_image_series(self):
         pass
 
@@ -362,6 +457,9 @@ class mesoSPIM_DemoCamera(mesoSPIM_GenericCamera):
     def get_images_in_series(self):
         return [self._create_random_image()]
 
+    def get_frame_reuse_distance(self):
+        return None
+
     def get_image(self):
         return self._create_random_image()
 
@@ -427,10 +525,23 @@ class mesoSPIM_HamamatsuCamera(mesoSPIM_GenericCamera):
         self.hcam.startAcquisition()
 
     def get_images_in_series(self):
+        ''' Returns views of the recycled DCAM buffers, no data is copied here '''
         [frames, _] = self.hcam.getFrames()
         images = [np.reshape(aframe.getData(), (-1,self.x_pixels)) for aframe in frames]
         return images
 
+    def get_frame_reuse_distance(self):
+        ''' HamamatsuCameraMR recycles its buffers in a circular fashion '''
+        return self.hcam.number_image_buffers
+
+    def get_driver_status(self):
+        ''' The DCAM frame count reveals frames which were overwritten before they were read out '''
+        if self.hcam.number_image_buffers > 0:
+            buffer_fill = min(1.0, self.hcam.backlog / self.hcam.number_image_buffers)
+        else:
+            buffer_fill = None
+        return self.hcam.last_frame_number, buffer_fill
+
     def close_image_series(self):
         self.hcam.stopAcquisition()
 
@@ -643,6 +754,14 @@ class mesoSPIM_PCOCamera(mesoSPIM_GenericCamera):
         image, meta = self.cam.image(image_number=-1)
         return [image]
 
+    def get_driver_status(self):
+        ''' The recorder counts all images, reading the newest image skips unread ones '''
+        try:
+            status = self.cam.rec.get_status()
+            return status['dwProcImgCount'], None
+        except Exception:
+            return None, None
+
     def close_image_series(self):
         pass
 
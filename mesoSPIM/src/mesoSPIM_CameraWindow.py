@@ -14,6 +14,8 @@ from PyQt5.uic import loadUi
 import pyqtgraph as pg
 
 class mesoSPIM_CameraWindow(QtWidgets.QWidget):
+    sig_image_displayed = QtCore.pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__()
 
@@ -108,6 +110,7 @@ class mesoSPIM_CameraWindow(QtWidgets.QWidget):
             '''
         else:
             self.draw_crosshairs()
+        self.sig_image_displayed.emit()
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
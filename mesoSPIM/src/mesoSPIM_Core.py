@@ -5,15 +5,15 @@ Core for the mesoSPIM project
 import os
 import numpy as np
 import time
-from scipy import signal
 import csv
+import threading
 import traceback
 
 import logging
 logger = logging.getLogger(__name__)
 
 '''PyQt5 Imports'''
-from PyQt5 import QtWidgets, QtCore, QtGui
+from PyQt5 import QtCore, QtGui
 
 '''National Instruments Imports'''
 # import nidaqmx
@@ -25,18 +25,25 @@ from PyQt5 import QtWidgets, QtCore, QtGui
 from .mesoSPIM_State import mesoSPIM_StateSingleton
 
 from .devices.shutters.Demo_Shutter import Demo_Shutter
-from .devices.shutters.NI_Shutter import NI_Shutter
+from .devices.shutters.NI_Shutter import NI_Shutter, set_shutters
 
 from .mesoSPIM_Camera import mesoSPIM_Camera
 
 from .devices.lasers.Demo_LaserEnabler import Demo_LaserEnabler
 from .devices.lasers.mesoSPIM_LaserEnabler import mesoSPIM_LaserEnabler
+from .devices.daq.nidaqmx_backend import get_nidaqmx
 
 from .mesoSPIM_Serial import mesoSPIM_Serial
 # from .mesoSPIM_DemoSerial import mesoSPIM_Serial
 from .mesoSPIM_WaveFormGenerator import mesoSPIM_WaveFormGenerator, mesoSPIM_DemoWaveFormGenerator
 
 from .utils.acquisitions import AcquisitionList, Acquisition
+from .utils.acquisition_optimizer import AcquisitionCostModel, optimize_acquisition_list, get_optimizer_config
+from .utils.timing_model import AcquisitionTimingModel, get_timing_config
+from .utils.command_registry import CommandRegistry
+from .utils.preflight import run_preflight
+from .utils.z_scan import ZScanPlan
+from .utils.z_profiles import parse_z_profile, evaluate_z_profile
 from .utils.utility_functions import convert_seconds_to_string
 
 class mesoSPIM_Core(QtCore.QObject):
@@ -64,6 +71,8 @@ class mesoSPIM_Core(QtCore.QObject):
     sig_add_images_to_image_series = QtCore.pyqtSignal(Acquisition, AcquisitionList)
     sig_add_images_to_image_series_and_wait_until_done = QtCore.pyqtSignal(Acquisition, AcquisitionList)
     sig_end_image_series = QtCore.pyqtSignal(Acquisition, AcquisitionList)
+    sig_end_image_series_in_background = QtCore.pyqtSignal(Acquisition, AcquisitionList)
+    sig_wait_for_image_series = QtCore.pyqtSignal()
 
     sig_prepare_live = QtCore.pyqtSignal()
     sig_get_live_image = QtCore.pyqtSignal()
@@ -81,6 +90,8 @@ class mesoSPIM_Core(QtCore.QObject):
     sig_load_sample = QtCore.pyqtSignal()
     sig_unload_sample = QtCore.pyqtSignal()
 
+    sig_start_z_scan = QtCore.pyqtSignal(dict)
+    sig_end_z_scan = QtCore.pyqtSignal()
     sig_mark_rotation_position = QtCore.pyqtSignal()
     sig_go_to_rotation_position = QtCore.pyqtSignal()
     sig_go_to_rotation_position_and_wait_until_done = QtCore.pyqtSignal()
@@ -88,9 +99,19 @@ class mesoSPIM_Core(QtCore.QObject):
     ''' ETL-related signals '''
     sig_save_etl_config = QtCore.pyqtSignal()
 
+    ''' Queued to run_next_step() '''
+    sig_next_step = QtCore.pyqtSignal()
+
     def __init__(self, config, parent):
         super().__init__()
 
+        ''' Stop requests can be set from any thread, see request_stop() '''
+        self.stop_event = threading.Event()
+        ''' Name of the running mode, None if idle, see begin_mode() '''
+        self.mode = None
+        self.next_step = None
+        self.sig_next_step.connect(self.run_next_step, type=QtCore.Qt.QueuedConnection)
+
         ''' Assign the parent class to a instance variable for callbacks '''
         self.parent = parent
         self.cfg = self.parent.cfg
@@ -99,6 +120,7 @@ class mesoSPIM_Core(QtCore.QObject):
         self.state['state']='init'
 
         ''' The signal-slot switchboard '''
+        self.register_state_request_handlers()
         self.parent.sig_state_request.connect(self.state_request_handler)
 
         self.parent.sig_execute_script.connect(self.execute_script)
@@ -127,6 +149,8 @@ class mesoSPIM_Core(QtCore.QObject):
         self.camera_worker.moveToThread(self.camera_thread)
         self.camera_worker.sig_update_gui_from_state.connect(self.sig_update_gui_from_state.emit)
         self.camera_worker.sig_status_message.connect(self.send_status_message_to_gui)
+        ''' Direct connection: The running stack is stopped from the writer thread '''
+        self.camera_worker.image_writer.sig_write_error.connect(self.abort_on_write_error, type=QtCore.Qt.DirectConnection)
         #logger.info('Camera worker thread affinity after moveToThread? Answer:'+str(id(self.camera_worker.thread())))
         ''' Set the serial thread up '''
         self.serial_thread = QtCore.QThread()
@@ -162,7 +186,7 @@ class mesoSPIM_Core(QtCore.QObject):
         #logger.info(f'Core: Serial Thread priority: {self.serial_thread.priority()}')
 
         ''' Setting waveform generation up '''
-        if self.cfg.waveformgeneration == 'NI':
+        if self.cfg.waveformgeneration in ('NI', 'SimulatedNI'):
             self.waveformer = mesoSPIM_WaveFormGenerator(self)
         elif self.cfg.waveformgeneration == 'DemoWaveFormGeneration':
             self.waveformer = mesoSPIM_DemoWaveFormGenerator(self)
@@ -177,9 +201,10 @@ class mesoSPIM_Core(QtCore.QObject):
         left_shutter_line = self.cfg.shutterdict['shutter_left']
         right_shutter_line = self.cfg.shutterdict['shutter_right']
 
-        if self.cfg.shutter == 'NI':
-            self.shutter_left = NI_Shutter(left_shutter_line)
-            self.shutter_right = NI_Shutter(right_shutter_line)
+        if self.cfg.shutter in ('NI', 'SimulatedNI'):
+            nidaqmx = get_nidaqmx(self.cfg.shutter, self.cfg)
+            self.shutter_left = NI_Shutter(left_shutter_line, nidaqmx)
+            self.shutter_right = NI_Shutter(right_shutter_line, nidaqmx)
         elif self.cfg.shutter == 'Demo':
             self.shutter_left = Demo_Shutter(left_shutter_line)
             self.shutter_right = Demo_Shutter(right_shutter_line)
@@ -190,8 +215,8 @@ class mesoSPIM_Core(QtCore.QObject):
         self.state['max_laser_voltage'] = self.cfg.startup['max_laser_voltage']
 
         ''' Setting the laserenabler up '''
-        if self.cfg.laser == 'NI':
-            self.laserenabler = mesoSPIM_LaserEnabler(self.cfg.laserdict)
+        if self.cfg.laser in ('NI', 'SimulatedNI'):
+            self.laserenabler = mesoSPIM_LaserEnabler(self.cfg.laserdict, get_nidaqmx(self.cfg.laser, self.cfg))
         elif self.cfg.laser == 'Demo':
             self.laserenabler = Demo_LaserEnabler(self.cfg.laserdict)
 
@@ -203,6 +228,14 @@ class mesoSPIM_Core(QtCore.QObject):
         self.stopflag = False
         logger.info('Thread ID at Startup: '+str(int(QtCore.QThread.currentThreadId())))
         self.metadata_file = None
+        self.z_scan_plan = None
+        self.acquisition_group = []
+        self.pending_timing_info = []
+        self.previous_stack_rows = None
+        if get_timing_config(self.cfg)['enabled']:
+            self.timing_model = AcquisitionTimingModel.from_config(self.cfg)
+        else:
+            self.timing_model = None
         # self.acquisition_list_rotation_position = {}
 
     def __del__(self):
@@ -221,64 +254,74 @@ class mesoSPIM_Core(QtCore.QObject):
             pass
 
 
+    def register_state_request_handlers(self):
+        '''
+        State requests handled by the Core itself, parameters of other 
+        subsystems are passed on to them together in a single request.
+        '''
+        self.command_registry = CommandRegistry('Core')
+        self.command_registry.register('filter', self.set_filter, str)
+        self.command_registry.register('zoom', self.set_zoom, str)
+        self.command_registry.register('laser', self.set_laser, str)
+        self.command_registry.register('intensity', self.set_intensity)
+        self.command_registry.register('shutterconfig', self.set_shutterconfig, str)
+        self.command_registry.register('state', self.set_state, str)
+        self.command_registry.register('camera_exposure_time', self.set_camera_exposure_time, float)
+        self.command_registry.register('camera_line_interval', self.set_camera_line_interval, float)
+
+        self.command_registry.register_group(('samplerate',
+                                              'sweeptime',
+                                              'ETL_cfg_file',
+                                              'etl_l_delay_%',
+                                              'etl_l_ramp_rising_%',
+                                              'etl_l_ramp_falling_%',
+                                              'etl_l_amplitude',
+                                              'etl_l_offset',
+                                              'etl_r_delay_%',
+                                              'etl_r_ramp_rising_%',
+                                              'etl_r_ramp_falling_%',
+                                              'etl_r_amplitude',
+                                              'etl_r_offset',
+                                              'galvo_l_frequency',
+                                              'galvo_l_amplitude',
+                                              'galvo_l_offset',
+                                              'galvo_l_duty_cycle',
+                                              'galvo_l_phase',
+                                              'galvo_r_frequency',
+                                              'galvo_r_amplitude',
+                                              'galvo_r_offset',
+                                              'galvo_r_duty_cycle',
+                                              'galvo_r_phase',
+                                              'laser_l_delay_%',
+                                              'laser_l_pulse_%',
+                                              'laser_l_max_amplitude',
+                                              'laser_r_delay_%',
+                                              'laser_r_pulse_%',
+                                              'laser_r_max_amplitude',
+                                              'camera_delay_%',
+                                              'camera_pulse_%',
+                                              'camera_display_live_subsampling',
+                                              'camera_display_snap_subsampling',
+                                              'camera_display_acquisition_subsampling',
+                                              'camera_sensor_mode',
+                                              'camera_binning'),
+                                             self.sig_state_request.emit)
+
     @QtCore.pyqtSlot(dict)
     def state_request_handler(self, dict):
-        for key, value in zip(dict.keys(),dict.values()):
-            # print('Core Thread: State request: Key: ', key, ' Value: ', value)
-            '''
-            The request handling is done with exec() to write fewer lines of
-            code.
-            '''
-            if key in ('filter',
-                       'zoom',
-                       'laser',
-                       'intensity',
-                       'shutterconfig',
-                       'state',
-                       'camera_exposure_time',
-                       'camera_line_interval'):
-                exec('self.set_'+key+'(value)')
-
-            elif key in ('samplerate',
-                       'sweeptime',
-                       'ETL_cfg_file',
-                       'etl_l_delay_%',
-                       'etl_l_ramp_rising_%',
-                       'etl_l_ramp_falling_%',
-                       'etl_l_amplitude',
-                       'etl_l_offset',
-                       'etl_r_delay_%',
-                       'etl_r_ramp_rising_%',
-                       'etl_r_ramp_falling_%',
-                       'etl_r_amplitude',
-                       'etl_r_offset',
-                       'galvo_l_frequency',
-                       'galvo_l_amplitude',
-                       'galvo_l_offset',
-                       'galvo_l_duty_cycle',
-                       'galvo_l_phase',
-                       'galvo_r_frequency',
-                       'galvo_r_amplitude',
-                       'galvo_r_offset',
-                       'galvo_r_duty_cycle',
-                       'galvo_r_phase',
-                       'laser_l_delay_%',
-                       'laser_l_pulse_%',
-                       'laser_l_max_amplitude',
-                       'laser_r_delay_%',
-                       'laser_r_pulse_%',
-                       'laser_r_max_amplitude',
-                       'camera_delay_%',
-                       'camera_pulse_%',
-                       'camera_display_live_subsampling',
-                       'camera_display_snap_subsampling',
-                       'camera_display_acquisition_subsampling',
-                       'camera_sensor_mode',
-                       'camera_binning',
-                       ):
-                self.sig_state_request.emit({key : value})
+        '''
+        The request handling is done with a lookup in the command registry
+        '''
+        self.command_registry.dispatch(dict)
+
+    def log_state_request_statistics(self):
+        for registry in (self.command_registry, self.waveformer.command_registry, self.camera_worker.command_registry):
+            registry.log_statistics()
 
     def set_state(self, state):
+        if state in self.modes and not self.begin_mode(state):
+            return
+
         if state == 'live':
             self.state['state']='live'
             self.sig_state_request.emit({'state':'live'})
@@ -290,6 +333,7 @@ class mesoSPIM_Core(QtCore.QObject):
             self.state['state']='snap'
             self.sig_state_request.emit({'state':'snap'})
             self.snap()
+            self.finish_mode()
 
         elif state == 'run_selected_acquisition':
             self.state['state']= 'run_selected_acquisition'
@@ -324,9 +368,104 @@ class mesoSPIM_Core(QtCore.QObject):
             self.sig_state_request.emit({'state':'live'})
             self.visual_mode()
 
+    ''' State requests which start a mode '''
+    modes = ('live',
+             'snap',
+             'run_selected_acquisition',
+             'run_acquisition_list',
+             'preview_acquisition_with_z_update',
+             'preview_acquisition_without_z_update',
+             'lightsheet_alignment_mode',
+             'visual_mode')
+
+    '''
+    Event-driven modes
+
+    Modes (live, acquisitions, previews) are sequences of steps. Each step runs to
+    completion and schedules the next one with schedule_step(), which returns to the
+    event loop of the Core thread. Queued state requests are therefore handled between
+    steps and never within one, and a mode cannot be started while another one runs.
+    Within a step (e.g. the frames of a stack), only the thread-safe stop flag is checked.
+    Waiting periods are delayed steps (schedule_step() with delay_ms), not sleeps.
+    A script runs as a single step, so it cannot start a mode (see execute_script()).
+    '''
+
+    @property
+    def stopflag(self):
+        return self.stop_event.is_set()
+
+    @stopflag.setter
+    def stopflag(self, value):
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
+    def request_stop(self):
+        '''
+        Stops the running mode at its next frame, can be called from any thread
+
+        The GUI calls this directly, as a queued stop request would only be
+        handled after the running step.
+        '''
+        self.stop_event.set()
+
+    def abort_on_write_error(self, message):
+        ''' Stops the acquisition if planes cannot be written (e.g. disk full), called from the writer thread '''
+        self.request_stop()
+        self.sig_warning.emit('Image data could not be written - stopping! \n'+message)
+
+    def begin_mode(self, mode):
+        ''' Returns False if another mode is still running '''
+        if self.started_from_script(mode):
+            return False
+        if self.mode is not None:
+            logger.warning(f'Core: Request for {mode} ignored, {self.mode} is still running')
+            return False
+        self.mode = mode
+        return True
+
+    def started_from_script(self, mode):
+        ''' Logs an error and returns True if a script tries to start a mode '''
+        if self.mode == 'script':
+            logger.error(f'Core: {mode} cannot be started from a script, scripts can only use single steps like snap()')
+            return True
+        return False
+
+    def finish_mode(self):
+        self.mode = None
+        self.next_step = None
+
+    def schedule_step(self, step, *args, delay_ms=0):
+        '''
+        Runs step(*args) after the events queued in the Core thread so far,
+        with delay_ms > 0 not before delay_ms have passed. The Core thread keeps
+        handling events during the delay.
+        '''
+        self.next_step = (step, args)
+        if delay_ms > 0:
+            QtCore.QTimer.singleShot(delay_ms, self.run_next_step)
+        else:
+            self.sig_next_step.emit()
+
+    @QtCore.pyqtSlot()
+    def run_next_step(self):
+        if self.next_step is None:
+            return
+        step, args = self.next_step
+        self.next_step = None
+        try:
+            step(*args)
+        except Exception:
+            logger.error(f'Core: {self.mode} failed: {traceback.format_exc()}')
+            self.close_shutters()
+            self.finish_mode()
+            self.state['state']='idle'
+            self.sig_update_gui_from_state.emit(False)
+            self.sig_finished.emit()
+
     def stop(self):
         self.stopflag = True
-        ''' This stopflag is a bit risky, needs to be updated'''
         self.state['state']='idle'
         self.sig_update_gui_from_state.emit(False)
         self.sig_finished.emit()
@@ -349,6 +488,7 @@ class mesoSPIM_Core(QtCore.QObject):
                 'image_counter':image_counter,
                 'time_passed_string': time_passed_string,
                 'remaining_time_string': remaining_time_string,
+                'camera_telemetry': self.camera_worker.telemetry.get_summary(),
         }
         self.sig_progress.emit(dict)
 
@@ -436,26 +576,32 @@ class mesoSPIM_Core(QtCore.QObject):
         shutterconfig = self.state['shutterconfig']
 
         if shutterconfig == 'Both':
-            self.shutter_left.open()
-            self.shutter_right.open()
+            self.set_shutters(True, True)
         elif shutterconfig == 'Left':
-            self.shutter_left.open()
-            self.shutter_right.close()
+            self.set_shutters(True, False)
         elif shutterconfig == 'Right':
-            self.shutter_right.open()
-            self.shutter_left.close()
+            self.set_shutters(False, True)
         else:
-            self.shutter_right.open()
-            self.shutter_left.open()
+            self.set_shutters(True, True)
 
         self.state['shutterstate'] = True
 
     @QtCore.pyqtSlot()
     def close_shutters(self):
-        self.shutter_left.close()
-        self.shutter_right.close()
+        self.set_shutters(False, False)
         self.state['shutterstate'] = False
 
+    def set_shutters(self, left_open, right_open):
+        '''Opens or closes both shutters, NI shutters are switched with a single digital output update'''
+        if isinstance(self.shutter_left, NI_Shutter):
+            set_shutters({self.shutter_left : left_open, self.shutter_right : right_open})
+        else:
+            for shutter, shutter_open in ((self.shutter_left, left_open), (self.shutter_right, right_open)):
+                if shutter_open:
+                    shutter.open()
+                else:
+                    shutter.close()
+
     '''
     Sub-Imaging modes
     '''
@@ -474,7 +620,6 @@ class mesoSPIM_Core(QtCore.QObject):
 
         self.sig_end_live.emit()
         self.sig_finished.emit()
-        QtWidgets.QApplication.processEvents()
 
     def snap_image(self):
         '''Snaps a single image after updating the waveforms.
@@ -491,6 +636,21 @@ class mesoSPIM_Core(QtCore.QObject):
         self.waveformer.stop_tasks()
         self.waveformer.close_tasks()
 
+    def prepare_live_image_series(self):
+        '''Prepares persistent tasks for live-like modes, waveforms are updated when they change'''
+        self.waveformer.start_live_tasks()
+
+    def snap_live_image(self):
+        '''Snaps an image with the persistent tasks of prepare_live_image_series()
+
+        Much less overhead than snap_image(), as tasks are neither created nor closed.
+        '''
+        self.waveformer.run_live_tasks()
+
+    def close_live_image_series(self):
+        '''Cleans up after prepare_live_image_series()'''
+        self.waveformer.stop_live_tasks()
+
     def prepare_image_series(self):
         '''Prepares an image series without waveform update'''
         self.waveformer.create_tasks()
@@ -511,25 +671,46 @@ class mesoSPIM_Core(QtCore.QObject):
     '''
 
     def live(self):
+        if self.started_from_script('live'):
+            return
         self.stopflag = False
         self.sig_prepare_live.emit()
 
         self.open_shutters()
-        while self.stopflag is False:
-            ''' Needs update to use snap image in series '''
-            self.snap_image()
-            self.sig_get_live_image.emit()
+        self.prepare_live_image_series()
+        self.schedule_step(self.live_step, self.snap_live_frame)
 
-            QtWidgets.QApplication.processEvents()
+    def snap_live_frame(self):
+        self.snap_live_image()
+        self.sig_get_live_image.emit()
 
-            ''' How to handle a possible shutter switch?'''
-            self.open_shutters()
+        ''' How to handle a possible shutter switch?'''
+        self.open_shutters()
 
+    def live_step(self, snap_frame, end_mode=None):
+        '''
+        One frame of a live-like mode, repeated until stopped
+
+        Args:
+            snap_frame (callable): Acquires and displays the frame(s)
+            end_mode (callable): Called after the live image series has been closed
+        '''
+        if self.stopflag is False:
+            snap_frame()
+            self.schedule_step(self.live_step, snap_frame, end_mode)
+            return
+
+        self.close_live_image_series()
         self.close_shutters()
         self.sig_end_live.emit()
         self.sig_finished.emit()
+        if end_mode is not None:
+            end_mode()
+        self.finish_mode()
 
     def start(self, row=None):
+        if self.started_from_script('start'):
+            return
         self.stopflag = False
 
         if row==None:
@@ -542,22 +723,88 @@ class mesoSPIM_Core(QtCore.QObject):
         nonexisting_folders_list = acq_list.check_for_nonexisting_folders()
         filename_list = acq_list.check_for_existing_filenames()
         duplicates_list = acq_list.check_for_duplicated_filenames()
+        invalid_z_profiles_list = acq_list.check_for_invalid_z_profiles()
 
         if nonexisting_folders_list != []:
             self.sig_warning.emit('The following folders do not exist - stopping! \n'+self.list_to_string_with_carriage_return(nonexisting_folders_list))
+            self.finish_mode()
             self.sig_finished.emit()
         elif filename_list != []:
             self.sig_warning.emit('The following files already exist - stopping! \n'+self.list_to_string_with_carriage_return(filename_list))
+            self.finish_mode()
             self.sig_finished.emit()
         elif duplicates_list != []:
             self.sig_warning.emit('The following filenames are duplicated - stopping! \n' +self.list_to_string_with_carriage_return(duplicates_list))
+            self.finish_mode()
+            self.sig_finished.emit()
+        elif invalid_z_profiles_list != []:
+            self.sig_warning.emit('The following z profiles are invalid - stopping! \n' +self.list_to_string_with_carriage_return(invalid_z_profiles_list))
+            self.finish_mode()
+            self.sig_finished.emit()
+        elif not self.preflight_check(acq_list):
+            self.finish_mode()
             self.sig_finished.emit()
         else:
+            if row == None:
+                acq_list = self.optimize_acquisition_list(acq_list)
             self.sig_update_gui_from_state.emit(True)
             self.prepare_acquisition_list(acq_list)
             self.run_acquisition_list(acq_list)
-            self.close_acquisition_list(acq_list)
-            self.sig_update_gui_from_state.emit(False)
+
+    def preflight_check(self, acq_list):
+        '''
+        Checks disk space and write bandwidth for the acquisition list
+
+        Returns:
+            bool: False if the acquisition list should not be started
+        '''
+        if not self.cfg.preflight['enabled']:
+            return True
+
+        self.sig_status_message.emit('Checking disk space and write bandwidth')
+        binning_string = self.state['camera_binning']
+        x_pixels = int(self.cfg.camera_parameters['x_pixels'] / int(binning_string[0]))
+        y_pixels = int(self.cfg.camera_parameters['y_pixels'] / int(binning_string[2]))
+
+        try:
+            errors, warnings = run_preflight(acq_list, self.cfg, x_pixels, y_pixels, self.state['current_framerate'])
+        except Exception:
+            logger.error(f'Preflight check failed: {traceback.format_exc()}')
+            return True
+
+        if errors != []:
+            self.sig_warning.emit('Preflight check failed - stopping! \n'+self.list_to_string_with_carriage_return(errors+warnings))
+            return False
+        elif warnings != []:
+            self.sig_warning.emit('Preflight check warnings: \n'+self.list_to_string_with_carriage_return(warnings))
+        return True
+
+    def optimize_acquisition_list(self, acq_list):
+        '''
+        Reorders the acquisition list to reduce filter, zoom, rotation and stage
+        overhead, if enabled in the config. The list in the table is not changed.
+
+        Returns:
+            AcquisitionList: The list to run
+        '''
+        optimizer_cfg = get_optimizer_config(self.cfg)
+        if not optimizer_cfg['enabled']:
+            return acq_list
+
+        try:
+            optimized_list, time_saved = optimize_acquisition_list(acq_list,
+                                                                   AcquisitionCostModel.from_config(self.cfg),
+                                                                   keep_interleaved_groups=self.state['laser_interleaving'],
+                                                                   max_passes=optimizer_cfg['max_2opt_passes'])
+        except Exception:
+            logger.error(f'Core: Acquisition list optimization failed, using the table order: {traceback.format_exc()}')
+            return acq_list
+
+        if time_saved > 0:
+            message = f'Acquisition list reordered, predicted time saved: {convert_seconds_to_string(time_saved)}'
+            logger.info(f'Core: {message}')
+            self.sig_status_message.emit(message)
+        return optimized_list
 
     def prepare_acquisition_list(self, acq_list):
         '''
@@ -565,20 +812,83 @@ class mesoSPIM_Core(QtCore.QObject):
         '''
         self.image_count = 0
         self.acquisition_count = 0
+        ''' Timing metadata of stacks whose image series may still be ending: [(rows, timing)] '''
+        self.pending_timing_info = []
         self.total_acquisition_count = len(acq_list)
         self.total_image_count = acq_list.get_image_count()
         self.start_time = time.time()
+        ''' Rows of the last completed stack, for the transition costs of the timing model '''
+        self.previous_stack_rows = None
+        if self.timing_model is not None:
+            self.update_acquisition_time_prediction(acq_list)
+
+    def update_acquisition_time_prediction(self, acq_list):
+        '''
+        Predicts the time of the remaining rows with the timing model
+
+        The predicted list time is the time passed plus the predicted remaining time.
+        '''
+        remaining_list = AcquisitionList(acq_list[self.acquisition_count:])
+        time_remaining = self.timing_model.predict_list(remaining_list,
+                                                        interleaved=self.state['laser_interleaving'],
+                                                        previous=self.previous_stack_rows)
+        self.state['predicted_acq_list_time'] = time.time() - self.start_time + time_remaining
+        self.state['remaining_acq_list_time'] = time_remaining
 
 
     def run_acquisition_list(self, acq_list):
-        for acq in acq_list:
-            if not self.stopflag:
-                self.prepare_acquisition(acq, acq_list)
-                self.run_acquisition(acq, acq_list)
-                self.close_acquisition(acq, acq_list)
+        '''
+        Runs the stacks as steps: acquisition_list_step() moves to a stack and sets
+        filter, zoom and laser, acquisition_step() acquires it. The list is closed
+        after the last stack or when stopped.
+        '''
+        if self.started_from_script('run_acquisition_list'):
+            return
+        ''' With laser interleaving, each group of interleaved rows is acquired as one stack (named after its first row) '''
+        if self.state['laser_interleaving']:
+            acquisitions = [group[0] for group in acq_list.get_interleaved_groups()]
+        else:
+            acquisitions = list(acq_list)
+
+        ''' Dead time: From the last frame of a stack to the first frame of the next '''
+        self.dead_times = []
+        self.previous_image_acq_end_time = None
+        self.schedule_step(self.acquisition_list_step, acq_list, acquisitions, 0)
+
+    def acquisition_list_step(self, acq_list, acquisitions, index):
+        if self.stopflag or index == len(acquisitions):
+            if self.dead_times:
+                logger.info(f'Core: Dead time between stacks: mean {np.mean(self.dead_times):.2f} s, max {np.max(self.dead_times):.2f} s')
+            self.close_acquisition_list(acq_list)
+            return
+
+        self.prepare_acquisition(acquisitions[index], acq_list)
+        ''' The row's ETL parameters are set after the state requests queued so far '''
+        self.schedule_step(self.acquisition_step, acq_list, acquisitions, index)
+
+    def acquisition_step(self, acq_list, acquisitions, index):
+        if self.stopflag:
+            self.acquisition_list_step(acq_list, acquisitions, index)
+            return
+
+        acq = acquisitions[index]
+        self.finish_acquisition_preparation(acq, acq_list)
+        self.run_acquisition(acq, acq_list)
+        if self.previous_image_acq_end_time is not None:
+            self.dead_times.append(self.image_acq_start_time - self.previous_image_acq_end_time)
+        self.previous_image_acq_end_time = self.image_acq_end_time
+        self.close_acquisition(acq, acq_list)
+        self.schedule_step(self.acquisition_list_step, acq_list, acquisitions, index + 1)
 
     def close_acquisition_list(self, acq_list):
         self.sig_status_message.emit('Closing Acquisition List')
+        ''' The image series of the last stack may still be ending in the camera thread '''
+        self.sig_wait_for_image_series.emit()
+        self.write_pending_timing_info()
+        self.log_state_request_statistics()
+        if self.timing_model is not None:
+            self.timing_model.save()
+            logger.info('Core: Timing model costs: '+', '.join(f'{key} {cost:.4g}' for key, cost in self.timing_model.get_costs().items()))
 
         if not self.stopflag:
             current_rotation = self.state['position']['theta_pos']
@@ -594,25 +904,38 @@ class mesoSPIM_Core(QtCore.QObject):
             self.set_filter(acq_list[0]['filter'])
             self.set_laser(acq_list[0]['laser'], wait_until_done=False, update_etl=False)
             self.set_zoom(acq_list[0]['zoom'], wait_until_done=False, update_etl=False)
-            ''' This is for the GUI to update properly, otherwise ETL values for previous laser might be displayed '''
-            QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 1)
-
-            self.sig_state_request.emit({'etl_l_amplitude' : acq_list[0]['etl_l_amplitude']})
-            self.sig_state_request.emit({'etl_r_amplitude' : acq_list[0]['etl_r_amplitude']})
-            self.sig_state_request.emit({'etl_l_offset' : acq_list[0]['etl_l_offset']})
-            self.sig_state_request.emit({'etl_r_offset' : acq_list[0]['etl_r_offset']})
-            self.set_intensity(acq_list[0]['intensity'])
-            time.sleep(0.1) # tiny sleep period to allow Main Window indicators to catch up
-            self.sig_finished.emit()
+            ''' This is for the GUI to update properly, otherwise ETL values for previous laser might be displayed:
+            The ETL parameters are set after the state requests queued so far '''
+            self.schedule_step(self.finish_acquisition_list, acq_list)
+        else:
+            self.sig_update_gui_from_state.emit(False)
+            self.finish_mode()
+
+    def finish_acquisition_list(self, acq_list):
+        self.sig_state_request.emit({'etl_l_amplitude' : acq_list[0]['etl_l_amplitude']})
+        self.sig_state_request.emit({'etl_r_amplitude' : acq_list[0]['etl_r_amplitude']})
+        self.sig_state_request.emit({'etl_l_offset' : acq_list[0]['etl_l_offset']})
+        self.sig_state_request.emit({'etl_r_offset' : acq_list[0]['etl_r_offset']})
+        self.set_intensity(acq_list[0]['intensity'])
+        ''' Tiny waiting period to allow Main Window indicators to catch up '''
+        self.schedule_step(self.end_acquisition_list, delay_ms=100)
+
+    def end_acquisition_list(self):
+        self.sig_finished.emit()
+        self.sig_update_gui_from_state.emit(False)
+        self.finish_mode()
 
     def preview_acquisition(self, z_update=True):
+        if self.started_from_script('preview_acquisition'):
+            return
         self.stopflag = False
 
         row = self.state['selected_row']
 
         if row==None:
-            pass
             # print('No row selected!')
+            self.state['state'] = 'idle'
+            self.finish_mode()
         else:
             self.sig_update_gui_from_state.emit(True)
             acq = self.state['acq_list'][row]
@@ -653,18 +976,20 @@ class mesoSPIM_Core(QtCore.QObject):
             self.set_zoom(acq['zoom'], wait_until_done=False, update_etl=False)
             self.set_intensity(acq['intensity'], wait_until_done=True)
             self.set_laser(acq['laser'], wait_until_done=True, update_etl=False)
-            ''' This is for the GUI to update properly, otherwise ETL values for previous laser might be displayed '''
-            QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 1)
-
-            self.sig_state_request.emit({'etl_l_amplitude' : acq['etl_l_amplitude']})
-            self.sig_state_request.emit({'etl_r_amplitude' : acq['etl_r_amplitude']})
-            self.sig_state_request.emit({'etl_l_offset' : acq['etl_l_offset']})
-            self.sig_state_request.emit({'etl_r_offset' : acq['etl_r_offset']})
+            ''' This is for the GUI to update properly, otherwise ETL values for previous laser might be displayed:
+            The ETL parameters are set after the state requests queued so far '''
+            self.schedule_step(self.finish_preview_acquisition, acq)
 
-            self.sig_status_message.emit('Ready for preview...')
-            self.sig_update_gui_from_state.emit(False)
+    def finish_preview_acquisition(self, acq):
+        self.sig_state_request.emit({'etl_l_amplitude' : acq['etl_l_amplitude']})
+        self.sig_state_request.emit({'etl_r_amplitude' : acq['etl_r_amplitude']})
+        self.sig_state_request.emit({'etl_l_offset' : acq['etl_l_offset']})
+        self.sig_state_request.emit({'etl_r_offset' : acq['etl_r_offset']})
 
+        self.sig_status_message.emit('Ready for preview...')
+        self.sig_update_gui_from_state.emit(False)
         self.state['state'] = 'idle'
+        self.finish_mode()
 
     def prepare_acquisition(self, acq, acq_list):
         '''
@@ -672,6 +997,11 @@ class mesoSPIM_Core(QtCore.QObject):
         '''
         logger.info(f'Core: Running Acquisition #{self.acquisition_count} with Filename: {acq["filename"]}')
 
+        if self.state['laser_interleaving']:
+            self.acquisition_group = acq_list.get_interleaved_group(acq)
+        else:
+            self.acquisition_group = [acq]
+
         self.sig_status_message.emit('Going to start position')
         ''' Rotation handling goes here:
 
@@ -701,26 +1031,113 @@ class mesoSPIM_Core(QtCore.QObject):
         self.set_zoom(acq['zoom'], wait_until_done=False, update_etl=False)
         self.set_intensity(acq['intensity'], wait_until_done=True)
         self.set_laser(acq['laser'], wait_until_done=True, update_etl=False)
-        ''' This is for the GUI to update properly, otherwise ETL values for previous laser might be displayed '''
-        QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 1)
 
+    def finish_acquisition_preparation(self, acq, acq_list):
+        '''
+        Sets the ETL parameters, waveforms and camera up for the stack
+
+        This is for the GUI to update properly, otherwise ETL values for previous laser
+        might be displayed: Call it in a step after prepare_acquisition(), so that the
+        state requests queued in between are handled before.
+        '''
         self.sig_state_request.emit({'etl_l_amplitude' : acq['etl_l_amplitude']})
         self.sig_state_request.emit({'etl_r_amplitude' : acq['etl_r_amplitude']})
         self.sig_state_request.emit({'etl_l_offset' : acq['etl_l_offset']})
         self.sig_state_request.emit({'etl_r_offset' : acq['etl_r_offset']})
 
+        if len(self.acquisition_group) > 1:
+            ''' Every plane gets one sweep per interleaved row, the lasers are switched by their analog outputs '''
+            self.sig_status_message.emit('Setting up laser interleaving')
+            self.laserenabler.enable_multiple([row['laser'] for row in self.acquisition_group])
+            self.waveformer.set_interleaved_channels([{key : row[key] for key in ('laser', 'intensity',
+                                                                                  'etl_l_offset', 'etl_l_amplitude',
+                                                                                  'etl_r_offset', 'etl_r_amplitude')}
+                                                      for row in self.acquisition_group])
+
+        ''' Depth-dependent intensity & ETL parameters: All plane waveforms are computed before the stack '''
+        z_profiles = [parse_z_profile(row['z_profile']) for row in self.acquisition_group]
+        if any(z_profiles):
+            self.sig_status_message.emit('Precomputing waveforms for z profiles')
+            depths = acq.get_plane_depths()
+            self.waveformer.set_plane_tables([dict(evaluate_z_profile(z_profile, depths, row), laser=row['laser'])
+                                              for row, z_profile in zip(self.acquisition_group, z_profiles)])
+
         self.f_step_generator = acq.get_focus_stepsize_generator()
 
         self.sig_status_message.emit('Preparing camera: Allocating memory')
+        ''' Blocks until the camera thread has also finished the previous image series '''
         self.sig_prepare_image_series.emit(acq, acq_list)
-        self.prepare_image_series()
+        self.write_pending_timing_info()
+
+        self.z_scan_plan = self.plan_z_scan(acq)
+        if self.z_scan_plan is not None:
+            ''' The stage needs a run-up before it passes the first plane at constant velocity '''
+            self.move_absolute({'z_abs' : self.z_scan_plan.scan_start}, wait_until_done=True)
+            self.waveformer.create_tasks(n_sweeps=acq.get_image_count() * len(self.acquisition_group))
+            self.waveformer.write_waveforms_to_tasks()
+        else:
+            self.prepare_image_series()
 
         # ''' HICKUP DEBUGGING: Measure z position '''
         # self.z_start_measured = self.state['position']['z_pos']
 
-        self.write_metadata(acq, acq_list)
+        for row in self.acquisition_group:
+            self.write_metadata(row, acq_list)
+
+    def plan_z_scan(self, acq):
+        '''
+        Returns a ZScanPlan if the acquisition should be a continuous z-scan, otherwise None (step mode)
+
+        Continuous z-scans are used if cfg.z_scan['mode'] is 'continuous', the stage supports
+        them and the acquisition has no focus interpolation (f_start == f_end).
+        '''
+        if self.cfg.z_scan['mode'] != 'continuous':
+            return None
+        if not self.serial_worker.stage.supports_z_scan:
+            logger.warning('Core: The stage does not support continuous z-scans, using step mode')
+            return None
+        if acq['f_start'] != acq['f_end']:
+            logger.info('Core: Focus interpolation requires step mode')
+            return None
+        if self.waveformer.plane_tables:
+            logger.info('Core: Z profiles require step mode')
+            return None
+
+        plan = ZScanPlan(acq['z_start'], acq['z_end'], acq['z_step'], acq.get_image_count(),
+                         frame_period=self.state['sweeptime'] * len(self.acquisition_group),
+                         acceleration=self.cfg.z_scan['acceleration'],
+                         settle_time=self.cfg.z_scan['settle_time'])
+        ''' Stage limits are in true axis positions, the scan in (possibly zeroed) positions '''
+        offset = self.serial_worker.stage.int_z_pos_offset
+        errors = plan.check(self.cfg.z_scan['max_velocity'],
+                            self.cfg.stage_parameters['z_min'] + offset,
+                            self.cfg.stage_parameters['z_max'] + offset)
+        if errors != []:
+            logger.warning('Core: Continuous z-scan not possible, using step mode: '+'; '.join(errors))
+            return None
+
+        logger.info(f'Core: Continuous z-scan at {plan.velocity:.1f} um/s from {plan.scan_start:.1f} to {plan.scan_end:.1f} um')
+        return plan
 
     def run_acquisition(self, acq, acq_list):
+        '''
+        Acquires a stack, in step mode or as a continuous z-scan
+
+        The whole stack runs as a single step: State requests queued during the stack
+        (e.g. from the GUI) are applied after it, so all planes are acquired with the
+        same settings, and the stack is not slowed down by a return to the event loop
+        per plane. Only the thread-safe stop flag is checked for every plane.
+        '''
+        if self.z_scan_plan is not None:
+            if self.run_continuous_acquisition(acq, acq_list):
+                return
+            ''' The stage refused the scan: acquire the stack in step mode from its start '''
+            logger.warning('Core: The stage refused the continuous z-scan, using step mode')
+            self.z_scan_plan = None
+            self.close_image_series()
+            self.move_absolute({'z_abs' : acq['z_start']}, wait_until_done=True)
+            self.prepare_image_series()
+
         steps = acq.get_image_count()
         self.sig_status_message.emit('Running Acquisition')
         self.open_shutters()
@@ -735,6 +1152,8 @@ class mesoSPIM_Core(QtCore.QObject):
                 self.sig_finished.emit()
                 break
             else:
+                if self.waveformer.plane_tables:
+                    self.waveformer.write_plane_waveforms_to_tasks(i)
                 self.snap_image_in_series()
                 self.sig_add_images_to_image_series.emit(acq, acq_list)
                 #time.sleep(0.02)
@@ -750,25 +1169,28 @@ class mesoSPIM_Core(QtCore.QObject):
 
                 self.move_relative(move_dict)
 
-                QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 1)
-                self.image_count += 1
+                ''' No event processing within a stack: Stop requests arrive via the thread-safe stop flag '''
+                self.image_count += len(self.acquisition_group)
 
-                ''' Keep track of passed time and predict remaining time '''
+                ''' Keep track of passed time and predict remaining time,
+                one lock-free snapshot of the state per plane '''
+                state = self.state.snapshot()
                 time_passed = time.time() - self.start_time
-                time_remaining = self.state['predicted_acq_list_time'] - time_passed
+                time_remaining = state['predicted_acq_list_time'] - time_passed
 
                 ''' If the time to set up everything is longer than the predicted 
                 acq time, the remaining time turns negative - here a different 
                 calcuation should be employed here: '''
                 if time_remaining < 0:
                     time_passed = time.time() - self.image_acq_start_time
-                    time_remaining = self.state['predicted_acq_list_time'] - time_passed
+                    time_remaining = state['predicted_acq_list_time'] - time_passed
 
                 self.state['remaining_acq_list_time'] = time_remaining
                 framerate = self.image_count / time_passed
 
-                ''' Every 100 images, update the predicted acquisition time '''
-                if self.image_count % 100 == 0:
+                ''' Every 100 images, update the predicted acquisition time,
+                the timing model updates it after every stack instead '''
+                if self.timing_model is None and self.image_count % 100 == 0:
                     framerate = self.image_count / time_passed
                     self.state['predicted_acq_list_time'] = self.total_image_count / framerate
       
@@ -787,6 +1209,79 @@ class mesoSPIM_Core(QtCore.QObject):
 
         self.close_shutters()
 
+    def run_continuous_acquisition(self, acq, acq_list):
+        '''
+        Hardware-timed continuous z-scan: The stage moves through the stack at constant
+        velocity while the NI tasks output one sweep (and camera trigger) per plane.
+
+        The sweeps are started when the stage passes the first plane, which happens
+        trigger_delay after the start of the movement according to the scan plan.
+        Frames are collected at the planned frame times.
+
+        Returns:
+            bool: False if the stage refused the scan, nothing was acquired then
+        '''
+        plan = self.z_scan_plan
+        steps = acq.get_image_count()
+
+        self.waveformer.start_tasks()
+
+        self.sig_start_z_scan.emit({'z_abs' : plan.scan_end, 'velocity' : plan.velocity})
+        scan_start_time = time.perf_counter()
+        if not self.serial_worker.z_scan_started:
+            self.waveformer.stop_tasks()
+            return False
+
+        self.sig_status_message.emit('Running Acquisition (continuous z-scan)')
+        self.open_shutters()
+
+        self.image_acq_start_time = time.time()
+        self.image_acq_start_time_string = time.strftime("%Y%m%d-%H%M%S")
+
+        ''' Wait for the stage to reach constant velocity at the first plane '''
+        time.sleep(max(0, scan_start_time + plan.trigger_delay - time.perf_counter()))
+        self.waveformer.trigger_tasks()
+        trigger_time = time.perf_counter()
+
+        for i in range(steps):
+            if self.stopflag is True:
+                self.sig_stop_movement.emit()
+                self.waveformer.stop_tasks()
+                self.sig_end_z_scan.emit()
+                self.close_image_series()
+                self.sig_end_image_series.emit(acq, acq_list)
+                self.sig_finished.emit()
+                break
+
+            ''' Wait until the frame of plane i has been exposed '''
+            time.sleep(max(0, trigger_time + (i + 1) * plan.frame_period - time.perf_counter()))
+            self.sig_add_images_to_image_series.emit(acq, acq_list)
+
+            self.image_count += len(self.acquisition_group)
+
+            time_passed = time.time() - self.start_time
+            time_remaining = max(0, self.state.snapshot()['predicted_acq_list_time'] - time_passed)
+            self.state['remaining_acq_list_time'] = time_remaining
+
+            self.send_progress(self.acquisition_count,
+                               self.total_acquisition_count,
+                               i,
+                               steps,
+                               self.total_image_count,
+                               self.image_count,
+                               convert_seconds_to_string(time_passed),
+                               convert_seconds_to_string(time_remaining))
+        else:
+            self.waveformer.wait_for_tasks()
+            self.waveformer.stop_tasks()
+            self.sig_end_z_scan.emit()
+
+        self.image_acq_end_time = time.time()
+        self.image_acq_end_time_string = time.strftime("%Y%m%d-%H%M%S")
+
+        self.close_shutters()
+        return True
+
     def close_acquisition(self, acq, acq_list):
 
         # ''' HICKUP DEBUGGING '''
@@ -797,19 +1292,53 @@ class mesoSPIM_Core(QtCore.QObject):
 
         self.sig_status_message.emit('Closing Acquisition: Saving data & freeing up memory')
 
+        pipelined = self.cfg.stack_pipeline['enabled'] and self.stopflag is False
         if self.stopflag is False:
             # self.move_absolute(acq.get_startpoint(), wait_until_done=True)
             self.close_image_series()
-            self.sig_end_image_series.emit(acq, acq_list)
+            if pipelined:
+                ''' The camera thread finishes writing while the next stack is prepared '''
+                self.sig_end_image_series_in_background.emit(acq, acq_list)
+            else:
+                self.sig_end_image_series.emit(acq, acq_list)
 
         self.acq_end_time = time.time()
         self.acq_end_time_string = time.strftime("%Y%m%d-%H%M%S")
 
-        self.append_timing_info_to_metadata(acq)
-        self.acquisition_count += 1
+        ''' The camera telemetry is complete once the image series has ended '''
+        self.pending_timing_info.append((list(self.acquisition_group), self.get_timing_info()))
+        if not pipelined:
+            self.write_pending_timing_info()
+        self.acquisition_count += len(self.acquisition_group)
+
+        if self.timing_model is not None and self.stopflag is False:
+            ''' Learn from the completed stack and update the prediction of the remaining rows '''
+            self.timing_model.add_stack(self.previous_stack_rows,
+                                        self.acquisition_group,
+                                        self.acq_start_time,
+                                        self.acq_end_time - self.acq_start_time)
+            self.previous_stack_rows = list(self.acquisition_group)
+            self.update_acquisition_time_prediction(acq_list)
+
+        if self.waveformer.plane_tables:
+            self.waveformer.set_plane_tables(None)
+        if len(self.acquisition_group) > 1:
+            self.waveformer.set_interleaved_channels(None)
+            self.laserenabler.enable(acq['laser'])
 
     @QtCore.pyqtSlot(str)
     def execute_script(self, script):
+        '''
+        Runs a script with self being the Core
+
+        The script runs as a single step in the Core thread, state requests are handled
+        after it. Modes consist of queued steps and would never get to run, so scripts
+        cannot start them: live(), start(), preview_acquisition(), lightsheet_alignment_mode(),
+        visual_mode() and set_state() with a mode log an error instead. Scripts can snap
+        images, move stages and set filter, zoom, laser and shutters.
+        '''
+        if not self.begin_mode('script'):
+            return
         self.sig_update_gui_from_state.emit(True)
         self.state['state']='running_script'
         try:
@@ -819,9 +1348,12 @@ class mesoSPIM_Core(QtCore.QObject):
         self.sig_finished.emit()
         self.state['state']='idle'
         self.sig_update_gui_from_state.emit(False)
+        self.finish_mode()
 
     def lightsheet_alignment_mode(self):
         '''Switches shutters after each image to allow coalignment of both lightsheets'''
+        if self.started_from_script('lightsheet_alignment_mode'):
+            return
         self.stopflag = False
         self.sig_prepare_live.emit()
         '''Needs more careful adjustment of the timing
@@ -829,49 +1361,37 @@ class mesoSPIM_Core(QtCore.QObject):
         TODO: There is no wait period to wait for the shutters to open. Nonetheless, the
         visual of the mode impression is not too bad.
         '''
-        while self.stopflag is False:
-            self.shutter_left.open()
-            self.snap_image()
-            self.sig_get_live_image.emit()
-            self.shutter_left.close()
-            self.shutter_right.open()
-            self.snap_image()
-            self.sig_get_live_image.emit()
-            self.shutter_right.close()
-            QtWidgets.QApplication.processEvents()
-
-        self.close_shutters()
-        self.sig_end_live.emit()
-        self.sig_finished.emit()
+        self.prepare_live_image_series()
+        self.schedule_step(self.live_step, self.snap_lightsheet_alignment_frames)
+
+    def snap_lightsheet_alignment_frames(self):
+        self.set_shutters(True, False)
+        self.snap_live_image()
+        self.sig_get_live_image.emit()
+        self.set_shutters(False, True)
+        self.snap_live_image()
+        self.sig_get_live_image.emit()
+        self.set_shutters(False, False)
 
     def visual_mode(self):
+        if self.started_from_script('visual_mode'):
+            return
         old_l_amp = self.state['etl_l_amplitude']
         old_r_amp = self.state['etl_r_amplitude']
         self.sig_state_request.emit({'etl_l_amplitude' : 0})
         self.sig_state_request.emit({'etl_r_amplitude' : 0})
-        time.sleep(0.05)
+        self.stopflag = False
+        ''' Short waiting period for the ETL amplitudes to be applied '''
+        self.schedule_step(self.start_visual_mode, old_l_amp, old_r_amp, delay_ms=50)
 
+    def start_visual_mode(self, old_l_amp, old_r_amp):
         self.sig_prepare_live.emit()
 
-        self.stopflag = False
-
         self.open_shutters()
-        while self.stopflag is False:
-            ''' Needs update to use snap image in series '''
-            self.snap_image()
-            self.sig_get_live_image.emit()
-            QtWidgets.QApplication.processEvents()
-
-            ''' How to handle a possible shutter switch?'''
-            self.open_shutters()
-
-        self.close_shutters()
-        self.sig_end_live.emit()
-
-        self.sig_finished.emit()
-
-        self.sig_state_request.emit({'etl_l_amplitude' : old_l_amp})
-        self.sig_state_request.emit({'etl_r_amplitude' : old_r_amp})
+        self.prepare_live_image_series()
+        self.schedule_step(self.live_step, self.snap_live_frame,
+                           lambda: self.sig_state_request.emit({'etl_l_amplitude' : old_l_amp,
+                                                                'etl_r_amplitude' : old_r_amp}))
 
     def write_line(self, file, key='', value=''):
         ''' Little helper method to write a single line with a key and value for metadata
@@ -894,7 +1414,7 @@ class mesoSPIM_Core(QtCore.QObject):
         metadata_path = os.path.dirname(path) + '/' + os.path.basename(path) + '_meta.txt'
 
         # print('Metadata_path: ', metadata_path)
-        if acq['filename'][-3:] == '.h5':
+        if acq['filename'].endswith(('.h5', '.zarr')):
             if acq == acq_list[0]:
                 self.metadata_file = open(metadata_path, 'w')
         else:
@@ -913,6 +1433,7 @@ class mesoSPIM_Core(QtCore.QObject):
         self.write_line(self.metadata_file, 'Pixelsize in um', self.state['pixelsize'])
         self.write_line(self.metadata_file, 'Filter', acq['filter'])
         self.write_line(self.metadata_file, 'Shutter', acq['shutterconfig'])
+        self.write_line(self.metadata_file, 'Z profile', acq['z_profile'])
         self.write_line(self.metadata_file)
         self.write_line(self.metadata_file, 'POSITION')
         self.write_line(self.metadata_file, 'x_pos', acq['x_pos'])
@@ -948,7 +1469,7 @@ class mesoSPIM_Core(QtCore.QObject):
         self.write_line(self.metadata_file, 'x_pixels', self.cfg.camera_parameters['x_pixels'])
         self.write_line(self.metadata_file, 'y_pixels', self.cfg.camera_parameters['y_pixels'])
 
-        if acq['filename'][-3:] == '.h5':
+        if acq['filename'].endswith(('.h5', '.zarr')):
             if acq == acq_list[-1]:
                 self.metadata_file.close()
         else:
@@ -1032,11 +1553,34 @@ class mesoSPIM_Core(QtCore.QObject):
     #         self.write_line(file, 'f_end expected', acq['f_end'])
     #         self.write_line(file, 'f_end measured', str(self.f_end_measured))
 
-    def append_timing_info_to_metadata(self, acq):
+    def get_timing_info(self):
+        ''' Timing of the current stack, kept until its metadata can be written '''
+        return {'acq_start_time_string' : self.acq_start_time_string,
+                'image_acq_start_time_string' : self.image_acq_start_time_string,
+                'image_acq_end_time_string' : self.image_acq_end_time_string,
+                'acq_end_time_string' : self.acq_end_time_string,
+                'image_acq_duration' : self.image_acq_end_time-self.image_acq_start_time}
+
+    def write_pending_timing_info(self):
+        '''
+        Writes the timing metadata of stacks whose image series has ended
+
+        Only call this when no image series is ending in the camera thread anymore.
+        '''
+        for rows, timing in self.pending_timing_info:
+            for row in rows:
+                self.append_timing_info_to_metadata(row, timing, self.camera_worker.series_telemetry)
+        self.pending_timing_info = []
+
+    def append_timing_info_to_metadata(self, acq, timing, telemetry):
         '''
         Appends a metadata.txt file
 
         Path contains the file to be written
+
+        Args:
+            timing (dict): See get_timing_info()
+            telemetry (dict): Camera telemetry summary of the image series
         '''
         path = acq['folder']+'/'+acq['filename']
 
@@ -1046,11 +1590,24 @@ class mesoSPIM_Core(QtCore.QObject):
             ''' Adding troubleshooting information '''
             self.write_line(file)
             self.write_line(file, 'TIMING INFORMATION')
-            self.write_line(file, 'Started stack', self.acq_start_time_string )
-            self.write_line(file, 'Started taking images', self.image_acq_start_time_string )
-            self.write_line(file, 'Stopped taking images', self.image_acq_end_time_string )
-            self.write_line(file, 'Stopped stack', self.acq_end_time_string )
-            self.write_line(file, 'Frame rate:', str(acq.get_image_count()/(self.image_acq_end_time-self.image_acq_start_time)))
+            self.write_line(file, 'Started stack', timing['acq_start_time_string'] )
+            self.write_line(file, 'Started taking images', timing['image_acq_start_time_string'] )
+            self.write_line(file, 'Stopped taking images', timing['image_acq_end_time_string'] )
+            self.write_line(file, 'Stopped stack', timing['acq_end_time_string'] )
+            self.write_line(file, 'Frame rate:', str(acq.get_image_count()/timing['image_acq_duration']))
+
+            self.write_line(file)
+            self.write_line(file, 'CAMERA TELEMETRY')
+            self.write_line(file, 'Frames received', telemetry['frames'])
+            self.write_line(file, 'Frames dropped by camera driver', telemetry['dropped_frames'])
+            self.write_line(file, 'Sustained frame rate', f"{telemetry['sustained_framerate']:.3f}")
+            self.write_line(file, 'Mean frame interval (ms)', f"{telemetry['mean_interval_ms']:.3f}")
+            self.write_line(file, 'Max frame interval (ms)', f"{telemetry['max_interval_ms']:.3f}")
+            self.write_line(file, 'Mean backlog (frames)', f"{telemetry['mean_backlog']:.2f}")
+            self.write_line(file, 'Max backlog (frames)', telemetry['max_backlog'])
+            self.write_line(file, 'Max driver buffer fill', telemetry['max_buffer_fill'])
+            self.write_line(file, 'Mean retrieval latency (ms)', f"{telemetry['mean_latency_ms']:.3f}")
+            self.write_line(file, 'Max retrieval latency (ms)', f"{telemetry['max_latency_ms']:.3f}")
 
     @QtCore.pyqtSlot(str)
     def send_status_message_to_gui(self, string):
@@ -0,0 +1,109 @@
+'''
+mesoSPIM Image Display class, intended to run in its own thread
+
+Decouples the camera from the GUI: The camera thread only deposits the newest
+frame in a mailbox (older frames which were not displayed yet are overwritten).
+A timer in the display thread picks the latest frame up at a limited rate,
+downsamples it by binning and hands it to the camera window. A new frame is
+only sent once the camera window has displayed the previous one, so the GUI
+event queue never holds more than a single frame.
+'''
+
+import time
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+from PyQt5 import QtCore
+
+from .utils.image_processing import bin_image
+
+class mesoSPIM_ImageDisplay(QtCore.QObject):
+    sig_display_frame = QtCore.pyqtSignal(np.ndarray)
+
+    def __init__(self, parent = None):
+        super().__init__()
+
+        self.parent = parent
+        self.cfg = parent.cfg
+
+        self.mutex = QtCore.QMutex()
+        self.latest_image = None
+        self.latest_subsampling = 1
+
+        self.frame_in_flight = False
+        self.frame_sent_time = 0
+        ''' If the display does not acknowledge a frame within this time (in s), frames are sent again '''
+        self.in_flight_timeout = 1
+
+        self.frames_posted = 0
+        self.frames_displayed = 0
+
+        self.max_display_framerate = self.cfg.startup['camera_display_max_framerate']
+        self.timer = None
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        ''' Needs to be called in the display thread (e.g. via QThread.started) to create the timer there '''
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.process_latest_image)
+        self.set_max_display_framerate(self.max_display_framerate)
+        self.timer.start()
+
+    def set_max_display_framerate(self, framerate):
+        self.max_display_framerate = framerate
+        if self.timer is not None:
+            self.timer.setInterval(int(1000/max(framerate, 0.1)))
+
+    def post_image(self, image, subsampling=1, copy=False):
+        '''
+        Deposits an (unrotated) camera image for display, called from the camera thread
+
+        Only a reference is stored, the image is not copied. This never blocks
+        for longer than a mutex lock.
+
+        With copy=True (images in camera memory which is reused), the image is copied
+        instead, but only if the display has picked up the previous image. Copies are
+        therefore limited to the display framerate, newer images are skipped until then.
+        '''
+        if copy:
+            self.mutex.lock()
+            display_ready = self.latest_image is None
+            self.mutex.unlock()
+            if not display_ready:
+                return
+            image = image.copy()
+
+        self.mutex.lock()
+        self.latest_image = image
+        self.latest_subsampling = subsampling
+        self.frames_posted += 1
+        self.mutex.unlock()
+
+    @QtCore.pyqtSlot()
+    def image_displayed(self):
+        ''' Acknowledgement from the camera window that the last frame has been rendered '''
+        self.frame_in_flight = False
+
+    @QtCore.pyqtSlot()
+    def process_latest_image(self):
+        if self.frame_in_flight and (time.time() - self.frame_sent_time) < self.in_flight_timeout:
+            return
+
+        self.mutex.lock()
+        image = self.latest_image
+        subsampling = self.latest_subsampling
+        self.latest_image = None
+        self.mutex.unlock()
+
+        if image is None:
+            return
+
+        ''' Binning and rotation happen here, in the display thread, the result no longer references camera memory '''
+        image = np.ascontiguousarray(np.rot90(bin_image(image, subsampling)))
+
+        self.frame_in_flight = True
+        self.frame_sent_time = time.time()
+        self.frames_displayed += 1
+        self.sig_display_frame.emit(image)
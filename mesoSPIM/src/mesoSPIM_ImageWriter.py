@@ -1,5 +1,11 @@
 '''
 mesoSPIM Image Writer class, intended to run in the Camera Thread and handle file I/O
+
+Frames are copied into a preallocated ring buffer on the camera thread and written
+to disk by a separate writer thread, so that camera readout and disk writes overlap.
+
+Frames arrive in the camera layout. The 90 degree rotation into the mesoSPIM layout
+is only applied as a (strided) view when a plane is written to disk.
 '''
 
 import os
@@ -12,10 +18,64 @@ import sys
 from PyQt5 import QtCore
 
 from .mesoSPIM_State import mesoSPIM_StateSingleton
+from .utils.frame_buffer import FrameRingBuffer
+from .utils.projections import ProjectionAccumulator, parse_processing_options
+from .utils.zarr_writer import ZarrWriter
+from .utils.bdv_writer import BdvBlockWriter
+from .utils.pyramid import RawPyramidSidecars
+
+class mesoSPIM_ImageWriterThread(QtCore.QThread):
+    '''
+    Consumer thread: Takes frames out of the ring buffer and hands them to the image writer
+
+    The thread finishes once the ring buffer has been closed and drained.
+    Planes which cannot be written are counted, the first failure of a stack
+    is reported with sig_write_error of the image writer.
+    '''
+    def __init__(self, image_writer):
+        super().__init__()
+        self.image_writer = image_writer
+        self.write_errors = 0
+
+    def run(self):
+        frame_buffer = self.image_writer.frame_buffer
+        while True:
+            item = frame_buffer.get()
+            if item is None:
+                break
+            image, plane_index = item
+            try:
+                self.image_writer.write_plane(image, plane_index)
+            except Exception as error:
+                self.write_errors += 1
+                logger.error(f'Image Writer: Plane {plane_index} could not be written: {sys.exc_info()}')
+                if self.write_errors == 1:
+                    self.image_writer.sig_write_error.emit(f'Plane {plane_index} could not be written: {error}')
+            frame_buffer.release()
 
-import npy2bdv
+class mesoSPIM_ImageWriterChannel(object):
+    '''
+    Destination of the frames of one row of the acquisition list
+
+    Usually, a stack has a single channel. With laser interleaving, the frames of
+    all channels of an interleaved group arrive in turn and every channel is written
+    to its own view (or raw file).
+    '''
+    def __init__(self, acq):
+        self.acq = acq
+        self.folder = acq['folder']
+        self.filename = acq['filename']
+        self.path = self.folder+'/'+self.filename
+        self.view_index = None
+        self.xy_stack = None
+        self.raw_pyramid = None
+        self.projector = None
+        self.projection_suffix = ''
 
 class mesoSPIM_ImageWriter(QtCore.QObject):
+    ''' Emitted from the writer thread when a plane could not be written '''
+    sig_write_error = QtCore.pyqtSignal(str)
+
     def __init__(self, parent = None):
         super().__init__()
 
@@ -36,12 +96,30 @@ class mesoSPIM_ImageWriter(QtCore.QObject):
 
         self.file_extension = ''
         self.bdv_writer = None
+        self.zarr_writer = None
+
+        self.frame_buffer = None
+        self.writer_thread = None
+        self.buffer_statistics = {}
+
+        self.channels = []
 
     def prepare_acquisition(self, acq, acq_list):
+        '''
+        Prepares writing a stack. With laser interleaving, acq is the first row of an
+        interleaved group and frames are demultiplexed into one view per row of the group.
+        '''
+        if self.state['laser_interleaving']:
+            group = acq_list.get_interleaved_group(acq)
+        else:
+            group = [acq]
+
         self.folder = acq['folder']
         self.filename = acq['filename']
         self.path = self.folder+'/'+self.filename
         logger.info(f'Image Writer: Save path: {self.path}')
+        if len(group) > 1:
+            logger.info(f'Image Writer: Interleaved channels: {", ".join(channel["filename"] for channel in group)}')
 
         _ , self.file_extension = os.path.splitext(self.filename)
 
@@ -49,64 +127,200 @@ class mesoSPIM_ImageWriter(QtCore.QObject):
         self.x_binning = int(self.binning_string[0])
         self.y_binning = int(self.binning_string[2])
 
-        self.x_pixels = int(self.x_pixels / self.x_binning)
-        self.y_pixels = int(self.y_pixels / self.y_binning)
+        ''' Always start from the unbinned sensor size, otherwise binning is applied again for every acquisition '''
+        self.x_pixels = int(self.cfg.camera_parameters['x_pixels'] / self.x_binning)
+        self.y_pixels = int(self.cfg.camera_parameters['y_pixels'] / self.y_binning)
 
         self.max_frame = acq.get_image_count()
-        self.processing_options_string = acq['processing']
 
         if self.file_extension == '.h5':
             # create writer object if the view is first in the list
             if acq == acq_list[0]:
-                self.bdv_writer = npy2bdv.BdvWriter(self.path,
-                                                    nilluminations=acq_list.get_n_shutter_configs(),
-                                                    nchannels=acq_list.get_n_lasers(),
-                                                    nangles=acq_list.get_n_angles(),
-                                                    ntiles=acq_list.get_n_tiles(),
-                                                    blockdim=((1, 256, 256),),
-                                                    subsamp=self.cfg.hdf5['subsamp'],
-                                                    compression=self.cfg.hdf5['compression'])
+                self.bdv_writer = BdvBlockWriter(self.path,
+                                                 nilluminations=acq_list.get_n_shutter_configs(),
+                                                 nchannels=acq_list.get_n_lasers(),
+                                                 nangles=acq_list.get_n_angles(),
+                                                 ntiles=acq_list.get_n_tiles(),
+                                                 blockdim=self.cfg.hdf5['blockdim'],
+                                                 subsamp=self.cfg.hdf5['subsamp'],
+                                                 compression=self.cfg.hdf5['compression'],
+                                                 min_stack_shape=(min([a.get_image_count() for a in acq_list]), self.x_pixels, self.y_pixels))
+        elif self.file_extension == '.zarr':
+            ''' All views of the acquisition list go into a single zarr hierarchy '''
+            if acq == acq_list[0] or self.zarr_writer is None:
+                if self.zarr_writer is not None:
+                    self.zarr_writer.close()
+                self.zarr_writer = ZarrWriter(self.path,
+                                              chunks=self.cfg.zarr['chunks'],
+                                              compression=self.cfg.zarr['compression'],
+                                              compression_level=self.cfg.zarr['compression_level'],
+                                              n_threads=self.cfg.zarr['n_threads'],
+                                              subsamp=self.cfg.zarr['subsamp'])
+
+        self.channels = []
+        for index, channel_acq in enumerate(group):
+            self.channels.append(self.prepare_channel(channel_acq, acq_list, keep_open=index > 0))
+
+        self.cur_image = 0
+        self.start_writer_thread()
+
+    def prepare_channel(self, acq, acq_list, keep_open=False):
+        '''
+        Creates the view (or raw file) and projections of a single row
+
+        Args:
+            keep_open (bool): Keep previously created views open (interleaved channels)
+
+        Returns:
+            mesoSPIM_ImageWriterChannel
+        '''
+        channel = mesoSPIM_ImageWriterChannel(acq)
+
+        ''' Resolve the view indices once per stack, looking them up per plane scales with the list length '''
+        view_indices = acq_list.get_view_indices(acq)
+        view_name = ZarrWriter.get_view_name(**view_indices)
+
+        if self.file_extension == '.h5':
             # x and y need to be exchanged to account for the image rotation
-            shape = (self.max_frame, self.y_pixels, self.x_pixels)
+            shape = (self.max_frame, self.x_pixels, self.y_pixels)
             px_size_um = self.cfg.pixelsize[acq['zoom']]
             sign_xyz = (1 - np.array(self.cfg.hdf5['flip_xyz'])) * 2 - 1
             affine_matrix = np.array(((1.0, 0.0, 0.0, sign_xyz[0] * acq['x_pos']/px_size_um),
                                       (0.0, 1.0, 0.0, sign_xyz[1] * acq['y_pos']/px_size_um),
                                       (0.0, 0.0, 1.0, sign_xyz[2] * acq['z_start']/acq['z_step'])))
-            self.bdv_writer.append_view(stack=None, virtual_stack_dim=shape,
-                                        illumination=acq_list.find_value_index(acq['shutterconfig'], 'shutterconfig'),
-                                        channel=acq_list.find_value_index(acq['laser'], 'laser'),
-                                        angle=acq_list.find_value_index(acq['rot'], 'rot'),
-                                        tile=acq_list.get_tile_index(acq),
-                                        voxel_units='um',
-                                        voxel_size_xyz=(px_size_um, px_size_um, acq['z_step']),
-                                        calibration=(1.0, 1.0, acq['z_step']/px_size_um),
-                                        m_affine=affine_matrix,
-                                        name_affine="Translation to Regular Grid"
-                                        )
+            channel.view_index = self.bdv_writer.append_view(virtual_stack_dim=shape,
+                                                             illumination=view_indices['illumination'],
+                                                             channel=view_indices['channel'],
+                                                             angle=view_indices['angle'],
+                                                             tile=view_indices['tile'],
+                                                             keep_open=keep_open,
+                                                             voxel_units='um',
+                                                             voxel_size_xyz=(px_size_um, px_size_um, acq['z_step']),
+                                                             calibration=(1.0, 1.0, acq['z_step']/px_size_um),
+                                                             m_affine=affine_matrix,
+                                                             name_affine="Translation to Regular Grid"
+                                                             )
+            ''' All views share a single file, projections need a per-view filename '''
+            channel.projection_suffix = '_' + view_name
+        elif self.file_extension == '.zarr':
+            px_size_um = self.cfg.pixelsize[acq['zoom']]
+            ''' Frames are rotated when they are written, hence the exchanged x and y '''
+            channel.view_index = self.zarr_writer.append_view(shape=(self.max_frame, self.x_pixels, self.y_pixels),
+                                                              **view_indices,
+                                                              voxel_size_zyx=(acq['z_step'], px_size_um, px_size_um),
+                                                              translation_zyx=(acq['z_start'], acq['y_pos'], acq['x_pos']),
+                                                              metadata={'laser' : acq['laser'],
+                                                                        'filter' : acq['filter'],
+                                                                        'zoom' : acq['zoom'],
+                                                                        'shutterconfig' : acq['shutterconfig'],
+                                                                        'rot' : acq['rot'],
+                                                                        'f_start' : acq['f_start'],
+                                                                        'f_end' : acq['f_end']},
+                                                              keep_open=keep_open)
+            channel.projection_suffix = '_' + view_name
         else:
-            self.fsize = self.x_pixels*self.y_pixels
-            self.xy_stack = np.memmap(self.path, mode="write", dtype=np.uint16, shape=self.fsize * self.max_frame)
-    
-        self.cur_image = 0
+            ''' The raw file contains rotated frames, the memmap is shaped accordingly to avoid flattening each frame '''
+            channel.xy_stack = np.memmap(channel.path, mode="write", dtype=np.uint16, shape=(self.max_frame, self.x_pixels, self.y_pixels))
+            if len(self.cfg.raw['subsamp']) > 1:
+                channel.raw_pyramid = RawPyramidSidecars(channel.path, self.cfg.raw['subsamp'], channel.xy_stack.shape)
 
-    def write_image(self, image, acq, acq_list):
-        if self.file_extension == '.h5':
-            self.bdv_writer.append_plane(plane=image, plane_index=self.cur_image,
-                                         illumination=acq_list.find_value_index(acq['shutterconfig'], 'shutterconfig'),
-                                         channel=acq_list.find_value_index(acq['laser'], 'laser'),
-                                         angle=acq_list.find_value_index(acq['rot'], 'rot'),
-                                         tile=acq_list.get_tile_index(acq)
-                                         )
+        ''' Projections are accumulated in the writer thread from the rotated planes '''
+        projection_options = parse_processing_options(acq['processing'])
+        if projection_options:
+            channel.projector = ProjectionAccumulator(projection_options, self.max_frame, (self.x_pixels, self.y_pixels))
+
+        return channel
+
+    def start_writer_thread(self):
+        ''' 
+        (Re-)allocates the ring buffer if the frame size changed and starts the writer thread.
+
+        The buffer holds frames in the (unrotated) camera layout.
+        '''
+        frame_shape = (self.y_pixels, self.x_pixels)
+        if self.frame_buffer is None or not self.frame_buffer.matches(frame_shape):
+            n_slots = self.cfg.frame_buffer['n_slots']
+            logger.info(f'Image Writer: Allocating ring buffer with {n_slots} frames of shape {frame_shape}')
+            self.frame_buffer = FrameRingBuffer(n_slots, frame_shape, dtype=np.uint16)
         else:
-            image = image.flatten()
-            self.xy_stack[self.cur_image*self.fsize:(self.cur_image+1)*self.fsize] = image
+            self.frame_buffer.reset()
+
+        self.writer_thread = mesoSPIM_ImageWriterThread(self)
+        self.writer_thread.start()
+
+    def stop_writer_thread(self):
+        ''' Waits until all buffered frames are written to disk '''
+        if self.writer_thread is not None:
+            self.frame_buffer.close()
+            self.writer_thread.wait()
+
+            self.buffer_statistics = self.frame_buffer.get_statistics()
+            self.buffer_statistics['write_errors'] = self.writer_thread.write_errors
+            self.writer_thread = None
+            stats = self.buffer_statistics
+            logger.info(f'Image Writer: Ring buffer high-water mark: {stats["high_water_mark"]} of {stats["n_slots"]} frames, '
+                        f'frames written: {stats["frames_put"]} ({stats["frames_referenced"]} without copy), frames dropped: {stats["frames_dropped"]}, '
+                        f'waits for a free slot: {stats["frames_waited"]}, write errors: {stats["write_errors"]}')
+            if stats['frames_dropped'] > 0:
+                logger.warning(f'Image Writer: {stats["frames_dropped"]} frames were dropped because the disk could not keep up')
+            if stats['write_errors'] > 0:
+                logger.warning(f'Image Writer: {stats["write_errors"]} planes could not be written')
+
+    def write_image(self, image, acq, acq_list, copy=True):
+        '''
+        Queues an image for writing, called from the camera thread.
+
+        Blocks for at most cfg.frame_buffer['put_timeout_ms'] if the ring buffer is full.
+
+        Args:
+            image (np.ndarray): Unrotated image as delivered by the camera
+            copy (bool): If False, the writer thread works directly on the camera-owned memory
+                         of the image. Only safe if the camera does not reuse that memory
+                         before the frame has been written.
+        '''
+        if not self.frame_buffer.put(image, self.cur_image, timeout_ms=self.cfg.frame_buffer['put_timeout_ms'], copy=copy):
+            logger.warning(f'Image Writer: Ring buffer full, dropped frame {self.cur_image}')
 
         self.cur_image += 1
+
+    def write_plane(self, image, plane_index):
+        ''' Writes a single plane to disk, called from the writer thread '''
+        ''' rot90 only returns a view, the only copy happens when the data lands in the file '''
+        image = np.rot90(image)
+
+        ''' Interleaved channels arrive in turn, one frame per channel and plane '''
+        n_channels = len(self.channels)
+        channel = self.channels[plane_index % n_channels]
+        plane_index = plane_index // n_channels
+
+        if self.file_extension == '.h5':
+            self.bdv_writer.append_plane(image, plane_index, channel.view_index)
+        elif self.file_extension == '.zarr':
+            self.zarr_writer.append_plane(image, plane_index, channel.view_index)
+        else:
+            channel.xy_stack[plane_index] = image
+            if channel.raw_pyramid is not None:
+                channel.raw_pyramid.append_plane(channel.xy_stack[plane_index], plane_index)
+
+        if channel.projector is not None:
+            channel.projector.add_plane(image, plane_index)
         
     def end_acquisition(self, acq, acq_list):
+        self.stop_writer_thread()
+
+        for channel in self.channels:
+            if channel.projector is not None:
+                try:
+                    channel.projector.save(channel.folder, channel.filename, channel.projection_suffix)
+                except:
+                    logger.error(f'Projections could not be saved: {sys.exc_info()}')
+                channel.projector = None
+
+        ''' With interleaving, the group ends with its last channel '''
+        last_acq = self.channels[-1].acq if self.channels else acq
+
         if self.file_extension == '.h5':
-            if acq == acq_list[-1]:
+            if last_acq == acq_list[-1]:
                 try:
                     self.bdv_writer.write_xml_file()
                 except:
@@ -115,11 +329,28 @@ class mesoSPIM_ImageWriter(QtCore.QObject):
                     self.bdv_writer.close()
                 except:
                     logger.error(f'HDF5 file could not be closed: {sys.exc_info()}')
-        else:
+            else:
+                ''' Write the last (incomplete) block of this view '''
+                self.bdv_writer.finish_view()
+        elif self.file_extension == '.zarr':
             try:
-                del self.xy_stack
+                if last_acq == acq_list[-1]:
+                    self.zarr_writer.close()
+                    self.zarr_writer = None
+                else:
+                    self.zarr_writer.finish_view()
             except:
-                logger.warning('Raw data stack could not be deleted')
+                logger.error(f'Zarr file could not be finished: {sys.exc_info()}')
+        else:
+            for channel in self.channels:
+                try:
+                    del channel.xy_stack
+                except:
+                    logger.warning('Raw data stack could not be deleted')
+                if channel.raw_pyramid is not None:
+                    channel.raw_pyramid.close()
+                    channel.raw_pyramid = None
+        self.channels = []
     
     def write_snap_image(self, image):
         timestr = time.strftime("%Y%m%d-%H%M%S")
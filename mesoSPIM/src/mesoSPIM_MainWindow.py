@@ -71,7 +71,6 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
 
         ''' Instantiate the one and only mesoSPIM state '''
         self.state = mesoSPIM_StateSingleton()
-        self.state.sig_updated.connect(self.update_gui_from_state)
 
         '''
         Setting up the user interface windows
@@ -122,9 +121,13 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
         self.core.sig_warning.connect(self.display_warning)
 
         ''' Connecting the camera frames (this is a deep connection and slightly
-        risky) It will break immediately when there is an API change.'''
+        risky) It will break immediately when there is an API change.
+        
+        The camera window acknowledges every displayed frame, the display worker 
+        only sends the next frame after that.'''
         try:
-            self.core.camera_worker.sig_camera_frame.connect(self.camera_window.set_image)
+            self.core.camera_worker.image_display.sig_display_frame.connect(self.camera_window.set_image)
+            self.camera_window.sig_image_displayed.connect(self.core.camera_worker.image_display.image_displayed)
             # print('Camera connected successfully to the display window!')
         except:
             logger.warning(f'Main Window: Camera not connected to display!', exc_info=True)
@@ -267,8 +270,13 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
             self.win_taskbar_button.progress().setValue(int((image_count+1)/tot_images*100))
         '''
 
+        telemetry = dict['camera_telemetry']
+        telemetry_string = f"{telemetry['sustained_framerate']:.1f} fps, backlog: {telemetry['backlog']}"
+        if telemetry['dropped_frames'] > 0:
+            telemetry_string += f", dropped: {telemetry['dropped_frames']}"
+
         self.AcquisitionProgressBar.setFormat('%p% Image '+ str(cur_image+1) +\
-                                        '/' + str(images_in_acq) + ' ')
+                                        '/' + str(images_in_acq) + ' (' + telemetry_string + ') ')
         self.TotalProgressBar.setFormat('%p% Acq: '+ str(cur_acq+1) +\
                                         '/' + str(tot_acqs) +\
                                          ' ' + ' Image: '+ str(image_count) +\
@@ -324,7 +332,7 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
         self.SnapButton.clicked.connect(self.run_snap)
         self.RunSelectedAcquisitionButton.clicked.connect(self.run_selected_acquisition)
         self.RunAcquisitionListButton.clicked.connect(self.run_acquisition_list)
-        self.StopButton.clicked.connect(lambda: self.sig_state_request.emit({'state':'idle'}))
+        self.StopButton.clicked.connect(self.stop)
         #self.StopButton.clicked.connect(lambda: print('Stopping'))
         self.LightsheetSwitchingModeButton.clicked.connect(self.run_lightsheet_alignment_mode)
         self.VisualModeButton.clicked.connect(self.run_visual_mode)
@@ -382,6 +390,13 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
         for widget, state_parameter, conversion_factor in self.widget_to_state_parameter_assignment:
             self.connect_widget_to_state_parameter(widget, state_parameter, conversion_factor)
 
+        ''' Widgets per state parameter: only these are updated when the parameter changes '''
+        self.state_parameter_to_widgets = {}
+        for widget, state_parameter, conversion_factor in self.widget_to_state_parameter_assignment:
+            if (widget, conversion_factor) not in self.state_parameter_to_widgets.setdefault(state_parameter, []):
+                self.state_parameter_to_widgets[state_parameter].append((widget, conversion_factor))
+        self.state.subscribe(list(self.state_parameter_to_widgets.keys()), self.update_gui_from_state)
+
         ''' Connecting the microscope controls '''
 
         ''' List for subsampling factors - comboboxes need a list of strings'''
@@ -467,17 +482,25 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
         elif isinstance(widget, (QtWidgets.QSlider,QtWidgets.QDoubleSpinBox,QtWidgets.QSpinBox)):
             widget.setValue(self.state[state_parameter_string]*conversion_factor)
     
-    @QtCore.pyqtSlot()
-    def update_gui_from_state(self):
+    def update_gui_from_state(self, changed_keys):
         '''
-        Updates the GUI controls after a state_change
+        Updates the GUI controls of the changed state parameters
         if the self.update_gui_from_state_flag is enabled.
+
+        Args:
+            changed_keys (frozenset): State parameters changed since the last update
         '''
         if self.update_gui_from_state_flag:
-            self.block_signals_from_controls(True)
-            for widget, state_parameter, conversion_factor in self.widget_to_state_parameter_assignment:
-                self.update_widget_from_state(widget, state_parameter, conversion_factor)                
-            self.block_signals_from_controls(False)
+            for state_parameter in changed_keys:
+                for widget, conversion_factor in self.state_parameter_to_widgets.get(state_parameter, []):
+                    widget.blockSignals(True)
+                    self.update_widget_from_state(widget, state_parameter, conversion_factor)
+                    widget.blockSignals(False)
+
+    def stop(self):
+        ''' The running mode sees the stop flag at its next frame, the state request follows it '''
+        self.core.request_stop()
+        self.sig_state_request.emit({'state':'idle'})
 
     def run_snap(self):
         self.sig_state_request.emit({'state':'snap'})
@@ -546,6 +569,12 @@ class mesoSPIM_MainWindow(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot(bool)
     def enable_gui_updates_from_state(self, boolean):
+        '''
+        State changes are coalesced: Changes made while updates were enabled
+        might still be pending, they are delivered before disabling updates.
+        '''
+        if self.update_gui_from_state_flag and not boolean:
+            self.state.notify_changes()
         self.update_gui_from_state_flag = boolean
 
     def enable_stop_button(self, boolean):
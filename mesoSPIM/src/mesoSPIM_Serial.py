@@ -49,6 +49,8 @@ class mesoSPIM_Serial(QtCore.QObject):
 
         self.state = mesoSPIM_StateSingleton()
 
+        self.z_scan_started = False
+
         ''' Handling of state changing requests '''
         self.parent.sig_state_request.connect(self.state_request_handler)
         self.parent.sig_state_request_and_wait_until_done.connect(lambda dict: self.state_request_handler(dict, wait_until_done=True), type=3)
@@ -109,6 +111,9 @@ class mesoSPIM_Serial(QtCore.QObject):
         self.parent.sig_load_sample.connect(self.sig_load_sample.emit)
         self.parent.sig_unload_sample.connect(self.sig_unload_sample.emit)
 
+        self.parent.sig_start_z_scan.connect(self.start_z_scan, type=3)
+        self.parent.sig_end_z_scan.connect(self.end_z_scan, type=3)
+
         self.parent.sig_mark_rotation_position.connect(self.sig_mark_rotation_position.emit)
         self.parent.sig_go_to_rotation_position.connect(self.go_to_rotation_position)
         self.parent.sig_go_to_rotation_position_and_wait_until_done.connect(lambda: self.go_to_rotation_position(wait_until_done=True), type=3)
@@ -158,6 +163,15 @@ class mesoSPIM_Serial(QtCore.QObject):
         else:
             self.stage.move_absolute(dict)
 
+    @QtCore.pyqtSlot(dict)
+    def start_z_scan(self, dict):
+        ''' Called with a blocking connection, the Core reads z_scan_started afterwards '''
+        self.z_scan_started = self.stage.start_z_scan(dict)
+
+    @QtCore.pyqtSlot()
+    def end_z_scan(self):
+        self.stage.end_z_scan()
+
     @QtCore.pyqtSlot(dict)
     def report_position(self, dict):
         self.sig_position.emit({'position': dict})
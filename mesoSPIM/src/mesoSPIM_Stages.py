@@ -9,6 +9,7 @@ logger = logging.getLogger(__name__)
 
 from PyQt5 import QtCore
 from .mesoSPIM_State import mesoSPIM_StateSingleton
+from .utils.z_scan import trapezoidal_position, trapezoidal_duration
 
 # from .mesoSPIM_State import mesoSPIM_StateSingleton
 
@@ -33,6 +34,9 @@ class mesoSPIM_Stage(QtCore.QObject):
     sig_position = QtCore.pyqtSignal(dict)
     sig_status_message = QtCore.pyqtSignal(str,int)
 
+    ''' Stages which can move z at a set constant velocity for continuous z-scans '''
+    supports_z_scan = False
+
     def __init__(self, parent = None):
         super().__init__()
         self.parent = parent
@@ -279,12 +283,71 @@ class mesoSPIM_Stage(QtCore.QObject):
         print('Going to rotation position: NOT IMPLEMENTED / DEMO MODE')
         logger.info('Going to rotation position: NOT IMPLEMENTED / DEMO MODE')
 
+    def start_z_scan(self, dict):
+        '''Starts a z movement to dict['z_abs'] at constant velocity dict['velocity'] (microns/s)
+
+        Returns immediately, end_z_scan() waits for the end of the movement.
+        Only available if supports_z_scan is True.
+
+        Returns:
+            bool: True if the scan was started, False if it was refused (e.g. z limits)
+        '''
+        logger.error('This stage does not support continuous z-scans')
+        return False
+
+    def end_z_scan(self):
+        '''Waits until a z-scan has finished and restores the normal z velocity'''
+        pass
+
 class mesoSPIM_DemoStage(mesoSPIM_Stage):
+    '''
+    Simulated stage: Movements are immediate, except for z-scans which follow a
+    trapezoidal velocity profile with the acceleration given in cfg.z_scan.
+    '''
+    supports_z_scan = True
+
     def __init__(self, parent = None):
         super().__init__(parent)
+        self.z_scan_profile = None
+
+    def report_position(self):
+        if self.z_scan_profile is not None:
+            self.z_pos = self.get_simulated_z_position(time.perf_counter())
+        super().report_position()
+
+    def get_simulated_z_position(self, timestamp):
+        start_time, start, target, velocity = self.z_scan_profile
+        return trapezoidal_position(timestamp - start_time, start, target, velocity, self.cfg.z_scan['acceleration'])
+
+    def start_z_scan(self, dict):
+        target = dict['z_abs'] - self.int_z_pos_offset
+        if self.z_min < target and self.z_max > target:
+            self.z_scan_profile = (time.perf_counter(), self.z_pos, target, dict['velocity'])
+            return True
+        else:
+            self.sig_status_message.emit('Z-scan stopped: Z Motion limit would be reached!',1000)
+            return False
+
+    def end_z_scan(self):
+        ''' Waits for the end of the simulated profile, returns at once after stop() '''
+        if self.z_scan_profile is not None:
+            start_time, start, target, velocity = self.z_scan_profile
+            end_time = start_time + trapezoidal_duration(start, target, velocity, self.cfg.z_scan['acceleration'])
+            time.sleep(max(0, end_time - time.perf_counter()))
+            self.z_pos = target
+            self.z_scan_profile = None
+
+    @QtCore.pyqtSlot()
+    def stop(self):
+        ''' A stopped z-scan stays at its current position '''
+        if self.z_scan_profile is not None:
+            self.z_pos = self.get_simulated_z_position(time.perf_counter())
+            self.z_scan_profile = None
+        super().stop()
 
 class mesoSPIM_PIstage(mesoSPIM_Stage):
     '''
+    Supports continuous z-scans via the z velocity (axis 3).
 
     It is expected that the parent class has the following signals:
         sig_move_relative = pyqtSignal(dict)
@@ -300,6 +363,8 @@ class mesoSPIM_PIstage(mesoSPIM_Stage):
     during the execution of movements.
     '''
 
+    supports_z_scan = True
+
     def __init__(self, parent = None):
         super().__init__(parent)
 
@@ -310,6 +375,10 @@ class mesoSPIM_PIstage(mesoSPIM_Stage):
 
         self.pitools = pitools
 
+        ''' z velocity to restore after a z-scan, None if no scan is running '''
+        self.z_velocity_before_scan = None
+        self.z_scan_stopped = False
+
         ''' Setting up the PI stages '''
         self.pi = self.cfg.pi_parameters
 
@@ -495,7 +564,32 @@ class mesoSPIM_PIstage(mesoSPIM_Stage):
         if wait_until_done == True:
             self.pitools.waitontarget(self.pidevice)
 
+    def start_z_scan(self, dict):
+        ''' PI z-scan: z moves with a temporarily reduced velocity (PI units: mm/s) '''
+        z_abs = dict['z_abs'] - self.int_z_pos_offset
+        if self.z_min < z_abs and self.z_max > z_abs:
+            self.z_scan_stopped = False
+            self.z_velocity_before_scan = self.pidevice.qVEL(3)['3']
+            self.pidevice.VEL({3 : dict['velocity']/1000})
+            self.pidevice.MOV({3 : z_abs/1000})
+            return True
+        else:
+            self.z_velocity_before_scan = None
+            self.sig_status_message.emit('Z-scan stopped: Z Motion limit would be reached!',1000)
+            return False
+
+    def end_z_scan(self):
+        ''' A stopped scan has no target to wait for, the velocity is restored in any case '''
+        try:
+            if not self.z_scan_stopped:
+                self.pitools.waitontarget(self.pidevice)
+        finally:
+            if self.z_velocity_before_scan is not None:
+                self.pidevice.VEL({3 : self.z_velocity_before_scan})
+                self.z_velocity_before_scan = None
+
     def stop(self):
+        self.z_scan_stopped = True
         self.pidevice.STP(noraise=True)
 
     def load_sample(self):
@@ -1,21 +1,63 @@
 '''
 mesoSPIM State class
 '''
+import collections.abc
+
 import numpy as np
 from PyQt5 import QtCore
 
 from .utils.acquisitions import AcquisitionList
 
+class mesoSPIM_StateSnapshot(collections.abc.Mapping):
+    '''
+    Immutable, versioned view of the mesoSPIM state.
+
+    Every change of the state publishes a new snapshot, existing snapshots never 
+    change. A snapshot can therefore be read without locking and all values in 
+    it belong to the same version of the state.
+
+    The snapshot is shallow: Mutable values such as the acquisition list are 
+    shared with the state and have to be replaced, not modified in place, to 
+    create a new version.
+    '''
+    __slots__ = ('_values', 'version')
+
+    def __init__(self, values, version):
+        self._values = values
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f'mesoSPIM_StateSnapshot(version={self.version}, {len(self._values)} parameters)'
+
 class mesoSPIM_StateSingleton():
     '''
     Singleton object containing the whole mesoSPIM state.
 
     Only classes which control.
 
-    Access to attributes is mutex-locked to allow access from multiple threads.
+    Writes are mutex-locked and copy-on-write: every write publishes a new 
+    immutable snapshot of the whole state (see mesoSPIM_StateSnapshot), which 
+    replaces the previous one in a single reference assignment. Reads don't lock, 
+    they access the current snapshot. Hot loops can keep one snapshot() instead 
+    of reading key by key.
 
     If more than one state parameter should be set at the same time, the 
     set_parameter 
+
+    Changes are not announced one by one: the keys set in a burst (e.g. within 
+    one pass of the acquisition loop) are collected and sig_keys_updated is 
+    emitted once with all of them in the next tick of the event loop of the 
+    thread owning the state (the GUI thread). Callbacks for single keys can be 
+    registered with subscribe().
     '''
 
     instance = None
@@ -34,11 +76,20 @@ class mesoSPIM_StateSingleton():
 
     class __StateObject(QtCore.QObject):
         sig_updated = QtCore.pyqtSignal()
+        sig_keys_updated = QtCore.pyqtSignal(frozenset)
+        sig_changes_pending = QtCore.pyqtSignal()
         mutex = QtCore.QMutex()
 
         def __init__(self):
             super().__init__()
-            self._state_dict = {
+            ''' Keys set since the last notification and callbacks per key: {key : [callback, ...]} '''
+            self._changed_keys = set()
+            self._subscribers = {}
+            self.notification_count = 0
+            ''' Queued, so that the notification is delivered in the thread owning the state '''
+            self.sig_changes_pending.connect(self.notify_changes, type=QtCore.Qt.QueuedConnection)
+
+            state_dict = {
                             'state' : 'init', # 'init', 'idle' , 'live', 'snap', 'running_script'
                             'acq_list' : AcquisitionList(),
                             'selected_row': -2,
@@ -99,56 +150,128 @@ class mesoSPIM_StateSingleton():
                             'predicted_acq_list_time':1,
                             'remaining_acq_list_time':1,
                             }
+            self._snapshot = mesoSPIM_StateSnapshot(state_dict, 0)
 
         def __len__(self):
-            return len(self._state_dict) 
+            return len(self._snapshot) 
         
         def __setitem__(self, key, value):
             '''
-            Custom __setitem__ method to allow mutexed access to 
-            a state parameter. 
+            Custom __setitem__ method to publish a new version of the state 
+            with the changed parameter.
 
-            After the state has been changed, the updated signal is emitted.
+            After the state has been changed, the key is marked as changed. 
             '''
-            with QtCore.QMutexLocker(self.mutex):
-                self._state_dict.__setitem__(key, value)
-            self.sig_updated.emit()
+            self.set_parameters({key : value})
 
         def __getitem__(self, key):
             '''
-            Custom __getitem__ method to allow mutexed access to 
-            a state parameter.
-
-            To avoid the state being updated while a parameter is read.
+            Custom __getitem__ method reading a state parameter from the 
+            current snapshot, without locking.
             '''
-
-            with QtCore.QMutexLocker(self.mutex):
-                return self._state_dict.__getitem__(key)
+            return self._snapshot[key]
 
         def set_parameters(self, dict):
             '''
             Sometimes, several parameters should be set at once 
             without allowing the state being updated while a parameter is read.
+
+            The new values are written into a copy of the current snapshot, 
+            which is then published as the next version. Writers are serialized 
+            by the mutex, readers see either the old or the new version.
             '''
             with QtCore.QMutexLocker(self.mutex):
-                for key, value in dict.items():
-                    self._state_dict.__setitem__(key, value)
+                current = self._snapshot
+                values = current._values.copy()
+                values.update(dict)
+                self._snapshot = mesoSPIM_StateSnapshot(values, current.version + 1)
+            self.mark_changed(dict.keys())
+
+        def snapshot(self):
+            '''
+            Returns the current immutable snapshot of the state.
+
+            Reading from the snapshot needs no locking and gives consistent 
+            values, even if the state is changed in the meantime.
+            '''
+            return self._snapshot
+
+        @property
+        def version(self):
+            ''' Version of the state, incremented by every write '''
+            return self._snapshot.version
+
+        def mark_changed(self, keys):
+            '''
+            Adds keys to the set of changed keys. 
+
+            Only the first change after a notification requests a new one, 
+            further changes until then are coalesced into it.
+            '''
+            if self.signalsBlocked():
+                return
+            with QtCore.QMutexLocker(self.mutex):
+                notification_pending = len(self._changed_keys) > 0
+                self._changed_keys.update(keys)
+            if not notification_pending:
+                self.sig_changes_pending.emit()
+
+        @QtCore.pyqtSlot()
+        def notify_changes(self):
+            '''
+            Emits sig_keys_updated with all keys changed since the last 
+            notification and calls the callbacks subscribed to them.
+            '''
+            with QtCore.QMutexLocker(self.mutex):
+                changed_keys = frozenset(self._changed_keys)
+                self._changed_keys.clear()
+            if not changed_keys:
+                return
+
+            self.notification_count += 1
+            self.sig_keys_updated.emit(changed_keys)
             self.sig_updated.emit()
 
+            callbacks = {}
+            for key in changed_keys:
+                for callback in self._subscribers.get(key, []):
+                    callbacks.setdefault(callback, set()).add(key)
+            for callback, keys in callbacks.items():
+                callback(frozenset(keys))
+
+        def subscribe(self, keys, callback):
+            '''
+            Registers a callback for changes of one or several keys.
+
+            The callback is called in the thread owning the state, at most once 
+            per notification, with the frozenset of its keys which changed.
+
+            Args:
+                keys (str or list): State parameter(s)
+                callback (callable): Function taking the changed keys
+            '''
+            if isinstance(keys, str):
+                keys = (keys,)
+            for key in keys:
+                if callback not in self._subscribers.setdefault(key, []):
+                    self._subscribers[key].append(callback)
+
+        def unsubscribe(self, keys, callback):
+            if isinstance(keys, str):
+                keys = (keys,)
+            for key in keys:
+                if callback in self._subscribers.get(key, []):
+                    self._subscribers[key].remove(callback)
+
         def get_parameter_dict(self, list):
             '''
             For a list of keys, get a state dict with the current values back.
 
-            All the values are read out under a QMutexLocker so that 
-            the state cannot be updated at the same time.
+            All the values are read from the same snapshot so that 
+            they belong to the same version of the state.
             '''
-            return_dict = {}
-
-            with QtCore.QMutexLocker(self.mutex):
-                for key in list:
-                    return_dict[key] = self._state_dict.__getitem__(key)
-            
-            return return_dict
+            snapshot = self._snapshot
+            return {key : snapshot[key] for key in list}
 
         def get_parameter_list(self, list):
             '''
@@ -156,16 +279,11 @@ class mesoSPIM_StateSingleton():
 
             This is especially useful for unpacking.
 
-            All the values are read out under a QMutexLocker so that 
-            the state cannot be updated at the same time.
+            All the values are read from the same snapshot so that 
+            they belong to the same version of the state.
             '''
-            return_list = []
-
-            with QtCore.QMutexLocker(self.mutex):
-                for key in list:
-                    return_list.append(self._state_dict.__getitem__(key))
-            
-            return return_list
+            snapshot = self._snapshot
+            return [snapshot[key] for key in list]
 
         def block_signals(self, boolean):
             self.blockSignals(boolean)
@@ -9,15 +9,12 @@ import time
 import logging
 logger = logging.getLogger(__name__)
 
-'''National Instruments Imports'''
-import nidaqmx
-from nidaqmx.constants import AcquisitionType, TaskMode
-from nidaqmx.constants import LineGrouping, DigitalWidthUnits
-from nidaqmx.types import CtrTime
-
 '''mesoSPIM imports'''
 from .mesoSPIM_State import mesoSPIM_StateSingleton
-from .utils.waveforms import single_pulse, tunable_lens_ramp, sawtooth, square
+from .utils.waveforms import single_pulse, tunable_lens_ramp, sawtooth, square, tunable_lens_ramp_table, single_pulse_table
+from .utils.waveform_cache import WaveformCache, read_etl_csv
+from .utils.command_registry import CommandRegistry
+from .devices.daq.nidaqmx_backend import get_nidaqmx
 
 from PyQt5 import QtCore
 
@@ -36,8 +33,33 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         self.cfg = parent.cfg
         self.parent = parent
 
+        ''' National Instruments: nidaqmx or its simulation, depending on the config '''
+        self.nidaqmx = self.load_nidaqmx()
+
         self.state = mesoSPIM_StateSingleton()
         self.parent.sig_save_etl_config.connect(self.save_etl_parameters_to_csv)
+        self.register_state_request_handlers()
+
+        ''' Counts waveform updates, so that persistent tasks know when to rewrite their buffers '''
+        self.waveform_version = 0
+        self.live_tasks_active = False
+
+        ''' Waveforms are memoized by their parameters and regenerated lazily '''
+        self.waveform_cache = WaveformCache()
+        self.waveforms_dirty = True
+        self.galvo_and_etl_components = None
+        self.laser_components = None
+        self.interleaved_components = None
+
+        ''' Waveforms are bundled into preallocated (channels x samples) buffers '''
+        self.waveform_buffers = {}
+
+        ''' Interleaved multi-laser acquisitions: one sweep per channel '''
+        self.interleaved_channels = []
+        self.sweeps_per_buffer = 1
+
+        ''' Depth-dependent waveforms: Precomputed ETL & laser waveforms for every plane '''
+        self.plane_tables = []
 
         cfg_file = self.cfg.startup['ETL_cfg_file']
         self.state['ETL_cfg_file'] = cfg_file
@@ -52,108 +74,262 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         self.state['galvo_l_offset'] = self.cfg.startup['galvo_l_offset']
         self.state['galvo_r_offset'] = self.cfg.startup['galvo_r_offset']
 
+    def load_nidaqmx(self):
+        return get_nidaqmx(self.cfg.waveformgeneration, self.cfg)
+
+    def register_state_request_handlers(self):
+        ''' Waveform parameters are set together, the waveforms are then updated once '''
+        self.command_registry = CommandRegistry('Waveform Generator')
+        self.command_registry.register_group(('samplerate',
+                                              'sweeptime',
+                                              'intensity',
+                                              'etl_l_delay_%',
+                                              'etl_l_ramp_rising_%',
+                                              'etl_l_ramp_falling_%',
+                                              'etl_l_amplitude',
+                                              'etl_l_offset',
+                                              'etl_r_delay_%',
+                                              'etl_r_ramp_rising_%',
+                                              'etl_r_ramp_falling_%',
+                                              'etl_r_amplitude',
+                                              'etl_r_offset',
+                                              'galvo_l_frequency',
+                                              'galvo_l_amplitude',
+                                              'galvo_l_offset',
+                                              'galvo_l_duty_cycle',
+                                              'galvo_l_phase',
+                                              'galvo_r_frequency',
+                                              'galvo_r_amplitude',
+                                              'galvo_r_offset',
+                                              'galvo_r_duty_cycle',
+                                              'galvo_r_phase',
+                                              'laser_l_delay_%',
+                                              'laser_l_pulse_%',
+                                              'laser_l_max_amplitude',
+                                              'laser_r_delay_%',
+                                              'laser_r_pulse_%',
+                                              'laser_r_max_amplitude',
+                                              'camera_delay_%',
+                                              'camera_pulse_%'),
+                                             self.set_waveform_parameters)
+        self.command_registry.register('ETL_cfg_file', self.set_etl_cfg_file, str)
+        self.command_registry.register('set_etls_according_to_zoom', self.update_etl_parameters_from_zoom, str)
+        self.command_registry.register('set_etls_according_to_laser', self.set_laser_and_etl_parameters, str)
+        self.command_registry.register('laser', self.set_laser, str)
+        self.command_registry.register('state', self.set_state, str)
+
     @QtCore.pyqtSlot(dict)
     def state_request_handler(self, dict):
-        for key, value in zip(dict.keys(),dict.values()):
-            # print('Waveform Generator: State request: Key: ', key, ' Value: ', value)
-            '''
-            The request handling is done
-            '''
-            if key in ('samplerate',
-                       'sweeptime',
-                       'intensity',
-                       'etl_l_delay_%',
-                       'etl_l_ramp_rising_%',
-                       'etl_l_ramp_falling_%',
-                       'etl_l_amplitude',
-                       'etl_l_offset',
-                       'etl_r_delay_%',
-                       'etl_r_ramp_rising_%',
-                       'etl_r_ramp_falling_%',
-                       'etl_r_amplitude',
-                       'etl_r_offset',
-                       'galvo_l_frequency',
-                       'galvo_l_amplitude',
-                       'galvo_l_offset',
-                       'galvo_l_duty_cycle',
-                       'galvo_l_phase',
-                       'galvo_r_frequency',
-                       'galvo_r_amplitude',
-                       'galvo_r_offset',
-                       'galvo_r_duty_cycle',
-                       'galvo_r_phase',
-                       'laser_l_delay_%',
-                       'laser_l_pulse_%',
-                       'laser_l_max_amplitude',
-                       'laser_r_delay_%',
-                       'laser_r_pulse_%',
-                       'laser_r_max_amplitude',
-                       'camera_delay_%',
-                       'camera_pulse_%'):
-                ''' Notify GUI about the change '''
-                #self.sig_update_gui_from_state.emit(True)
-                self.state[key] = value
-                #self.sig_update_gui_from_state.emit(False)
-                self.create_waveforms()
-                # print('Waveform change')
-            elif key in ('ETL_cfg_file'):
-                self.state[key] = value
-                self.update_etl_parameters_from_csv(value, self.state['laser'], self.state['zoom'])
-                # print('ETL CFG File changed')
-            elif key in ('set_etls_according_to_zoom'):
-                self.update_etl_parameters_from_zoom(value)
-                #print('zoom change')
-            elif key in ('set_etls_according_to_laser'):
-                self.state['laser'] = value
-                self.create_waveforms()
-                self.update_etl_parameters_from_laser(value)
-                #print('laser change')
-            elif key in ('laser'):
-                self.state['laser'] = value
-                self.create_waveforms()
-                
-            # Log Thread ID during Live: just debugging code
-            elif key == 'state':
-                if value == 'live':
-                    logger.info('Thread ID during live: '+str(int(QtCore.QThread.currentThreadId())))
+        '''
+        The request handling is done with a lookup in the command registry
+        '''
+        self.command_registry.dispatch(dict)
+
+    def set_waveform_parameters(self, parameters):
+        self.state.set_parameters(parameters)
+        self.create_waveforms()
+
+    def set_etl_cfg_file(self, cfg_file):
+        self.state['ETL_cfg_file'] = cfg_file
+        self.update_etl_parameters_from_csv(cfg_file, self.state['laser'], self.state['zoom'])
+
+    def set_laser(self, laser):
+        self.state['laser'] = laser
+        self.create_waveforms()
+
+    def set_laser_and_etl_parameters(self, laser):
+        self.state['laser'] = laser
+        self.create_waveforms()
+        self.update_etl_parameters_from_laser(laser)
+
+    def set_state(self, state):
+        ''' Log Thread ID during Live: just debugging code '''
+        if state == 'live':
+            logger.info('Thread ID during live: '+str(int(QtCore.QThread.currentThreadId())))
 
     def calculate_samples(self):
         samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
         self.samples = int(samplerate*sweeptime)
 
     def create_waveforms(self):
+        '''Marks the waveforms as outdated
+
+        Waveforms are regenerated lazily by update_waveforms(), so that a burst of
+        parameter changes only causes a single regeneration.
+        '''
+        self.waveforms_dirty = True
+
+    def update_waveforms(self):
+        '''Regenerates the waveforms if any parameter changed since the last update
+
+        Each waveform is memoized by its parameters, only changed channels are recomputed.
+        The waveform version is only incremented if the output actually changed.
+        '''
+        if not self.waveforms_dirty:
+            return
+        self.waveforms_dirty = False
         self.calculate_samples()
-        self.create_etl_waveforms()
+        if self.interleaved_channels:
+            changed = self.create_interleaved_waveforms()
+        else:
+            self.create_etl_waveforms()
+            self.create_galvo_waveforms()
+            '''Bundle everything'''
+            galvo_and_etl_changed = self.bundle_galvo_and_etl_waveforms()
+            laser_changed = self.create_laser_waveforms()
+            changed = galvo_and_etl_changed or laser_changed
+        if changed:
+            self.waveform_version += 1
+
+    def set_interleaved_channels(self, channels):
+        '''Sets up interleaved multi-laser acquisitions
+
+        The waveform buffers then contain one sweep per channel, each with the laser,
+        intensity and ETL parameters of its channel. The camera is triggered once per sweep.
+
+        Args:
+            channels (list): One dict per channel with the keys 'laser', 'intensity', 'etl_l_offset',
+                             'etl_l_amplitude', 'etl_r_offset' and 'etl_r_amplitude'.
+                             None or an empty list switches back to single sweeps.
+        '''
+        self.interleaved_channels = list(channels) if channels else []
+        self.sweeps_per_buffer = max(1, len(self.interleaved_channels))
+        self.create_waveforms()
+
+    def create_interleaved_waveforms(self):
+        '''Creates waveform buffers with consecutive sweeps for all interleaved channels
+
+        Returns:
+            bool: True if the waveforms changed
+        '''
         self.create_galvo_waveforms()
-        '''Bundle everything'''
-        self.bundle_galvo_and_etl_waveforms()
-        self.create_laser_waveforms()
+        components = [self.galvo_l_waveform, self.galvo_r_waveform]
+        for channel in self.interleaved_channels:
+            etl_l_waveform, etl_r_waveform = self.get_etl_waveforms(channel['etl_l_amplitude'], channel['etl_l_offset'],
+                                                                    channel['etl_r_amplitude'], channel['etl_r_offset'])
+            components += [etl_l_waveform, etl_r_waveform, self.get_laser_pulse(channel['intensity']),
+                           self.cfg.laser_designation[channel['laser']]]
+        if self.interleaved_components is not None and len(components) == len(self.interleaved_components) and \
+           all(a is b for a, b in zip(components, self.interleaved_components)):
+            return False
+        self.interleaved_components = components
+
+        ''' Returning to single sweeps has to restack the waveforms '''
+        self.galvo_and_etl_components = None
+        self.laser_components = None
+
+        n_sweeps = len(self.interleaved_channels)
+        samples = self.samples
+        self.galvo_and_etl_waveforms = self.get_waveform_buffer('interleaved_galvo_and_etl', (4, n_sweeps * samples))
+        self.laser_waveforms = self.get_waveform_buffer('interleaved_laser', (len(self.cfg.laser_designation), n_sweeps * samples))
+        self.laser_waveforms.fill(0)
+        for i in range(n_sweeps):
+            etl_l_waveform, etl_r_waveform, laser_pulse, laser_index = components[2 + 4 * i:6 + 4 * i]
+            columns = slice(i * samples, (i + 1) * samples)
+            self.galvo_and_etl_waveforms[0, columns] = self.galvo_l_waveform
+            self.galvo_and_etl_waveforms[1, columns] = self.galvo_r_waveform
+            self.galvo_and_etl_waveforms[2, columns] = etl_l_waveform
+            self.galvo_and_etl_waveforms[3, columns] = etl_r_waveform
+            self.laser_waveforms[laser_index, columns] = laser_pulse
+        return True
+
+    def set_plane_tables(self, channel_parameters):
+        '''Precomputes the ETL and laser waveforms of every plane of a stack (z profiles)
+
+        Each waveform table is a 2D array with one row per plane, computed at once.
+        Parameters which are constant over the stack get a table with a single row.
+        write_plane_waveforms_to_tasks() then copies the rows of a plane into the
+        waveform buffers, nothing is recomputed during the stack.
+
+        Args:
+            channel_parameters (list): One dict per sweep of the buffer (one per interleaved channel)
+                                       with the 'laser' and arrays of one value per plane for
+                                       'intensity', 'etl_l_offset', 'etl_l_amplitude', 'etl_r_offset'
+                                       and 'etl_r_amplitude'. None switches back to constant waveforms.
+        '''
+        self.plane_tables = []
+        if not channel_parameters:
+            return
+
+        self.update_waveforms()
+        self.calculate_samples()
+        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
+        etl_l_delay, etl_l_ramp_rising, etl_l_ramp_falling = \
+        self.state.get_parameter_list(['etl_l_delay_%','etl_l_ramp_rising_%','etl_l_ramp_falling_%'])
+        etl_r_delay, etl_r_ramp_rising, etl_r_ramp_falling = \
+        self.state.get_parameter_list(['etl_r_delay_%','etl_r_ramp_rising_%','etl_r_ramp_falling_%'])
+        laser_l_delay, laser_l_pulse, max_laser_voltage = \
+        self.state.get_parameter_list(['laser_l_delay_%','laser_l_pulse_%','max_laser_voltage'])
+
+        def per_plane(*parameters):
+            ''' Constant parameters only need a single row '''
+            if all(np.ptp(values) == 0 for values in parameters):
+                return [values[:1] for values in parameters]
+            return parameters
+
+        table_bytes = 0
+        for sweep, parameters in enumerate(channel_parameters):
+            amplitudes, offsets = per_plane(parameters['etl_l_amplitude'], parameters['etl_l_offset'])
+            etl_l_table = tunable_lens_ramp_table(samplerate, sweeptime, etl_l_delay, etl_l_ramp_rising, etl_l_ramp_falling,
+                                                  amplitudes=amplitudes, offsets=offsets)
+            amplitudes, offsets = per_plane(parameters['etl_r_amplitude'], parameters['etl_r_offset'])
+            etl_r_table = tunable_lens_ramp_table(samplerate, sweeptime, etl_r_delay, etl_r_ramp_rising, etl_r_ramp_falling,
+                                                  amplitudes=amplitudes, offsets=offsets)
+            intensities, = per_plane(parameters['intensity'])
+            laser_table = single_pulse_table(samplerate, sweeptime, laser_l_delay, laser_l_pulse,
+                                             amplitudes=max_laser_voltage * intensities / 100)
+            self.plane_tables.append((sweep, self.cfg.laser_designation[parameters['laser']],
+                                      etl_l_table, etl_r_table, laser_table))
+            table_bytes += etl_l_table.nbytes + etl_r_table.nbytes + laser_table.nbytes
+
+        ''' The galvo waveforms and the outputs of other lasers stay constant '''
+        self.plane_galvo_and_etl_waveforms = np.array(self.galvo_and_etl_waveforms)
+        self.plane_laser_waveforms = np.array(self.laser_waveforms)
+        logger.info(f'Precomputed waveforms for {len(channel_parameters[0]["intensity"])} planes: {table_bytes/1e6:.1f} MB')
+
+    def fill_plane_waveforms(self, plane):
+        '''Copies the precomputed waveforms of a plane into the waveform buffers'''
+        samples = self.samples
+        for sweep, laser_index, etl_l_table, etl_r_table, laser_table in self.plane_tables:
+            columns = slice(sweep * samples, (sweep + 1) * samples)
+            self.plane_galvo_and_etl_waveforms[2, columns] = etl_l_table[min(plane, len(etl_l_table) - 1)]
+            self.plane_galvo_and_etl_waveforms[3, columns] = etl_r_table[min(plane, len(etl_r_table) - 1)]
+            self.plane_laser_waveforms[laser_index, columns] = laser_table[min(plane, len(laser_table) - 1)]
 
     def create_etl_waveforms(self):
+        etl_l_amplitude, etl_l_offset, etl_r_amplitude, etl_r_offset = \
+        self.state.get_parameter_list(['etl_l_amplitude','etl_l_offset','etl_r_amplitude','etl_r_offset'])
+
+        self.etl_l_waveform, self.etl_r_waveform = self.get_etl_waveforms(etl_l_amplitude, etl_l_offset,
+                                                                          etl_r_amplitude, etl_r_offset)
+
+    def get_etl_waveforms(self, etl_l_amplitude, etl_l_offset, etl_r_amplitude, etl_r_offset):
+        '''Returns the left and right ETL waveforms for the given amplitudes and offsets,
+        timing parameters are taken from the state'''
         samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-        etl_l_delay, etl_l_ramp_rising, etl_l_ramp_falling, etl_l_amplitude, etl_l_offset =\
-        self.state.get_parameter_list(['etl_l_delay_%','etl_l_ramp_rising_%','etl_l_ramp_falling_%',
-        'etl_l_amplitude','etl_l_offset'])
-        etl_r_delay, etl_r_ramp_rising, etl_r_ramp_falling, etl_r_amplitude, etl_r_offset =\
-        self.state.get_parameter_list(['etl_r_delay_%','etl_r_ramp_rising_%','etl_r_ramp_falling_%',
-        'etl_r_amplitude','etl_r_offset'])
-
-
-        self.etl_l_waveform = tunable_lens_ramp(samplerate = samplerate,
-                                                sweeptime = sweeptime,
-                                                delay = etl_l_delay,
-                                                rise = etl_l_ramp_rising,
-                                                fall = etl_l_ramp_falling,
-                                                amplitude = etl_l_amplitude,
-                                                offset = etl_l_offset)
-
-        self.etl_r_waveform = tunable_lens_ramp(samplerate = samplerate,
-                                                sweeptime = sweeptime,
-                                                delay = etl_r_delay,
-                                                rise = etl_r_ramp_rising,
-                                                fall = etl_r_ramp_falling,
-                                                amplitude = etl_r_amplitude,
-                                                offset = etl_r_offset)
+        etl_l_delay, etl_l_ramp_rising, etl_l_ramp_falling = \
+        self.state.get_parameter_list(['etl_l_delay_%','etl_l_ramp_rising_%','etl_l_ramp_falling_%'])
+        etl_r_delay, etl_r_ramp_rising, etl_r_ramp_falling = \
+        self.state.get_parameter_list(['etl_r_delay_%','etl_r_ramp_rising_%','etl_r_ramp_falling_%'])
+
+        etl_l_waveform = self.waveform_cache.get(tunable_lens_ramp,
+                                                 samplerate = samplerate,
+                                                 sweeptime = sweeptime,
+                                                 delay = etl_l_delay,
+                                                 rise = etl_l_ramp_rising,
+                                                 fall = etl_l_ramp_falling,
+                                                 amplitude = etl_l_amplitude,
+                                                 offset = etl_l_offset)
+
+        etl_r_waveform = self.waveform_cache.get(tunable_lens_ramp,
+                                                 samplerate = samplerate,
+                                                 sweeptime = sweeptime,
+                                                 delay = etl_r_delay,
+                                                 rise = etl_r_ramp_rising,
+                                                 fall = etl_r_ramp_falling,
+                                                 amplitude = etl_r_amplitude,
+                                                 offset = etl_r_offset)
+        return etl_l_waveform, etl_r_waveform
 
     def create_galvo_waveforms(self):
         samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
@@ -167,52 +343,65 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         'galvo_r_duty_cycle', 'galvo_r_phase'])
 
         '''Create Galvo waveforms:'''
-        self.galvo_l_waveform = sawtooth(samplerate = samplerate,
-                                         sweeptime = sweeptime,
-                                         frequency = galvo_l_frequency,
-                                         amplitude = galvo_l_amplitude,
-                                         offset = galvo_l_offset,
-                                         dutycycle = galvo_l_duty_cycle,
-                                         phase = galvo_l_phase)
+        self.galvo_l_waveform = self.waveform_cache.get(sawtooth,
+                                                        samplerate = samplerate,
+                                                        sweeptime = sweeptime,
+                                                        frequency = galvo_l_frequency,
+                                                        amplitude = galvo_l_amplitude,
+                                                        offset = galvo_l_offset,
+                                                        dutycycle = galvo_l_duty_cycle,
+                                                        phase = galvo_l_phase)
 
         ''' Attention: Right Galvo gets the left frequency for now '''
 
-        self.galvo_r_waveform = sawtooth(samplerate = samplerate,
-                                         sweeptime = sweeptime,
-                                         frequency = galvo_l_frequency,
-                                         amplitude = galvo_r_amplitude,
-                                         offset = galvo_r_offset,
-                                         dutycycle = galvo_r_duty_cycle,
-                                         phase = galvo_r_phase)
+        self.galvo_r_waveform = self.waveform_cache.get(sawtooth,
+                                                        samplerate = samplerate,
+                                                        sweeptime = sweeptime,
+                                                        frequency = galvo_l_frequency,
+                                                        amplitude = galvo_r_amplitude,
+                                                        offset = galvo_r_offset,
+                                                        dutycycle = galvo_r_duty_cycle,
+                                                        phase = galvo_r_phase)
 
     def create_laser_waveforms(self):
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
+        '''Creates the laser waveforms: A pulse for the current laser, zeros for all others
 
-        laser_l_delay, laser_l_pulse, max_laser_voltage, intensity = \
-        self.state.get_parameter_list(['laser_l_delay_%','laser_l_pulse_%',
-        'max_laser_voltage','intensity'])
+        Returns:
+            bool: True if the laser waveforms changed
+        '''
+        self.laser_template_waveform = self.get_laser_pulse(self.state['intensity'])
+
+        current_laser_index = self.cfg.laser_designation[self.state['laser']]
 
-        '''Create zero waveforms for the lasers'''
-        self.zero_waveform = np.zeros((self.samples))
+        ''' Cached waveforms are shared, so unchanged components are the identical objects '''
+        components = (self.laser_template_waveform, current_laser_index)
+        if self.laser_components is not None and all(a is b for a, b in zip(components, self.laser_components)):
+            return False
+        self.laser_components = components
 
-        '''Update the laser intensity waveform'''
-        '''This could be improved: create a list with as many zero arrays as analog out lines for ETL and Lasers'''
-        self.laser_waveform_list = [self.zero_waveform for i in self.cfg.laser_designation]
+        '''Zero waveforms for all lasers, the template for the current one'''
+        self.laser_waveforms = self.get_waveform_buffer('laser', (len(self.cfg.laser_designation), self.samples))
+        self.laser_waveforms.fill(0)
+        self.laser_waveforms[current_laser_index] = self.laser_template_waveform
+        return True
+
+    def get_laser_pulse(self, intensity):
+        '''Returns the laser intensity pulse of a sweep, intensity in %'''
+        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
+
+        laser_l_delay, laser_l_pulse, max_laser_voltage = \
+        self.state.get_parameter_list(['laser_l_delay_%','laser_l_pulse_%','max_laser_voltage'])
 
         ''' Conversion from % to V of the intensity:'''
         laser_voltage = max_laser_voltage * intensity / 100
 
-        self.laser_template_waveform = single_pulse(samplerate = samplerate,
-                                                    sweeptime = sweeptime,
-                                                    delay = laser_l_delay,
-                                                    pulsewidth = laser_l_pulse,
-                                                    amplitude = laser_voltage,
-                                                    offset = 0)
-
-        '''The key: replace the waveform in the waveform list with this new template'''
-        current_laser_index = self.cfg.laser_designation[self.state['laser']]
-        self.laser_waveform_list[current_laser_index] = self.laser_template_waveform
-        self.laser_waveforms = np.stack(self.laser_waveform_list)
+        return self.waveform_cache.get(single_pulse,
+                                       samplerate = samplerate,
+                                       sweeptime = sweeptime,
+                                       delay = laser_l_delay,
+                                       pulsewidth = laser_l_pulse,
+                                       amplitude = laser_voltage,
+                                       offset = 0)
 
     def bundle_galvo_and_etl_waveforms(self):
         ''' Stacks the Galvo and ETL waveforms into a numpy array adequate for
@@ -220,11 +409,32 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
 
         In here, the assignment of output channels of the Galvo / ETL card to the
         corresponding output channel is hardcoded: This could be improved.
+
+        Returns:
+            bool: True if any of the waveforms changed
+        '''
+        components = (self.galvo_l_waveform,
+                      self.galvo_r_waveform,
+                      self.etl_l_waveform,
+                      self.etl_r_waveform)
+        if self.galvo_and_etl_components is not None and all(a is b for a, b in zip(components, self.galvo_and_etl_components)):
+            return False
+        self.galvo_and_etl_components = components
+        self.galvo_and_etl_waveforms = self.get_waveform_buffer('galvo_and_etl', (len(components), self.samples))
+        for channel, waveform in enumerate(components):
+            self.galvo_and_etl_waveforms[channel] = waveform
+        return True
+
+    def get_waveform_buffer(self, name, shape):
+        '''Returns a preallocated waveform buffer, it is only reallocated if its shape changed
+
+        Buffers are overwritten by the next waveform update. Tasks copy the data when it is written.
         '''
-        self.galvo_and_etl_waveforms = np.stack((self.galvo_l_waveform,
-                                                 self.galvo_r_waveform,
-                                                 self.etl_l_waveform,
-                                                 self.etl_r_waveform))
+        buffer = self.waveform_buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.zeros(shape)
+            self.waveform_buffers[name] = buffer
+        return buffer
 
     def update_etl_parameters_from_zoom(self, zoom):
         ''' Little helper method: Because the mesoSPIM core is not handling
@@ -257,34 +467,22 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         # print('Updating ETL parameters from file:', cfg_path)
 
         self.sig_update_gui_from_state.emit(True)
-        with open(cfg_path) as file:
-            reader = csv.DictReader(file,delimiter=';')
-            #print('opened csv')
-            for row in reader:
-                if row['Wavelength'] == laser and row['Zoom'] == zoom:
-
-                    ''' Some diagnostic tracing statements
-
-                    # print(row)
-                    # print('updating parameters')
-                    # print(self.etl_l['amplitude'])
-
-                    '''
-
-                    ''' updating internal state '''
-                    etl_l_offset = float(row['ETL-Left-Offset'])
-                    etl_l_amplitude = float(row['ETL-Left-Amp'])
-                    etl_r_offset = float(row['ETL-Right-Offset'])
-                    etl_r_amplitude = float(row['ETL-Right-Amp'])
-
-                    parameter_dict = {'etl_l_offset': etl_l_offset,
-                                      'etl_l_amplitude' : etl_l_amplitude,
-                                      'etl_r_offset' : etl_r_offset,
-                                      'etl_r_amplitude' : etl_r_amplitude}
-
-                    '''  Now the GUI needs to be updated '''
-                    # print('Parameters set from csv')
-                    self.state.set_parameters(parameter_dict)
+        ''' The parsed file is cached until it changes on disk '''
+        row = read_etl_csv(cfg_path).get((laser, zoom))
+        if row is not None:
+            ''' updating internal state '''
+            etl_l_offset = float(row['ETL-Left-Offset'])
+            etl_l_amplitude = float(row['ETL-Left-Amp'])
+            etl_r_offset = float(row['ETL-Right-Offset'])
+            etl_r_amplitude = float(row['ETL-Right-Amp'])
+
+            parameter_dict = {'etl_l_offset': etl_l_offset,
+                              'etl_l_amplitude' : etl_l_amplitude,
+                              'etl_r_offset' : etl_r_offset,
+                              'etl_r_amplitude' : etl_r_amplitude}
+
+            '''  Now the GUI needs to be updated '''
+            self.state.set_parameters(parameter_dict)
 
         '''Update waveforms with the new parameters'''
 
@@ -354,7 +552,7 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         os.remove(etl_cfg_file)
         os.rename(tmp_etl_cfg_file, etl_cfg_file)
 
-    def create_tasks(self):
+    def create_tasks(self, n_sweeps=None):
         '''Creates a total of four tasks for the mesoSPIM:
 
         These are:
@@ -364,8 +562,19 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
           the light-sheet and shadow avoidance
         - the ETL & Laser task (analog out) that controls all the laser intensities (Laser should only
           be on when the camera is acquiring) and the left/right ETL waveforms
+
+        With n_sweeps > 1, a single master trigger outputs n_sweeps consecutive sweeps
+        (and camera triggers), e.g. for continuous z-scans. The waveform buffers still
+        contain a single sweep (or one per interleaved channel), which is regenerated by
+        the cards. n_sweeps has to be a multiple of sweeps_per_buffer, by default one
+        buffer is output.
         '''
+        if n_sweeps is None:
+            n_sweeps = self.sweeps_per_buffer
         ah = self.cfg.acquisition_hardware
+        nidaqmx = self.nidaqmx
+        AcquisitionType = nidaqmx.constants.AcquisitionType
+        LineGrouping = nidaqmx.constants.LineGrouping
 
         self.calculate_samples()
         samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
@@ -390,9 +599,18 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         self.camera_delay = camera_delay_percent*0.01*sweeptime
 
         '''Housekeeping: Setting up the counter task for the camera trigger'''
-        self.camera_trigger_task.co_channels.add_co_pulse_chan_time(ah['camera_trigger_out_line'],
-                                                                    high_time=self.camera_high_time,
-                                                                    initial_delay=self.camera_delay)
+        if n_sweeps == 1:
+            self.camera_trigger_task.co_channels.add_co_pulse_chan_time(ah['camera_trigger_out_line'],
+                                                                        high_time=self.camera_high_time,
+                                                                        initial_delay=self.camera_delay)
+        else:
+            ''' A pulse train with one camera trigger per sweep '''
+            self.camera_trigger_task.co_channels.add_co_pulse_chan_time(ah['camera_trigger_out_line'],
+                                                                        high_time=self.camera_high_time,
+                                                                        low_time=sweeptime-self.camera_high_time,
+                                                                        initial_delay=self.camera_delay)
+            self.camera_trigger_task.timing.cfg_implicit_timing(sample_mode=AcquisitionType.FINITE,
+                                                                samps_per_chan=n_sweeps)
 
         self.camera_trigger_task.triggers.start_trigger.cfg_dig_edge_start_trig(ah['camera_trigger_source'])
 
@@ -400,21 +618,30 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         self.galvo_etl_task.ao_channels.add_ao_voltage_chan(ah['galvo_etl_task_line'])
         self.galvo_etl_task.timing.cfg_samp_clk_timing(rate=samplerate,
                                                    sample_mode=AcquisitionType.FINITE,
-                                                   samps_per_chan=samples)
+                                                   samps_per_chan=samples*n_sweeps)
         self.galvo_etl_task.triggers.start_trigger.cfg_dig_edge_start_trig(ah['galvo_etl_task_trigger_source'])
 
         '''Housekeeping: Setting up the AO task for the ETL and lasers and setting the trigger input'''
         self.laser_task.ao_channels.add_ao_voltage_chan(ah['laser_task_line'])
         self.laser_task.timing.cfg_samp_clk_timing(rate=samplerate,
                                                     sample_mode=AcquisitionType.FINITE,
-                                                    samps_per_chan=samples)
+                                                    samps_per_chan=samples*n_sweeps)
         self.laser_task.triggers.start_trigger.cfg_dig_edge_start_trig(ah['laser_task_trigger_source'])
 
+        self.n_sweeps = n_sweeps
+
     def write_waveforms_to_tasks(self):
         '''Write the waveforms to the slave tasks'''
+        self.update_waveforms()
         self.galvo_etl_task.write(self.galvo_and_etl_waveforms)
         self.laser_task.write(self.laser_waveforms)
 
+    def write_plane_waveforms_to_tasks(self, plane):
+        '''Writes the precomputed waveforms of a plane (see set_plane_tables) to the slave tasks'''
+        self.fill_plane_waveforms(plane)
+        self.galvo_etl_task.write(self.plane_galvo_and_etl_waveforms)
+        self.laser_task.write(self.plane_laser_waveforms)
+
     def start_tasks(self):
         '''Starts the tasks for camera triggering and analog outputs
 
@@ -434,12 +661,19 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         For this to work, all analog output and counter tasks have to be started so
         that they are waiting for the trigger signal.
         '''
+        self.trigger_tasks()
+        self.wait_for_tasks()
+
+    def trigger_tasks(self):
+        '''Sends the master trigger to the started tasks without waiting for them'''
         self.master_trigger_task.write([False, True, True, True, False], auto_start=True)
 
+    def wait_for_tasks(self):
         '''Wait until everything is done - this is effectively a sleep function.'''
-        self.galvo_etl_task.wait_until_done()
-        self.laser_task.wait_until_done()
-        self.camera_trigger_task.wait_until_done()
+        timeout = 10.0 + self.n_sweeps * self.state['sweeptime']
+        self.galvo_etl_task.wait_until_done(timeout=timeout)
+        self.laser_task.wait_until_done(timeout=timeout)
+        self.camera_trigger_task.wait_until_done(timeout=timeout)
 
     def stop_tasks(self):
         '''Stops the tasks for triggering, analog and counter outputs'''
@@ -458,374 +692,93 @@ class mesoSPIM_WaveFormGenerator(QtCore.QObject):
         self.camera_trigger_task.close()
         self.master_trigger_task.close()
 
-class mesoSPIM_DemoWaveFormGenerator(QtCore.QObject):
-    '''This class contains the microscope state
-
-    Any access to this global state should only be done via signals sent by
-    the responsible class for actually causing that state change in hardware.
-
-    '''
-    sig_update_gui_from_state = QtCore.pyqtSignal(bool)
-
-    def __init__(self, parent):
-        super().__init__()
-
-        self.cfg = parent.cfg
-        self.parent = parent
-
-        self.state = mesoSPIM_StateSingleton()
-        self.parent.sig_save_etl_config.connect(self.save_etl_parameters_to_csv)
-
-        cfg_file = self.cfg.startup['ETL_cfg_file']
-        self.state['ETL_cfg_file'] = cfg_file
-        self.update_etl_parameters_from_csv(cfg_file, self.state['laser'], self.state['zoom'])
-
-        logger.info('Thread ID at Startup: '+str(int(QtCore.QThread.currentThreadId())))
-
-        self.state['galvo_l_amplitude'] = self.cfg.startup['galvo_l_amplitude']
-        self.state['galvo_r_amplitude'] = self.cfg.startup['galvo_r_amplitude']
-        self.state['galvo_l_frequency'] = self.cfg.startup['galvo_l_frequency']
-        self.state['galvo_r_frequency'] = self.cfg.startup['galvo_r_frequency']
-        self.state['galvo_l_offset'] = self.cfg.startup['galvo_l_offset']
-        self.state['galvo_r_offset'] = self.cfg.startup['galvo_r_offset']
-
-    @QtCore.pyqtSlot(dict)
-    def state_request_handler(self, dict):
-        for key, value in zip(dict.keys(),dict.values()):
-            # print('Waveform Generator: State request: Key: ', key, ' Value: ', value)
-            '''
-            The request handling is done
-            '''
-            if key in ('samplerate',
-                       'sweeptime',
-                       'intensity',
-                       'etl_l_delay_%',
-                       'etl_l_ramp_rising_%',
-                       'etl_l_ramp_falling_%',
-                       'etl_l_amplitude',
-                       'etl_l_offset',
-                       'etl_r_delay_%',
-                       'etl_r_ramp_rising_%',
-                       'etl_r_ramp_falling_%',
-                       'etl_r_amplitude',
-                       'etl_r_offset',
-                       'galvo_l_frequency',
-                       'galvo_l_amplitude',
-                       'galvo_l_offset',
-                       'galvo_l_duty_cycle',
-                       'galvo_l_phase',
-                       'galvo_r_frequency',
-                       'galvo_r_amplitude',
-                       'galvo_r_offset',
-                       'galvo_r_duty_cycle',
-                       'galvo_r_phase',
-                       'laser_l_delay_%',
-                       'laser_l_pulse_%',
-                       'laser_l_max_amplitude',
-                       'laser_r_delay_%',
-                       'laser_r_pulse_%',
-                       'laser_r_max_amplitude',
-                       'camera_delay_%',
-                       'camera_pulse_%'):
-                ''' Notify GUI about the change '''
-                #self.sig_update_gui_from_state.emit(True)
-                self.state[key] = value
-                #self.sig_update_gui_from_state.emit(False)
-                self.create_waveforms()
-                # print('Waveform change')
-            elif key in ('ETL_cfg_file'):
-                self.state[key] = value
-                self.update_etl_parameters_from_csv(value, self.state['laser'], self.state['zoom'])
-                # print('ETL CFG File changed')
-            elif key in ('zoom'):
-                self.update_etl_parameters_from_zoom(value)
-                #print('zoom change')
-            elif key in ('laser'):
-                self.state[key] = value
-                self.create_waveforms()
-                self.update_etl_parameters_from_laser(value)
-                #print('laser change')
-
-            # Log Thread ID during Live: just debugging code
-            elif key == 'state':
-                if value == 'live':
-                    logger.info('Thread ID during live: '+str(int(QtCore.QThread.currentThreadId())))
-
-    def calculate_samples(self):
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-        self.samples = int(samplerate*sweeptime)
-
-    def create_waveforms(self):
-        self.calculate_samples()
-        self.create_etl_waveforms()
-        self.create_galvo_waveforms()
-        '''Bundle everything'''
-        self.bundle_galvo_and_etl_waveforms()
-        self.create_laser_waveforms()
-
-    def create_etl_waveforms(self):
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-        etl_l_delay, etl_l_ramp_rising, etl_l_ramp_falling, etl_l_amplitude, etl_l_offset =\
-        self.state.get_parameter_list(['etl_l_delay_%','etl_l_ramp_rising_%','etl_l_ramp_falling_%',
-        'etl_l_amplitude','etl_l_offset'])
-        etl_r_delay, etl_r_ramp_rising, etl_r_ramp_falling, etl_r_amplitude, etl_r_offset =\
-        self.state.get_parameter_list(['etl_r_delay_%','etl_r_ramp_rising_%','etl_r_ramp_falling_%',
-        'etl_r_amplitude','etl_r_offset'])
-
-
-        self.etl_l_waveform = tunable_lens_ramp(samplerate = samplerate,
-                                                sweeptime = sweeptime,
-                                                delay = etl_l_delay,
-                                                rise = etl_l_ramp_rising,
-                                                fall = etl_l_ramp_falling,
-                                                amplitude = etl_l_amplitude,
-                                                offset = etl_l_offset)
-
-        self.etl_r_waveform = tunable_lens_ramp(samplerate = samplerate,
-                                                sweeptime = sweeptime,
-                                                delay = etl_r_delay,
-                                                rise = etl_r_ramp_rising,
-                                                fall = etl_r_ramp_falling,
-                                                amplitude = etl_r_amplitude,
-                                                offset = etl_r_offset)
-
-    def create_galvo_waveforms(self):
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-
-        galvo_l_frequency, galvo_l_amplitude, galvo_l_offset, galvo_l_duty_cycle, galvo_l_phase =\
-        self.state.get_parameter_list(['galvo_l_frequency', 'galvo_l_amplitude', 'galvo_l_offset',
-        'galvo_l_duty_cycle', 'galvo_l_phase'])
-
-        galvo_r_frequency, galvo_r_amplitude, galvo_r_offset, galvo_r_duty_cycle, galvo_r_phase =\
-        self.state.get_parameter_list(['galvo_r_frequency', 'galvo_r_amplitude', 'galvo_r_offset',
-        'galvo_r_duty_cycle', 'galvo_r_phase'])
-
-        '''Create Galvo waveforms:'''
-        self.galvo_l_waveform = sawtooth(samplerate = samplerate,
-                                         sweeptime = sweeptime,
-                                         frequency = galvo_l_frequency,
-                                         amplitude = galvo_l_amplitude,
-                                         offset = galvo_l_offset,
-                                         dutycycle = galvo_l_duty_cycle,
-                                         phase = galvo_l_phase)
-
-        ''' Attention: Right Galvo gets the left frequency for now '''
-
-        self.galvo_r_waveform = sawtooth(samplerate = samplerate,
-                                         sweeptime = sweeptime,
-                                         frequency = galvo_l_frequency,
-                                         amplitude = galvo_r_amplitude,
-                                         offset = galvo_r_offset,
-                                         dutycycle = galvo_r_duty_cycle,
-                                         phase = galvo_r_phase)
-
-    def create_laser_waveforms(self):
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-
-        laser_l_delay, laser_l_pulse, max_laser_voltage, intensity = \
-        self.state.get_parameter_list(['laser_l_delay_%','laser_l_pulse_%',
-        'max_laser_voltage','intensity'])
-
-        '''Create zero waveforms for the lasers'''
-        self.zero_waveform = np.zeros((self.samples))
-
-        '''Update the laser intensity waveform'''
-        '''This could be improved: create a list with as many zero arrays as analog out lines for ETL and Lasers'''
-        self.laser_waveform_list = [self.zero_waveform for i in self.cfg.laser_designation]
-
-        ''' Conversion from % to V of the intensity:'''
-        laser_voltage = max_laser_voltage * intensity / 100
-
-        self.laser_template_waveform = single_pulse(samplerate = samplerate,
-                                                    sweeptime = sweeptime,
-                                                    delay = laser_l_delay,
-                                                    pulsewidth = laser_l_pulse,
-                                                    amplitude = laser_voltage,
-                                                    offset = 0)
-
-        '''The key: replace the waveform in the waveform list with this new template'''
-        current_laser_index = self.cfg.laser_designation[self.state['laser']]
-        self.laser_waveform_list[current_laser_index] = self.laser_template_waveform
-        self.laser_waveforms = np.stack(self.laser_waveform_list)
-
-    def bundle_galvo_and_etl_waveforms(self):
-        ''' Stacks the Galvo and ETL waveforms into a numpy array adequate for
-        the NI cards.
-
-        In here, the assignment of output channels of the Galvo / ETL card to the
-        corresponding output channel is hardcoded: This could be improved.
-        '''
-        self.galvo_and_etl_waveforms = np.stack((self.galvo_l_waveform,
-                                                 self.galvo_r_waveform,
-                                                 self.etl_l_waveform,
-                                                 self.etl_r_waveform))
-
-    def update_etl_parameters_from_zoom(self, zoom):
-        ''' Little helper method: Because the mesoSPIM core is not handling
-        the serial Zoom connection. '''
-        laser = self.state['laser']
-        etl_cfg_file = self.state['ETL_cfg_file']
-        self.update_etl_parameters_from_csv(etl_cfg_file, laser, zoom)
-
-    def update_etl_parameters_from_laser(self, laser):
-        ''' Little helper method: Because laser changes need an ETL parameter update '''
-        zoom = self.state['zoom']
-        etl_cfg_file = self.state['ETL_cfg_file']
-        self.update_etl_parameters_from_csv(etl_cfg_file, laser, zoom)
-
-    def update_etl_parameters_from_csv(self, cfg_path, laser, zoom):
-        ''' Updates the internal ETL left/right offsets and amplitudes from the
-        values in the ETL csv files
-
-        The .csv file needs to contain the follwing columns:
-
-        Wavelength
-        Zoom
-        ETL-Left-Offset
-        ETL-Left-Amp
-        ETL-Right-Offset
-        ETL-Right-Amp
+    def get_task_configuration(self):
+        ''' Parameters which are set when tasks are created, changing them requires new tasks '''
+        return tuple(self.state.get_parameter_list(['samplerate','sweeptime','camera_pulse_%','camera_delay_%'])) + (self.sweeps_per_buffer,)
 
+    def start_live_tasks(self):
+        '''Creates persistent tasks for live, visual and alignment mode
 
+        Instead of creating, writing and closing all tasks for every frame like
+        snap_image(), the tasks are kept and only started and stopped per frame
+        by run_live_tasks(). Call stop_live_tasks() at the end.
         '''
-        # print('Updating ETL parameters from file:', cfg_path)
-
-        with open(cfg_path) as file:
-            reader = csv.DictReader(file,delimiter=';')
-            #print('opened csv')
-            for row in reader:
-                if row['Wavelength'] == laser and row['Zoom'] == zoom:
-
-                    ''' Some diagnostic tracing statements
-
-                    # print(row)
-                    # print('updating parameters')
-                    # print(self.etl_l['amplitude'])
-
-                    '''
-
-                    ''' updating internal state '''
-                    etl_l_offset = float(row['ETL-Left-Offset'])
-                    etl_l_amplitude = float(row['ETL-Left-Amp'])
-                    etl_r_offset = float(row['ETL-Right-Offset'])
-                    etl_r_amplitude = float(row['ETL-Right-Amp'])
-
-                    parameter_dict = {'etl_l_offset': etl_l_offset,
-                                      'etl_l_amplitude' : etl_l_amplitude,
-                                      'etl_r_offset' : etl_r_offset,
-                                      'etl_r_amplitude' : etl_r_amplitude}
+        self.create_tasks()
+        self.write_waveforms_to_tasks()
+        self.live_task_configuration = self.get_task_configuration()
+        self.live_waveform_version = self.waveform_version
+        self.live_tasks_active = True
 
-                    '''  Now the GUI needs to be updated '''
-                    self.sig_update_gui_from_state.emit(True)
-                    self.state.set_parameters(parameter_dict)
-                    self.sig_update_gui_from_state.emit(False)
-
-        '''Update waveforms with the new parameters'''
-
-        self.create_waveforms()
-
-    @QtCore.pyqtSlot()
-    def save_etl_parameters_to_csv(self):
-        ''' Saves the current ETL left/right offsets and amplitudes from the
-        values to the ETL csv files
-
-        The .csv file needs to contain the following columns:
-
-        Wavelength
-        Zoom
-        ETL-Left-Offset
-        ETL-Left-Amp
-        ETL-Right-Offset
-        ETL-Right-Amp
-
-        Creates a temporary cfg file with the ending _tmp
+    def run_live_tasks(self):
+        '''Outputs the waveforms for a single frame with the persistent tasks
 
+        Tasks are only recreated if their timing changed, waveform buffers are only
+        rewritten if a waveform parameter changed since the last frame.
         '''
-
-        etl_cfg_file, laser, zoom, etl_l_offset, etl_l_amplitude, etl_r_offset, etl_r_amplitude = \
-        self.state.get_parameter_list(['ETL_cfg_file', 'laser', 'zoom',
-        'etl_l_offset', 'etl_l_amplitude', 'etl_r_offset','etl_r_amplitude'])
-
-        '''Temporary filepath'''
-        tmp_etl_cfg_file = etl_cfg_file+'_tmp'
-
-        # print('saving current ETL parameters')
-
-        with open(etl_cfg_file,'r') as input_file, open(tmp_etl_cfg_file,'w') as outputfile:
-            reader = csv.DictReader(input_file,delimiter=';')
-            #print('created reader')
-            fieldnames = ['Objective',
-                          'Wavelength',
-                          'Zoom',
-                          'ETL-Left-Offset',
-                          'ETL-Left-Amp',
-                          'ETL-Right-Offset',
-                          'ETL-Right-Amp']
-
-            writer = csv.DictWriter(outputfile,fieldnames=fieldnames,dialect='excel',delimiter=';')
-            #print('created writer')
-
-            writer.writeheader()
-
-            for row in reader:
-                if row['Wavelength'] == laser and row['Zoom'] == zoom:
-
-                        writer.writerow({'Objective' : '1x',
-                                         'Wavelength' : laser,
-                                         'Zoom' : zoom,
-                                         'ETL-Left-Offset' : etl_l_offset,
-                                         'ETL-Left-Amp' : etl_l_amplitude,
-                                         'ETL-Right-Offset' : etl_r_offset,
-                                         'ETL-Right-Amp' : etl_r_amplitude,
-                                         })
-
-                else:
-                        writer.writerow(row)
-
-            writer.writerows(reader)
-
-        os.remove(etl_cfg_file)
-        os.rename(tmp_etl_cfg_file, etl_cfg_file)
-
-    def create_tasks(self):
-
+        self.update_waveforms()
+        if self.get_task_configuration() != self.live_task_configuration:
+            self.close_tasks()
+            self.start_live_tasks()
+        elif self.waveform_version != self.live_waveform_version:
+            self.write_waveforms_to_tasks()
+            self.live_waveform_version = self.waveform_version
+
+        self.start_tasks()
+        self.run_tasks()
+        self.stop_tasks()
+
+    def stop_live_tasks(self):
+        '''Closes the persistent tasks of start_live_tasks()'''
+        if self.live_tasks_active:
+            self.close_tasks()
+            self.live_tasks_active = False
+
+class mesoSPIM_DemoWaveFormGenerator(mesoSPIM_WaveFormGenerator):
+    '''Waveform generator for setups without NI cards
+
+    Waveforms, state requests and live tasks are handled exactly like by
+    mesoSPIM_WaveFormGenerator, only the task primitives are replaced: Running
+    the tasks takes the time of their sweeps. For the complete NI task logic
+    without hardware, use 'SimulatedNI'.
+    '''
+    def load_nidaqmx(self):
+        return None
+
+    def create_tasks(self, n_sweeps=None):
+        ''' Simulated tasks: Only the timing of the sweeps is kept '''
+        if n_sweeps is None:
+            n_sweeps = self.sweeps_per_buffer
+        self.n_sweeps = n_sweeps
         self.calculate_samples()
-        samplerate, sweeptime = self.state.get_parameter_list(['samplerate','sweeptime'])
-        samples = self.samples
+        sweeptime = self.state['sweeptime']
         camera_pulse_percent, camera_delay_percent = self.state.get_parameter_list(['camera_pulse_%','camera_delay_%'])
 
         self.camera_high_time = camera_pulse_percent*0.01*sweeptime
         self.camera_delay = camera_delay_percent*0.01*sweeptime
 
     def write_waveforms_to_tasks(self):
-        '''Write the waveforms to the slave tasks'''
-        pass
+        '''Simulated tasks: Only the waveforms are generated'''
+        self.update_waveforms()
 
-    def start_tasks(self):
-        '''Starts the tasks for camera triggering and analog outputs
+    def write_plane_waveforms_to_tasks(self, plane):
+        '''Simulated tasks: Only the waveforms of the plane are assembled'''
+        self.fill_plane_waveforms(plane)
 
-        If the tasks are configured to be triggered, they won't output any
-        signals until run_tasks() is called.
-        '''
+    def start_tasks(self):
         pass
 
-    def run_tasks(self):
-        '''Runs the tasks for triggering, analog and counter outputs
-
-        Firstly, the master trigger triggers all other task via a shared trigger
-        line (PFI line as given in the config file).
+    def trigger_tasks(self):
+        ''' Simulated tasks: Output of all sweeps starts now '''
+        self.trigger_time = time.perf_counter()
 
-        For this to work, all analog output and counter tasks have to be started so
-        that they are waiting for the trigger signal.
-        '''
-        time.sleep(self.state['sweeptime'])
+    def wait_for_tasks(self):
+        ''' Simulated tasks: Wait until all sweeps would have been output '''
+        remaining = self.trigger_time + self.n_sweeps * self.state['sweeptime'] - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
 
     def stop_tasks(self):
         pass
 
     def close_tasks(self):
-        '''Closes the tasks for triggering, analog and counter outputs.
-
-        Tasks should only be closed are they are stopped.
-        '''
         pass
@@ -0,0 +1,233 @@
+'''
+Acquisition list optimizer
+
+Rows of an acquisition list are executed in table order. Lists created tile by tile
+with one row per channel change filter (and laser) at every row, each change
+of the filter wheel takes a fixed time. The optimizer reorders the rows to
+minimize the predicted overhead between stacks:
+
+- Filter, zoom and laser changes take a fixed time each (from the config)
+- Stage travel takes the distance of the slowest axis divided by the stage velocity
+- Rotations go via the rotation position (go_to_rotation_position) and take the
+  angle divided by the rotation velocity
+
+The order is found as an open tour through all rows, starting with the first
+row: a greedy nearest-neighbour tour improved with 2-opt moves. Filenames are
+part of the rows and are not changed, BDV/zarr view indices are resolved in
+the original row order (see AcquisitionList.index_reference).
+
+The optimized list stores the units as its interleaved groups, so rows which
+only become neighbours by the reordering are not interleaved.
+'''
+
+import numpy as np
+
+from .acquisitions import AcquisitionList
+
+import logging
+logger = logging.getLogger(__name__)
+
+''' Used for config files without an acquisition_optimizer section '''
+DEFAULT_OPTIMIZER_CONFIG = {'enabled': False,
+                            'filter_change_time': 0.5,
+                            'zoom_change_time': 1.0,
+                            'laser_change_time': 0.0,
+                            'stage_velocity': 1000,
+                            'rotation_velocity': 10,
+                            'max_2opt_passes': 20,
+                            }
+
+def get_optimizer_config(cfg):
+    return getattr(cfg, 'acquisition_optimizer', DEFAULT_OPTIMIZER_CONFIG)
+
+class AcquisitionCostModel(object):
+    '''
+    Predicts the time in seconds from the end of one stack to the start of the next
+
+    Args:
+        filter_change_time (float): Time of a filter change in s
+        zoom_change_time (float): Time of a zoom change in s
+        laser_change_time (float): Time of a laser change in s
+        stage_velocity (float): Travel velocity of the xyz and focus stages in um/s
+        rotation_velocity (float): Velocity of the rotation stage in degrees/s
+        rotation_position (tuple): (x, y, z) position for rotations in um, None to
+                                   rotate at the current position
+    '''
+    def __init__(self,
+                 filter_change_time=0.5,
+                 zoom_change_time=1.0,
+                 laser_change_time=0.0,
+                 stage_velocity=1000,
+                 rotation_velocity=10,
+                 rotation_position=None):
+        self.filter_change_time = filter_change_time
+        self.zoom_change_time = zoom_change_time
+        self.laser_change_time = laser_change_time
+        self.stage_velocity = stage_velocity
+        self.rotation_velocity = rotation_velocity
+        self.rotation_position = rotation_position
+
+    @classmethod
+    def from_config(cls, cfg):
+        optimizer_cfg = get_optimizer_config(cfg)
+        rotation_position = (cfg.stage_parameters['x_rot_position'],
+                             cfg.stage_parameters['y_rot_position'],
+                             cfg.stage_parameters['z_rot_position'])
+        return cls(filter_change_time=optimizer_cfg['filter_change_time'],
+                   zoom_change_time=optimizer_cfg['zoom_change_time'],
+                   laser_change_time=optimizer_cfg['laser_change_time'],
+                   stage_velocity=optimizer_cfg['stage_velocity'],
+                   rotation_velocity=optimizer_cfg['rotation_velocity'],
+                   rotation_position=rotation_position)
+
+    def get_travel_time(self, start, end):
+        ''' Axes move simultaneously: The slowest axis determines the time. start, end: (n, axes) arrays '''
+        return np.max(np.abs(end - start), axis=-1) / self.stage_velocity
+
+    def get_cost_matrix(self, units):
+        '''
+        Costs between all pairs of units (rows or groups of interleaved rows)
+
+        A unit starts with the settings of its first row and ends with those of its last row.
+
+        Returns:
+            np.ndarray: cost[i, j] is the time from the end of unit i to the start of unit j
+        '''
+        starts = [unit[0] for unit in units]
+        ends = [unit[-1] for unit in units]
+
+        def positions(acqs, point):
+            return np.array([[p['x_abs'], p['y_abs'], p['z_abs'], p['f_abs']] for p in
+                             (getattr(acq, point)() for acq in acqs)], dtype=np.float64)
+
+        def changed(key):
+            ''' Matrix of 1.0 where the value of key differs between end of i and start of j '''
+            _, codes = np.unique([acq[key] for acq in ends + starts], return_inverse=True)
+            codes = codes.reshape(-1)
+            return (codes[:len(ends), np.newaxis] != codes[np.newaxis, len(ends):]).astype(np.float64)
+
+        end_positions = positions(ends, 'get_endpoint')
+        start_positions = positions(starts, 'get_startpoint')
+
+        cost = self.filter_change_time * changed('filter')
+        cost += self.zoom_change_time * changed('zoom')
+        cost += self.laser_change_time * changed('laser')
+
+        travel = self.get_travel_time(end_positions[:, np.newaxis, :], start_positions[np.newaxis, :, :])
+
+        end_angles = np.array([float(acq['rot']) for acq in ends])
+        start_angles = np.array([float(acq['rot']) for acq in starts])
+        rotation_angle = np.abs(end_angles[:, np.newaxis] - start_angles[np.newaxis, :])
+        rotation = rotation_angle > 0.1
+        if np.any(rotation):
+            rotation_travel = rotation_angle / self.rotation_velocity
+            if self.rotation_position is not None:
+                ''' xyz via the rotation position, the focus moves directly '''
+                rotation_point = np.array(self.rotation_position, dtype=np.float64)
+                to_point = self.get_travel_time(end_positions[:, :3], rotation_point)
+                from_point = self.get_travel_time(rotation_point, start_positions[:, :3])
+                focus = np.abs(end_positions[:, np.newaxis, 3] - start_positions[np.newaxis, :, 3]) / self.stage_velocity
+                rotation_travel += np.maximum(to_point[:, np.newaxis] + from_point[np.newaxis, :], focus)
+            travel = np.where(rotation, rotation_travel, travel)
+
+        cost += travel
+        return cost
+
+def get_path_cost(cost, order):
+    order = np.asarray(order)
+    return float(cost[order[:-1], order[1:]].sum())
+
+def get_greedy_order(cost, start=0):
+    ''' Nearest-neighbour tour starting with start '''
+    n = len(cost)
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, cost[order[-1]])
+        ''' argmin returns the first minimum: ties keep the table order '''
+        next_unit = int(np.argmin(candidates))
+        order.append(next_unit)
+        visited[next_unit] = True
+    return order
+
+def improve_order_2opt(cost, order, max_passes=20):
+    '''
+    Improves an open tour with fixed start by reversing segments (2-opt)
+
+    Costs are asymmetric, so the reversed segment is evaluated with prefix sums
+    of the forward and backward edge costs along the tour. For every segment
+    start, all segment ends are evaluated at once.
+    '''
+    order = np.array(order)
+    n = len(order)
+    if n < 3:
+        return list(order)
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            forward = np.concatenate(([0.0], np.cumsum(cost[order[:-1], order[1:]])))
+            backward = np.concatenate(([0.0], np.cumsum(cost[order[1:], order[:-1]])))
+
+            j = np.arange(i + 1, n)
+            ''' Reverse order[i..j]: edges into and out of the segment change, inner edges change direction '''
+            new_in = cost[order[i - 1], order[j]]
+            old_in = cost[order[i - 1], order[i]]
+            has_out = j < n - 1
+            next_index = np.minimum(j + 1, n - 1)
+            new_out = np.where(has_out, cost[order[i], order[next_index]], 0.0)
+            old_out = np.where(has_out, cost[order[j], order[next_index]], 0.0)
+            inner_change = (backward[j] - backward[i]) - (forward[j] - forward[i])
+            delta = new_in + new_out - old_in - old_out + inner_change
+
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                order[i:j[best] + 1] = order[i:j[best] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return [int(unit) for unit in order]
+
+def optimize_acquisition_list(acq_list, cost_model, keep_interleaved_groups=False, max_passes=20):
+    '''
+    Reorders an acquisition list to minimize the predicted overhead between stacks
+
+    The first row stays first. View indices of the returned list are resolved in
+    the order of acq_list, so h5/zarr setups and filenames do not change.
+
+    Args:
+        acq_list (AcquisitionList): List to optimize, is not modified
+        cost_model (AcquisitionCostModel)
+        keep_interleaved_groups (bool): Keep rows which are acquired with interleaved
+                                        lasers together and in their order. Has to be
+                                        True if laser interleaving is enabled.
+
+    Returns:
+        tuple: (AcquisitionList, predicted time saved in s). If no better order
+               was found, acq_list itself and 0 are returned.
+    '''
+    if keep_interleaved_groups:
+        units = acq_list.get_interleaved_groups()
+    else:
+        units = [[acq] for acq in acq_list]
+
+    if len(units) < 3:
+        return acq_list, 0.0
+
+    cost = cost_model.get_cost_matrix(units)
+    table_order = list(range(len(units)))
+    table_time = get_path_cost(cost, table_order)
+
+    order = improve_order_2opt(cost, get_greedy_order(cost), max_passes)
+    optimized_time = get_path_cost(cost, order)
+
+    if optimized_time >= table_time - 1e-9:
+        logger.info(f'Acquisition optimizer: Table order is already optimal ({table_time:.1f} s overhead)')
+        return acq_list, 0.0
+
+    optimized_list = AcquisitionList([acq for unit in order for acq in units[unit]])
+    optimized_list.index_reference = acq_list.get_index_reference()
+    optimized_list.interleaved_group_sizes = [len(units[unit]) for unit in order]
+    logger.info(f'Acquisition optimizer: Predicted overhead {table_time:.1f} s -> {optimized_time:.1f} s')
+    return optimized_list, table_time - optimized_time
@@ -7,6 +7,9 @@ Helper classes for mesoSPIM acquisitions
 
 import indexed
 import os.path
+import numpy as np
+
+from .z_profiles import parse_z_profile
 
 class Acquisition(indexed.IndexedOrderedDict):
     '''
@@ -26,6 +29,7 @@ class Acquisition(indexed.IndexedOrderedDict):
         filter (str): Filter designation (has to be in the config)
         zoom (str): Zoom designation
         filename (str): Filename for the file to be saved
+        z_profile (str): Depth-dependent intensity & ETL parameters, see utils.z_profiles
 
     Attributes:
 
@@ -61,7 +65,8 @@ class Acquisition(indexed.IndexedOrderedDict):
                  etl_l_amplitude =0,
                  etl_r_offset = 0,
                  etl_r_amplitude = 0,
-                 processing = ''):
+                 processing = '',
+                 z_profile = ''):
 
         super().__init__()
 
@@ -86,10 +91,15 @@ class Acquisition(indexed.IndexedOrderedDict):
         self['etl_r_offset']=etl_r_offset
         self['etl_r_amplitude']=etl_r_amplitude
         self['processing']=processing
+        self['z_profile']=z_profile
+
 
+    ''' Incremented whenever a value of any acquisition changes, invalidates cached interleaved groups '''
+    modification_count = 0
 
     def __setitem__(self, key, value):
         super().__setitem__(key, value)
+        Acquisition.modification_count += 1
 
     def __call__(self, index):
         ''' This way the dictionary is callable with an index '''
@@ -109,6 +119,12 @@ class Acquisition(indexed.IndexedOrderedDict):
         '''
         return abs(int((self['z_end'] - self['z_start'])/self['z_step']))
 
+    def get_plane_depths(self):
+        '''
+        Returns the distance of every plane from the first plane in microns
+        '''
+        return abs(self['z_step']) * np.arange(self.get_image_count())
+
     def get_acquisition_time(self, framerate):
         '''
         Method to return the time the acquisition will take at a certain 
@@ -227,6 +243,21 @@ class AcquisitionList(list):
 
 
     '''
+
+    ''' Rows in the order in which view indices are assigned, None for the list order.
+    Set for reordered lists (see utils.acquisition_optimizer), so that their h5/zarr 
+    views keep the indices of the table order. Class attribute: pickled lists lack it. '''
+    index_reference = None
+
+    ''' (modification key, groups, groups by first row) of get_interleaved_groups(), None if
+    the list changed. Class attribute for the same reason as index_reference. '''
+    interleaved_groups_cache = None
+
+    ''' Explicit sizes of the interleaved groups in list order, None to group consecutive rows which
+    can be interleaved. Set for reordered lists, so that rows which became neighbours do not form
+    new groups (see utils.acquisition_optimizer). Dropped when the list changes. '''
+    interleaved_group_sizes = None
+
     def __init__(self, *args):
         list.__init__(self, *args)
 
@@ -253,6 +284,17 @@ class AcquisitionList(list):
         '''
         return self[0].get_keylist()
 
+    def add_missing_keys(self):
+        '''
+        Rows of tables saved with an older version lack the newer keys
+        (e.g. 'z_profile'), they get the default values of Acquisition
+        '''
+        defaults = Acquisition()
+        for acq in self:
+            for key, value in defaults.items():
+                if key not in acq:
+                    acq[key] = value
+
     def get_acquisition_time(self, framerate):
         '''
         Returns total time in seconds of a list of acquisitions
@@ -315,7 +357,8 @@ class AcquisitionList(list):
         filename_list = []
         for i in range(len(self)):
             filename = self[i]['folder']+'/'+self[i]['filename']
-            file_exists = os.path.isfile(filename)
+            ''' .zarr "files" are directories '''
+            file_exists = os.path.exists(filename)
             if file_exists:
                 filename_list.append(filename)
 
@@ -326,7 +369,8 @@ class AcquisitionList(list):
         filenames = []
         # Create a list of full file paths
         for i in range(len(self)):
-            if self[i]['filename'][-3:] != '.h5':
+            ''' All rows of an acquisition list can share a single .h5 or .zarr file '''
+            if not self[i]['filename'].endswith(('.h5', '.zarr')):
                 filename = self[i]['folder']+'/'+self[i]['filename']
                 filenames.append(filename)
         duplicates = self.get_duplicates_in_list(filenames)
@@ -343,6 +387,17 @@ class AcquisitionList(list):
         
         return nonexisting_folders
 
+    def check_for_invalid_z_profiles(self):
+        ''' Returns a list of rows with invalid z profiles and the reasons '''
+        invalid_profiles = []
+        for i in range(len(self)):
+            try:
+                parse_z_profile(self[i]['z_profile'])
+            except ValueError as error:
+                invalid_profiles.append(f'Row {i+1} ({self[i]["filename"]}): {error}')
+
+        return invalid_profiles
+
     def get_duplicates_in_list(self, in_list):
         duplicates = []
         unique = set(in_list)
@@ -370,24 +425,33 @@ class AcquisitionList(list):
         laser_set = set(laser_list)
         return len(laser_set)
 
+    def get_tile_key(self, acq):
+        """Tiles are unique (x,y,z_start,rot) combinations"""
+        return (acq['x_pos'], acq['y_pos'], acq['z_start'], acq['rot'])
+
+    def get_index_reference(self):
+        """Returns the rows in the order in which view indices are assigned"""
+        return self.index_reference if self.index_reference is not None else list(self)
+
+    def get_unique_value_indices(self, keyfunc):
+        """Returns a dict mapping every unique value (as returned by keyfunc for each 
+        acquisition) to the index of its first occurence in the list of unique values.
+        
+        Single pass over the list with a dict lookup per row, in the order of 
+        get_index_reference().
+        """
+        indices = {}
+        for a in self.get_index_reference():
+            indices.setdefault(keyfunc(a), len(indices))
+        return indices
+
     def get_n_tiles(self):
         """Get the number of tiles as unique (x,y,z_start,rot) combinations"""
-        tile_list = []
-        for a in self:
-            tile_str = f"{a['x_pos']}{a['y_pos']}{a['z_start']}{a['rot']}"
-            if not tile_str in tile_list:
-                tile_list.append(tile_str)
-        return len(tile_list)
+        return len(set(self.get_tile_key(a) for a in self))
 
     def get_tile_index(self, acq):
         """Get the the tile index for given acquisition"""
-        acq_str = f"{acq['x_pos']}{acq['y_pos']}{acq['z_start']}{acq['rot']}"
-        tile_list = []
-        for a in self:
-            tile_str = f"{a['x_pos']}{a['y_pos']}{a['z_start']}{a['rot']}"
-            if not tile_str in tile_list:
-                tile_list.append(tile_str)
-        return tile_list.index(acq_str)
+        return self.get_unique_value_indices(self.get_tile_key)[self.get_tile_key(acq)]
 
     def find_value_index(self, value='488 nm', keyword='laser'):
         """Find the index of occurence in the list of unique elements. Non-unique elements are removed from the list.
@@ -401,9 +465,105 @@ class AcquisitionList(list):
         al.find_value_index('561 nm', 'laser') # -> 1
         al.find_value_index('637 nm', 'laser') # -> 2
         """
-        unique_list = []
-        for a in self:
-            if a[keyword] not in unique_list:
-                unique_list.append(a[keyword])
-        assert value in unique_list, f"Value({value}) not found in list {unique_list}"
-        return unique_list.index(value)
+        unique_indices = self.get_unique_value_indices(lambda a: a[keyword])
+        assert value in unique_indices, f"Value({value}) not found in list {list(unique_indices)}"
+        return unique_indices[value]
+
+    def get_view_indices(self, acq):
+        """Get the BigDataViewer view (setup) indices of an acquisition.
+
+        Resolves illumination, channel, angle and tile index at once, meant to be 
+        called once per stack and not per plane.
+
+        Returns:
+            dict: {'illumination': int, 'channel': int, 'angle': int, 'tile': int}
+        """
+        return {'illumination' : self.find_value_index(acq['shutterconfig'], 'shutterconfig'),
+                'channel' : self.find_value_index(acq['laser'], 'laser'),
+                'angle' : self.find_value_index(acq['rot'], 'rot'),
+                'tile' : self.get_tile_index(acq)}
+
+    ''' Keys which may differ between the channels of an interleaved acquisition '''
+    interleaved_channel_keys = ('laser', 'intensity', 'etl_l_offset', 'etl_l_amplitude',
+                                'etl_r_offset', 'etl_r_amplitude', 'filename', 'processing', 'z_profile')
+
+    def can_interleave(self, acq, other):
+        """Returns True if two acquisitions can be acquired as channels of a single z-pass,
+        i.e. they only differ in laser, intensity, ETL parameters, filename, processing and z profile.
+
+        The lasers have to differ, files have to be of the same type and .h5/.zarr
+        channels have to go into the same file.
+        """
+        for key in acq.get_keylist():
+            if key not in self.interleaved_channel_keys and acq[key] != other[key]:
+                return False
+        if acq['laser'] == other['laser']:
+            return False
+        extension = os.path.splitext(acq['filename'])[1]
+        if extension != os.path.splitext(other['filename'])[1]:
+            return False
+        if extension in ('.h5', '.zarr') and acq['filename'] != other['filename']:
+            return False
+        return True
+
+    def invalidate_cache(self):
+        """Called by all methods which change the list, changed rows are detected via Acquisition.modification_count"""
+        self.interleaved_groups_cache = None
+        self.interleaved_group_sizes = None
+
+    def get_cached_interleaved_groups(self):
+        """Computes the interleaved groups once per list and row content, returns (groups, groups by first row)"""
+        cache = self.interleaved_groups_cache
+        if cache is not None and cache[0] == Acquisition.modification_count:
+            return cache[1], cache[2]
+
+        key = Acquisition.modification_count
+        groups = []
+        if self.interleaved_group_sizes is not None:
+            start = 0
+            for size in self.interleaved_group_sizes:
+                groups.append(list(self[start:start + size]))
+                start += size
+        else:
+            for acq in self:
+                if groups and all(self.can_interleave(channel, acq) for channel in groups[-1]):
+                    groups[-1].append(acq)
+                else:
+                    groups.append([acq])
+        groups_by_first_row = {id(group[0]) : group for group in groups}
+        self.interleaved_groups_cache = (key, groups, groups_by_first_row)
+        return groups, groups_by_first_row
+
+    def get_interleaved_groups(self):
+        """Groups consecutive rows which can be acquired with interleaved lasers.
+
+        The groups are cached until the list or one of its rows changes. Lists with
+        interleaved_group_sizes use these groups instead.
+
+        Returns:
+            list: Lists of acquisitions, every row is in exactly one group
+        """
+        groups, _ = self.get_cached_interleaved_groups()
+        return [list(group) for group in groups]
+
+    def get_interleaved_group(self, acq):
+        """Returns the interleaved group starting with acq, [acq] if it does not start a group"""
+        _, groups_by_first_row = self.get_cached_interleaved_groups()
+        group = groups_by_first_row.get(id(acq))
+        if group is None or group[0] is not acq:
+            return [acq]
+        return list(group)
+
+def _invalidating(name):
+    ''' Wraps a list method which changes the list, so that cached results of the AcquisitionList are invalidated '''
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        self.invalidate_cache()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(AcquisitionList, _name, _invalidating(_name))
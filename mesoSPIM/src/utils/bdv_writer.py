@@ -0,0 +1,215 @@
+'''
+Block-buffered BigDataViewer HDF5 writer for mesoSPIM stacks
+
+The file follows the BigDataViewer HDF5 layout:
+
+    s{setup}/resolutions        (levels, 3) float64 subsampling factors in (x,y,z) order
+    s{setup}/subdivisions       (levels, 3) int32 chunk shapes in (x,y,z) order
+    t{time}/s{setup}/{level}/cells   (z,y,x) int16 data of a resolution level
+
+and is described by an XML file (SpimData) next to it. Setup ids are assigned in
+(illumination, channel, tile, angle) order, like npy2bdv does, so the files can be
+opened in BigDataViewer and BigStitcher like before.
+'''
+
+import os
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import h5py
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .block_writer import ZBlockWriter
+
+class BdvBlockWriter(ZBlockWriter):
+    '''
+    Writes the views of an acquisition list into a BigDataViewer HDF5 file
+
+    Planes are collected into blocks as deep as the HDF5 chunks and written (and
+    compressed) block by block in a background thread, instead of touching every
+    chunk once per plane. As h5py does not allow parallel writes, a single writer
+    thread is used.
+
+    The resolution levels are computed while the stack is written (see PyramidBuilder),
+    which also allows subsampling in z, e.g. subsamp=((1, 1, 1), (2, 2, 2), (4, 4, 4)).
+
+    Args:
+        filename (str): Path of the .h5 file, the XML file gets the same name
+        blockdim (tuple): HDF5 chunk shapes in (z,y,x) order per resolution level, e.g. ((16, 256, 256),)
+        subsamp (tuple): Subsampling factors in (z,y,x) order per resolution level
+        compression: None, 'gzip' or 'lzf'
+        nilluminations, nchannels, nangles, ntiles (int): Number of view attributes
+        min_stack_shape (tuple): Smallest (z,y,x) stack shape of all views, chunks are clipped to it
+    '''
+    group_format = 't{:05d}/s{:02d}/{}'
+
+    def __init__(self, filename, blockdim=((16, 256, 256),), subsamp=((1, 1, 1),), compression=None,
+                 nilluminations=1, nchannels=1, nangles=1, ntiles=1, min_stack_shape=None):
+        super().__init__(n_threads=1)
+
+        self.filename = filename
+        self.subsamp = np.asarray(subsamp, dtype=int)
+        self.compression = compression
+        self.attribute_counts = (nilluminations, nchannels, ntiles, nangles)
+        self.nsetups = int(np.prod(self.attribute_counts))
+
+        if min_stack_shape is not None:
+            self.chunks = self.fit_blockdim(blockdim, subsamp, min_stack_shape)
+        else:
+            self.chunks = tuple(tuple(int(c) for c in (blockdim[ilevel] if ilevel < len(blockdim) else blockdim[0]))
+                                for ilevel in range(len(subsamp)))
+        self.block_depth = self.chunks[0][0]
+
+        ''' XML information of the appended views by setup id '''
+        self.views = {}
+
+        if os.path.exists(filename):
+            logger.warning(f'BDV writer: {filename} already exists and is overwritten')
+        self.file = h5py.File(filename, 'w')
+        self.write_setups_header()
+
+    @staticmethod
+    def fit_blockdim(blockdim, subsamp, stack_shape):
+        '''
+        Returns chunk shapes for every resolution level which do not exceed the
+        (subsampled) stack shape, as HDF5 does not allow chunks larger than a dataset.
+        Levels without own blockdim entry use the first one (like npy2bdv).
+        '''
+        fitted = []
+        for ilevel, level_subsamp in enumerate(subsamp):
+            level_blockdim = blockdim[ilevel] if ilevel < len(blockdim) else blockdim[0]
+            fitted.append(tuple(max(1, min(int(c), int(s) // int(f)))
+                                for c, s, f in zip(level_blockdim, stack_shape, level_subsamp)))
+        return tuple(fitted)
+
+    def get_setup_id(self, illumination=0, channel=0, tile=0, angle=0):
+        return int(np.ravel_multi_index((illumination, channel, tile, angle), self.attribute_counts))
+
+    def write_setups_header(self):
+        ''' Resolutions and subdivisions of all setups, in (x,y,z) order '''
+        for isetup in range(self.nsetups):
+            group = self.file.create_group('s{:02d}'.format(isetup))
+            group.create_dataset('resolutions', data=np.flip(self.subsamp, 1), dtype='<f8')
+            group.create_dataset('subdivisions', data=np.flip(np.asarray(self.chunks), 1), dtype='<i4')
+
+    def append_view(self, virtual_stack_dim, illumination=0, channel=0, angle=0, tile=0, keep_open=False,
+                    m_affine=None, name_affine='manually defined', voxel_size_xyz=(1, 1, 1), voxel_units='px',
+                    calibration=(1, 1, 1), exposure_time=0, exposure_units='s'):
+        '''
+        Creates the datasets of all resolution levels for a new view
+
+        With keep_open=True, previously appended views stay open for writing (interleaved channels).
+
+        Args:
+            virtual_stack_dim (tuple): (z,y,x) shape of the stack
+            m_affine (np.ndarray): (3,4) affine transformation of the view, None for none
+            voxel_size_xyz (tuple): Voxel size in voxel_units
+            calibration (tuple): (x,y,z) voxel calibration of BigDataViewer
+
+        Returns:
+            int: View index for append_plane()
+        '''
+        if not keep_open:
+            self.finish_view()
+
+        isetup = self.get_setup_id(illumination, channel, tile, angle)
+        stack_shape = np.asarray(virtual_stack_dim, dtype=int)
+        datasets = []
+        for ilevel in range(len(self.subsamp)):
+            group = self.file.require_group(self.group_format.format(0, isetup, ilevel))
+            if 'cells' in group:
+                del group['cells']
+            shape = tuple(int(s) for s in np.maximum(stack_shape // self.subsamp[ilevel], 1))
+            chunks = tuple(min(c, s) for c, s in zip(self.chunks[ilevel], shape))
+            datasets.append(group.create_dataset('cells', shape=shape, chunks=chunks,
+                                                 compression=self.compression, dtype='int16'))
+
+        self.views[isetup] = {'attributes' : (illumination, channel, tile, angle),
+                              'shape' : tuple(int(s) for s in stack_shape),
+                              'm_affine' : None if m_affine is None else np.array(m_affine, dtype=np.float64),
+                              'name_affine' : name_affine,
+                              'voxel_size_xyz' : tuple(voxel_size_xyz),
+                              'voxel_units' : voxel_units,
+                              'calibration' : tuple(calibration),
+                              'exposure_time' : exposure_time,
+                              'exposure_units' : exposure_units}
+
+        return self.allocate_blocks((min(self.block_depth, int(stack_shape[0])),) + tuple(int(s) for s in stack_shape[1:]),
+                                    int(stack_shape[0]), subsamp=self.subsamp, targets=datasets, keep_open=keep_open)
+
+    def write_block(self, datasets, block, z_start, z_end):
+        ''' BigDataViewer convention: uint16 data in an int16 dataset '''
+        datasets[0][z_start:z_end, :, :] = block[:z_end - z_start].astype('int16')
+
+    def write_level_block(self, datasets, level, data, z_start):
+        datasets[level][z_start:z_start + data.shape[0], :, :] = data.astype('int16')
+
+    def write_xml_file(self):
+        ''' Writes the SpimData XML file describing all appended views (a single time point) '''
+        self.finish_view()
+
+        root = ET.Element('SpimData', version='0.2')
+        ET.SubElement(root, 'BasePath', type='relative').text = '.'
+
+        sequence = ET.SubElement(root, 'SequenceDescription')
+        loader = ET.SubElement(sequence, 'ImageLoader', format='bdv.hdf5')
+        ET.SubElement(loader, 'hdf5', type='relative').text = os.path.basename(self.filename)
+
+        setups = ET.SubElement(sequence, 'ViewSetups')
+        for isetup in sorted(self.views):
+            view = self.views[isetup]
+            setup = ET.SubElement(setups, 'ViewSetup')
+            ET.SubElement(setup, 'id').text = str(isetup)
+            ET.SubElement(setup, 'name').text = 'setup ' + str(isetup)
+            nz, ny, nx = view['shape']
+            ET.SubElement(setup, 'size').text = f'{nx} {ny} {nz}'
+            voxel_size = ET.SubElement(setup, 'voxelSize')
+            ET.SubElement(voxel_size, 'unit').text = view['voxel_units']
+            ET.SubElement(voxel_size, 'size').text = ' '.join(str(v) for v in view['voxel_size_xyz'])
+            camera = ET.SubElement(setup, 'camera')
+            ET.SubElement(camera, 'exposureTime').text = str(view['exposure_time'])
+            ET.SubElement(camera, 'exposureUnits').text = view['exposure_units']
+            attributes = ET.SubElement(setup, 'attributes')
+            for name, value in zip(('illumination', 'channel', 'tile', 'angle'), view['attributes']):
+                ET.SubElement(attributes, name).text = str(value)
+
+        for name, count in zip(('illumination', 'channel', 'tile', 'angle'), self.attribute_counts):
+            attribute = ET.SubElement(setups, 'Attributes', name=name)
+            for index in range(count):
+                entry = ET.SubElement(attribute, name.capitalize())
+                ET.SubElement(entry, 'id').text = str(index)
+                ET.SubElement(entry, 'name').text = f'{name} {index}'
+
+        timepoints = ET.SubElement(sequence, 'Timepoints', type='range')
+        ET.SubElement(timepoints, 'first').text = '0'
+        ET.SubElement(timepoints, 'last').text = '0'
+
+        missing = [isetup for isetup in range(self.nsetups) if isetup not in self.views]
+        if missing != []:
+            missing_views = ET.SubElement(sequence, 'MissingViews')
+            for isetup in missing:
+                ET.SubElement(missing_views, 'MissingView', timepoint='0', setup=str(isetup))
+
+        registrations = ET.SubElement(root, 'ViewRegistrations')
+        for isetup in sorted(self.views):
+            view = self.views[isetup]
+            registration = ET.SubElement(registrations, 'ViewRegistration', timepoint='0', setup=str(isetup))
+            if view['m_affine'] is not None:
+                transform = ET.SubElement(registration, 'ViewTransform', type='affine')
+                ET.SubElement(transform, 'Name').text = view['name_affine']
+                ET.SubElement(transform, 'affine').text = ' '.join(f'{v:.6f}' for v in view['m_affine'].flatten())
+            transform = ET.SubElement(registration, 'ViewTransform', type='affine')
+            ET.SubElement(transform, 'Name').text = 'calibration'
+            calx, caly, calz = view['calibration']
+            ET.SubElement(transform, 'affine').text = f'{calx} 0.0 0.0 0.0 0.0 {caly} 0.0 0.0 0.0 0.0 {calz} 0.0'
+
+        tree = ET.ElementTree(root)
+        if hasattr(ET, 'indent'):
+            ET.indent(tree)
+        tree.write(os.path.splitext(self.filename)[0] + '.xml', xml_declaration=True, encoding='utf-8', method='xml')
+
+    def close(self):
+        super().close()
+        self.file.close()
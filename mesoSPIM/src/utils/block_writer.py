@@ -0,0 +1,186 @@
+'''
+Base class for writers which store stacks in z-blocks (chunks) instead of single planes
+'''
+
+import abc
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .pyramid import PyramidBuilder
+
+class ZBlockView(object):
+    '''
+    Blocks of a stack which is being written
+
+    Args:
+        blocks (list): Two (z,y,x) arrays which are filled alternately
+        stack_depth (int): Number of planes in the stack
+        pyramid (PyramidBuilder): Builder for the downsampled levels, None for no pyramid
+        targets: Where the blocks are written to, defined by the subclass (e.g. datasets).
+                 They are handed to write_block() together with each block, so that views
+                 can be switched while blocks are still being written.
+    '''
+    def __init__(self, blocks, stack_depth, pyramid=None, targets=None):
+        self.blocks = blocks
+        self.block_futures = [[], []]
+        self.current_block = 0
+        self.block_z_start = None
+        self.block_filled = np.zeros(blocks[0].shape[0], dtype=bool)
+        self.stack_depth = stack_depth
+        self.pyramid = pyramid
+        self.targets = targets
+
+class ZBlockWriter(abc.ABC):
+    '''
+    Collects planes of a stack into z-blocks and writes complete blocks asynchronously
+
+    Incoming planes are copied into a block as deep as a chunk. Once a block is
+    complete, it is handed to a thread pool via submit_block(). Two blocks are
+    used alternately, so the next block is filled while the previous one is still
+    being compressed and written.
+
+    Optionally, downsampled resolution levels are computed from every block as it
+    is flushed (see PyramidBuilder) and written with write_level_block().
+
+    Several views can be open at the same time (e.g. the channels of an interleaved
+    acquisition), every view has its own blocks. Planes go to the view selected by
+    their index.
+
+    Subclasses implement write_block() and write_level_block() and call allocate_blocks() for every new stack.
+
+    Args:
+        n_threads (int): Number of threads writing blocks
+    '''
+    def __init__(self, n_threads=1):
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+
+        self.open_views = []
+        self.view = None
+        self.spare_blocks = []
+
+    def allocate_blocks(self, block_shape, stack_depth, subsamp=None, targets=None, keep_open=False):
+        '''
+        Prepares the blocks for a new stack, blocks of finished views are reused if their shape matches
+
+        Args:
+            block_shape (tuple): (z,y,x) shape of a block, z is the chunk depth
+            stack_depth (int): Number of planes in the stack
+            subsamp (tuple): Absolute (z,y,x) subsampling factors per resolution level, starting
+                             with level 0. None or a single level: No pyramid is generated.
+            targets: Passed on to write_block() and write_level_block() for the blocks of this view
+            keep_open (bool): If True, previously allocated views stay open
+
+        Returns:
+            int: Index of the new view, for append_plane()
+        '''
+        if not keep_open:
+            self.finish_view()
+
+        block_shape = tuple(block_shape)
+        blocks = None
+        for i, spare in enumerate(self.spare_blocks):
+            if spare[0].shape == block_shape:
+                blocks = self.spare_blocks.pop(i)
+                break
+        if blocks is None:
+            blocks = [np.zeros(block_shape, dtype=np.uint16), np.zeros(block_shape, dtype=np.uint16)]
+
+        if subsamp is not None and len(subsamp) > 1:
+            pyramid = PyramidBuilder(subsamp, (stack_depth,) + block_shape[1:])
+        else:
+            pyramid = None
+
+        self.view = ZBlockView(blocks, stack_depth, pyramid, targets)
+        self.open_views.append(self.view)
+        return len(self.open_views) - 1
+
+    def append_plane(self, plane, plane_index, view_index=None):
+        '''
+        Adds a plane to a stack (by default the last allocated one). Planes have to arrive
+        in ascending order, missing planes are stored as zeros.
+        '''
+        view = self.view if view_index is None else self.open_views[view_index]
+        depth = view.blocks[0].shape[0]
+        z_start = (plane_index // depth) * depth
+
+        if view.block_z_start != z_start:
+            if view.block_z_start is not None:
+                self._flush_block(view)
+                view.current_block = 1 - view.current_block
+            ''' Wait until the block has been written before it is refilled '''
+            self._wait_for_block(view, view.current_block)
+            view.block_z_start = z_start
+            view.block_filled[:] = False
+
+        np.copyto(view.blocks[view.current_block][plane_index - z_start], plane)
+        view.block_filled[plane_index - z_start] = True
+
+    def _flush_block(self, view):
+        block = view.blocks[view.current_block]
+        z_start = view.block_z_start
+        z_end = min(z_start + block.shape[0], view.stack_depth)
+
+        ''' Missing (dropped) planes would otherwise contain data of an older block '''
+        for i in np.flatnonzero(~view.block_filled[:z_end - z_start]):
+            block[i] = 0
+
+        futures = self.submit_block(view.targets, block, z_start, z_end)
+
+        ''' The pyramid has to see the blocks in order, so it is updated here and not in the pool '''
+        if view.pyramid is not None:
+            for level, level_z_start, data in view.pyramid.add_planes(block[:z_end - z_start]):
+                futures.append(self.executor.submit(self.write_level_block, view.targets, level, data, level_z_start))
+
+        view.block_futures[view.current_block] = futures
+
+    def submit_block(self, targets, block, z_start, z_end):
+        '''
+        Hands a complete block to the thread pool, can be reimplemented to split the block
+
+        Returns:
+            list: Futures of the submitted tasks
+        '''
+        return [self.executor.submit(self.write_block, targets, block, z_start, z_end)]
+
+    @abc.abstractmethod
+    def write_block(self, targets, block, z_start, z_end):
+        '''
+        Writes planes z_start to z_end of the stack, stored in block[:z_end-z_start].
+        Runs in a thread pool thread.
+        '''
+
+    @abc.abstractmethod
+    def write_level_block(self, targets, level, data, z_start):
+        '''
+        Writes planes of a downsampled resolution level (level >= 1), starting at z_start.
+        Runs in a thread pool thread.
+        '''
+
+    def _wait_for_block(self, view, block_index):
+        for future in view.block_futures[block_index]:
+            try:
+                future.result()
+            except Exception as error:
+                logger.error(f'{self.__class__.__name__}: Writing a block failed: {error}')
+        view.block_futures[block_index] = []
+
+    def finish_view(self):
+        ''' Writes the remaining planes of all open stacks and waits until all blocks are on disk '''
+        for view in self.open_views:
+            if view.block_z_start is not None:
+                self._flush_block(view)
+                view.block_z_start = None
+            self._wait_for_block(view, 0)
+            self._wait_for_block(view, 1)
+        self.spare_blocks = [view.blocks for view in self.open_views] or self.spare_blocks
+        self.open_views = []
+        self.view = None
+
+    def close(self):
+        self.finish_view()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,127 @@
+'''
+Table-driven dispatch of state requests
+
+State requests are dicts such as {'intensity' : 20, 'zoom' : '2x'}. Every subsystem
+(Core, camera, waveform generator) registers its handlers per key in a
+CommandRegistry, a request is then routed with one dict lookup per key instead of
+scanning key tuples and compiling code strings.
+
+Two kinds of handlers exist:
+
+- Key handlers are called with the value of their key: handler(value)
+- Group handlers are registered for several keys and called once per request with
+  all of their keys in it: handler({key : value, ...}). This allows e.g. to
+  regenerate the waveforms only once for a request changing several parameters.
+
+Every call is counted and timed per key, see get_statistics().
+'''
+
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+class CommandRegistry(object):
+    '''
+    Maps state request keys to handlers
+
+    Keys without a handler are ignored, as requests are broadcast to all subsystems.
+
+    Args:
+        name (str): Name of the subsystem, used for logging
+    '''
+    def __init__(self, name):
+        self.name = name
+        ''' {key : (handler, value_type, is_group)} '''
+        self.handlers = {}
+        ''' {key : [calls, total time in s, max time in s]} '''
+        self.statistics = {}
+
+    def register(self, key, handler, value_type=None):
+        '''
+        Registers a handler called with the value of key
+
+        Args:
+            key (str): State request key
+            handler (callable): Function taking the value
+            value_type (type): If given, values are converted to it before the call, e.g. float
+
+        Raises:
+            ValueError: If the key already has a handler
+        '''
+        self._add(key, (handler, value_type, False))
+
+    def register_group(self, keys, handler):
+        '''
+        Registers a handler called once per request with a dict of all its keys in the request
+        '''
+        for key in keys:
+            self._add(key, (handler, None, True))
+
+    def _add(self, key, entry):
+        if key in self.handlers:
+            raise ValueError(f'{self.name}: State request key "{key}" has already a handler')
+        self.handlers[key] = entry
+        self.statistics[key] = [0, 0.0, 0.0]
+
+    def handles(self, key):
+        return key in self.handlers
+
+    def dispatch(self, request):
+        '''
+        Routes a state request to the registered handlers
+
+        Handlers are called in the order of the keys in the request, group handlers
+        at the position of their first key.
+
+        Args:
+            request (dict): {key : value}
+        '''
+        groups = {}
+        calls = []
+        for key, value in request.items():
+            entry = self.handlers.get(key)
+            if entry is None:
+                continue
+            handler, value_type, is_group = entry
+            if is_group:
+                if handler not in groups:
+                    groups[handler] = {}
+                    calls.append((handler, groups[handler], tuple()))
+                groups[handler][key] = value
+            else:
+                if value_type is not None:
+                    value = value_type(value)
+                calls.append((handler, value, (key,)))
+
+        for handler, argument, keys in calls:
+            start_time = time.perf_counter()
+            handler(argument)
+            self._record(keys or tuple(argument.keys()), time.perf_counter() - start_time)
+
+    def _record(self, keys, duration):
+        ''' The duration of a group call is accounted to each of its keys '''
+        for key in keys:
+            statistics = self.statistics[key]
+            statistics[0] += 1
+            statistics[1] += duration
+            statistics[2] = max(statistics[2], duration)
+
+    def get_statistics(self):
+        '''
+        Returns:
+            dict: {key : {'calls', 'mean_latency', 'max_latency'}} of all keys called at least once
+        '''
+        return {key : {'calls' : calls,
+                       'mean_latency' : total / calls,
+                       'max_latency' : maximum}
+                for key, (calls, total, maximum) in self.statistics.items() if calls > 0}
+
+    def log_statistics(self):
+        for key, statistics in sorted(self.get_statistics().items(), key=lambda item: -item[1]['calls']):
+            logger.info(f'{self.name}: State request "{key}": {statistics["calls"]} calls, '
+                        f'mean {1000*statistics["mean_latency"]:.3f} ms, max {1000*statistics["max_latency"]:.3f} ms')
+
+    def reset_statistics(self):
+        for key in self.statistics:
+            self.statistics[key] = [0, 0.0, 0.0]
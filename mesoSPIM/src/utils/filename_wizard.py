@@ -20,8 +20,8 @@ class FilenameWizard(QtWidgets.QWizard):
     '''
     wizard_done = QtCore.pyqtSignal()
 
-    num_of_pages = 4
-    (welcome, raw, single_hdf5, finished) = range(num_of_pages)
+    num_of_pages = 5
+    (welcome, raw, single_hdf5, finished, single_zarr) = range(num_of_pages)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -37,6 +37,7 @@ class FilenameWizard(QtWidgets.QWizard):
         self.setPage(1, FilenameWizardRawSelectionPage(self))
         self.setPage(2, FilenameWizardSingleHDF5SelectionPage(self))
         self.setPage(3, FilenameWizardCheckResultsPage(self))
+        self.setPage(4, FilenameWizardSingleZarrSelectionPage(self))
         
         self.show()
 
@@ -90,6 +91,11 @@ class FilenameWizard(QtWidgets.QWizard):
                 filename += self.replace_spaces_with_underscores(descriptionstring)
                 filename += '_'
 
+            if self.field('DescriptionZarr'):
+                descriptionstring = self.field('DescriptionZarr')
+                filename += self.replace_spaces_with_underscores(descriptionstring)
+                filename += '_'
+
             if self.field('xyPosition'):
                 '''Round to nearest integer '''
                 x_position_string = str(int(round(self.parent.model.getXPosition(row))))
@@ -150,10 +156,11 @@ class FilenameWizardWelcomePage(QtWidgets.QWizardPage):
 
         self.raw_string = 'Individual Raw Files: ~.raw'
         self.single_hdf5_string = 'Single HDF5-File: ~.h5'
+        self.single_zarr_string = 'Single OME-Zarr-File: ~.zarr'
 
         self.SaveAsComboBoxLabel = QtWidgets.QLabel('Save as:')
         self.SaveAsComboBox = QtWidgets.QComboBox()
-        self.SaveAsComboBox.addItems([self.raw_string, self.single_hdf5_string])
+        self.SaveAsComboBox.addItems([self.raw_string, self.single_hdf5_string, self.single_zarr_string])
         self.SaveAsComboBox.setCurrentIndex(0)
 
         self.registerField('SaveAs', self.SaveAsComboBox, 'currentIndex')
@@ -168,6 +175,8 @@ class FilenameWizardWelcomePage(QtWidgets.QWizardPage):
             return self.parent.raw 
         elif self.SaveAsComboBox.currentText() == self.single_hdf5_string: # is .h5 
             return self.parent.single_hdf5
+        elif self.SaveAsComboBox.currentText() == self.single_zarr_string: # is .zarr
+            return self.parent.single_zarr
 
 class FilenameWizardRawSelectionPage(QtWidgets.QWizardPage):
     def __init__(self, parent=None):
@@ -242,6 +251,32 @@ class FilenameWizardSingleHDF5SelectionPage(QtWidgets.QWizardPage):
     def nextId(self):
         return self.parent.finished
 
+class FilenameWizardSingleZarrSelectionPage(QtWidgets.QWizardPage):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+
+        self.setTitle("Autogenerate OME-Zarr filename")
+        self.setSubTitle("This replaces all filenames with a single zarr file. \n Which properties would you like to use?")
+
+        self.DescriptionCheckBox = QtWidgets.QCheckBox('Description: ',self)
+        self.DescriptionLineEdit = QtWidgets.QLineEdit(self) 
+        self.DescriptionCheckBox.toggled.connect(lambda boolean: self.DescriptionLineEdit.setEnabled(boolean))
+
+        self.layout = QtWidgets.QGridLayout()
+        self.layout.addWidget(self.DescriptionCheckBox, 0, 0)
+        self.layout.addWidget(self.DescriptionLineEdit, 0, 1)
+        self.setLayout(self.layout)
+
+        self.registerField('DescriptionZarr', self.DescriptionLineEdit)
+
+    def validatePage(self):
+        self.parent.generate_filename_list('zarr', increment_number=False)
+        return super().validatePage()
+
+    def nextId(self):
+        return self.parent.finished
+
 class FilenameWizardCheckResultsPage(QtWidgets.QWizardPage):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -0,0 +1,194 @@
+'''
+Frame ring buffer for handing camera frames from the camera thread to the image writer thread
+
+The buffer is preallocated once with a fixed number of slots, so that no memory allocation
+takes place while an acquisition is running. There is exactly one producer (the camera thread)
+and one consumer (the writer thread).
+'''
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+from PyQt5 import QtCore
+
+class FrameRingBuffer(object):
+    '''
+    Fixed-size, preallocated ring buffer of frames with backpressure.
+
+    If all slots are full, put() blocks the producer until the consumer frees
+    a slot or the timeout expires. In the latter case, the frame is dropped
+    and counted.
+
+    With copy=False, put() only stores a reference to the frame instead of copying
+    it into the slot. This is meant for frames living in camera-owned memory which
+    is not overwritten while the producer keeps up. The copy then happens in the
+    consumer: get() copies a referenced frame into its slot, so the frame being
+    read never lives in camera memory. Once put() has to wait for a free slot,
+    the camera keeps acquiring without the producer: all referenced frames still
+    queued are copied into their slots before waiting, and the frame being put
+    is copied as well.
+
+    Args:
+        n_slots (int): Number of frames the buffer can hold
+        frame_shape (tuple): Shape of a single frame
+        dtype: Data type of the frames
+    '''
+    def __init__(self, n_slots, frame_shape, dtype=np.uint16):
+        self.n_slots = int(n_slots)
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+
+        self.frames = np.zeros((self.n_slots,) + self.frame_shape, dtype=self.dtype)
+        self.metadata = [None] * self.n_slots
+        self.references = [None] * self.n_slots
+
+        self.mutex = QtCore.QMutex()
+        self.not_empty = QtCore.QWaitCondition()
+        self.not_full = QtCore.QWaitCondition()
+
+        self.reset()
+
+    def reset(self):
+        ''' Empties the buffer and resets all counters, only call this while no consumer is running '''
+        self.mutex.lock()
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+        self.closed = False
+        self.frames_put = 0
+        self.frames_referenced = 0
+        self.frames_dropped = 0
+        self.frames_waited = 0
+        self.high_water_mark = 0
+        self.mutex.unlock()
+
+    def matches(self, frame_shape, dtype=np.uint16):
+        return self.frame_shape == tuple(frame_shape) and self.dtype == np.dtype(dtype)
+
+    def put(self, frame, metadata=None, timeout_ms=1000, copy=True):
+        '''
+        Copies a frame into the next free slot.
+
+        Args:
+            frame (np.ndarray): Frame with the shape the buffer was allocated for
+            metadata: Arbitrary object handed to the consumer together with the frame
+            timeout_ms (int): Maximum time to wait for a free slot, -1 waits forever
+            copy (bool): If False, only a reference to the frame is stored
+
+        Returns:
+            bool: True if the frame was queued, False if it was dropped
+        '''
+        if frame.shape != self.frame_shape:
+            logger.error(f'Frame buffer: Frame shape {frame.shape} does not match buffer shape {self.frame_shape}, dropping frame')
+            self.mutex.lock()
+            self.frames_dropped += 1
+            self.mutex.unlock()
+            return False
+
+        self.mutex.lock()
+        if self.count == self.n_slots and not self.closed:
+            self.frames_waited += 1
+            self._copy_references()
+            copy = True
+        deadline = QtCore.QDeadlineTimer(timeout_ms) if timeout_ms >= 0 else QtCore.QDeadlineTimer(QtCore.QDeadlineTimer.Forever)
+        while self.count == self.n_slots and not self.closed:
+            if not self.not_full.wait(self.mutex, deadline):
+                break
+
+        if self.count == self.n_slots or self.closed:
+            self.frames_dropped += 1
+            self.mutex.unlock()
+            return False
+
+        index = self.head
+        self.mutex.unlock()
+
+        ''' Only the producer writes to the slot at head, so the copy can happen without holding the lock '''
+        if copy:
+            np.copyto(self.frames[index], frame, casting='unsafe')
+        else:
+            self.references[index] = frame
+        self.metadata[index] = metadata
+
+        self.mutex.lock()
+        self.head = (self.head + 1) % self.n_slots
+        self.count += 1
+        self.frames_put += 1
+        if not copy:
+            self.frames_referenced += 1
+        self.high_water_mark = max(self.high_water_mark, self.count)
+        self.not_empty.wakeOne()
+        self.mutex.unlock()
+        return True
+
+    def get(self):
+        '''
+        Blocks until a frame is available.
+
+        Returns:
+            tuple: (frame, metadata) with frame being a view into the buffer which
+            stays valid until release() is called. None if the buffer was closed
+            and all frames have been consumed.
+
+        A referenced frame is copied into its slot first. The reference is taken
+        out of the slot with the lock held, so the producer does not copy it as well.
+        '''
+        self.mutex.lock()
+        while self.count == 0 and not self.closed:
+            self.not_empty.wait(self.mutex)
+
+        if self.count == 0:
+            self.mutex.unlock()
+            return None
+
+        index = self.tail
+        reference = self.references[index]
+        self.references[index] = None
+        metadata = self.metadata[index]
+        self.mutex.unlock()
+
+        ''' Only the consumer writes to the slot at tail while it is queued '''
+        if reference is not None:
+            np.copyto(self.frames[index], reference, casting='unsafe')
+        return self.frames[index], metadata
+
+    def release(self):
+        ''' Frees the slot of the frame returned by the last get() '''
+        self.mutex.lock()
+        self.metadata[self.tail] = None
+        self.tail = (self.tail + 1) % self.n_slots
+        self.count -= 1
+        self.not_full.wakeOne()
+        self.mutex.unlock()
+
+    def _copy_references(self):
+        ''' Copies queued referenced frames into their slots. Called with the mutex locked '''
+        for i in range(self.count):
+            index = (self.tail + i) % self.n_slots
+            if self.references[index] is None:
+                continue
+            np.copyto(self.frames[index], self.references[index], casting='unsafe')
+            self.references[index] = None
+            self.frames_referenced -= 1
+
+    def close(self):
+        ''' No more frames will be put, the consumer drains the remaining frames and stops '''
+        self.mutex.lock()
+        self.closed = True
+        self.not_empty.wakeAll()
+        self.not_full.wakeAll()
+        self.mutex.unlock()
+
+    def get_statistics(self):
+        self.mutex.lock()
+        stats = {'n_slots' : self.n_slots,
+                 'frames_put' : self.frames_put,
+                 'frames_referenced' : self.frames_referenced,
+                 'frames_dropped' : self.frames_dropped,
+                 'frames_waited' : self.frames_waited,
+                 'high_water_mark' : self.high_water_mark,
+                 'fill_level' : self.count}
+        self.mutex.unlock()
+        return stats
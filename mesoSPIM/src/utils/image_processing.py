@@ -0,0 +1,49 @@
+'''
+Image processing helper functions
+'''
+
+import numpy as np
+
+def bin_stack(stack, factors):
+    '''
+    Downsamples an n-dimensional array by averaging non-overlapping blocks
+
+    Elements at the end of an axis which do not fill a complete block are discarded,
+    so the result has the shape stack.shape // factors. Integer arrays are summed in
+    a wider integer type to avoid overflows and floating point conversion.
+
+    Args:
+        stack (np.ndarray): Array to downsample, e.g. a 2D image or a (z,y,x) stack
+        factors (tuple): Binning factor per axis, 1 leaves an axis unchanged
+
+    Returns:
+        np.ndarray: Binned array with the same dtype as the input
+    '''
+    factors = tuple(int(f) for f in factors)
+    if all(f == 1 for f in factors):
+        return stack
+
+    out_shape = tuple(s // f for s, f in zip(stack.shape, factors))
+    cropped = stack[tuple(slice(0, n * f) for n, f in zip(out_shape, factors))]
+    blocks = cropped.reshape([dim for n, f in zip(out_shape, factors) for dim in (n, f)])
+    block_axes = tuple(range(1, 2 * len(factors), 2))
+
+    if np.issubdtype(stack.dtype, np.integer):
+        binned = blocks.sum(axis=block_axes, dtype=np.uint64 if np.issubdtype(stack.dtype, np.unsignedinteger) else np.int64)
+        binned //= int(np.prod(factors))
+    else:
+        binned = blocks.mean(axis=block_axes)
+    return binned.astype(stack.dtype, copy=False)
+
+def bin_image(image, factor):
+    '''
+    Downsamples a 2D image by averaging non-overlapping factor x factor blocks
+
+    Args:
+        image (np.ndarray): 2D image
+        factor (int): Binning factor, 1 returns the image unchanged
+
+    Returns:
+        np.ndarray: Binned image with the same dtype as the input
+    '''
+    return bin_stack(image, (factor, factor))
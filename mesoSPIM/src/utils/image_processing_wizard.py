@@ -9,6 +9,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import pyqtProperty
 
 from ..mesoSPIM_State import mesoSPIM_StateSingleton
+from .projections import PROJECTION_OPTIONS
 
 class ImageProcessingWizard(QtWidgets.QWizard):
     '''
@@ -53,15 +54,19 @@ class ImageProcessingWizard(QtWidgets.QWizard):
         super().done(r)
 
     def set_processing_options(self):
-        row_count = self.parent.model.rowCount()
+        ''' Writes the selected projections as comma-separated string, e.g. 'MAX,MEAN', into the processing column '''
         processing_column = self.parent.model.getColumnByName('Processing')
-         
-        for row in range(0, row_count):
+
+        processing_options_string = ','.join([option for option in PROJECTION_OPTIONS if self.field(option+'Enabled')])
+
+        if self.field('selectedRowsOnly'):
+            rows = sorted(set([index.row() for index in self.parent.selection_model.selectedIndexes()]))
+        else:
+            rows = range(0, self.parent.model.rowCount())
+
+        for row in rows:
             index = self.parent.model.createIndex(row, processing_column)
-            if self.field('maxProjEnabled'):
-                self.parent.model.setData(index, 'MAX')
-            else:
-                self.parent.model.setData(index,  '')
+            self.parent.model.setData(index, processing_options_string)
 
 class ImageProcessingWizardWelcomePage(QtWidgets.QWizardPage):
     def __init__(self, parent=None):
@@ -79,12 +84,27 @@ class ImageProcessingWizardSetOptionsPage(QtWidgets.QWizardPage):
         self.setTitle("Select processing options")
         #self.setSubTitle("Select the processing options:")
 
-        self.maxProjectionCheckBox = QtWidgets.QCheckBox('Post-stack MAX projection (adds time)', self)
-        
-        self.registerField('maxProjEnabled',self.maxProjectionCheckBox)
+        ''' Projections are calculated while the stack is written and do not add acquisition time '''
+        checkbox_labels = {'MAX' : 'MAX projection along Z',
+                           'MEAN' : 'MEAN projection along Z',
+                           'MIN' : 'MIN projection along Z',
+                           'MAX_XZ' : 'MAX projection in XZ',
+                           'MAX_YZ' : 'MAX projection in YZ'}
 
         self.layout = QtWidgets.QGridLayout()
-        self.layout.addWidget(self.maxProjectionCheckBox, 0, 0)
+
+        for row, option in enumerate(PROJECTION_OPTIONS):
+            checkbox = QtWidgets.QCheckBox(checkbox_labels[option], self)
+            self.registerField(option+'Enabled', checkbox)
+            self.layout.addWidget(checkbox, row, 0)
+
+        self.allRowsButton = QtWidgets.QRadioButton('Apply to all rows', self)
+        self.allRowsButton.setChecked(True)
+        self.selectedRowsButton = QtWidgets.QRadioButton('Apply to selected rows only', self)
+        self.registerField('selectedRowsOnly', self.selectedRowsButton)
+
+        self.layout.addWidget(self.allRowsButton, len(PROJECTION_OPTIONS), 0)
+        self.layout.addWidget(self.selectedRowsButton, len(PROJECTION_OPTIONS)+1, 0)
         self.setLayout(self.layout)
 
     def validatePage(self):
@@ -1,6 +1,7 @@
 from PyQt5 import QtWidgets, QtGui, QtCore, QtDesigner
 
 from .acquisitions import Acquisition, AcquisitionList
+from .utility_functions import convert_seconds_to_string
 
 from ..mesoSPIM_State import mesoSPIM_StateSingleton
 
@@ -29,6 +30,9 @@ class AcquisitionModel(QtCore.QAbstractTableModel):
 
         self.state = mesoSPIM_StateSingleton()
 
+        ''' Predicted time in s of every row, see setPredictedTimes() '''
+        self._predicted_times = []
+
         self.dataChanged.connect(self.updatePlanes)
 
     def rowCount(self, parent = QtCore.QModelIndex()):
@@ -66,6 +70,9 @@ class AcquisitionModel(QtCore.QAbstractTableModel):
                 return self._headers[section]
             if orientation == QtCore.Qt.Vertical:
                 return 'Stack ' + str(section)
+        if role == QtCore.Qt.ToolTipRole:
+            if orientation == QtCore.Qt.Vertical and section < len(self._predicted_times):
+                return 'Predicted time: ' + convert_seconds_to_string(self._predicted_times[section])
 
     def data(self, index, role):
         ''' Data allows to fetch one item'''
@@ -278,8 +285,15 @@ class AcquisitionModel(QtCore.QAbstractTableModel):
     def getColumnByName(self, name):
         return self._headers.index(name)
 
+    def setPredictedTimes(self, times):
+        ''' Sets the predicted time in s of every row, shown as tooltip of the row headers '''
+        self._predicted_times = list(times)
+        self.headerDataChanged.emit(QtCore.Qt.Vertical, 0, max(0, len(self._table) - 1))
+
     def getTime(self, row):
-        return int(self._table[row].get_acquisition_time())
+        if row < len(self._predicted_times):
+            return int(self._predicted_times[row])
+        return int(self._table[row].get_acquisition_time(self.state['current_framerate']))
 
     def getFilter(self, row):
         return self._table[row]['filter']
@@ -333,6 +347,7 @@ class AcquisitionModel(QtCore.QAbstractTableModel):
     def loadModel(self, filename):
         self.modelAboutToBeReset.emit()
         self._table = pickle.load(open(filename, "rb" ))
+        self._table.add_missing_keys()
         self.modelReset.emit()
 
     def deleteTable(self):
@@ -0,0 +1,160 @@
+'''
+Preflight checks for acquisition lists: Is there enough disk space, and are the disks fast enough?
+
+The data volume of an acquisition list is known before it starts, so a full or too
+slow disk can be detected before hours of acquisition are lost.
+'''
+
+import os
+import time
+import shutil
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .projections import parse_processing_options
+
+''' Cached bandwidth probes per volume (device id): {st_dev : (timestamp, bytes per second)} '''
+_bandwidth_cache = {}
+
+def get_pyramid_factor(subsamp):
+    ''' Returns the data volume of all resolution levels relative to the full resolution level '''
+    factor = 0.0
+    for level in subsamp:
+        factor += 1.0 / (level[0] * level[1] * level[2])
+    return factor
+
+def get_subsamp_for_filename(filename, cfg):
+    ''' Returns the resolution levels written for a file, depending on its format '''
+    if filename.endswith('.h5'):
+        return cfg.hdf5['subsamp']
+    elif filename.endswith('.zarr'):
+        return cfg.zarr['subsamp']
+    elif filename.endswith('.raw'):
+        return cfg.raw['subsamp']
+    else:
+        return ((1, 1, 1),)
+
+def estimate_acquisition_bytes(acq, cfg, x_pixels, y_pixels):
+    '''
+    Estimates the bytes written for a single acquisition (row)
+
+    Compression is ignored, the estimate is an upper bound. This includes
+    resolution levels and projections.
+
+    Args:
+        acq (Acquisition): Row of the acquisition list
+        x_pixels, y_pixels (int): Binned frame size
+
+    Returns:
+        int: Number of bytes
+    '''
+    n_planes = acq.get_image_count()
+    frame_bytes = x_pixels * y_pixels * 2
+    stack_bytes = n_planes * frame_bytes * get_pyramid_factor(get_subsamp_for_filename(acq['filename'], cfg))
+
+    projection_bytes = 0
+    for option in parse_processing_options(acq['processing']):
+        if option == 'MAX_XZ':
+            projection_bytes += n_planes * y_pixels * 2
+        elif option == 'MAX_YZ':
+            projection_bytes += n_planes * x_pixels * 2
+        else:
+            projection_bytes += frame_bytes
+    return int(stack_bytes + projection_bytes)
+
+def get_volume_id(folder):
+    return os.stat(folder).st_dev
+
+def probe_write_bandwidth(folder, probe_size_mb=64, max_age_s=3600):
+    '''
+    Measures the sustained write bandwidth of the volume containing folder
+
+    A temporary file is written in 8 MB blocks and synced to disk. Results are
+    cached per volume for max_age_s seconds.
+
+    Returns:
+        float: Write bandwidth in bytes per second
+    '''
+    volume = get_volume_id(folder)
+    if volume in _bandwidth_cache:
+        timestamp, bandwidth = _bandwidth_cache[volume]
+        if time.time() - timestamp < max_age_s:
+            return bandwidth
+
+    ''' Random data, so that compressing file systems do not fake high rates '''
+    block = os.urandom(8 * 1024 * 1024)
+    n_blocks = max(1, int(probe_size_mb / 8))
+    probe_path = os.path.join(folder, '.mesoSPIM_write_probe.tmp')
+    try:
+        start_time = time.perf_counter()
+        with open(probe_path, 'wb', buffering=0) as probe_file:
+            for i in range(n_blocks):
+                probe_file.write(block)
+            os.fsync(probe_file.fileno())
+        duration = time.perf_counter() - start_time
+    finally:
+        if os.path.exists(probe_path):
+            os.remove(probe_path)
+
+    bandwidth = n_blocks * len(block) / max(duration, 1e-6)
+    logger.info(f'Preflight: Write bandwidth of {folder}: {bandwidth/1e6:.0f} MB/s')
+    _bandwidth_cache[volume] = (time.time(), bandwidth)
+    return bandwidth
+
+def run_preflight(acq_list, cfg, x_pixels, y_pixels, framerate):
+    '''
+    Checks free disk space and write bandwidth for all target folders of an acquisition list
+
+    Folders on the same volume share its space and bandwidth and are checked together.
+
+    Args:
+        acq_list (AcquisitionList): Acquisition list to check, all folders have to exist
+        cfg: Configuration module, uses the preflight section
+        x_pixels, y_pixels (int): Binned frame size
+        framerate (float): Predicted frame rate in frames per second
+
+    Returns:
+        tuple: (errors, warnings) lists of strings. Errors should stop the acquisition.
+    '''
+    errors = []
+    warnings = []
+
+    volumes = {}
+    for acq in acq_list:
+        folder = acq['folder']
+        volume = volumes.setdefault(get_volume_id(folder), {'folders' : [], 'bytes' : 0, 'rate' : 0.0})
+        if folder not in volume['folders']:
+            volume['folders'].append(folder)
+        volume['bytes'] += estimate_acquisition_bytes(acq, cfg, x_pixels, y_pixels)
+
+        ''' Rows are acquired one after another, the fastest required rate counts '''
+        frame_bytes = x_pixels * y_pixels * 2 * get_pyramid_factor(get_subsamp_for_filename(acq['filename'], cfg))
+        volume['rate'] = max(volume['rate'], frame_bytes * framerate)
+
+    for volume in volumes.values():
+        folder = volume['folders'][0]
+        folder_string = ', '.join(volume['folders'])
+
+        free_bytes = shutil.disk_usage(folder).free
+        required_bytes = volume['bytes'] * (1 + cfg.preflight['free_space_margin'])
+        logger.info(f'Preflight: {folder_string}: {volume["bytes"]/1e9:.1f} GB required, {free_bytes/1e9:.1f} GB free')
+        if required_bytes > free_bytes:
+            errors.append(f'Not enough disk space in {folder_string}: '
+                          f'{required_bytes/1e9:.1f} GB required, {free_bytes/1e9:.1f} GB free')
+
+        if cfg.preflight['bandwidth_probe']:
+            try:
+                bandwidth = probe_write_bandwidth(folder, cfg.preflight['probe_size_mb'], cfg.preflight['probe_max_age_s'])
+            except OSError as error:
+                warnings.append(f'Write bandwidth of {folder_string} could not be measured: {error}')
+                continue
+            if bandwidth < volume['rate']:
+                message = (f'Disk too slow for {folder_string}: {volume["rate"]/1e6:.0f} MB/s required, '
+                           f'{bandwidth/1e6:.0f} MB/s measured. Frames will be dropped once the frame buffer is full.')
+                if cfg.preflight['refuse_if_too_slow']:
+                    errors.append(message)
+                else:
+                    warnings.append(message)
+
+    return errors, warnings
@@ -0,0 +1,103 @@
+'''
+Incremental projections of image stacks
+
+The projections are updated plane by plane while a stack is written, so no
+second pass over the data on disk is necessary.
+'''
+
+import numpy as np
+import tifffile
+
+import logging
+logger = logging.getLogger(__name__)
+
+''' Supported projections: MAX, MEAN and MIN along z, maximum projections in XZ and YZ '''
+PROJECTION_OPTIONS = ('MAX', 'MEAN', 'MIN', 'MAX_XZ', 'MAX_YZ')
+
+def parse_processing_options(processing_options_string):
+    '''
+    Converts the processing string of an acquisition into a list of projections
+
+    The string is a comma-separated list such as 'MAX,MEAN,MAX_XZ', a single
+    'MAX' (as written by older versions) is valid as well.
+    '''
+    options = []
+    for option in processing_options_string.split(','):
+        option = option.strip().upper()
+        if option == '':
+            continue
+        if option in PROJECTION_OPTIONS:
+            if option not in options:
+                options.append(option)
+        else:
+            logger.warning(f'Unknown processing option: {option}')
+    return options
+
+class ProjectionAccumulator(object):
+    '''
+    Accumulates projections of a stack one plane at a time
+
+    Args:
+        options (list): Projections out of PROJECTION_OPTIONS
+        n_planes (int): Number of planes in the stack, sets the z size of XZ & YZ projections
+        frame_shape (tuple): Shape (rows, columns) of the planes
+    '''
+    def __init__(self, options, n_planes, frame_shape):
+        self.options = list(options)
+        self.n_planes = n_planes
+        self.frame_shape = tuple(frame_shape)
+        self.plane_count = 0
+
+        rows, columns = self.frame_shape
+        self.accumulators = {}
+        if 'MAX' in self.options:
+            self.accumulators['MAX'] = np.zeros(self.frame_shape, dtype=np.uint16)
+        if 'MIN' in self.options:
+            self.accumulators['MIN'] = np.full(self.frame_shape, np.iinfo(np.uint16).max, dtype=np.uint16)
+        if 'MEAN' in self.options:
+            self.accumulators['MEAN'] = np.zeros(self.frame_shape, dtype=np.uint64)
+        if 'MAX_XZ' in self.options:
+            self.accumulators['MAX_XZ'] = np.zeros((n_planes, columns), dtype=np.uint16)
+        if 'MAX_YZ' in self.options:
+            self.accumulators['MAX_YZ'] = np.zeros((n_planes, rows), dtype=np.uint16)
+
+    def add_plane(self, plane, plane_index):
+        '''
+        Updates all projections with a single plane, all operations happen in place
+
+        Args:
+            plane (np.ndarray): Image with the shape frame_shape, can be a (strided) view
+            plane_index (int): z index of the plane in the stack
+        '''
+        acc = self.accumulators
+        if 'MAX' in acc:
+            np.maximum(acc['MAX'], plane, out=acc['MAX'])
+        if 'MIN' in acc:
+            np.minimum(acc['MIN'], plane, out=acc['MIN'])
+        if 'MEAN' in acc:
+            np.add(acc['MEAN'], plane, out=acc['MEAN'], casting='unsafe')
+        if plane_index < self.n_planes:
+            if 'MAX_XZ' in acc:
+                np.max(plane, axis=0, out=acc['MAX_XZ'][plane_index])
+            if 'MAX_YZ' in acc:
+                np.max(plane, axis=1, out=acc['MAX_YZ'][plane_index])
+        self.plane_count += 1
+
+    def get_projections(self):
+        ''' Returns a dict with the projection names as keys and uint16 images as values '''
+        projections = {}
+        for option, accumulator in self.accumulators.items():
+            if option == 'MEAN':
+                projections[option] = (accumulator // max(self.plane_count, 1)).astype(np.uint16)
+            else:
+                projections[option] = accumulator
+        return projections
+
+    def save(self, folder, filename, suffix=''):
+        '''
+        Writes each projection as TIFF file named e.g. MAX_<filename><suffix>.tif into folder
+        '''
+        for option, projection in self.get_projections().items():
+            path = folder + '/' + option + '_' + filename + suffix + '.tif'
+            tifffile.imwrite(path, projection, photometric='minisblack')
+            logger.info(f'Saved {option} projection: {path}')
@@ -0,0 +1,121 @@
+'''
+Streaming generation of multi-resolution pyramids
+
+Downsampled levels are computed while the planes of a stack arrive, so a
+finished stack can be viewed at low resolution without another pass over the data.
+'''
+
+import os
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .image_processing import bin_stack
+
+class PyramidBuilder(object):
+    '''
+    Computes downsampled levels of a stack from its planes, in z order
+
+    Each level is computed from the previous one by block means, e.g. 2x2x2.
+    Planes that do not complete a z-block yet are carried over to the next call.
+    Planes left over at the end of the stack are discarded, so level shapes are
+    stack_shape // subsamp.
+
+    Args:
+        subsamp (tuple): Absolute (z,y,x) subsampling factors per level, starting with
+                         level 0, e.g. ((1, 1, 1), (2, 2, 2), (4, 4, 4)). Each level has to be
+                         an integer multiple of the previous one.
+        stack_shape (tuple): (z,y,x) shape of the full resolution stack
+    '''
+    def __init__(self, subsamp, stack_shape):
+        self.subsamp = np.asarray(subsamp, dtype=int)
+        self.n_levels = len(self.subsamp)
+        self.shapes = [tuple(int(s) for s in np.asarray(stack_shape) // level) for level in self.subsamp]
+
+        self.relative_factors = [None]
+        for level in range(1, self.n_levels):
+            factors = self.subsamp[level] // self.subsamp[level - 1]
+            assert np.all(factors * self.subsamp[level - 1] == self.subsamp[level]), \
+                f'Subsampling level {self.subsamp[level]} is not a multiple of {self.subsamp[level - 1]}'
+            self.relative_factors.append(tuple(int(f) for f in factors))
+
+        self.carry_over = [None] * self.n_levels
+        self.next_z = [0] * self.n_levels
+
+    def add_planes(self, planes):
+        '''
+        Adds consecutive full resolution planes to the pyramid
+
+        Args:
+            planes (np.ndarray): (n,y,x) array with the next n planes of the stack
+
+        Returns:
+            list: (level, z_start, data) tuples for all newly completed planes of levels >= 1
+        '''
+        results = []
+        current = planes
+        for level in range(1, self.n_levels):
+            fz, fy, fx = self.relative_factors[level]
+            if self.carry_over[level] is not None:
+                current = np.concatenate((self.carry_over[level], current))
+
+            n_complete = (current.shape[0] // fz) * fz
+            self.carry_over[level] = current[n_complete:].copy() if n_complete < current.shape[0] else None
+            if n_complete == 0:
+                break
+
+            ''' Binning z, y and x in one step avoids rounding twice '''
+            current = bin_stack(current[:n_complete], (fz, fy, fx))
+
+            z_start = self.next_z[level]
+            n_planes = min(current.shape[0], self.shapes[level][0] - z_start)
+            self.next_z[level] += current.shape[0]
+            if n_planes > 0:
+                results.append((level, z_start, current[:n_planes]))
+        return results
+
+class RawPyramidSidecars(object):
+    '''
+    Writes the downsampled levels of a raw stack into separate raw files next to it
+
+    The files are named <stack name>_level<n>_<z>x<y>x<x>.raw, so their shape
+    is evident from the filename.
+
+    Args:
+        path (str): Path of the full resolution raw file
+        subsamp (tuple): Absolute (z,y,x) subsampling factors per level, starting with (1, 1, 1)
+        stack_shape (tuple): (z,y,x) shape of the full resolution stack
+    '''
+    def __init__(self, path, subsamp, stack_shape):
+        self.pyramid = PyramidBuilder(subsamp, stack_shape)
+        self.plane_count = 0
+
+        root, _ = os.path.splitext(path)
+        self.stacks = [None]
+        for level in range(1, self.pyramid.n_levels):
+            shape = self.pyramid.shapes[level]
+            level_path = root + f'_level{level}_{shape[0]}x{shape[1]}x{shape[2]}.raw'
+            if min(shape) > 0:
+                self.stacks.append(np.memmap(level_path, mode='write', dtype=np.uint16, shape=shape))
+            else:
+                logger.warning(f'Pyramid level {level} of {path} would be empty, skipping it')
+                self.stacks.append(None)
+
+    def append_plane(self, plane, plane_index):
+        ''' Planes have to arrive in order, missing planes are treated as zeros '''
+        while self.plane_count < plane_index:
+            self._add(np.zeros((1,) + plane.shape, dtype=np.uint16))
+        self._add(plane[np.newaxis])
+
+    def _add(self, planes):
+        self.plane_count += planes.shape[0]
+        for level, z_start, data in self.pyramid.add_planes(planes):
+            if self.stacks[level] is not None:
+                self.stacks[level][z_start:z_start + data.shape[0]] = data
+
+    def close(self):
+        for stack in self.stacks:
+            if stack is not None:
+                stack.flush()
+        self.stacks = []
@@ -0,0 +1,99 @@
+'''
+Vendor-neutral camera telemetry
+
+Every camera returns one FrameTelemetry record per frame. The records are
+aggregated per stack to find the sustained frame rate and to detect driver
+buffer overruns (dropped frames).
+'''
+
+import threading
+from collections import namedtuple
+
+'''
+Telemetry of a single frame:
+    frame_number (int): Frame number as counted by the camera (driver), starting at 1
+    backlog (int): Frames waiting in the driver buffer when the frame was retrieved
+    buffer_fill (float): Fill level of the driver buffer (0..1), None if unknown
+    interval (float): Time since the previous frame in s, None for the first frame
+    latency (float): Time in s the retrieval call for this frame took
+    timestamp (float): time.perf_counter() value when the frame was retrieved
+'''
+FrameTelemetry = namedtuple('FrameTelemetry', ['frame_number', 'backlog', 'buffer_fill', 'interval', 'latency', 'timestamp'])
+
+class TelemetryAggregator(object):
+    '''
+    Aggregates FrameTelemetry records of a stack into running statistics
+
+    Records are added in the camera thread, summaries can be requested from any thread.
+    Gaps in the frame numbers are counted as dropped frames.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.frames = 0
+            self.dropped_frames = 0
+            self.last_frame_number = None
+            self.backlog = 0
+            self.max_backlog = 0
+            self.backlog_sum = 0
+            self.max_buffer_fill = None
+            self.interval_sum = 0.0
+            self.interval_count = 0
+            self.max_interval = 0.0
+            self.latency_sum = 0.0
+            self.max_latency = 0.0
+            self.first_timestamp = None
+            self.last_timestamp = None
+
+    def add(self, record):
+        with self.lock:
+            self.frames += 1
+            if record.frame_number is not None:
+                if self.last_frame_number is not None and record.frame_number > self.last_frame_number + 1:
+                    self.dropped_frames += record.frame_number - self.last_frame_number - 1
+                self.last_frame_number = record.frame_number
+
+            self.backlog = record.backlog
+            self.max_backlog = max(self.max_backlog, record.backlog)
+            self.backlog_sum += record.backlog
+
+            if record.buffer_fill is not None:
+                self.max_buffer_fill = record.buffer_fill if self.max_buffer_fill is None else max(self.max_buffer_fill, record.buffer_fill)
+
+            if record.interval is not None:
+                self.interval_sum += record.interval
+                self.interval_count += 1
+                self.max_interval = max(self.max_interval, record.interval)
+
+            self.latency_sum += record.latency
+            self.max_latency = max(self.max_latency, record.latency)
+
+            if self.first_timestamp is None:
+                self.first_timestamp = record.timestamp
+            self.last_timestamp = record.timestamp
+
+    def get_summary(self):
+        '''
+        Returns:
+            dict: Statistics of all frames added since the last reset(), times in ms
+        '''
+        with self.lock:
+            if self.frames > 1 and self.last_timestamp > self.first_timestamp:
+                sustained_framerate = (self.frames - 1) / (self.last_timestamp - self.first_timestamp)
+            else:
+                sustained_framerate = 0.0
+            return {'frames' : self.frames,
+                    'dropped_frames' : self.dropped_frames,
+                    'backlog' : self.backlog,
+                    'max_backlog' : self.max_backlog,
+                    'mean_backlog' : self.backlog_sum / self.frames if self.frames else 0.0,
+                    'max_buffer_fill' : self.max_buffer_fill,
+                    'mean_interval_ms' : 1000 * self.interval_sum / self.interval_count if self.interval_count else 0.0,
+                    'max_interval_ms' : 1000 * self.max_interval,
+                    'mean_latency_ms' : 1000 * self.latency_sum / self.frames if self.frames else 0.0,
+                    'max_latency_ms' : 1000 * self.max_latency,
+                    'sustained_framerate' : sustained_framerate,
+                    }
@@ -0,0 +1,372 @@
+'''
+Learned acquisition time model
+
+A stack takes the time from the start of its preparation (stage movement, filter,
+zoom and laser changes, rotations) to the end of its image series (including
+closing the files, unless the stack pipeline ends it in the background). The model
+predicts it as a sum of per-operation costs:
+
+    time = stack overhead + frames * frame time
+           + filter change + zoom change + laser change
+           + rotation angle * time per degree + stage travel * time per um
+
+Stage travel is the distance of the slowest axis from the end of the previous stack
+to the start of the stack. The costs are fitted to a history of measured stacks
+by non-negative ridge regression towards the values of the config (average_frame_rate and the
+acquisition_optimizer times), so the prediction starts with the config and
+converges to the measured costs of the microscope. Features which are the same for
+all measured stacks (always the stack overhead, often the frames) cannot be told
+apart: they are fitted as one level, split in the ratio of their config values.
+
+The history is a json file. It is filled from the TIMING INFORMATION blocks of
+the metadata files in the configured folders and by the Core after every stack.
+'''
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from .acquisition_optimizer import get_optimizer_config
+
+import logging
+logger = logging.getLogger(__name__)
+
+TIMING_FEATURES = ('stack', 'frames', 'filter_change', 'zoom_change', 'laser_change', 'rotation', 'travel')
+
+''' Stacks starting more than MAX_STACK_GAP s after the previous one are treated as the first of a list '''
+MAX_STACK_GAP = 60
+
+HISTORY_VERSION = 1
+
+''' Used for config files without a timing_model section '''
+DEFAULT_TIMING_CONFIG = {'enabled': False,
+                         'history_file': 'log/timing_history.json',
+                         'metadata_folders': [],
+                         'max_records': 2000,
+                         'stack_overhead': 2.0,
+                         'prior_weight': 5,
+                         }
+
+def get_timing_config(cfg):
+    return getattr(cfg, 'timing_model', DEFAULT_TIMING_CONFIG)
+
+def nonnegative_least_squares(A, b, max_iterations=None):
+    '''
+    Solves min ||A x - b|| subject to x >= 0 (active set method of Lawson and Hanson)
+
+    Unlike clipping the unconstrained solution, the costs of the free variables
+    are solved again without the variables held at 0, so they absorb their share.
+    '''
+    n = A.shape[1]
+    if max_iterations is None:
+        max_iterations = 3 * n
+    tolerance = 10 * np.finfo(np.float64).eps * np.linalg.norm(A, 1) * max(A.shape)
+    x = np.zeros(n)
+    free = np.zeros(n, dtype=bool)
+    gradient = A.T @ (b - A @ x)
+
+    for _ in range(max_iterations):
+        if free.all() or np.max(np.where(free, -np.inf, gradient)) <= tolerance:
+            break
+        free[np.argmax(np.where(free, -np.inf, gradient))] = True
+
+        while True:
+            z = np.zeros(n)
+            z[free] = np.linalg.lstsq(A[:, free], b, rcond=None)[0]
+            if np.all(z[free] > 0):
+                x = z
+                break
+            ''' Step towards z until the first free variable reaches 0 and fix it there '''
+            blocking = free & (z <= 0)
+            alpha = np.min(x[blocking] / (x[blocking] - z[blocking]))
+            x = x + alpha * (z - x)
+            free &= x > tolerance
+            x[~free] = 0.0
+        gradient = A.T @ (b - A @ x)
+    return x
+
+def describe_stack(rows):
+    '''
+    Settings of a stack which determine its time
+
+    Args:
+        rows (list): Acquisitions acquired as one stack (several with laser interleaving)
+
+    Returns:
+        dict: {'laser', 'zoom', 'filter', 'rot', 'start', 'end', 'frames'} with
+              start and end as [x, y, z, f] positions in um
+    '''
+    acq = rows[0]
+    return {'laser' : str(acq['laser']),
+            'zoom' : str(acq['zoom']),
+            'filter' : str(acq['filter']),
+            'rot' : float(acq['rot']),
+            'start' : [float(acq['x_pos']), float(acq['y_pos']), float(acq['z_start']), float(acq['f_start'])],
+            'end' : [float(acq['x_pos']), float(acq['y_pos']), float(acq['z_end']), float(acq['f_end'])],
+            'frames' : sum(row.get_image_count() for row in rows)}
+
+def get_stack_features(previous, stack):
+    '''
+    Feature vector of a stack, see TIMING_FEATURES
+
+    Args:
+        previous (dict): describe_stack() of the stack before, None for the first stack
+        stack (dict): describe_stack() of the stack
+    '''
+    features = [1.0, float(stack['frames']), 0.0, 0.0, 0.0, 0.0, 0.0]
+    if previous is not None:
+        features[2] = float(previous['filter'] != stack['filter'])
+        features[3] = float(previous['zoom'] != stack['zoom'])
+        features[4] = float(previous['laser'] != stack['laser'])
+        features[5] = abs(stack['rot'] - previous['rot'])
+        features[6] = float(np.max(np.abs(np.subtract(stack['start'], previous['end']))))
+    return features
+
+def parse_metadata_file(path):
+    '''
+    Reads the settings and the TIMING INFORMATION block of a metadata file
+
+    Returns:
+        dict: describe_stack() entries with 'start_time', 'end_time' (s since the epoch)
+              and 'source', None if the file has no complete timing information
+    '''
+    values = {}
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('[') and ']' in line:
+                key, value = line[1:].split(']', 1)
+                ''' The last value counts: z_planes of the POSITION block is the image count '''
+                values[key] = value.strip()
+
+    try:
+        start_time = time.mktime(time.strptime(values['Started stack'], '%Y%m%d-%H%M%S'))
+        end_time = time.mktime(time.strptime(values['Stopped stack'], '%Y%m%d-%H%M%S'))
+        return {'laser' : values['Laser'],
+                'zoom' : values['Zoom'],
+                'filter' : values['Filter'],
+                'rot' : float(values['rot']),
+                'start' : [float(values[key]) for key in ('x_pos', 'y_pos', 'z_start', 'f_start')],
+                'end' : [float(values[key]) for key in ('x_pos', 'y_pos', 'z_end', 'f_end')],
+                'frames' : int(values['z_planes']),
+                'start_time' : start_time,
+                'end_time' : end_time,
+                'source' : os.path.abspath(path)}
+    except (KeyError, ValueError):
+        return None
+
+class AcquisitionTimingModel(object):
+    '''
+    Predicts stack and acquisition list times from a history of measured stacks
+
+    Args:
+        history_file (str): Path of the json history file
+        prior (list): Costs before any measurement, one per TIMING_FEATURES entry
+        prior_weight (float): Weight of the prior in number of average stacks
+        max_records (int): The oldest records are dropped beyond this number
+        metadata_folders (list): Folders whose metadata files are imported
+    '''
+    def __init__(self, history_file, prior, prior_weight=5, max_records=2000, metadata_folders=()):
+        self.history_file = history_file
+        self.prior = np.array(prior, dtype=np.float64)
+        self.prior_weight = prior_weight
+        self.max_records = max_records
+        self.metadata_folders = list(metadata_folders)
+        ''' [{'source', 'start_time', 'duration', 'features'}] '''
+        self.records = []
+        self.costs = self.prior.copy()
+        self.history_mtime = None
+
+    @classmethod
+    def from_config(cls, cfg):
+        timing_cfg = get_timing_config(cfg)
+        optimizer_cfg = get_optimizer_config(cfg)
+        prior = [timing_cfg['stack_overhead'],
+                 1 / cfg.startup['average_frame_rate'],
+                 optimizer_cfg['filter_change_time'],
+                 optimizer_cfg['zoom_change_time'],
+                 optimizer_cfg['laser_change_time'],
+                 1 / optimizer_cfg['rotation_velocity'],
+                 1 / optimizer_cfg['stage_velocity']]
+        model = cls(timing_cfg['history_file'],
+                    prior,
+                    prior_weight=timing_cfg['prior_weight'],
+                    max_records=timing_cfg['max_records'],
+                    metadata_folders=timing_cfg['metadata_folders'])
+        model.load()
+        return model
+
+    def load(self):
+        ''' Reads the history file, imports the metadata folders and fits the costs '''
+        self.records = []
+        if os.path.exists(self.history_file):
+            try:
+                with open(self.history_file, 'r') as file:
+                    history = json.load(file)
+                if history.get('version') == HISTORY_VERSION:
+                    self.records = history['records']
+                self.history_mtime = os.path.getmtime(self.history_file)
+            except (OSError, ValueError, KeyError) as error:
+                logger.warning(f'Timing model: History {self.history_file} could not be read: {error}')
+
+        for folder in self.metadata_folders:
+            self.import_metadata_folder(folder)
+        self.fit()
+
+    def reload_if_changed(self):
+        ''' Loads the history again if another instance saved it, returns True if it was loaded '''
+        try:
+            mtime = os.path.getmtime(self.history_file)
+        except OSError:
+            return False
+        if mtime == self.history_mtime:
+            return False
+        self.load()
+        return True
+
+    def save(self):
+        try:
+            with open(self.history_file, 'w') as file:
+                json.dump({'version' : HISTORY_VERSION, 'features' : TIMING_FEATURES, 'records' : self.records}, file)
+            self.history_mtime = os.path.getmtime(self.history_file)
+        except OSError as error:
+            logger.warning(f'Timing model: History {self.history_file} could not be saved: {error}')
+
+    def import_metadata_folder(self, folder):
+        '''
+        Adds the stacks of all *_meta.txt files in a folder which are not in the history yet
+
+        Rows acquired as one stack (laser interleaving) share their start and end
+        time and are merged. Returns the number of added stacks.
+        '''
+        known_sources = set(record['source'] for record in self.records)
+        stacks = {}
+        for path in glob.glob(os.path.join(folder, '*_meta.txt')):
+            if os.path.abspath(path) in known_sources:
+                continue
+            stack = parse_metadata_file(path)
+            if stack is None:
+                continue
+            key = (stack['start_time'], stack['end_time'])
+            if key in stacks:
+                stacks[key]['frames'] += stack['frames']
+            else:
+                stacks[key] = stack
+
+        previous = None
+        added = 0
+        for stack in sorted(stacks.values(), key=lambda stack: stack['start_time']):
+            if previous is not None and stack['start_time'] - previous['end_time'] > MAX_STACK_GAP:
+                previous = None
+            duration = stack['end_time'] - stack['start_time']
+            if duration > 0 and stack['frames'] > 0:
+                self.add_record(stack['source'], stack['start_time'], duration, get_stack_features(previous, stack))
+                added += 1
+            previous = stack
+        if added:
+            logger.info(f'Timing model: Imported {added} stacks from {folder}')
+        return added
+
+    def add_record(self, source, start_time, duration, features):
+        self.records.append({'source' : source,
+                             'start_time' : start_time,
+                             'duration' : duration,
+                             'features' : list(features)})
+        if len(self.records) > self.max_records:
+            self.records.sort(key=lambda record: record['start_time'])
+            del self.records[:len(self.records) - self.max_records]
+
+    def add_stack(self, previous, rows, start_time, duration):
+        '''
+        Adds a measured stack and fits the costs again
+
+        Args:
+            previous (list): Rows of the stack before, None for the first stack of a list
+            rows (list): Rows of the stack
+        '''
+        previous_stack = describe_stack(previous) if previous is not None else None
+        source = os.path.abspath(rows[0]['folder']+'/'+rows[0]['filename']+'_meta.txt')
+        self.add_record(source, start_time, duration, get_stack_features(previous_stack, describe_stack(rows)))
+        self.fit()
+
+    def fit(self):
+        '''
+        Non-negative ridge regression of the stack durations towards the prior costs
+
+        Features which vary in the history are scaled to a standard deviation of 1, so
+        the prior counts as prior_weight stacks for every cost: a cost is learned once
+        the history varies its operation more than the prior weight. Features with the
+        same value in all records share one level which is fitted without prior, so
+        a wrong prior cannot shift all predictions. Costs of operations which never
+        occurred in the history stay at their prior. The ridge term is appended to the
+        design matrix, so the non-negativity is part of the fit instead of being
+        applied afterwards.
+        '''
+        self.costs = self.prior.copy()
+        if self.records == []:
+            return
+
+        X = np.array([record['features'] for record in self.records], dtype=np.float64)
+        y = np.array([record['duration'] for record in self.records], dtype=np.float64)
+        constant = np.all(X == X[0], axis=0)
+        level = constant & (X[0] != 0)
+        varying = ~constant
+
+        ''' Fraction of the level of every constant feature '''
+        share = self.prior[level] * X[0, level]
+        if share.sum() <= 0:
+            share = np.ones(np.count_nonzero(level))
+        share = share / share.sum()
+
+        scale = np.std(X[:, varying], axis=0)
+        ridge = np.sqrt(self.prior_weight)
+        n_varying = np.count_nonzero(varying)
+        A = np.block([[np.ones((len(y), 1)), X[:, varying] / scale],
+                      [np.zeros((n_varying, 1)), ridge * np.eye(n_varying)]])
+        b = np.concatenate((y, ridge * self.prior[varying] * scale))
+        solution = nonnegative_least_squares(A, b)
+
+        self.costs[level] = solution[0] * share / X[0, level]
+        self.costs[varying] = solution[1:] / scale
+
+    def get_costs(self):
+        return dict(zip(TIMING_FEATURES, self.costs))
+
+    def predict_stacks(self, stacks, previous=None):
+        '''
+        Args:
+            stacks (list): Lists of rows, each acquired as one stack
+            previous (list): Rows of the stack before the first one, None if there is none
+
+        Returns:
+            list: Predicted time in s of every stack
+        '''
+        previous_stack = describe_stack(previous) if previous is not None else None
+        times = []
+        for rows in stacks:
+            stack = describe_stack(rows)
+            times.append(float(np.dot(self.costs, get_stack_features(previous_stack, stack))))
+            previous_stack = stack
+        return times
+
+    def predict_rows(self, acq_list, interleaved=False, previous=None):
+        '''
+        Predicted time in s of every row of an acquisition list in table order
+
+        With laser interleaving, the time of a stack is split evenly among its rows.
+        '''
+        if interleaved:
+            stacks = acq_list.get_interleaved_groups()
+        else:
+            stacks = [[acq] for acq in acq_list]
+
+        row_times = []
+        for rows, stack_time in zip(stacks, self.predict_stacks(stacks, previous)):
+            row_times.extend([stack_time / len(rows)] * len(rows))
+        return row_times
+
+    def predict_list(self, acq_list, interleaved=False, previous=None):
+        return sum(self.predict_rows(acq_list, interleaved, previous))
@@ -0,0 +1,79 @@
+'''
+Memoization of waveforms and ETL parameter files
+
+Waveforms only depend on a handful of parameters, so a waveform is only
+recomputed if one of its parameters changed. Unchanged channels are served
+from a small LRU cache.
+'''
+
+import os
+import csv
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+''' Parsed ETL csv files: {path : ((mtime_ns, size), {(wavelength, zoom) : row})} '''
+_etl_csv_cache = {}
+
+class WaveformCache(object):
+    '''
+    LRU cache of waveforms keyed by the generating function and its parameters
+
+    Cached arrays are read-only, as they are shared between all users of a
+    parameter set. Stacking them (np.stack) creates writable copies.
+
+    Args:
+        maxsize (int): Number of waveforms to keep
+    '''
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.waveforms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, function, **kwargs):
+        '''
+        Returns function(**kwargs), computed only if this parameter set is not cached
+
+        All parameters have to be passed as (hashable) keyword arguments.
+        '''
+        key = (function.__name__, tuple(sorted(kwargs.items())))
+        if key in self.waveforms:
+            self.hits += 1
+            self.waveforms.move_to_end(key)
+            return self.waveforms[key]
+
+        self.misses += 1
+        waveform = function(**kwargs)
+        waveform.setflags(write=False)
+        self.waveforms[key] = waveform
+        if len(self.waveforms) > self.maxsize:
+            self.waveforms.popitem(last=False)
+        return waveform
+
+    def clear(self):
+        self.waveforms.clear()
+
+def read_etl_csv(cfg_path):
+    '''
+    Returns the rows of an ETL csv file as {(wavelength, zoom) : row}
+
+    The file is only parsed again if its modification time or size changed.
+    If several rows match the same wavelength and zoom, the last one is used.
+    '''
+    stat = os.stat(cfg_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if cfg_path in _etl_csv_cache:
+        cached_signature, rows = _etl_csv_cache[cfg_path]
+        if cached_signature == signature:
+            return rows
+
+    rows = {}
+    with open(cfg_path) as file:
+        reader = csv.DictReader(file,delimiter=';')
+        for row in reader:
+            rows[(row['Wavelength'], row['Zoom'])] = row
+    logger.debug(f'Parsed ETL csv file {cfg_path}: {len(rows)} rows')
+    _etl_csv_cache[cfg_path] = (signature, rows)
+    return rows
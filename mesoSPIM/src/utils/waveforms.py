@@ -11,16 +11,58 @@ Author: Fabian Voigt
 # from nidaqmx.constants import AcquisitionType, TaskMode
 # from nidaqmx.constants import LineGrouping
 
-from scipy import signal
+import functools
 import numpy as np
 
+'''
+All waveform functions accept an optional preallocated out array (e.g. a row of a
+(channels x samples) buffer). The waveform is then written into out and no new
+array is allocated. Without out, a new array is returned.
+'''
+
+def get_sample_count(samplerate, sweeptime):
+    ''' Number of samples of a sweep '''
+    return int(samplerate*sweeptime)
+
+@functools.lru_cache(maxsize=8)
+def get_time_base(samplerate, sweeptime):
+    '''
+    Returns the (read-only) time of every sample of a sweep in seconds
+
+    The time base is shared by all waveforms with the same samplerate and sweeptime.
+    '''
+    time_base = np.linspace(0, sweeptime, get_sample_count(samplerate, sweeptime))
+    time_base.setflags(write=False)
+    return time_base
+
+@functools.lru_cache(maxsize=8)
+def get_index_base(samples):
+    ''' Returns the (read-only) sample indices 0..samples-1 as floats, used for ramps '''
+    index_base = np.arange(samples, dtype=np.float64)
+    index_base.setflags(write=False)
+    return index_base
+
+def _get_output(out, samples):
+    if out is None:
+        return np.empty(samples)
+    if out.shape != (samples,):
+        raise ValueError(f'Output array of shape {out.shape} does not fit {samples} samples')
+    return out
+
+def _write_phase(out, samplerate, sweeptime, frequency, phase):
+    ''' Writes the phase (2*pi*frequency*t + phase) modulo 2*pi of every sample into out '''
+    np.multiply(get_time_base(samplerate, sweeptime), 2 * np.pi * frequency, out=out)
+    out += phase
+    np.mod(out, 2 * np.pi, out=out)
+
 def single_pulse(
     samplerate=100000,  # in samples/second
     sweeptime=0.4,      # in seconds
     delay=10,           # in percent
     pulsewidth=1,       # in percent
     amplitude=0,        # in volts
-    offset=0            # in volts
+    offset=0,           # in volts
+    out=None            # preallocated output array
     ):
 
     '''
@@ -45,8 +87,9 @@ def single_pulse(
 
     # get an integer number of samples
     samples = int(np.floor(np.multiply(samplerate, sweeptime)))
-    # create an array just containing the offset voltage:
-    array = np.zeros((samples))+offset
+    # an array just containing the offset voltage:
+    array = _get_output(out, samples)
+    array.fill(offset)
 
     # convert pulsewidth and delay in % into number of samples
     pulsedelaysamples = int(samples * delay / 100)
@@ -54,7 +97,7 @@ def single_pulse(
 
     # modify the array
     array[pulsedelaysamples:pulsesamples+pulsedelaysamples] = amplitude
-    return np.array(array)
+    return array
 
 def tunable_lens_ramp(
     samplerate = 100000,    # in samples/second
@@ -63,7 +106,8 @@ def tunable_lens_ramp(
     rise = 85,              # in percent
     fall = 2.5,             # in percent
     amplitude = 0,          # in volts
-    offset = 0              # in volts
+    offset = 0,             # in volts
+    out = None              # preallocated output array
     ):
 
     '''
@@ -87,26 +131,28 @@ def tunable_lens_ramp(
     '''
     # get an integer number of samples
     samples = int(np.floor(np.multiply(samplerate, sweeptime)))
-    # create an array just containing the negative amplitude voltage:
-    array = np.zeros((samples))-amplitude + offset
+    # an array just containing the negative amplitude voltage:
+    array = _get_output(out, samples)
+    array.fill(offset - amplitude)
 
     # convert rise, fall, and delay in % into number of samples
     delaysamples = int(samples * delay / 100)
     risesamples = int(samples * rise / 100)
     fallsamples = int(samples * fall / 100)
+    index_base = get_index_base(samples)
 
-    risearray = np.arange(0,risesamples)
-    risearray = amplitude * (2 * np.divide(risearray, risesamples) - 1) + offset
-
-    fallarray = np.arange(0,fallsamples)
-    fallarray = amplitude * (1-2*np.divide(fallarray, fallsamples)) + offset
+    # rise phase: amplitude * (2 * i / risesamples - 1) + offset
+    rise_phase = array[delaysamples:delaysamples+risesamples]
+    if risesamples > 0:
+        np.multiply(index_base[:len(rise_phase)], 2 * amplitude / risesamples, out=rise_phase)
+        rise_phase += offset - amplitude
+    # fall phase: amplitude * (1 - 2 * i / fallsamples) + offset
+    fall_phase = array[delaysamples+risesamples:delaysamples+risesamples+fallsamples]
+    if fallsamples > 0:
+        np.multiply(index_base[:len(fall_phase)], -2 * amplitude / fallsamples, out=fall_phase)
+        fall_phase += offset + amplitude
 
-    # rise phase
-    array[delaysamples:delaysamples+risesamples] = risearray
-    # fall phase
-    array[delaysamples+risesamples:delaysamples+risesamples+fallsamples] = fallarray
-
-    return np.array(array)
+    return array
 
 def sawtooth(
     samplerate = 100000,    # in samples/second
@@ -116,23 +162,35 @@ def sawtooth(
     offset = 0,             # in V
     dutycycle = 50,          # dutycycle in percent
     phase = np.pi/2,          # in rad
+    out = None              # preallocated output array
     ):
     '''
     Returns a numpy array with a sawtooth function
 
-    Used for creating the galvo signal.
+    Used for creating the galvo signal. Equivalent to scipy.signal.sawtooth: The
+    signal rises from -1 to 1 during the first dutycycle % of each period and falls
+    back to -1 during the rest.
 
     Example:
     galvosignal =  sawtooth(100000, 0.4, 199, 3.67, 0, 50, np.pi)
     '''
 
-    samples =  int(samplerate*sweeptime)
-    dutycycle = dutycycle/100       # the signal.sawtooth width parameter has to be between 0 and 1
-    t = np.linspace(0, sweeptime, samples)
-    # Using the signal toolbox from scipy for the sawtooth:
-    waveform = signal.sawtooth(2 * np.pi * frequency * t + phase, width=dutycycle)
-    # Scale the waveform to a certain amplitude and apply an offset:
-    waveform = amplitude * waveform + offset
+    samples = get_sample_count(samplerate, sweeptime)
+    width = dutycycle/100       # fraction of the period with rising signal, between 0 and 1
+    waveform = _get_output(out, samples)
+    _write_phase(waveform, samplerate, sweeptime, frequency, phase)
+
+    ''' Both flanks are linear in the phase x and are scaled to amplitude and offset in place '''
+    rising = waveform < 2 * np.pi * width
+    if width > 0:
+        # rising flank: x / (pi * width) - 1
+        np.multiply(waveform, amplitude / (np.pi * width), out=waveform, where=rising)
+        np.add(waveform, offset - amplitude, out=waveform, where=rising)
+    if width < 1:
+        # falling flank: (pi * (width + 1) - x) / (pi * (1 - width))
+        falling = np.logical_not(rising, out=rising)
+        np.multiply(waveform, -amplitude / (np.pi * (1 - width)), out=waveform, where=falling)
+        np.add(waveform, offset + amplitude * (width + 1) / (1 - width), out=waveform, where=falling)
 
     return waveform
 
@@ -144,18 +202,55 @@ def square(
     offset = 0,             # in V
     dutycycle = 50,         # dutycycle in percent
     phase = np.pi,          # in rad
+    out = None              # preallocated output array
     ):
     """
     Returns a numpy array with a rectangular waveform
+
+    Equivalent to scipy.signal.square: 1 during the first dutycycle % of each period, -1 otherwise.
     """
 
-    samples =  int(samplerate*sweeptime)
-    dutycycle = dutycycle/100       # the signal.square duty parameter has to be between 0 and 1
-    t = np.linspace(0, sweeptime, samples)
+    samples = get_sample_count(samplerate, sweeptime)
+    duty = dutycycle/100       # fraction of the period with high signal, between 0 and 1
+    waveform = _get_output(out, samples)
+    _write_phase(waveform, samplerate, sweeptime, frequency, phase)
 
-    # Using the signal toolbox from scipy for the sawtooth:
-    waveform = signal.square(2 * np.pi * frequency * t + phase, duty=dutycycle)
-    # Scale the waveform to a certain amplitude and apply an offset:
-    waveform = amplitude * waveform + offset
+    high = waveform < 2 * np.pi * duty
+    waveform.fill(offset - amplitude)
+    np.copyto(waveform, offset + amplitude, where=high)
 
     return waveform
+
+def tunable_lens_ramp_table(
+    samplerate = 100000,    # in samples/second
+    sweeptime = 0.4,        # in seconds
+    delay = 7.5,            # in percent
+    rise = 85,              # in percent
+    fall = 2.5,             # in percent
+    amplitudes = (0,),      # in volts, one per row
+    offsets = (0,)          # in volts, one per row
+    ):
+    '''
+    Returns a 2D numpy array with one ETL ramp per row, e.g. one per plane
+
+    The ramp is linear in amplitude and offset, so all rows are computed at once
+    from a single ramp with amplitude 1 and offset 0.
+    '''
+    unit_ramp = tunable_lens_ramp(samplerate, sweeptime, delay, rise, fall, amplitude=1, offset=0)
+    amplitudes = np.asarray(amplitudes, dtype=np.float64)[:, np.newaxis]
+    offsets = np.asarray(offsets, dtype=np.float64)[:, np.newaxis]
+    return offsets + amplitudes * unit_ramp
+
+def single_pulse_table(
+    samplerate=100000,  # in samples/second
+    sweeptime=0.4,      # in seconds
+    delay=10,           # in percent
+    pulsewidth=1,       # in percent
+    amplitudes=(0,),    # in volts, one per row
+    ):
+    '''
+    Returns a 2D numpy array with one pulse per row, e.g. laser pulses with
+    a different intensity for every plane
+    '''
+    unit_pulse = single_pulse(samplerate, sweeptime, delay, pulsewidth, amplitude=1, offset=0)
+    return np.asarray(amplitudes, dtype=np.float64)[:, np.newaxis] * unit_pulse
@@ -0,0 +1,97 @@
+'''
+Depth-dependent acquisition parameters (z profiles)
+
+Laser intensity and ETL parameters can follow a curve along the stack, e.g. to
+compensate for the attenuation in deep samples. A profile is given as a string
+in the z_profile column of an acquisition, one curve per parameter:
+
+    'intensity: 0=10, 2000=40; etl_l_offset: poly(2.3, 0.0001)'
+
+Curves are functions of the depth, the distance from the first plane of the stack
+in microns. Two types are supported:
+
+- Piecewise-linear: 'depth=value' points in ascending depth order. The value is
+  interpolated linearly and constant before the first and after the last point.
+- Polynomial: 'poly(c0, c1, c2, ...)' evaluates to c0 + c1*depth + c2*depth**2 + ...
+
+Parameters without a curve keep the value of their acquisition.
+'''
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+''' Parameters which can follow a z profile '''
+Z_PROFILE_PARAMETERS = ('intensity', 'etl_l_offset', 'etl_l_amplitude', 'etl_r_offset', 'etl_r_amplitude')
+
+def parse_z_profile(z_profile_string):
+    '''
+    Converts the z_profile string of an acquisition into curves
+
+    Returns:
+        dict: {parameter : ('linear', depths, values)} or {parameter : ('poly', coefficients)}
+
+    Raises:
+        ValueError: If the string is not a valid z profile
+    '''
+    profile = {}
+    for entry in z_profile_string.split(';'):
+        if entry.strip() == '':
+            continue
+        if ':' not in entry:
+            raise ValueError(f'Missing ":" in z profile entry "{entry.strip()}"')
+        parameter, curve = entry.split(':', 1)
+        parameter = parameter.strip().lower()
+        curve = curve.strip()
+        if parameter not in Z_PROFILE_PARAMETERS:
+            raise ValueError(f'Unknown z profile parameter "{parameter}", valid are: {", ".join(Z_PROFILE_PARAMETERS)}')
+        if parameter in profile:
+            raise ValueError(f'Duplicated z profile for "{parameter}"')
+
+        if curve.lower().startswith('poly(') and curve.endswith(')'):
+            try:
+                coefficients = tuple(float(c) for c in curve[5:-1].split(','))
+            except ValueError:
+                raise ValueError(f'Invalid polynomial coefficients for "{parameter}": {curve}')
+            profile[parameter] = ('poly', coefficients)
+        else:
+            depths = []
+            values = []
+            for point in curve.split(','):
+                try:
+                    depth, value = point.split('=')
+                    depths.append(float(depth))
+                    values.append(float(value))
+                except ValueError:
+                    raise ValueError(f'Invalid z profile point "{point.strip()}" for "{parameter}", use depth=value')
+            if any(np.diff(depths) <= 0):
+                raise ValueError(f'Depths of the z profile for "{parameter}" have to be ascending')
+            profile[parameter] = ('linear', tuple(depths), tuple(values))
+    return profile
+
+def evaluate_z_profile(profile, depths, defaults):
+    '''
+    Evaluates all curves of a profile for all planes of a stack at once
+
+    Args:
+        profile (dict): Parsed profile, see parse_z_profile()
+        depths (np.ndarray): Depth of every plane in microns
+        defaults (dict): Values of parameters without a curve, e.g. the acquisition
+
+    Returns:
+        dict: {parameter : np.ndarray of one value per plane} for all Z_PROFILE_PARAMETERS
+    '''
+    depths = np.asarray(depths, dtype=np.float64)
+    values = {}
+    for parameter in Z_PROFILE_PARAMETERS:
+        curve = profile.get(parameter)
+        if curve is None:
+            values[parameter] = np.full(len(depths), float(defaults[parameter]))
+        elif curve[0] == 'poly':
+            ''' np.polyval expects the highest order first '''
+            values[parameter] = np.polyval(curve[1][::-1], depths)
+        else:
+            values[parameter] = np.interp(depths, curve[1], curve[2])
+    values['intensity'] = np.clip(values['intensity'], 0, 100)
+    return values
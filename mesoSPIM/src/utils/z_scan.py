@@ -0,0 +1,114 @@
+'''
+Planning of hardware-timed continuous z-scans
+
+Instead of moving the stage for every plane (step-and-shoot), the z stage moves
+at constant velocity through the stack while the NI tasks output one sweep per frame.
+The velocity follows from the z step and the sweep time, so that consecutive frames
+are exactly one z step apart.
+'''
+
+import numpy as np
+
+class ZScanPlan(object):
+    '''
+    Motion and trigger timing of a continuous z-scan
+
+    The stage starts at scan_start, accelerates (ramp) and settles before it passes
+    z_start at constant velocity. The first frame is triggered at that moment
+    (trigger_delay after the start of the motion). After the last frame, the stage
+    decelerates behind the stack, the scan ends at scan_end.
+
+    Args:
+        z_start (float): Position of the first plane in microns
+        z_end (float): Position after the last plane in microns (like in an Acquisition)
+        z_step (float): Plane spacing in microns, the sign is ignored
+        n_planes (int): Number of planes
+        frame_period (float): Time between frames in s (the waveform sweep time)
+        acceleration (float): Stage acceleration in microns/s^2
+        settle_time (float): Time at constant velocity before the first frame in s
+    '''
+    def __init__(self, z_start, z_end, z_step, n_planes, frame_period, acceleration, settle_time=0.0):
+        self.z_start = z_start
+        self.n_planes = n_planes
+        self.frame_period = frame_period
+        self.direction = 1 if z_end >= z_start else -1
+
+        self.velocity = abs(z_step) / frame_period
+        self.acceleration = acceleration
+        self.ramp_time = self.velocity / acceleration
+        self.ramp_distance = self.velocity**2 / (2 * acceleration)
+        self.settle_time = settle_time
+        self.settle_distance = self.velocity * settle_time
+
+        self.scan_start = z_start - self.direction * (self.ramp_distance + self.settle_distance)
+        self.scan_end = z_start + self.direction * (n_planes * abs(z_step) + self.ramp_distance)
+        self.trigger_delay = self.ramp_time + self.settle_time
+        self.duration = self.trigger_delay + n_planes * frame_period + self.ramp_time
+
+    def get_plane_positions(self):
+        ''' Stage positions at the start of each frame '''
+        return self.z_start + self.direction * self.velocity * self.frame_period * np.arange(self.n_planes)
+
+    def check(self, max_velocity, z_min=None, z_max=None):
+        '''
+        Returns:
+            list: Reasons why this scan can not be executed, empty if it can
+        '''
+        errors = []
+        if self.velocity > max_velocity:
+            errors.append(f'Scan velocity of {self.velocity:.1f} um/s exceeds the maximum of {max_velocity} um/s')
+        low, high = sorted((self.scan_start, self.scan_end))
+        if z_min is not None and low <= z_min:
+            errors.append(f'Scan would start/end at {low:.1f} um, beyond the z limit of {z_min} um')
+        if z_max is not None and high >= z_max:
+            errors.append(f'Scan would start/end at {high:.1f} um, beyond the z limit of {z_max} um')
+        return errors
+
+def get_trapezoidal_profile(distance, velocity, acceleration):
+    '''
+    Ramp time, ramp distance, maximum velocity and cruise time of a movement over
+    distance with a trapezoidal velocity profile
+    '''
+    ramp_time = velocity / acceleration
+    ramp_distance = velocity**2 / (2 * acceleration)
+    if 2 * ramp_distance > distance:
+        ''' Triangular profile: maximum velocity is never reached '''
+        ramp_time = np.sqrt(distance / acceleration)
+        ramp_distance = distance / 2
+        velocity = acceleration * ramp_time
+    cruise_time = (distance - 2 * ramp_distance) / velocity if velocity > 0 else 0.0
+    return ramp_time, ramp_distance, velocity, cruise_time
+
+def trapezoidal_duration(start, target, velocity, acceleration):
+    ''' Time in s of a movement from start to target with a trapezoidal velocity profile '''
+    distance = abs(target - start)
+    if distance == 0:
+        return 0.0
+    ramp_time, _, _, cruise_time = get_trapezoidal_profile(distance, velocity, acceleration)
+    return 2 * ramp_time + cruise_time
+
+def trapezoidal_position(t, start, target, velocity, acceleration):
+    '''
+    Position at time t of a stage moving from start to target with a trapezoidal
+    velocity profile (constant acceleration, maximum velocity, constant deceleration)
+
+    Used to simulate stage motion.
+    '''
+    distance = abs(target - start)
+    direction = 1 if target >= start else -1
+    if distance == 0 or t <= 0:
+        return start
+
+    ramp_time, ramp_distance, velocity, cruise_time = get_trapezoidal_profile(distance, velocity, acceleration)
+    total_time = 2 * ramp_time + cruise_time
+
+    if t < ramp_time:
+        travelled = 0.5 * acceleration * t**2
+    elif t < ramp_time + cruise_time:
+        travelled = ramp_distance + velocity * (t - ramp_time)
+    elif t < total_time:
+        remaining = total_time - t
+        travelled = distance - 0.5 * acceleration * remaining**2
+    else:
+        travelled = distance
+    return start + direction * travelled
@@ -0,0 +1,148 @@
+'''
+OME-Zarr writer for mesoSPIM stacks
+
+Writes all views of an acquisition list into a single OME-NGFF (v0.4) hierarchy.
+Requires the zarr (v2) and numcodecs packages: python -m pip install "zarr<3"
+'''
+
+import numpy as np
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .block_writer import ZBlockWriter
+
+class ZarrWriter(ZBlockWriter):
+    '''
+    Chunked, compressed OME-Zarr writer with a plane-by-plane interface
+
+    Every view (stack) is stored as an NGFF image group named
+    tile<t>_ch<c>_illu<i>_ang<a> using the same indices as the BigDataViewer
+    HDF5 files. The group contains the full resolution array '0' in (z,y,x) order
+    and optionally downsampled levels '1', '2', ... which are computed while the
+    stack is written.
+
+    Planes are collected in z-blocks as deep as a chunk. Complete blocks are split
+    into chunk-aligned y-bands which are compressed and written in parallel by a
+    thread pool.
+
+    Args:
+        path (str): Path of the .zarr directory
+        chunks (tuple): Chunk shape in (z,y,x) order
+        compression (str): Blosc compressor name, e.g. 'zstd' or 'lz4'. None for no compression.
+        compression_level (int): Blosc compression level (1-9)
+        n_threads (int): Number of compression & write threads
+        subsamp (tuple): Absolute (z,y,x) subsampling factors per resolution level,
+                         e.g. ((1, 1, 1), (2, 2, 2), (4, 4, 4))
+    '''
+    def __init__(self, path, chunks=(32, 256, 256), compression='zstd', compression_level=3, n_threads=8,
+                 subsamp=((1, 1, 1),)):
+        import zarr
+        from numcodecs import Blosc, blosc
+
+        super().__init__(n_threads=n_threads)
+
+        ''' Parallelism comes from the thread pool, Blosc itself should not spawn threads '''
+        blosc.use_threads = False
+
+        self.path = path
+        self.chunks = tuple(chunks)
+        self.subsamp = tuple(tuple(int(f) for f in level) for level in subsamp)
+        if compression is None:
+            self.compressor = None
+        else:
+            self.compressor = Blosc(cname=compression, clevel=compression_level, shuffle=Blosc.BITSHUFFLE)
+
+        self.root = zarr.open_group(path, mode='a')
+        self.views = list(self.root.attrs.get('mesoSPIM', {}).get('views', []))
+
+
+    @staticmethod
+    def get_view_name(tile=0, channel=0, illumination=0, angle=0):
+        return f'tile{tile}_ch{channel}_illu{illumination}_ang{angle}'
+
+    def append_view(self, shape, tile=0, channel=0, illumination=0, angle=0,
+                    voxel_size_zyx=(1.0, 1.0, 1.0), translation_zyx=(0.0, 0.0, 0.0), metadata=None, keep_open=False):
+        '''
+        Creates the array for a new view, planes are added afterwards with append_plane()
+
+        Args:
+            shape (tuple): Stack shape in (z,y,x) order
+            voxel_size_zyx (tuple): Voxel size in micrometers
+            translation_zyx (tuple): Position of the first voxel in micrometers
+            metadata (dict): Additional metadata stored as group attribute 'mesoSPIM'
+            keep_open (bool): If True, previously appended views stay open for writing (interleaved channels)
+
+        Returns:
+            int: View index for append_plane()
+        '''
+        if not keep_open:
+            self.finish_view()
+
+        name = self.get_view_name(tile, channel, illumination, angle)
+        group = self.root.require_group(name)
+        chunks = tuple(min(c, s) for c, s in zip(self.chunks, shape))
+        array = group.zeros('0', shape=shape, chunks=chunks, dtype=np.uint16,
+                            compressor=self.compressor, overwrite=True)
+
+        ''' Chunks of a level can receive planes from consecutive blocks, which are written
+        in parallel. A lock per level avoids concurrent read-modify-write of a chunk. '''
+        level_arrays = [array]
+        datasets = [{'path' : '0',
+                     'coordinateTransformations' : [{'type' : 'scale', 'scale' : [float(v) for v in voxel_size_zyx]},
+                                                    {'type' : 'translation', 'translation' : [float(v) for v in translation_zyx]}]}]
+        for level, factors in enumerate(self.subsamp[1:], start=1):
+            level_shape = tuple(s // f for s, f in zip(shape, factors))
+            level_chunks = tuple(max(1, min(c, s)) for c, s in zip(self.chunks, level_shape))
+            level_arrays.append(group.zeros(str(level), shape=level_shape, chunks=level_chunks, dtype=np.uint16,
+                                            compressor=self.compressor, overwrite=True))
+            ''' Voxel centers of a level are shifted by half of the voxels they average '''
+            datasets.append({'path' : str(level),
+                             'coordinateTransformations' : [{'type' : 'scale', 'scale' : [float(v * f) for v, f in zip(voxel_size_zyx, factors)]},
+                                                            {'type' : 'translation', 'translation' : [float(t + v * (f - 1) / 2)
+                                                                for t, v, f in zip(translation_zyx, voxel_size_zyx, factors)]}]})
+        level_locks = [threading.Lock() for _ in level_arrays]
+
+        group.attrs['multiscales'] = [{
+            'version' : '0.4',
+            'name' : name,
+            'axes' : [{'name' : 'z', 'type' : 'space', 'unit' : 'micrometer'},
+                      {'name' : 'y', 'type' : 'space', 'unit' : 'micrometer'},
+                      {'name' : 'x', 'type' : 'space', 'unit' : 'micrometer'}],
+            'datasets' : datasets,
+        }]
+        view_metadata = {'tile' : tile, 'channel' : channel, 'illumination' : illumination, 'angle' : angle}
+        if metadata is not None:
+            view_metadata.update(metadata)
+        group.attrs['mesoSPIM'] = view_metadata
+
+        if name not in self.views:
+            self.views.append(name)
+        self.root.attrs['mesoSPIM'] = {'views' : self.views}
+
+        return self.allocate_blocks((chunks[0],) + tuple(shape[1:]), shape[0], subsamp=self.subsamp,
+                                    targets=(level_arrays, level_locks), keep_open=keep_open)
+
+    def submit_block(self, targets, block, z_start, z_end):
+        ''' Splits the block into chunk-aligned y-bands, so that chunks are compressed in parallel '''
+        array = targets[0][0]
+        band_height = array.chunks[1]
+        futures = []
+        for y_start in range(0, array.shape[1], band_height):
+            y_end = min(y_start + band_height, array.shape[1])
+            futures.append(self.executor.submit(self._write_band, array, block, z_start, z_end, y_start, y_end))
+        return futures
+
+    def write_block(self, targets, block, z_start, z_end):
+        ''' Unsplit write of a whole block, submit_block() writes y-bands instead '''
+        targets[0][0][z_start:z_end] = block[:z_end - z_start]
+
+    @staticmethod
+    def _write_band(array, block, z_start, z_end, y_start, y_end):
+        array[z_start:z_end, y_start:y_end, :] = block[:z_end - z_start, y_start:y_end, :]
+
+    def write_level_block(self, targets, level, data, z_start):
+        level_arrays, level_locks = targets
+        with level_locks[level]:
+            level_arrays[level][z_start:z_start + data.shape[0]] = data
@@ -0,0 +1,132 @@
+'''
+Tests of the acquisition list optimizer
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip('indexed')
+
+from mesoSPIM.src.utils.acquisitions import Acquisition, AcquisitionList
+from mesoSPIM.src.utils.acquisition_optimizer import (AcquisitionCostModel, get_path_cost, get_greedy_order,
+                                                      improve_order_2opt, optimize_acquisition_list)
+
+def make_acq(x=0, y=0, laser='488 nm', filter='515LP', rot=0, filename='one.raw'):
+    return Acquisition(x_pos=x, y_pos=y, z_start=0, z_end=0, laser=laser, filter=filter,
+                       theta_pos=rot, filename=filename)
+
+def make_cost_model(**kwargs):
+    settings = {'filter_change_time' : 2.0, 'zoom_change_time' : 1.0, 'laser_change_time' : 0.0,
+                'stage_velocity' : 1000, 'rotation_velocity' : 10}
+    settings.update(kwargs)
+    return AcquisitionCostModel(**settings)
+
+def test_cost_matrix():
+    acqs = [make_acq(0, 0), make_acq(3000, 1000, filter='593/40'), make_acq(0, 0, rot=20)]
+    cost = make_cost_model().get_cost_matrix([[acq] for acq in acqs])
+    assert cost.shape == (3, 3)
+    np.testing.assert_allclose(np.diag(cost), 0)
+    ''' Filter change and the slowest axis '''
+    assert cost[0, 1] == pytest.approx(2.0 + 3.0)
+    assert cost[1, 0] == pytest.approx(2.0 + 3.0)
+    ''' Rotation without rotation position: angle / rotation velocity '''
+    assert cost[0, 2] == pytest.approx(2.0)
+
+def test_rotations_go_via_the_rotation_position():
+    acqs = [make_acq(0, 0), make_acq(0, 0, rot=20)]
+    cost = make_cost_model(rotation_position=(5000, 0, 0)).get_cost_matrix([[acq] for acq in acqs])
+    assert cost[0, 1] == pytest.approx(2.0 + 5.0 + 5.0)
+
+def test_units_start_with_their_first_and_end_with_their_last_row():
+    units = [[make_acq(0), make_acq(1000)], [make_acq(1000), make_acq(4000)]]
+    cost = make_cost_model().get_cost_matrix(units)
+    assert cost[0, 1] == pytest.approx(0.0)
+    assert cost[1, 0] == pytest.approx(4.0)
+
+def random_cost(n, seed):
+    cost = np.random.default_rng(seed).uniform(0, 10, size=(n, n))
+    np.fill_diagonal(cost, 0)
+    return cost
+
+def best_cost(cost):
+    n = len(cost)
+    return min(get_path_cost(cost, (0,) + order) for order in itertools.permutations(range(1, n)))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_2opt_improves_the_greedy_tour(seed):
+    cost = random_cost(7, seed)
+    greedy = get_greedy_order(cost)
+    improved = improve_order_2opt(cost, greedy)
+    assert greedy[0] == 0 and improved[0] == 0
+    assert sorted(improved) == list(range(7))
+    assert best_cost(cost) - 1e-9 <= get_path_cost(cost, improved) <= get_path_cost(cost, greedy) + 1e-9
+
+def test_2opt_finds_a_reversed_segment():
+    ''' Points on a line visited in the order 0, 3, 2, 1, 4 '''
+    positions = np.array([0, 3, 2, 1, 4], dtype=float)
+    cost = np.abs(positions[:, np.newaxis] - positions[np.newaxis, :])
+    improved = improve_order_2opt(cost, [0, 1, 2, 3, 4])
+    assert [positions[i] for i in improved] == [0, 1, 2, 3, 4]
+
+def make_tiled_list():
+    ''' Tile by tile, one row per channel: the filter changes at every row '''
+    rows = []
+    for x in (0, 1000, 2000):
+        rows.append(make_acq(x, laser='488 nm', filter='515LP'))
+        rows.append(make_acq(x, laser='561 nm', filter='593/40'))
+    return AcquisitionList(rows)
+
+def test_optimized_list_keeps_view_indices():
+    acq_list = make_tiled_list()
+    table_rows = list(acq_list)
+    view_indices = {id(acq) : acq_list.get_view_indices(acq) for acq in acq_list}
+
+    optimized, saved = optimize_acquisition_list(acq_list, make_cost_model())
+    assert saved > 0
+    assert list(acq_list) == table_rows
+    assert optimized[0] is acq_list[0]
+    assert sorted(map(id, optimized)) == sorted(map(id, acq_list))
+    ''' Fewer filter changes than the table order '''
+    filter_changes = sum(a['filter'] != b['filter'] for a, b in zip(optimized[:-1], optimized[1:]))
+    assert filter_changes < 5
+    for acq in optimized:
+        assert optimized.get_view_indices(acq) == view_indices[id(acq)]
+
+def test_optimal_list_is_returned_unchanged():
+    acq_list = AcquisitionList([make_acq(x) for x in (0, 1000, 2000, 3000)])
+    optimized, saved = optimize_acquisition_list(acq_list, make_cost_model())
+    assert optimized is acq_list and saved == 0.0
+
+def test_interleaved_groups_are_kept():
+    rows = []
+    for x in (2000, 0, 1000):
+        rows.append(make_acq(x, laser='488 nm'))
+        rows.append(make_acq(x, laser='561 nm'))
+    acq_list = AcquisitionList(rows)
+    assert [len(group) for group in acq_list.get_interleaved_groups()] == [2, 2, 2]
+
+    optimized, saved = optimize_acquisition_list(acq_list, make_cost_model(), keep_interleaved_groups=True)
+    assert saved > 0
+    assert optimized.interleaved_group_sizes == [2, 2, 2]
+    for group in optimized.get_interleaved_groups():
+        assert [acq['laser'] for acq in group] == ['488 nm', '561 nm']
+        assert group[0]['x_pos'] == group[1]['x_pos']
+
+def test_rows_which_become_neighbours_are_not_interleaved():
+    ''' The 561 nm row moves next to the 488 nm row of the same tile, both stay single stacks '''
+    acq_list = AcquisitionList([make_acq(0, laser='488 nm'), make_acq(1000, laser='488 nm'), make_acq(0, laser='561 nm')])
+    assert [len(group) for group in acq_list.get_interleaved_groups()] == [1, 1, 1]
+
+    optimized, saved = optimize_acquisition_list(acq_list, make_cost_model(), keep_interleaved_groups=True)
+    assert [acq['x_pos'] for acq in optimized] == [0, 0, 1000]
+    assert optimized.can_interleave(optimized[0], optimized[1])
+    assert [len(group) for group in optimized.get_interleaved_groups()] == [1, 1, 1]
+    assert optimized.get_interleaved_group(optimized[0]) == [optimized[0]]
+
+    ''' Once the list is edited, consecutive rows are grouped again '''
+    optimized.append(make_acq(5000))
+    assert [len(group) for group in optimized.get_interleaved_groups()] == [2, 1, 1]
@@ -0,0 +1,63 @@
+'''
+Tests of the view (setup) indices of acquisition lists
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import pytest
+
+pytest.importorskip('indexed')
+
+from mesoSPIM.src.utils.acquisitions import Acquisition, AcquisitionList
+
+def make_list(rows):
+    ''' rows: (x_pos, laser, shutterconfig, rot) tuples '''
+    return AcquisitionList([Acquisition(x_pos=x, laser=laser, shutterconfig=shutter, theta_pos=rot)
+                            for x, laser, shutter, rot in rows])
+
+ROWS = [(0, '488 nm', 'Left', 0),
+        (0, '561 nm', 'Left', 0),
+        (100, '488 nm', 'Right', 0),
+        (100, '561 nm', 'Right', 0),
+        (0, '488 nm', 'Left', 90),
+        (200, '637 nm', 'Left', 0)]
+
+def test_view_indices():
+    acq_list = make_list(ROWS)
+    assert [acq_list.get_view_indices(acq) for acq in acq_list] == [
+        {'illumination' : 0, 'channel' : 0, 'angle' : 0, 'tile' : 0},
+        {'illumination' : 0, 'channel' : 1, 'angle' : 0, 'tile' : 0},
+        {'illumination' : 1, 'channel' : 0, 'angle' : 0, 'tile' : 1},
+        {'illumination' : 1, 'channel' : 1, 'angle' : 0, 'tile' : 1},
+        {'illumination' : 0, 'channel' : 0, 'angle' : 1, 'tile' : 2},
+        {'illumination' : 0, 'channel' : 2, 'angle' : 0, 'tile' : 3}]
+    assert acq_list.get_n_tiles() == 4
+
+def test_view_indices_match_find_value_index():
+    acq_list = make_list(ROWS)
+    for acq in acq_list:
+        indices = acq_list.get_view_indices(acq)
+        assert indices['channel'] == acq_list.find_value_index(acq['laser'], 'laser')
+        assert indices['illumination'] == acq_list.find_value_index(acq['shutterconfig'], 'shutterconfig')
+        assert indices['angle'] == acq_list.find_value_index(acq['rot'], 'rot')
+
+def test_unknown_value():
+    with pytest.raises(AssertionError):
+        make_list(ROWS).find_value_index('405 nm', 'laser')
+
+def test_index_reference_keeps_the_indices_of_a_reordered_list():
+    acq_list = make_list(ROWS)
+    indices = {id(acq) : acq_list.get_view_indices(acq) for acq in acq_list}
+
+    reordered = AcquisitionList(list(reversed(acq_list)))
+    assert reordered.get_view_indices(reordered[0]) != indices[id(reordered[0])]
+
+    reordered.index_reference = list(acq_list)
+    assert reordered.get_index_reference() == list(acq_list)
+    for acq in reordered:
+        assert reordered.get_view_indices(acq) == indices[id(acq)]
+
+def test_index_reference_defaults_to_the_list_order():
+    acq_list = make_list(ROWS)
+    assert acq_list.get_index_reference() == list(acq_list)
+    assert AcquisitionList.index_reference is None
@@ -0,0 +1,135 @@
+'''
+Round trip tests of the block-buffered BigDataViewer HDF5 writer
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from mesoSPIM.src.utils.bdv_writer import BdvBlockWriter
+from mesoSPIM.src.utils.block_writer import ZBlockWriter
+
+def make_stack(shape, seed):
+    return np.random.default_rng(seed).integers(0, 60000, size=shape, dtype=np.uint16)
+
+def block_mean(stack, factors):
+    fz, fy, fx = factors
+    nz, ny, nx = (s // f for s, f in zip(stack.shape, factors))
+    blocks = stack[:nz * fz, :ny * fy, :nx * fx].reshape(nz, fz, ny, fy, nx, fx).astype(np.float64)
+    return blocks.mean(axis=(1, 3, 5))
+
+def write_views(filename, stacks, subsamp=((1, 1, 1), (2, 2, 2)), interleaved=False, skip_planes=()):
+    writer = BdvBlockWriter(filename, blockdim=((4, 16, 16),), subsamp=subsamp,
+                            nchannels=len(stacks), ntiles=1, min_stack_shape=stacks[0].shape)
+    affine = np.array(((1.0, 0.0, 0.0, 10.0), (0.0, 1.0, 0.0, -20.0), (0.0, 0.0, 1.0, 5.0)))
+    view_indices = []
+    for channel, stack in enumerate(stacks):
+        view_indices.append(writer.append_view(virtual_stack_dim=stack.shape, channel=channel,
+                                               keep_open=interleaved and channel > 0,
+                                               voxel_units='um', voxel_size_xyz=(0.5, 0.5, 2.0),
+                                               calibration=(1.0, 1.0, 4.0), m_affine=affine,
+                                               name_affine='Translation to Regular Grid'))
+        if not interleaved:
+            for z, plane in enumerate(stack):
+                if z not in skip_planes:
+                    writer.append_plane(plane, z)
+    if interleaved:
+        for z in range(stacks[0].shape[0]):
+            for view_index, stack in zip(view_indices, stacks):
+                writer.append_plane(stack[z], z, view_index)
+    writer.write_xml_file()
+    writer.close()
+
+def read_level(filename, setup, level):
+    with h5py.File(filename, 'r') as f:
+        return f[f't00000/s{setup:02d}/{level}/cells'][()].view(np.uint16)
+
+def test_block_writer_is_abstract():
+    with pytest.raises(TypeError):
+        ZBlockWriter()
+
+def test_full_resolution_round_trip(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    stack = make_stack((10, 32, 24), seed=0)
+    write_views(filename, [stack])
+    np.testing.assert_array_equal(read_level(filename, 0, 0), stack)
+
+def test_pyramid_levels_include_z_subsampling(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    stack = make_stack((10, 32, 24), seed=1)
+    write_views(filename, [stack], subsamp=((1, 1, 1), (2, 2, 2), (4, 4, 4)))
+    level1 = read_level(filename, 0, 1)
+    level2 = read_level(filename, 0, 2)
+    assert level1.shape == (5, 16, 12)
+    assert level2.shape == (2, 8, 6)
+    np.testing.assert_allclose(level1, block_mean(stack, (2, 2, 2)), atol=1)
+    ''' Level 2 is computed from the rounded level 1 '''
+    np.testing.assert_allclose(level2, block_mean(stack, (4, 4, 4)), atol=2)
+
+def test_setup_header(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    write_views(filename, [make_stack((8, 32, 24), seed=2)], subsamp=((1, 1, 1), (2, 4, 4)))
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_array_equal(f['s00/resolutions'][()], [[1, 1, 1], [4, 4, 2]])
+        np.testing.assert_array_equal(f['s00/subdivisions'][()], [[16, 16, 4], [6, 8, 4]])
+        assert f['s00/resolutions'].dtype == np.float64
+        assert f['s00/subdivisions'].dtype == np.int32
+        assert f['t00000/s00/0/cells'].dtype == np.int16
+
+def test_dropped_planes_are_zero(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    stack = make_stack((10, 16, 16), seed=3)
+    write_views(filename, [stack], subsamp=((1, 1, 1),), skip_planes=(5, 9))
+    data = read_level(filename, 0, 0)
+    assert not data[5].any() and not data[9].any()
+    np.testing.assert_array_equal(data[:5], stack[:5])
+
+def test_interleaved_views_round_trip(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    stacks = [make_stack((9, 16, 16), seed=4), make_stack((9, 16, 16), seed=5)]
+    write_views(filename, stacks, interleaved=True)
+    for setup, stack in enumerate(stacks):
+        np.testing.assert_array_equal(read_level(filename, setup, 0), stack)
+
+def test_xml_describes_views(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    stacks = [make_stack((8, 32, 24), seed=6), make_stack((8, 32, 24), seed=7)]
+    write_views(filename, stacks)
+
+    root = ET.parse(str(tmp_path / 'stack.xml')).getroot()
+    assert root.tag == 'SpimData'
+    assert root.find('SequenceDescription/ImageLoader').get('format') == 'bdv.hdf5'
+    assert root.find('SequenceDescription/ImageLoader/hdf5').text == 'stack.h5'
+
+    setups = root.findall('SequenceDescription/ViewSetups/ViewSetup')
+    assert [s.find('id').text for s in setups] == ['0', '1']
+    assert setups[0].find('size').text == '24 32 8'
+    assert setups[1].find('attributes/channel').text == '1'
+    assert setups[0].find('voxelSize/unit').text == 'um'
+
+    registrations = root.findall('ViewRegistrations/ViewRegistration')
+    assert len(registrations) == 2
+    transforms = registrations[0].findall('ViewTransform')
+    assert transforms[0].find('Name').text == 'Translation to Regular Grid'
+    np.testing.assert_allclose([float(v) for v in transforms[0].find('affine').text.split()],
+                               [1, 0, 0, 10, 0, 1, 0, -20, 0, 0, 1, 5])
+    assert transforms[1].find('Name').text == 'calibration'
+    assert [float(v) for v in transforms[1].find('affine').text.split()][10] == 4.0
+
+def test_missing_views_are_listed(tmp_path):
+    filename = str(tmp_path / 'stack.h5')
+    writer = BdvBlockWriter(filename, blockdim=((4, 16, 16),), ntiles=2)
+    writer.append_view(virtual_stack_dim=(4, 16, 16), tile=1)
+    for z in range(4):
+        writer.append_plane(np.ones((16, 16), dtype=np.uint16), z)
+    writer.write_xml_file()
+    writer.close()
+
+    root = ET.parse(str(tmp_path / 'stack.xml')).getroot()
+    missing = root.findall('SequenceDescription/MissingViews/MissingView')
+    assert [m.get('setup') for m in missing] == ['0']
@@ -0,0 +1,69 @@
+'''
+Tests of the table-driven dispatch of state requests
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import time
+
+import pytest
+
+from mesoSPIM.src.utils.command_registry import CommandRegistry
+
+@pytest.fixture
+def calls():
+    return []
+
+@pytest.fixture
+def registry(calls):
+    registry = CommandRegistry('Test')
+    registry.register('intensity', lambda value: calls.append(('intensity', value)), value_type=float)
+    registry.register('zoom', lambda value: calls.append(('zoom', value)))
+    registry.register_group(('etl_l_offset', 'etl_l_amplitude'), lambda values: calls.append(('etl', values)))
+    return registry
+
+def test_key_handlers_get_converted_values(registry, calls):
+    registry.dispatch({'intensity' : '20', 'zoom' : '2x'})
+    assert calls == [('intensity', 20.0), ('zoom', '2x')]
+    assert isinstance(calls[0][1], float)
+
+def test_unknown_keys_are_ignored(registry, calls):
+    registry.dispatch({'filter' : '515LP', 'zoom' : '1x'})
+    assert calls == [('zoom', '1x')]
+    assert registry.handles('zoom') and not registry.handles('filter')
+
+def test_group_handler_is_called_once_at_its_first_key(registry, calls):
+    registry.dispatch({'etl_l_amplitude' : 0.5, 'zoom' : '1x', 'etl_l_offset' : 2.3, 'intensity' : 10})
+    assert calls == [('etl', {'etl_l_amplitude' : 0.5, 'etl_l_offset' : 2.3}), ('zoom', '1x'), ('intensity', 10.0)]
+
+def test_group_handler_with_a_single_key(registry, calls):
+    registry.dispatch({'etl_l_offset' : 2.3})
+    assert calls == [('etl', {'etl_l_offset' : 2.3})]
+
+def test_keys_can_only_have_one_handler(registry):
+    with pytest.raises(ValueError):
+        registry.register('zoom', print)
+    with pytest.raises(ValueError):
+        registry.register_group(('laser', 'intensity'), print)
+
+def test_statistics(registry):
+    registry.register('sleep', lambda value: time.sleep(value))
+    registry.dispatch({'sleep' : 0.01})
+    registry.dispatch({'sleep' : 0.0, 'etl_l_offset' : 1, 'etl_l_amplitude' : 2})
+    statistics = registry.get_statistics()
+    assert sorted(statistics) == ['etl_l_amplitude', 'etl_l_offset', 'sleep']
+    assert statistics['sleep']['calls'] == 2
+    assert statistics['sleep']['max_latency'] >= 0.01
+    assert statistics['sleep']['mean_latency'] <= statistics['sleep']['max_latency']
+    ''' A group call counts for each of its keys '''
+    assert statistics['etl_l_offset']['calls'] == 1 and statistics['etl_l_amplitude']['calls'] == 1
+
+    registry.reset_statistics()
+    assert registry.get_statistics() == {}
+
+def test_handler_errors_propagate(registry):
+    def fail(value):
+        raise RuntimeError('device error')
+    registry.register('laser', fail)
+    with pytest.raises(RuntimeError):
+        registry.dispatch({'laser' : '488 nm'})
@@ -0,0 +1,184 @@
+'''
+Tests of the frame ring buffer between the camera thread and the image writer thread
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt5')
+
+from mesoSPIM.src.utils.frame_buffer import FrameRingBuffer
+
+SHAPE = (4, 6)
+
+def make_frame(value):
+    return np.full(SHAPE, value, dtype=np.uint16)
+
+def drain(buffer):
+    ''' Consumes all frames until the buffer is closed, returns (frame value, metadata) pairs '''
+    frames = []
+    while True:
+        item = buffer.get()
+        if item is None:
+            return frames
+        frame, metadata = item
+        frames.append((int(frame[0, 0]), metadata))
+        buffer.release()
+
+def test_frames_arrive_in_order_with_metadata():
+    buffer = FrameRingBuffer(4, SHAPE)
+    for i in range(3):
+        assert buffer.put(make_frame(i), metadata=i)
+    buffer.close()
+    assert drain(buffer) == [(0, 0), (1, 1), (2, 2)]
+
+def test_put_copies_the_frame():
+    buffer = FrameRingBuffer(2, SHAPE)
+    frame = make_frame(7)
+    buffer.put(frame, 0)
+    frame[:] = 0
+    buffer.close()
+    assert drain(buffer) == [(7, 0)]
+
+def test_full_buffer_drops_after_timeout():
+    buffer = FrameRingBuffer(2, SHAPE)
+    assert buffer.put(make_frame(0), 0, timeout_ms=0)
+    assert buffer.put(make_frame(1), 1, timeout_ms=0)
+
+    start = time.perf_counter()
+    assert not buffer.put(make_frame(2), 2, timeout_ms=50)
+    assert time.perf_counter() - start >= 0.04
+
+    stats = buffer.get_statistics()
+    assert stats['frames_put'] == 2
+    assert stats['frames_dropped'] == 1
+    assert stats['frames_waited'] == 1
+    assert stats['fill_level'] == 2
+
+def test_full_buffer_applies_backpressure():
+    ''' The producer waits for the slow consumer instead of dropping frames '''
+    buffer = FrameRingBuffer(2, SHAPE)
+    received = []
+
+    def consumer():
+        while True:
+            item = buffer.get()
+            if item is None:
+                break
+            time.sleep(0.01)
+            received.append(item[1])
+            buffer.release()
+
+    thread = threading.Thread(target=consumer)
+    thread.start()
+    for i in range(10):
+        assert buffer.put(make_frame(i), i, timeout_ms=-1)
+    buffer.close()
+    thread.join()
+
+    assert received == list(range(10))
+    stats = buffer.get_statistics()
+    assert stats['frames_dropped'] == 0
+    assert stats['frames_waited'] > 0
+    assert stats['high_water_mark'] == 2
+
+def test_high_water_mark():
+    buffer = FrameRingBuffer(8, SHAPE)
+    for i in range(5):
+        buffer.put(make_frame(i), i)
+    for _ in range(3):
+        buffer.get()
+        buffer.release()
+    buffer.put(make_frame(5), 5)
+    stats = buffer.get_statistics()
+    assert stats['high_water_mark'] == 5
+    assert stats['fill_level'] == 3
+
+def test_close_drains_remaining_frames():
+    buffer = FrameRingBuffer(4, SHAPE)
+    for i in range(3):
+        buffer.put(make_frame(i), i)
+    buffer.close()
+    assert not buffer.put(make_frame(3), 3)
+    assert drain(buffer) == [(0, 0), (1, 1), (2, 2)]
+    assert buffer.get() is None
+
+def test_close_wakes_a_waiting_consumer():
+    buffer = FrameRingBuffer(2, SHAPE)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(buffer.get()))
+    thread.start()
+    time.sleep(0.02)
+    buffer.close()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+    assert result == [None]
+
+def test_wrong_frame_shape_is_dropped():
+    buffer = FrameRingBuffer(2, SHAPE)
+    assert not buffer.put(np.zeros((3, 3), dtype=np.uint16), 0)
+    assert buffer.get_statistics()['frames_dropped'] == 1
+
+def test_reset_clears_frames_and_counters():
+    buffer = FrameRingBuffer(2, SHAPE)
+    buffer.put(make_frame(1), 0)
+    buffer.close()
+    buffer.reset()
+    stats = buffer.get_statistics()
+    assert stats['frames_put'] == 0 and stats['fill_level'] == 0 and stats['high_water_mark'] == 0
+    buffer.put(make_frame(2), 1)
+    buffer.close()
+    assert drain(buffer) == [(2, 1)]
+
+def test_referenced_frames_are_copied_by_the_consumer():
+    ''' With copy=False, the camera thread does not copy, get() copies out of camera memory '''
+    buffer = FrameRingBuffer(4, SHAPE)
+    camera_memory = make_frame(3)
+    buffer.put(camera_memory, 0, copy=False)
+    assert buffer.get_statistics()['frames_referenced'] == 1
+
+    frame, metadata = buffer.get()
+    camera_memory[:] = 99
+    assert int(frame[0, 0]) == 3
+    assert not np.shares_memory(frame, camera_memory)
+    buffer.release()
+
+def test_waiting_put_copies_queued_references():
+    ''' Once the producer has to wait, the camera may overwrite its memory: queued references are copied '''
+    buffer = FrameRingBuffer(2, SHAPE)
+    camera_memory = [make_frame(0), make_frame(1)]
+    buffer.put(camera_memory[0], 0, copy=False)
+    buffer.put(camera_memory[1], 1, copy=False)
+    assert buffer.get_statistics()['frames_referenced'] == 2
+
+    ''' The buffer is full: _copy_references() runs before waiting, the new frame is copied as well '''
+    new_frame = make_frame(2)
+    assert not buffer.put(new_frame, 2, timeout_ms=0, copy=False)
+    stats = buffer.get_statistics()
+    assert stats['frames_referenced'] == 0
+    assert stats['frames_waited'] == 1
+
+    ''' The camera overwrites its memory, the queued frames are not affected '''
+    for frame in camera_memory:
+        frame[:] = 99
+    buffer.close()
+    assert drain(buffer) == [(0, 0), (1, 1)]
+
+def test_reference_being_read_is_not_copied_twice():
+    buffer = FrameRingBuffer(2, SHAPE)
+    buffer.put(make_frame(0), 0, copy=False)
+    buffer.put(make_frame(1), 1, copy=False)
+    frame, metadata = buffer.get()
+
+    ''' The frame being read was copied by get(), only the queued reference is left '''
+    buffer.put(make_frame(2), 2, timeout_ms=0, copy=False)
+    assert buffer.get_statistics()['frames_referenced'] == 1
+    assert int(frame[0, 0]) == 0
+    buffer.release()
+    buffer.close()
+    assert drain(buffer) == [(1, 1)]
@@ -0,0 +1,113 @@
+'''
+Tests of the disk space and bandwidth preflight checks of acquisition lists
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import os
+import collections
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('indexed')
+
+from mesoSPIM.src.utils import preflight
+from mesoSPIM.src.utils.acquisitions import Acquisition, AcquisitionList
+
+X_PIXELS, Y_PIXELS = 200, 100
+FRAME_BYTES = X_PIXELS * Y_PIXELS * 2
+
+DiskUsage = collections.namedtuple('DiskUsage', 'total used free')
+
+def make_cfg(**preflight_settings):
+    settings = {'enabled' : True, 'free_space_margin' : 0.05, 'bandwidth_probe' : False,
+                'probe_size_mb' : 8, 'probe_max_age_s' : 3600, 'refuse_if_too_slow' : False}
+    settings.update(preflight_settings)
+    return SimpleNamespace(hdf5={'subsamp' : ((1, 1, 1), (2, 2, 2))},
+                           zarr={'subsamp' : ((1, 1, 1), (2, 2, 2), (4, 4, 4))},
+                           raw={'subsamp' : ((1, 1, 1),)},
+                           preflight=settings)
+
+def make_acq(folder, filename='stack.tif', planes=10, processing=''):
+    return Acquisition(z_start=0, z_end=planes * 10, z_step=10, folder=str(folder),
+                       filename=filename, processing=processing)
+
+@pytest.fixture
+def free_bytes(monkeypatch):
+    ''' Free space reported for every folder, set by the test '''
+    free = {'bytes' : 10**12}
+    monkeypatch.setattr(preflight.shutil, 'disk_usage', lambda folder: DiskUsage(0, 0, free['bytes']))
+    monkeypatch.setattr(preflight, '_bandwidth_cache', {})
+    return free
+
+def test_pyramid_factor():
+    assert preflight.get_pyramid_factor(((1, 1, 1),)) == 1.0
+    assert preflight.get_pyramid_factor(((1, 1, 1), (2, 2, 2))) == 1.125
+    assert preflight.get_pyramid_factor(((1, 1, 1), (1, 2, 2))) == 1.25
+
+def test_estimate_includes_pyramid_and_projections(tmp_path):
+    cfg = make_cfg()
+    assert preflight.estimate_acquisition_bytes(make_acq(tmp_path), cfg, X_PIXELS, Y_PIXELS) == 10 * FRAME_BYTES
+    assert preflight.estimate_acquisition_bytes(make_acq(tmp_path, 'stack.h5'), cfg, X_PIXELS, Y_PIXELS) == 11.25 * FRAME_BYTES
+
+    acq = make_acq(tmp_path, processing='MAX,MEAN,MAX_XZ,MAX_YZ')
+    expected = 12 * FRAME_BYTES + 10 * Y_PIXELS * 2 + 10 * X_PIXELS * 2
+    assert preflight.estimate_acquisition_bytes(acq, cfg, X_PIXELS, Y_PIXELS) == expected
+
+def test_enough_space(tmp_path, free_bytes):
+    acq_list = AcquisitionList([make_acq(tmp_path), make_acq(tmp_path)])
+    free_bytes['bytes'] = int(20 * FRAME_BYTES * 1.05) + 1
+    assert preflight.run_preflight(acq_list, make_cfg(), X_PIXELS, Y_PIXELS, 10) == ([], [])
+
+def test_folders_on_one_volume_share_the_space(tmp_path, free_bytes):
+    first, second = tmp_path / 'a', tmp_path / 'b'
+    first.mkdir()
+    second.mkdir()
+    acq_list = AcquisitionList([make_acq(first), make_acq(second)])
+    free_bytes['bytes'] = 15 * FRAME_BYTES
+    errors, warnings = preflight.run_preflight(acq_list, make_cfg(), X_PIXELS, Y_PIXELS, 10)
+    assert len(errors) == 1 and warnings == []
+    assert 'Not enough disk space' in errors[0]
+    assert str(first) in errors[0] and str(second) in errors[0]
+
+def test_margin(tmp_path, free_bytes):
+    acq_list = AcquisitionList([make_acq(tmp_path)])
+    free_bytes['bytes'] = 10 * FRAME_BYTES
+    errors, _ = preflight.run_preflight(acq_list, make_cfg(free_space_margin=0.05), X_PIXELS, Y_PIXELS, 10)
+    assert len(errors) == 1
+    errors, _ = preflight.run_preflight(acq_list, make_cfg(free_space_margin=0), X_PIXELS, Y_PIXELS, 10)
+    assert errors == []
+
+def test_slow_disk(tmp_path, free_bytes, monkeypatch):
+    monkeypatch.setattr(preflight, 'probe_write_bandwidth', lambda folder, size, max_age: 50 * FRAME_BYTES)
+    acq_list = AcquisitionList([make_acq(tmp_path), make_acq(tmp_path, 'stack.h5')])
+
+    ''' 100 frames/s of the h5 row with its pyramid require 112.5 frames/s of bandwidth '''
+    errors, warnings = preflight.run_preflight(acq_list, make_cfg(bandwidth_probe=True), X_PIXELS, Y_PIXELS, 40)
+    assert errors == [] and warnings == []
+    errors, warnings = preflight.run_preflight(acq_list, make_cfg(bandwidth_probe=True), X_PIXELS, Y_PIXELS, 100)
+    assert errors == [] and len(warnings) == 1 and 'Disk too slow' in warnings[0]
+    errors, warnings = preflight.run_preflight(acq_list, make_cfg(bandwidth_probe=True, refuse_if_too_slow=True),
+                                               X_PIXELS, Y_PIXELS, 100)
+    assert len(errors) == 1 and warnings == []
+
+def test_failed_probe_is_a_warning(tmp_path, free_bytes, monkeypatch):
+    def probe(folder, size, max_age):
+        raise OSError('read-only file system')
+    monkeypatch.setattr(preflight, 'probe_write_bandwidth', probe)
+    errors, warnings = preflight.run_preflight(AcquisitionList([make_acq(tmp_path)]), make_cfg(bandwidth_probe=True),
+                                               X_PIXELS, Y_PIXELS, 10)
+    assert errors == [] and len(warnings) == 1 and 'read-only file system' in warnings[0]
+
+def test_bandwidth_probe_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(preflight, '_bandwidth_cache', {})
+    bandwidth = preflight.probe_write_bandwidth(str(tmp_path), probe_size_mb=8)
+    assert bandwidth > 0
+    assert os.listdir(str(tmp_path)) == []
+
+    volume = preflight.get_volume_id(str(tmp_path))
+    preflight._bandwidth_cache[volume] = (preflight._bandwidth_cache[volume][0], 123.0)
+    assert preflight.probe_write_bandwidth(str(tmp_path), probe_size_mb=8) == 123.0
+    ''' Expired results are measured again '''
+    assert preflight.probe_write_bandwidth(str(tmp_path), probe_size_mb=8, max_age_s=0) != 123.0
@@ -0,0 +1,70 @@
+'''
+Tests of the incremental stack projections
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils.projections import parse_processing_options, ProjectionAccumulator, PROJECTION_OPTIONS
+
+def make_stack(shape=(7, 12, 9), seed=0):
+    return np.random.default_rng(seed).integers(0, 65536, size=shape, dtype=np.uint16)
+
+def accumulate(stack, options):
+    accumulator = ProjectionAccumulator(options, stack.shape[0], stack.shape[1:])
+    for z, plane in enumerate(stack):
+        accumulator.add_plane(plane, z)
+    return accumulator
+
+def test_parse_processing_options():
+    assert parse_processing_options('MAX') == ['MAX']
+    assert parse_processing_options('max, MEAN ,MAX_XZ') == ['MAX', 'MEAN', 'MAX_XZ']
+    assert parse_processing_options('MAX,MAX,,') == ['MAX']
+    assert parse_processing_options('') == []
+    assert parse_processing_options('MAX,MEDIAN') == ['MAX']
+
+def test_projections_match_numpy():
+    stack = make_stack()
+    projections = accumulate(stack, PROJECTION_OPTIONS).get_projections()
+    np.testing.assert_array_equal(projections['MAX'], stack.max(axis=0))
+    np.testing.assert_array_equal(projections['MIN'], stack.min(axis=0))
+    np.testing.assert_array_equal(projections['MEAN'], (stack.astype(np.uint64).sum(axis=0) // stack.shape[0]))
+    np.testing.assert_array_equal(projections['MAX_XZ'], stack.max(axis=1))
+    np.testing.assert_array_equal(projections['MAX_YZ'], stack.max(axis=2))
+    assert all(p.dtype == np.uint16 for p in projections.values())
+
+def test_mean_does_not_overflow():
+    stack = np.full((300, 4, 4), 65535, dtype=np.uint16)
+    projections = accumulate(stack, ['MEAN']).get_projections()
+    assert (projections['MEAN'] == 65535).all()
+
+def test_strided_planes():
+    ''' Planes can be views, e.g. of a buffer with padding '''
+    padded = make_stack((5, 12, 20), seed=1)
+    stack = padded[:, :, ::2]
+    projections = accumulate(stack, ['MAX', 'MAX_YZ']).get_projections()
+    np.testing.assert_array_equal(projections['MAX'], stack.max(axis=0))
+    np.testing.assert_array_equal(projections['MAX_YZ'], stack.max(axis=2))
+
+def test_extra_planes_are_ignored_in_side_projections():
+    stack = make_stack((6, 8, 8), seed=2)
+    accumulator = ProjectionAccumulator(['MAX', 'MAX_XZ'], 4, (8, 8))
+    for z, plane in enumerate(stack):
+        accumulator.add_plane(plane, z)
+    projections = accumulator.get_projections()
+    assert projections['MAX_XZ'].shape == (4, 8)
+    np.testing.assert_array_equal(projections['MAX_XZ'], stack[:4].max(axis=1))
+    np.testing.assert_array_equal(projections['MAX'], stack.max(axis=0))
+
+def test_only_selected_projections_are_computed():
+    projections = accumulate(make_stack(), ['MAX_XZ']).get_projections()
+    assert list(projections) == ['MAX_XZ']
+
+def test_save(tmp_path):
+    tifffile = pytest.importorskip('tifffile')
+    stack = make_stack(seed=3)
+    accumulate(stack, ['MAX', 'MEAN']).save(str(tmp_path), 'stack', suffix='_ch0')
+    np.testing.assert_array_equal(tifffile.imread(str(tmp_path / 'MAX_stack_ch0.tif')), stack.max(axis=0))
+    assert (tmp_path / 'MEAN_stack_ch0.tif').exists()
@@ -0,0 +1,86 @@
+'''
+Tests of the streaming multi-resolution pyramids
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils.image_processing import bin_stack
+from mesoSPIM.src.utils.pyramid import PyramidBuilder, RawPyramidSidecars
+
+SUBSAMP = ((1, 1, 1), (2, 2, 2), (4, 4, 4), (8, 4, 4))
+
+def make_stack(shape=(21, 16, 12), seed=0):
+    return np.random.default_rng(seed).integers(0, 65536, size=shape, dtype=np.uint16)
+
+def expected_levels(stack, subsamp):
+    ''' Every level binned from the complete previous level '''
+    levels = [stack]
+    for level in range(1, len(subsamp)):
+        factors = np.asarray(subsamp[level]) // np.asarray(subsamp[level - 1])
+        levels.append(bin_stack(levels[-1], factors))
+    return levels
+
+def stream(stack, subsamp, planes_per_call):
+    pyramid = PyramidBuilder(subsamp, stack.shape)
+    levels = [None] + [np.zeros(shape, dtype=np.uint16) for shape in pyramid.shapes[1:]]
+    written = [None] + [np.zeros(shape[0], dtype=int) for shape in pyramid.shapes[1:]]
+    for z in range(0, stack.shape[0], planes_per_call):
+        for level, z_start, data in pyramid.add_planes(stack[z:z + planes_per_call]):
+            assert data.dtype == np.uint16
+            levels[level][z_start:z_start + data.shape[0]] = data
+            written[level][z_start:z_start + data.shape[0]] += 1
+    ''' Every plane of every level is returned exactly once '''
+    assert all((w == 1).all() for w in written[1:])
+    return pyramid, levels
+
+def test_level_shapes():
+    pyramid = PyramidBuilder(SUBSAMP, (21, 16, 12))
+    assert pyramid.shapes == [(21, 16, 12), (10, 8, 6), (5, 4, 3), (2, 4, 3)]
+    assert pyramid.relative_factors[1:] == [(2, 2, 2), (2, 2, 2), (2, 1, 1)]
+
+@pytest.mark.parametrize('planes_per_call', [1, 3, 4, 21])
+def test_streaming_matches_binning_the_whole_stack(planes_per_call):
+    stack = make_stack()
+    pyramid, levels = stream(stack, SUBSAMP, planes_per_call)
+    for level, expected in enumerate(expected_levels(stack, SUBSAMP)[1:], start=1):
+        assert levels[level].shape == pyramid.shapes[level]
+        np.testing.assert_array_equal(levels[level], expected[:pyramid.shapes[level][0]])
+
+def test_subsampling_only_in_xy():
+    stack = make_stack((5, 16, 16), seed=1)
+    _, levels = stream(stack, ((1, 1, 1), (1, 2, 2)), 1)
+    np.testing.assert_array_equal(levels[1], bin_stack(stack, (1, 2, 2)))
+
+def test_levels_have_to_be_multiples():
+    with pytest.raises(AssertionError):
+        PyramidBuilder(((1, 1, 1), (2, 2, 2), (3, 3, 3)), (12, 12, 12))
+
+def test_raw_sidecars(tmp_path):
+    stack = make_stack((8, 16, 12), seed=2)
+    path = str(tmp_path / 'stack.raw')
+    sidecars = RawPyramidSidecars(path, ((1, 1, 1), (2, 2, 2)), stack.shape)
+    for z, plane in enumerate(stack):
+        if z != 3:
+            sidecars.append_plane(plane, z)
+    sidecars.close()
+
+    level_path = str(tmp_path / 'stack_level1_4x8x6.raw')
+    assert os.path.exists(level_path)
+    level = np.fromfile(level_path, dtype=np.uint16).reshape(4, 8, 6)
+    ''' The missing plane counts as zeros '''
+    expected = stack.copy()
+    expected[3] = 0
+    np.testing.assert_array_equal(level, bin_stack(expected, (2, 2, 2)))
+
+def test_raw_sidecars_skip_empty_levels(tmp_path):
+    path = str(tmp_path / 'stack.raw')
+    sidecars = RawPyramidSidecars(path, ((1, 1, 1), (4, 4, 4)), (3, 16, 16))
+    assert sidecars.stacks == [None, None]
+    sidecars.append_plane(np.zeros((16, 16), dtype=np.uint16), 0)
+    sidecars.close()
+    assert os.listdir(str(tmp_path)) == []
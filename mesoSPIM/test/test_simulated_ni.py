@@ -0,0 +1,213 @@
+'''
+Tests of the NI code paths (waveform generation, shutters, laser enable lines)
+against the simulated nidaqmx module ('SimulatedNI' in the config file)
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import os
+import importlib.util
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt5')
+from PyQt5 import QtCore
+
+from mesoSPIM.src.devices.daq import simulated_nidaqmx, digital_outputs
+from mesoSPIM.src.devices.daq.digital_outputs import get_digital_output_manager
+from mesoSPIM.src.devices.shutters.NI_Shutter import NI_Shutter, set_shutters
+from mesoSPIM.src.devices.lasers.mesoSPIM_LaserEnabler import mesoSPIM_LaserEnabler
+from mesoSPIM.src.mesoSPIM_State import mesoSPIM_StateSingleton
+from mesoSPIM.src.mesoSPIM_WaveFormGenerator import mesoSPIM_WaveFormGenerator
+
+MESOSPIM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def load_demo_config():
+    spec = importlib.util.spec_from_file_location('demo_config', os.path.join(MESOSPIM_DIR, 'config', 'demo_config.py'))
+    cfg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cfg)
+    cfg.waveformgeneration = cfg.shutter = cfg.laser = 'SimulatedNI'
+    cfg.startup['ETL_cfg_file'] = os.path.join(MESOSPIM_DIR, cfg.startup['ETL_cfg_file'])
+    return cfg
+
+@pytest.fixture
+def cfg():
+    return load_demo_config()
+
+@pytest.fixture
+def nidaqmx(cfg):
+    ''' Simulation without task overheads, fresh recorder and digital output managers '''
+    digital_outputs._managers.clear()
+    simulated_nidaqmx.configure(task_create_time=0, task_start_time=0, task_stop_time=0, task_close_time=0,
+                                write_time_per_sample=0, record_writes=True,
+                                trigger_lines=(cfg.acquisition_hardware['master_trigger_out_line'],))
+    yield simulated_nidaqmx
+    for manager in digital_outputs._managers.values():
+        manager.close()
+    digital_outputs._managers.clear()
+    simulated_nidaqmx.configure(**simulated_nidaqmx.default_parameters)
+
+def get_events(task, event=None):
+    return [(name, kind) for timestamp, name, kind, detail in simulated_nidaqmx.recorder.events
+            if name == task.name and (event is None or kind == event)]
+
+def get_event_time(task, event):
+    for timestamp, name, kind, detail in simulated_nidaqmx.recorder.events:
+        if name == task.name and kind == event:
+            return timestamp
+    raise AssertionError(f'No {event} event of task {task.name}')
+
+class Parent(QtCore.QObject):
+    sig_save_etl_config = QtCore.pyqtSignal()
+
+    def __init__(self, cfg):
+        super().__init__()
+        self.cfg = cfg
+
+@pytest.fixture
+def waveformer(cfg, nidaqmx):
+    state = mesoSPIM_StateSingleton()
+    for key, value in cfg.startup.items():
+        state[key] = value
+    parent = Parent(cfg)
+    waveformer = mesoSPIM_WaveFormGenerator(parent)
+    waveformer.test_parent = parent
+    assert waveformer.nidaqmx is simulated_nidaqmx
+    yield waveformer
+    if hasattr(waveformer, 'master_trigger_task'):
+        waveformer.close_tasks()
+
+def test_waveforms_are_written_to_the_tasks(waveformer, cfg):
+    waveformer.create_tasks()
+    waveformer.write_waveforms_to_tasks()
+
+    recorder = simulated_nidaqmx.recorder
+    ah = cfg.acquisition_hardware
+    galvo_etl_writes = recorder.get_writes(waveformer.galvo_etl_task.name, ah['galvo_etl_task_line'])
+    laser_writes = recorder.get_writes(waveformer.laser_task.name, ah['laser_task_line'])
+    assert len(galvo_etl_writes) == 1 and len(laser_writes) == 1
+    np.testing.assert_array_equal(galvo_etl_writes[0], waveformer.galvo_and_etl_waveforms)
+    np.testing.assert_array_equal(laser_writes[0], waveformer.laser_waveforms)
+    assert galvo_etl_writes[0].shape == (4, waveformer.samples)
+    assert laser_writes[0].shape == (8, waveformer.samples)
+    waveformer.close_tasks()
+
+def test_tasks_wait_for_the_master_trigger(waveformer, cfg):
+    waveformer.create_tasks()
+    waveformer.write_waveforms_to_tasks()
+    slave_tasks = (waveformer.camera_trigger_task, waveformer.galvo_etl_task, waveformer.laser_task)
+
+    waveformer.start_tasks()
+    assert [task.state for task in slave_tasks] == ['armed'] * 3
+    assert all(get_events(task, 'output') == [] for task in slave_tasks)
+
+    waveformer.run_tasks()
+    trigger_writes = [(timestamp, list(data)) for timestamp, name, channel, data in simulated_nidaqmx.recorder.writes
+                      if name == waveformer.master_trigger_task.name]
+    assert [data for timestamp, data in trigger_writes] == [[False, True, True, True, False]]
+    trigger_time = trigger_writes[0][0]
+    for task in slave_tasks:
+        assert get_event_time(task, 'start') <= trigger_time <= get_event_time(task, 'output')
+        assert task.is_task_done()
+
+    ''' The master trigger task is on demand: It has no start event and none on stop '''
+    waveformer.stop_tasks()
+    start_times = [get_event_time(task, 'start') for task in slave_tasks]
+    assert start_times == sorted(start_times)
+    stop_order = (waveformer.galvo_etl_task, waveformer.laser_task, waveformer.camera_trigger_task)
+    stop_times = [get_event_time(task, 'stop') for task in stop_order]
+    assert stop_times == sorted(stop_times)
+    assert get_events(waveformer.master_trigger_task, 'stop') == []
+    waveformer.close_tasks()
+    assert all(task.state == 'closed' for task in slave_tasks)
+
+def test_live_tasks_are_kept_and_only_rewritten_on_changes(waveformer):
+    waveformer.start_live_tasks()
+    recorder = simulated_nidaqmx.recorder
+    creates = recorder.counts['create']
+    writes = len(recorder.get_writes(waveformer.laser_task.name))
+
+    waveformer.run_live_tasks()
+    waveformer.run_live_tasks()
+    assert recorder.counts['create'] == creates
+    assert len(recorder.get_writes(waveformer.laser_task.name)) == writes
+
+    waveformer.set_waveform_parameters({'intensity' : 50})
+    waveformer.run_live_tasks()
+    assert recorder.counts['create'] == creates
+    laser_writes = recorder.get_writes(waveformer.laser_task.name)
+    assert len(laser_writes) == writes + 1
+    np.testing.assert_array_equal(laser_writes[-1], waveformer.laser_waveforms)
+
+    waveformer.stop_live_tasks()
+    assert waveformer.laser_task.state == 'closed'
+
+def test_shutters_are_switched_with_one_write_per_port(nidaqmx, cfg):
+    left = NI_Shutter(cfg.shutterdict['shutter_left'], nidaqmx)
+    right = NI_Shutter(cfg.shutterdict['shutter_right'], nidaqmx)
+    line_states = nidaqmx.recorder.line_states
+    assert line_states[left.shutterline] == False and line_states[right.shutterline] == False
+
+    writes = nidaqmx.recorder.counts['write']
+    set_shutters({left : True, right : False})
+    ''' The shutters are on different ports '''
+    assert nidaqmx.recorder.counts['write'] == writes + 2
+    assert line_states[left.shutterline] == True and line_states[right.shutterline] == False
+    assert left.state() and not right.state()
+
+    right.open()
+    assert line_states[right.shutterline] == True
+    left.close()
+    assert line_states[left.shutterline] == False
+
+def test_digital_output_manager_keeps_one_task_per_port(nidaqmx):
+    manager = get_digital_output_manager(nidaqmx)
+    first = NI_Shutter('PXI6259/port0/line0', nidaqmx)
+    first.open()
+    first_task = manager.ports['PXI6259/port0'].task
+
+    ''' A second line on the same port replaces the task of the port, the first line keeps its state '''
+    second = NI_Shutter('PXI6259/port0/line3', nidaqmx)
+    port_task = manager.ports['PXI6259/port0'].task
+    assert list(manager.ports) == ['PXI6259/port0']
+    assert first_task.state == 'closed'
+    assert port_task.channel_names == ['PXI6259/port0/line0', 'PXI6259/port0/line3']
+    assert nidaqmx.recorder.line_states['PXI6259/port0/line0'] == True
+
+    ''' Switching does not create tasks and writes both lines at once '''
+    creates = nidaqmx.recorder.counts['create']
+    set_shutters({first : False, second : True})
+    assert nidaqmx.recorder.counts['create'] == creates
+    assert list(nidaqmx.recorder.get_writes(port_task.name)[-1]) == [False, True]
+
+def test_laser_enabler_switches_all_lines_at_once(nidaqmx, cfg):
+    enabler = mesoSPIM_LaserEnabler(cfg.laserdict, nidaqmx)
+    line_states = nidaqmx.recorder.line_states
+    assert not any(line_states[line] for line in cfg.laserdict.values())
+
+    ports = set(digital_outputs.DigitalOutputManager.get_port_name(line) for line in cfg.laserdict.values())
+    writes = nidaqmx.recorder.counts['write']
+    enabler.enable('488 nm')
+    assert nidaqmx.recorder.counts['write'] == writes + len(ports)
+    assert [laser for laser, line in cfg.laserdict.items() if line_states[line]] == ['488 nm']
+    assert enabler.state() == '488 nm'
+
+    enabler.enable_multiple(['488 nm', '561 nm'])
+    assert sorted(laser for laser, line in cfg.laserdict.items() if line_states[line]) == ['488 nm', '561 nm']
+
+    enabler.disable_all()
+    assert not any(line_states[line] for line in cfg.laserdict.values())
+    assert enabler.state() == 'off'
+
+    with pytest.raises(ValueError):
+        enabler.enable('999 nm')
+
+def test_shutters_and_lasers_share_the_digital_output_tasks(nidaqmx, cfg):
+    NI_Shutter(cfg.shutterdict['shutter_left'], nidaqmx)
+    mesoSPIM_LaserEnabler(cfg.laserdict, nidaqmx)
+    manager = get_digital_output_manager(nidaqmx)
+    lines = list(cfg.laserdict.values()) + [cfg.shutterdict['shutter_left']]
+    assert sorted(manager.ports) == sorted(set(manager.get_port_name(line) for line in lines))
+    open_tasks = [task for task in (port.task for port in manager.ports.values()) if task.state != 'closed']
+    assert len(open_tasks) == len(manager.ports)
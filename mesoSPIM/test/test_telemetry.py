@@ -0,0 +1,86 @@
+'''
+Tests of the camera telemetry aggregation
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import threading
+
+import pytest
+
+from mesoSPIM.src.utils.telemetry import FrameTelemetry, TelemetryAggregator
+
+def make_record(frame_number, timestamp, backlog=0, buffer_fill=None, interval=None, latency=0.001):
+    return FrameTelemetry(frame_number, backlog, buffer_fill, interval, latency, timestamp)
+
+def test_empty_summary():
+    summary = TelemetryAggregator().get_summary()
+    assert summary['frames'] == 0
+    assert summary['sustained_framerate'] == 0.0
+    assert summary['mean_backlog'] == 0.0 and summary['mean_interval_ms'] == 0.0
+    assert summary['max_buffer_fill'] is None
+
+def test_statistics():
+    aggregator = TelemetryAggregator()
+    aggregator.add(make_record(1, 10.0, backlog=0, buffer_fill=0.1, latency=0.002))
+    aggregator.add(make_record(2, 10.1, backlog=3, buffer_fill=0.5, interval=0.1, latency=0.004))
+    aggregator.add(make_record(3, 10.2, backlog=1, interval=0.1, latency=0.003))
+    aggregator.add(make_record(4, 10.4, backlog=0, buffer_fill=0.2, interval=0.2, latency=0.001))
+    summary = aggregator.get_summary()
+
+    assert summary['frames'] == 4
+    assert summary['dropped_frames'] == 0
+    assert summary['backlog'] == 0
+    assert summary['max_backlog'] == 3
+    assert summary['mean_backlog'] == pytest.approx(1.0)
+    assert summary['max_buffer_fill'] == 0.5
+    assert summary['mean_interval_ms'] == pytest.approx(400 / 3)
+    assert summary['max_interval_ms'] == pytest.approx(200)
+    assert summary['mean_latency_ms'] == pytest.approx(2.5)
+    assert summary['max_latency_ms'] == pytest.approx(4)
+    assert summary['sustained_framerate'] == pytest.approx(3 / 0.4)
+
+def test_gaps_in_frame_numbers_are_dropped_frames():
+    aggregator = TelemetryAggregator()
+    for frame_number in (1, 2, 5, 6, 10):
+        aggregator.add(make_record(frame_number, frame_number * 0.01))
+    assert aggregator.get_summary()['dropped_frames'] == 5
+
+def test_unknown_frame_numbers_are_not_counted_as_drops():
+    aggregator = TelemetryAggregator()
+    aggregator.add(make_record(1, 0.0))
+    aggregator.add(make_record(None, 0.01))
+    aggregator.add(make_record(2, 0.02))
+    assert aggregator.get_summary()['dropped_frames'] == 0
+
+def test_reset():
+    aggregator = TelemetryAggregator()
+    aggregator.add(make_record(1, 0.0, backlog=5))
+    aggregator.add(make_record(3, 0.1))
+    aggregator.reset()
+    ''' Frame numbers of the next stack start again, this is no gap '''
+    aggregator.add(make_record(1, 1.0))
+    summary = aggregator.get_summary()
+    assert summary['frames'] == 1
+    assert summary['dropped_frames'] == 0
+    assert summary['max_backlog'] == 0
+
+def test_concurrent_add_and_summary():
+    aggregator = TelemetryAggregator()
+    summaries = []
+
+    def read():
+        for _ in range(200):
+            summaries.append(aggregator.get_summary())
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for frame_number in range(1, 5001):
+        aggregator.add(make_record(frame_number, frame_number * 0.001, interval=0.001))
+    reader.join()
+
+    summary = aggregator.get_summary()
+    assert summary['frames'] == 5000 and summary['dropped_frames'] == 0
+    assert all(s['dropped_frames'] == 0 for s in summaries)
+    frames = [s['frames'] for s in summaries]
+    assert frames == sorted(frames)
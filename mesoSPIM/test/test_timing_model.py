@@ -0,0 +1,114 @@
+'''
+Tests of the learned acquisition time model on synthetic stack histories
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+
+from mesoSPIM.src.utils.timing_model import AcquisitionTimingModel, TIMING_FEATURES, get_stack_features, nonnegative_least_squares
+
+''' Config defaults: stack_overhead, 1/average_frame_rate, acquisition_optimizer times '''
+PRIOR = [2.0, 1 / 4.969, 0.5, 1.0, 0.0, 1 / 10, 1 / 1000]
+
+def make_tiled_stacks(n_lists=4, n_tiles=30, frames=500):
+    '''
+    Tile scans: the filter changes on 2 of 3 stacks and the stage travels
+    1000 um on every third stack, each list starts without a previous stack
+    '''
+    lists = []
+    for _ in range(n_lists):
+        stacks = []
+        x = 0.0
+        for tile in range(n_tiles):
+            if tile % 3 == 0:
+                x += 1000.0
+            stacks.append({'laser' : '488 nm',
+                           'zoom' : '1x',
+                           'filter' : ('515LP', '561LP', '561LP')[tile % 3] if tile % 3 else '515LP',
+                           'rot' : 0.0,
+                           'start' : [x, 0.0, 0.0, 0.0],
+                           'end' : [x, 0.0, 0.0, 0.0],
+                           'frames' : frames})
+        lists.append(stacks)
+    return lists
+
+def add_history(model, lists, true_costs, noise=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    start_time = 0.0
+    for stacks in lists:
+        previous = None
+        for stack in stacks:
+            features = get_stack_features(previous, stack)
+            duration = float(np.dot(true_costs, features)) + noise * rng.standard_normal()
+            model.add_record('synthetic', start_time, duration, features)
+            start_time += duration
+            previous = stack
+    model.fit()
+
+def predict_lists(model, lists):
+    return [[float(np.dot(model.costs, get_stack_features(previous, stack)))
+             for previous, stack in zip([None] + stacks[:-1], stacks)] for stacks in lists]
+
+def test_nonnegative_least_squares_matches_active_set_solution():
+    A = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+    b = np.array([2.0, -1.0, 1.0])
+    ''' The unconstrained solution has x[1] < 0, the constrained one refits x[0] alone '''
+    np.testing.assert_allclose(nonnegative_least_squares(A, b), [1.5, 0.0], atol=1e-12)
+
+def test_tiled_history_is_predicted_without_bias(tmp_path):
+    true_costs = np.array([3.0, 0.02, 1.0, 0.0, 0.0, 0.0, 0.002])
+    lists = make_tiled_stacks()
+    model = AcquisitionTimingModel(str(tmp_path / 'history.json'), PRIOR)
+    add_history(model, lists, true_costs, noise=0.2)
+
+    assert np.all(model.costs >= 0)
+    measured = np.array([record['duration'] for record in model.records])
+    predicted = np.concatenate(predict_lists(model, lists))
+    assert np.mean(np.abs(predicted - measured) / measured) < 0.03
+    assert abs(predicted.sum() - measured.sum()) / measured.sum() < 0.01
+
+    costs = model.get_costs()
+    assert abs(costs['filter_change'] - 1.0) < 0.2
+    assert abs(costs['travel'] - 0.002) < 0.0005
+    ''' Operations which never occurred keep their prior '''
+    assert costs['zoom_change'] == PRIOR[TIMING_FEATURES.index('zoom_change')]
+    assert costs['rotation'] == PRIOR[TIMING_FEATURES.index('rotation')]
+
+def test_varying_frames_separate_overhead_and_frame_time(tmp_path):
+    true_costs = np.array([3.0, 0.15, 1.0, 0.0, 0.0, 0.0, 0.002])
+    lists = make_tiled_stacks()
+    for stacks in lists:
+        for tile, stack in enumerate(stacks):
+            stack['frames'] = (200, 500, 800, 500)[tile % 4]
+    model = AcquisitionTimingModel(str(tmp_path / 'history.json'), PRIOR)
+    add_history(model, lists, true_costs, noise=0.2)
+
+    costs = model.get_costs()
+    assert abs(costs['frames'] - 0.15) < 0.005
+    assert abs(costs['stack'] - 3.0) < 1.5
+    measured = np.array([record['duration'] for record in model.records])
+    predicted = np.concatenate(predict_lists(model, lists))
+    assert np.mean(np.abs(predicted - measured) / measured) < 0.02
+
+def test_constant_history_predicts_measured_time(tmp_path):
+    model = AcquisitionTimingModel(str(tmp_path / 'history.json'), PRIOR)
+    stack = {'laser' : '488 nm', 'zoom' : '1x', 'filter' : '515LP', 'rot' : 0.0,
+             'start' : [0.0, 0.0, 0.0, 0.0], 'end' : [0.0, 0.0, 0.0, 0.0], 'frames' : 50}
+    for index in range(100):
+        model.add_record('synthetic', index * 15.0, 15.0, get_stack_features(None, stack))
+    model.fit()
+
+    predicted = float(np.dot(model.costs, get_stack_features(None, stack)))
+    assert abs(predicted - 15.0) < 0.5
+
+def test_history_is_saved_and_loaded(tmp_path):
+    history_file = str(tmp_path / 'history.json')
+    model = AcquisitionTimingModel(history_file, PRIOR)
+    add_history(model, make_tiled_stacks(n_lists=1), np.array([3.0, 0.02, 1.0, 0.0, 0.0, 0.0, 0.002]))
+    model.save()
+
+    loaded = AcquisitionTimingModel(history_file, PRIOR)
+    loaded.load()
+    assert len(loaded.records) == len(model.records)
+    np.testing.assert_allclose(loaded.costs, model.costs)
@@ -0,0 +1,97 @@
+'''
+Tests of the waveform LRU cache and the cached ETL csv files
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils import waveform_cache
+from mesoSPIM.src.utils.waveform_cache import WaveformCache, read_etl_csv
+
+calls = []
+
+def ramp(samples, amplitude):
+    calls.append((samples, amplitude))
+    return np.linspace(0, amplitude, samples)
+
+def square(samples, amplitude):
+    return np.full(samples, amplitude, dtype=np.float64)
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+def test_waveforms_are_computed_once_per_parameter_set():
+    cache = WaveformCache()
+    first = cache.get(ramp, samples=100, amplitude=2.0)
+    second = cache.get(ramp, amplitude=2.0, samples=100)
+    assert second is first
+    assert calls == [(100, 2.0)]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get(ramp, samples=100, amplitude=3.0)
+    assert len(calls) == 2
+
+def test_functions_are_part_of_the_key():
+    cache = WaveformCache()
+    assert not np.array_equal(cache.get(ramp, samples=10, amplitude=1.0), cache.get(square, samples=10, amplitude=1.0))
+    assert cache.misses == 2
+
+def test_cached_waveforms_are_read_only():
+    cache = WaveformCache()
+    waveform = cache.get(ramp, samples=10, amplitude=1.0)
+    with pytest.raises(ValueError):
+        waveform[0] = 5
+    stacked = np.stack((waveform, waveform))
+    stacked[0, 0] = 5
+    assert waveform[0] == 0
+
+def test_least_recently_used_waveforms_are_evicted():
+    cache = WaveformCache(maxsize=2)
+    cache.get(ramp, samples=10, amplitude=1.0)
+    cache.get(ramp, samples=10, amplitude=2.0)
+    cache.get(ramp, samples=10, amplitude=1.0)
+    cache.get(ramp, samples=10, amplitude=3.0)
+    assert len(cache.waveforms) == 2
+
+    cache.get(ramp, samples=10, amplitude=1.0)
+    assert len(calls) == 3
+    cache.get(ramp, samples=10, amplitude=2.0)
+    assert len(calls) == 4
+
+def test_clear():
+    cache = WaveformCache()
+    cache.get(ramp, samples=10, amplitude=1.0)
+    cache.clear()
+    cache.get(ramp, samples=10, amplitude=1.0)
+    assert len(calls) == 2
+
+def write_csv(path, rows):
+    with open(path, 'w') as file:
+        file.write('Wavelength;Zoom;ETL-Left-Offset\n')
+        for row in rows:
+            file.write(';'.join(row) + '\n')
+
+def test_etl_csv_is_parsed_again_only_after_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(waveform_cache, '_etl_csv_cache', {})
+    path = str(tmp_path / 'etl.csv')
+    write_csv(path, [('488 nm', '1x', '2.0'), ('561 nm', '1x', '2.1'), ('488 nm', '1x', '2.2')])
+
+    rows = read_etl_csv(path)
+    assert sorted(rows) == [('488 nm', '1x'), ('561 nm', '1x')]
+    ''' The last matching row wins '''
+    assert rows[('488 nm', '1x')]['ETL-Left-Offset'] == '2.2'
+    assert read_etl_csv(path) is rows
+
+    write_csv(path, [('488 nm', '1x', '3.0')])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert read_etl_csv(path)[('488 nm', '1x')]['ETL-Left-Offset'] == '3.0'
+
+def test_missing_etl_csv(tmp_path):
+    with pytest.raises(OSError):
+        read_etl_csv(str(tmp_path / 'missing.csv'))
@@ -0,0 +1,81 @@
+'''
+Tests of the NumPy waveform kernels against scipy.signal and the per-row functions
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils import waveforms
+
+SAMPLERATE, SWEEPTIME = 100000, 0.1
+SAMPLES = int(SAMPLERATE * SWEEPTIME)
+
+def scipy_time_base():
+    return np.linspace(0, SWEEPTIME, SAMPLES)
+
+@pytest.mark.parametrize('frequency, dutycycle, phase', [(10, 50, np.pi / 2), (199, 50, np.pi), (37, 95, 0.3),
+                                                         (20, 0, 0), (20, 100, 1.0), (20, 20, 2 * np.pi)])
+def test_sawtooth_matches_scipy(frequency, dutycycle, phase):
+    signal = pytest.importorskip('scipy.signal')
+    expected = 3.67 * signal.sawtooth(2 * np.pi * frequency * scipy_time_base() + phase, width=dutycycle / 100) + 0.5
+    result = waveforms.sawtooth(SAMPLERATE, SWEEPTIME, frequency, 3.67, 0.5, dutycycle, phase)
+    np.testing.assert_allclose(result, expected, atol=1e-9)
+
+@pytest.mark.parametrize('frequency, dutycycle, phase', [(10, 50, np.pi), (199, 10, 0.0), (37, 90, 2.0)])
+def test_square_matches_scipy(frequency, dutycycle, phase):
+    signal = pytest.importorskip('scipy.signal')
+    expected = 2.5 * signal.square(2 * np.pi * frequency * scipy_time_base() + phase, duty=dutycycle / 100) + 2.5
+    result = waveforms.square(SAMPLERATE, SWEEPTIME, frequency, 2.5, 2.5, dutycycle, phase)
+    np.testing.assert_array_equal(result, expected)
+
+def test_single_pulse():
+    pulse = waveforms.single_pulse(SAMPLERATE, SWEEPTIME, delay=10, pulsewidth=20, amplitude=5, offset=0.5)
+    expected = np.full(SAMPLES, 0.5)
+    expected[1000:3000] = 5
+    np.testing.assert_array_equal(pulse, expected)
+
+def test_tunable_lens_ramp():
+    ramp = waveforms.tunable_lens_ramp(SAMPLERATE, SWEEPTIME, delay=10, rise=80, fall=5, amplitude=1, offset=2)
+    assert ramp.shape == (SAMPLES,)
+    np.testing.assert_allclose(ramp[:1000], 1)
+    np.testing.assert_allclose(ramp[1000:9000], 1 + 2 * np.arange(8000) / 8000)
+    np.testing.assert_allclose(ramp[9000:9500], 3 - 2 * np.arange(500) / 500)
+    np.testing.assert_allclose(ramp[9500:], 1)
+
+@pytest.mark.parametrize('function, kwargs', [
+    (waveforms.single_pulse, {'delay' : 10, 'pulsewidth' : 50, 'amplitude' : 1, 'offset' : 0.1}),
+    (waveforms.tunable_lens_ramp, {'delay' : 5, 'rise' : 85, 'fall' : 5, 'amplitude' : 1, 'offset' : 2}),
+    (waveforms.sawtooth, {'frequency' : 99, 'amplitude' : 2, 'offset' : 0.1, 'dutycycle' : 50, 'phase' : 1}),
+    (waveforms.square, {'frequency' : 10, 'amplitude' : 2, 'offset' : 0.1, 'dutycycle' : 30, 'phase' : 1}),
+])
+def test_waveforms_are_written_into_preallocated_rows(function, kwargs):
+    expected = function(SAMPLERATE, SWEEPTIME, **kwargs)
+    buffer = np.full((3, SAMPLES), np.nan)
+    result = function(SAMPLERATE, SWEEPTIME, out=buffer[1], **kwargs)
+    assert np.shares_memory(result, buffer)
+    np.testing.assert_array_equal(buffer[1], expected)
+    assert np.isnan(buffer[0]).all() and np.isnan(buffer[2]).all()
+
+def test_output_array_has_to_fit():
+    with pytest.raises(ValueError):
+        waveforms.sawtooth(SAMPLERATE, SWEEPTIME, out=np.empty(SAMPLES + 1))
+
+def test_time_base_is_shared_and_read_only():
+    time_base = waveforms.get_time_base(SAMPLERATE, SWEEPTIME)
+    assert waveforms.get_time_base(SAMPLERATE, SWEEPTIME) is time_base
+    np.testing.assert_array_equal(time_base, scipy_time_base())
+    with pytest.raises(ValueError):
+        time_base[0] = 1
+
+def test_tables_match_the_per_row_functions():
+    amplitudes, offsets = (0.5, 1.0, 1.5), (2.0, 2.1, 2.2)
+    table = waveforms.tunable_lens_ramp_table(SAMPLERATE, SWEEPTIME, 5, 85, 5, amplitudes, offsets)
+    assert table.shape == (3, SAMPLES)
+    for row, amplitude, offset in zip(table, amplitudes, offsets):
+        np.testing.assert_allclose(row, waveforms.tunable_lens_ramp(SAMPLERATE, SWEEPTIME, 5, 85, 5, amplitude, offset))
+
+    table = waveforms.single_pulse_table(SAMPLERATE, SWEEPTIME, 10, 80, amplitudes)
+    for row, amplitude in zip(table, amplitudes):
+        np.testing.assert_allclose(row, waveforms.single_pulse(SAMPLERATE, SWEEPTIME, 10, 80, amplitude, 0))
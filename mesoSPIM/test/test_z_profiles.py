@@ -0,0 +1,65 @@
+'''
+Tests of the depth-dependent acquisition parameters (z profiles)
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils.z_profiles import parse_z_profile, evaluate_z_profile, Z_PROFILE_PARAMETERS
+
+DEFAULTS = {'intensity' : 20, 'etl_l_offset' : 2.3, 'etl_l_amplitude' : 0.5,
+            'etl_r_offset' : 2.4, 'etl_r_amplitude' : 0.6}
+
+def test_parse():
+    profile = parse_z_profile('intensity: 0=10, 2000=40; ETL_L_Offset: poly(2.3, 0.0001);')
+    assert profile == {'intensity' : ('linear', (0.0, 2000.0), (10.0, 40.0)),
+                       'etl_l_offset' : ('poly', (2.3, 0.0001))}
+
+def test_empty_profile():
+    assert parse_z_profile('') == {}
+    assert parse_z_profile(' ; ') == {}
+
+@pytest.mark.parametrize('z_profile, message', [
+    ('intensity 0=10', 'Missing ":"'),
+    ('power: 0=10', 'Unknown z profile parameter'),
+    ('intensity: 0=10; intensity: 0=20', 'Duplicated'),
+    ('intensity: poly(1, a)', 'polynomial coefficients'),
+    ('intensity: 0=10, 100', 'depth=value'),
+    ('intensity: 100=10, 0=20', 'ascending'),
+    ('intensity: 0=10, 0=20', 'ascending'),
+])
+def test_invalid_profiles(z_profile, message):
+    with pytest.raises(ValueError, match=message):
+        parse_z_profile(z_profile)
+
+def test_defaults_without_curves():
+    values = evaluate_z_profile({}, np.arange(4) * 10.0, DEFAULTS)
+    assert sorted(values) == sorted(Z_PROFILE_PARAMETERS)
+    for parameter in Z_PROFILE_PARAMETERS:
+        np.testing.assert_array_equal(values[parameter], [DEFAULTS[parameter]] * 4)
+
+def test_linear_curve_is_constant_outside_its_points():
+    profile = parse_z_profile('etl_r_amplitude: 100=1, 200=2, 400=0')
+    values = evaluate_z_profile(profile, [0, 100, 150, 200, 300, 400, 500], DEFAULTS)
+    np.testing.assert_allclose(values['etl_r_amplitude'], [1, 1, 1.5, 2, 1, 0, 0])
+
+def test_polynomial_curve():
+    profile = parse_z_profile('etl_l_offset: poly(2, 0.01, 0.001)')
+    depths = np.array([0.0, 10.0, 100.0])
+    values = evaluate_z_profile(profile, depths, DEFAULTS)
+    np.testing.assert_allclose(values['etl_l_offset'], 2 + 0.01 * depths + 0.001 * depths**2)
+
+def test_intensity_is_clipped():
+    profile = parse_z_profile('intensity: poly(-10, 1)')
+    values = evaluate_z_profile(profile, [0, 50, 200], DEFAULTS)
+    np.testing.assert_array_equal(values['intensity'], [0, 40, 100])
+
+def test_acquisition_plane_depths():
+    ''' Depths are relative to the first plane, also for stacks in negative z direction '''
+    Acquisition = pytest.importorskip('mesoSPIM.src.utils.acquisitions').Acquisition
+    acq = Acquisition(z_start=500, z_end=0, z_step=-50, z_profile='intensity: 0=10, 450=100')
+    profile = parse_z_profile(acq['z_profile'])
+    values = evaluate_z_profile(profile, acq.get_plane_depths(), acq)
+    np.testing.assert_allclose(values['intensity'], np.linspace(10, 100, 10))
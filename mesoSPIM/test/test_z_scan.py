@@ -0,0 +1,82 @@
+'''
+Tests of the continuous z-scan planning and the trapezoidal stage motion
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+import pytest
+
+from mesoSPIM.src.utils.z_scan import (ZScanPlan, get_trapezoidal_profile, trapezoidal_duration,
+                                       trapezoidal_position)
+
+def test_plan():
+    plan = ZScanPlan(z_start=100, z_end=200, z_step=5, n_planes=20, frame_period=0.05,
+                     acceleration=1000, settle_time=0.02)
+    assert plan.velocity == pytest.approx(100)
+    assert plan.ramp_time == pytest.approx(0.1)
+    assert plan.ramp_distance == pytest.approx(5)
+    assert plan.settle_distance == pytest.approx(2)
+    assert plan.scan_start == pytest.approx(93)
+    assert plan.scan_end == pytest.approx(205)
+    assert plan.trigger_delay == pytest.approx(0.12)
+    assert plan.duration == pytest.approx(0.12 + 1.0 + 0.1)
+    np.testing.assert_allclose(plan.get_plane_positions(), 100 + 5 * np.arange(20))
+
+def test_plan_in_negative_direction():
+    plan = ZScanPlan(z_start=200, z_end=100, z_step=-5, n_planes=20, frame_period=0.05, acceleration=1000)
+    assert plan.direction == -1
+    assert plan.scan_start == pytest.approx(205)
+    assert plan.scan_end == pytest.approx(95)
+    np.testing.assert_allclose(plan.get_plane_positions(), 200 - 5 * np.arange(20))
+
+@pytest.mark.parametrize('z_start, z_end', [(100, 200), (200, 100)])
+def test_simulated_stage_passes_the_planes_at_the_triggers(z_start, z_end):
+    ''' A stage moving from scan_start to scan_end with the planned velocity is at the
+    plane positions when the frames are triggered '''
+    plan = ZScanPlan(z_start=z_start, z_end=z_end, z_step=5, n_planes=20, frame_period=0.05,
+                     acceleration=1000, settle_time=0.02)
+    assert trapezoidal_duration(plan.scan_start, plan.scan_end, plan.velocity, plan.acceleration) == pytest.approx(plan.duration)
+    frame_times = plan.trigger_delay + plan.frame_period * np.arange(plan.n_planes)
+    positions = [trapezoidal_position(t, plan.scan_start, plan.scan_end, plan.velocity, plan.acceleration)
+                 for t in frame_times]
+    np.testing.assert_allclose(positions, plan.get_plane_positions())
+
+def test_check():
+    plan = ZScanPlan(z_start=100, z_end=200, z_step=5, n_planes=20, frame_period=0.05, acceleration=1000)
+    assert plan.check(max_velocity=200, z_min=0, z_max=1000) == []
+    assert plan.check(max_velocity=200) == []
+    errors = plan.check(max_velocity=50, z_min=96, z_max=205)
+    assert len(errors) == 3
+    assert 'velocity' in errors[0]
+    assert '95.0' in errors[1] and '205.0' in errors[2]
+
+def test_trapezoidal_profile():
+    ramp_time, ramp_distance, velocity, cruise_time = get_trapezoidal_profile(100, 10, 5)
+    assert (ramp_time, ramp_distance, velocity) == (2, 10, 10)
+    assert cruise_time == pytest.approx(8)
+    assert trapezoidal_duration(0, 100, 10, 5) == pytest.approx(12)
+    assert trapezoidal_duration(100, 0, 10, 5) == pytest.approx(12)
+    assert trapezoidal_duration(5, 5, 10, 5) == 0.0
+
+def test_triangular_profile():
+    ''' Short movements never reach the maximum velocity '''
+    ramp_time, ramp_distance, velocity, cruise_time = get_trapezoidal_profile(10, 10, 5)
+    assert ramp_time == pytest.approx(np.sqrt(2))
+    assert ramp_distance == pytest.approx(5)
+    assert velocity == pytest.approx(5 * np.sqrt(2))
+    assert cruise_time == pytest.approx(0)
+    assert trapezoidal_duration(0, 10, 10, 5) == pytest.approx(2 * np.sqrt(2))
+
+@pytest.mark.parametrize('distance', [100, 10])
+def test_trapezoidal_position(distance):
+    duration = trapezoidal_duration(0, distance, 10, 5)
+    times = np.linspace(-1, duration + 1, 501)
+    positions = np.array([trapezoidal_position(t, 0, distance, 10, 5) for t in times])
+    assert positions[0] == 0 and positions[-1] == distance
+    assert trapezoidal_position(duration / 2, 0, distance, 10, 5) == pytest.approx(distance / 2)
+    ''' Continuous, monotonic and never faster than the maximum velocity '''
+    steps = np.diff(positions)
+    assert (steps >= 0).all()
+    assert (steps / np.diff(times) <= 10 + 1e-9).all()
+    assert trapezoidal_position(duration / 2, distance, 0, 10, 5) == pytest.approx(distance / 2)
@@ -0,0 +1,98 @@
+'''
+Round trip tests of the OME-Zarr writer
+
+Run from the repository root with: python -m pytest mesoSPIM/test
+'''
+
+import numpy as np
+import pytest
+
+zarr = pytest.importorskip('zarr')
+
+from mesoSPIM.src.utils.zarr_writer import ZarrWriter
+
+def make_stack(shape, seed):
+    return np.random.default_rng(seed).integers(0, 65536, size=shape, dtype=np.uint16)
+
+def block_mean(stack, factors):
+    fz, fy, fx = factors
+    nz, ny, nx = (s // f for s, f in zip(stack.shape, factors))
+    blocks = stack[:nz * fz, :ny * fy, :nx * fx].reshape(nz, fz, ny, fy, nx, fx).astype(np.float64)
+    return blocks.mean(axis=(1, 3, 5))
+
+def write_stack(path, stack, **kwargs):
+    writer = ZarrWriter(path, **kwargs)
+    writer.append_view(stack.shape, tile=1, channel=2, voxel_size_zyx=(5.0, 2.0, 2.0),
+                       translation_zyx=(100.0, 10.0, 20.0), metadata={'laser' : '488 nm'})
+    for z, plane in enumerate(stack):
+        writer.append_plane(plane, z)
+    writer.close()
+
+@pytest.mark.parametrize('compression', ['zstd', None])
+def test_round_trip(tmp_path, compression):
+    path = str(tmp_path / 'stack.zarr')
+    ''' Stack shape not a multiple of the chunks '''
+    stack = make_stack((11, 40, 30), seed=0)
+    write_stack(path, stack, chunks=(4, 16, 16), compression=compression, n_threads=4)
+    array = zarr.open_group(path, mode='r')['tile1_ch2_illu0_ang0/0']
+    assert array.chunks == (4, 16, 16)
+    np.testing.assert_array_equal(array[:], stack)
+
+def test_metadata(tmp_path):
+    path = str(tmp_path / 'stack.zarr')
+    write_stack(path, make_stack((8, 16, 16), seed=1), chunks=(4, 16, 16), subsamp=((1, 1, 1), (2, 2, 2)))
+    root = zarr.open_group(path, mode='r')
+    assert root.attrs['mesoSPIM'] == {'views' : ['tile1_ch2_illu0_ang0']}
+
+    group = root['tile1_ch2_illu0_ang0']
+    assert group.attrs['mesoSPIM'] == {'tile' : 1, 'channel' : 2, 'illumination' : 0, 'angle' : 0, 'laser' : '488 nm'}
+    multiscales = group.attrs['multiscales'][0]
+    assert multiscales['version'] == '0.4'
+    assert [axis['name'] for axis in multiscales['axes']] == ['z', 'y', 'x']
+    level0, level1 = multiscales['datasets']
+    assert level0['coordinateTransformations'] == [{'type' : 'scale', 'scale' : [5.0, 2.0, 2.0]},
+                                                   {'type' : 'translation', 'translation' : [100.0, 10.0, 20.0]}]
+    assert level1['path'] == '1'
+    assert level1['coordinateTransformations'] == [{'type' : 'scale', 'scale' : [10.0, 4.0, 4.0]},
+                                                   {'type' : 'translation', 'translation' : [102.5, 11.0, 21.0]}]
+
+def test_resolution_levels(tmp_path):
+    path = str(tmp_path / 'stack.zarr')
+    stack = make_stack((12, 32, 24), seed=2)
+    write_stack(path, stack, chunks=(4, 8, 8), subsamp=((1, 1, 1), (2, 2, 2), (4, 4, 4)))
+    group = zarr.open_group(path, mode='r')['tile1_ch2_illu0_ang0']
+    assert group['1'].shape == (6, 16, 12)
+    assert group['2'].shape == (3, 8, 6)
+    np.testing.assert_allclose(group['1'][:], block_mean(stack, (2, 2, 2)), atol=1)
+    np.testing.assert_allclose(group['2'][:], block_mean(stack, (4, 4, 4)), atol=2)
+
+def test_interleaved_views(tmp_path):
+    path = str(tmp_path / 'stack.zarr')
+    stacks = [make_stack((9, 16, 16), seed=3), make_stack((9, 16, 16), seed=4)]
+    writer = ZarrWriter(path, chunks=(4, 16, 16), subsamp=((1, 1, 1), (2, 2, 2)))
+    view_indices = [writer.append_view(stack.shape, channel=channel, keep_open=channel > 0)
+                    for channel, stack in enumerate(stacks)]
+    for z in range(9):
+        for view_index, stack in zip(view_indices, stacks):
+            writer.append_plane(stack[z], z, view_index)
+    writer.close()
+
+    root = zarr.open_group(path, mode='r')
+    assert root.attrs['mesoSPIM']['views'] == ['tile0_ch0_illu0_ang0', 'tile0_ch1_illu0_ang0']
+    for channel, stack in enumerate(stacks):
+        np.testing.assert_array_equal(root[f'tile0_ch{channel}_illu0_ang0/0'][:], stack)
+
+def test_views_are_added_to_an_existing_file(tmp_path):
+    path = str(tmp_path / 'stack.zarr')
+    first, second = make_stack((4, 16, 16), seed=5), make_stack((4, 16, 16), seed=6)
+    write_stack(path, first, chunks=(4, 16, 16))
+    writer = ZarrWriter(path, chunks=(4, 16, 16))
+    writer.append_view(second.shape, tile=3)
+    for z, plane in enumerate(second):
+        writer.append_plane(plane, z)
+    writer.close()
+
+    root = zarr.open_group(path, mode='r')
+    assert root.attrs['mesoSPIM']['views'] == ['tile1_ch2_illu0_ang0', 'tile3_ch0_illu0_ang0']
+    np.testing.assert_array_equal(root['tile1_ch2_illu0_ang0/0'][:], first)
+    np.testing.assert_array_equal(root['tile3_ch0_illu0_ang0/0'][:], second)